@@ -0,0 +1,90 @@
+"""
+Async data access layer for the blocking pymongo & pymilvus clients
+
+Routes are async so a blocking driver call run directly on the event loop freezes every concurrent request of
+the worker, i.e. a slow milvus partition load stalls all /users lookups. Each backend gets a dedicated bounded
+thread pool & routes await their calls on it. A slow milvus call then only holds a milvus pool thread while
+mongo calls keep being served from the mongo pool. The pool sizes also bound the concurrent calls per backend
+"""
+import asyncio
+import logging
+import threading
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import AsyncIterator, Callable, Dict, TypeVar
+
+from pymongo import MongoClient
+from pymongo.client_session import ClientSession
+from pymongo.errors import PyMongoError
+
+
+logger = logging.getLogger('async_db')
+T = TypeVar("T")
+
+
+class BackendExecutor:
+    """
+    Bounded thread pool running the blocking calls of one backend
+    Arguments:
+        name: str = backend name, used for the thread names & metrics
+        max_workers: int = max num of concurrent backend calls, further calls are queued
+    """
+    def __init__(self, name: str, max_workers: int) -> None:
+        self.name = name
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}_db")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._stats = {"calls": 0, "failures": 0}
+
+    async def run(self, func: Callable[..., T], *args, **kwargs) -> T:
+        """Runs func(*args, **kwargs) in the backend pool & awaits its result"""
+        with self._lock:
+            self._pending += 1
+            self._stats["calls"] += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, partial(func, *args, **kwargs))
+        except Exception:
+            with self._lock:
+                self._stats["failures"] += 1
+            raise
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def metrics(self) -> Dict:
+        """Call counts & the num of running or queued calls"""
+        with self._lock:
+            return dict(self._stats, pending=self._pending, max_workers=self.max_workers)
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stops the pool threads once the queued calls are done"""
+        self._executor.shutdown(wait=wait)
+
+
+def is_transient_transaction_error(excep: BaseException) -> bool:
+    """
+    Checks if a transaction failed on a transient error, i.e. a write conflict with a concurrent transaction,
+    & can be run again from the start
+    """
+    return isinstance(excep, PyMongoError) and excep.has_error_label("TransientTransactionError")
+
+
+@asynccontextmanager
+async def mongo_transaction(mongodb_client: MongoClient, executor: BackendExecutor) -> AsyncIterator[ClientSession]:
+    """
+    Async counterpart of `with session.start_transaction()`, the session is yielded & the transaction is
+    committed on exit or aborted if the block raises. Commit & abort run in the mongo pool
+    """
+    session = mongodb_client.start_session()
+    try:
+        session.start_transaction()
+        try:
+            yield session
+        except BaseException:
+            await executor.run(session.abort_transaction)
+            raise
+        await executor.run(session.commit_transaction)
+    finally:
+        session.end_session()
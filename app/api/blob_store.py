@@ -0,0 +1,286 @@
+"""
+Content-addressed document storage
+
+Uploaded files are stored once per unique content at root_dir/<sha256[:2]>/<sha256>.zz, zlib compressed, or
+<sha256>.raw when compression saves less than min_compression_ratio, i.e. for pdfs which are compressed
+already. Each blob has a mongodb doc listing the user docs referencing it:
+    _id             sha256 hex digest of the uncompressed content
+    refs            "<user_id>/<doc_id>" of each referencing doc
+    size            uncompressed size & stored_size on disk
+    path            blob file path
+A blob is garbage collected as soon as its last reference is released. References are added & released with
+the session of the doc record so they are rolled back with it. Blob files are only removed after their doc is
+deleted & re-checked, so a concurrent upload of the same content never loses its file.
+The file of a new blob is written before its upload commits, an upload rolled back leaves a file without blob doc
+that collect_all removes once it is older than orphan_min_age_s, longer than any transaction runs
+"""
+import io
+import os
+import re
+import glob
+import time
+import zlib
+import hashlib
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import BinaryIO, Dict, Iterator, List, Optional
+
+from pymongo import MongoClient, ReturnDocument
+from pymongo.client_session import ClientSession
+
+
+logger = logging.getLogger('blob_store')
+
+BLOB_READ_SIZE = 1 << 20
+
+
+def get_blob_ref(user_id: str, doc_id: str) -> str:
+    """Reference of a user doc to its blob"""
+    return f"{user_id}/{doc_id}"
+
+
+class BlobStore:
+    """
+    Content-addressed, compressed blob files with reference counts in mongodb
+    Arguments:
+        root_dir: str = dir holding the blob files
+        mongodb_client: MongoClient = mongodb client of the blob refs collection
+        database: str = mongodb database of the blob refs collection
+        collection: str = mongodb collection of the blob refs
+        compression_level: int = zlib compression level
+        min_compression_ratio: float = min stored size saving for a blob to be kept compressed
+        orphan_min_age_s: float = min age of a file without blob doc before it is garbage collected
+    """
+    def __init__(
+            self,
+            root_dir: str,
+            mongodb_client: MongoClient,
+            database: str,
+            collection: str,
+            compression_level: int = 6,
+            min_compression_ratio: float = 0.05,
+            orphan_min_age_s: float = 3600.0) -> None:
+        self.root_dir = root_dir
+        self.mongodb_client = mongodb_client
+        self.database = database
+        self.collection = collection
+        self.compression_level = compression_level
+        self.min_compression_ratio = min_compression_ratio
+        self.orphan_min_age_s = orphan_min_age_s
+        os.makedirs(root_dir, exist_ok=True)
+
+    @property
+    def _blobs(self):
+        return self.mongodb_client[self.database][self.collection]
+
+    def _blob_path(self, digest: str, compressed: bool) -> str:
+        return os.path.join(self.root_dir, digest[:2], digest + (".zz" if compressed else ".raw"))
+
+    def _find_file(self, digest: str) -> Optional[str]:
+        for compressed in (True, False):
+            path = self._blob_path(digest, compressed)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def _write_file(self, fptr: BinaryIO, digest: str, size: int) -> str:
+        """Writes the content of fptr compressed if it is worth it, returns the blob path"""
+        compressor = zlib.compressobj(self.compression_level)
+        tmp_path = self._blob_path(digest, True) + f".tmp{os.getpid()}_{threading.get_ident()}"
+        os.makedirs(os.path.dirname(tmp_path), exist_ok=True)
+        fptr.seek(0)
+        with open(tmp_path, 'wb') as out:
+            for data in iter(lambda: fptr.read(BLOB_READ_SIZE), b""):
+                out.write(compressor.compress(data))
+            out.write(compressor.flush())
+        compressed = os.path.getsize(tmp_path) <= size * (1 - self.min_compression_ratio)
+        if not compressed:
+            fptr.seek(0)
+            with open(tmp_path, 'wb') as out:
+                for data in iter(lambda: fptr.read(BLOB_READ_SIZE), b""):
+                    out.write(data)
+        path = self._blob_path(digest, compressed)
+        os.replace(tmp_path, path)
+        return path
+
+    def put_file(self, fptr: BinaryIO, user_id: str, doc_id: str, session: ClientSession = None) -> Dict:
+        """
+        Stores the content of fptr unless a blob with the same content exists & references it from the user doc.
+        Returns the blob doc
+        """
+        sha256, size = hashlib.sha256(), 0
+        fptr.seek(0)
+        for data in iter(lambda: fptr.read(BLOB_READ_SIZE), b""):
+            sha256.update(data)
+            size += len(data)
+        digest = sha256.hexdigest()
+        # the ref is recorded before the file is checked so a concurrent collection keeps or restores the file
+        blob = self._blobs.find_one_and_update(
+            {"_id": digest},
+            {"$addToSet": {"refs": get_blob_ref(user_id, doc_id)},
+             "$setOnInsert": {"size": size, "created_at": datetime.now(timezone.utc)}},
+            upsert=True, return_document=ReturnDocument.AFTER, session=session)
+        path = self._find_file(digest)
+        if path is not None:
+            try:
+                # a recent mtime keeps the file from collect_orphan_files until the ref is committed
+                os.utime(path)
+            except FileNotFoundError:
+                path = None
+        if path is None:
+            path = self._write_file(fptr, digest, size)
+            logger.info("Blob %s stored at %s", digest, path)
+        if blob.get("path") != path:
+            stored_size = os.path.getsize(path)
+            self._blobs.update_one({"_id": digest}, {"$set": {"path": path, "stored_size": stored_size}},
+                                   session=session)
+            blob.update(path=path, stored_size=stored_size)
+        return blob
+
+    def put(self, data: bytes, user_id: str, doc_id: str, session: ClientSession = None) -> Dict:
+        """Stores data, see put_file"""
+        return self.put_file(io.BytesIO(data), user_id, doc_id, session=session)
+
+    def get(self, digest: str) -> Optional[Dict]:
+        """Returns the blob doc or None if no blob has the digest"""
+        return self._blobs.find_one({"_id": digest})
+
+    def iter_content(self, path: str) -> Iterator[bytes]:
+        """Yields the uncompressed content of the blob file at path in chunks of at most BLOB_READ_SIZE bytes"""
+        decompressor = zlib.decompressobj() if path.endswith(".zz") else None
+        with open(path, 'rb') as fptr:
+            for data in iter(lambda: fptr.read(BLOB_READ_SIZE), b""):
+                if decompressor is None:
+                    yield data
+                    continue
+                data = decompressor.decompress(data)
+                if data:
+                    yield data
+            if decompressor is not None:
+                data = decompressor.flush()
+                if data:
+                    yield data
+
+    def iter_range(self, path: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """
+        Yields the uncompressed bytes [start, end] of the blob file at path, end inclusive or None for the end of
+        the content. Raw files are read from start, compressed files are decompressed & discarded up to start
+        """
+        remaining = None if end is None else end - start + 1
+        if path.endswith(".zz"):
+            chunks, skip = self.iter_content(path), start
+        else:
+            chunks, skip = self._iter_file(path, start), 0
+        for data in chunks:
+            if skip:
+                skipped = min(skip, len(data))
+                data, skip = data[skipped:], skip - skipped
+            if remaining is not None:
+                data = data[:remaining]
+                remaining -= len(data)
+            if data:
+                yield data
+            if remaining == 0:
+                return
+
+    @staticmethod
+    def _iter_file(path: str, start: int) -> Iterator[bytes]:
+        with open(path, 'rb') as fptr:
+            fptr.seek(start)
+            yield from iter(lambda: fptr.read(BLOB_READ_SIZE), b"")
+
+    def read(self, path: str) -> bytes:
+        """Returns the uncompressed content of the blob file at path"""
+        return b"".join(self.iter_content(path))
+
+    def _collect(self, digest: str) -> bool:
+        """Removes the blob if it has no refs left. Returns True if it was removed"""
+        if self._blobs.find_one_and_delete({"_id": digest, "refs": {"$size": 0}}) is None:
+            return False
+        path = self._find_file(digest)
+        if path is not None:
+            # the file is moved away first & restored if the same content was uploaded meanwhile
+            gc_path = f"{path}.gc{os.getpid()}_{threading.get_ident()}"
+            os.replace(path, gc_path)
+            if self._blobs.find_one({"_id": digest}, {"_id": 1}) is not None:
+                os.replace(gc_path, path)
+                return False
+            os.remove(gc_path)
+        logger.info("Blob %s garbage collected", digest)
+        return True
+
+    def release(self, user_id: str, doc_ids: List[str], session: ClientSession = None) -> List[str]:
+        """
+        Releases the blob refs of the user docs. Blobs left without refs are removed once session commits,
+        call collect with the returned digests then. Returns the digests of the released blobs
+        """
+        refs = [get_blob_ref(user_id, doc_id) for doc_id in doc_ids]
+        digests = [blob["_id"] for blob in self._blobs.find({"refs": {"$in": refs}}, {"_id": 1}, session=session)]
+        if digests:
+            self._blobs.update_many({"_id": {"$in": digests}}, {"$pull": {"refs": {"$in": refs}}}, session=session)
+        return digests
+
+    def release_user(self, user_id: str, session: ClientSession = None) -> List[str]:
+        """Releases the blob refs of all docs of the user, see release"""
+        ref_re = {"$regex": f"^{re.escape(user_id)}/"}
+        digests = [blob["_id"] for blob in self._blobs.find({"refs": ref_re}, {"_id": 1}, session=session)]
+        if digests:
+            self._blobs.update_many({"_id": {"$in": digests}}, {"$pull": {"refs": ref_re}}, session=session)
+        return digests
+
+    def collect(self, digests: List[str]) -> int:
+        """Garbage collects the blobs among digests without refs left. Returns num of blobs removed"""
+        return sum(self._collect(digest) for digest in digests)
+
+    def collect_all(self) -> int:
+        """
+        Garbage collects all blobs without refs, i.e. left by a failed collection, & the files without blob doc
+        left by rolled back uploads. Returns num of blobs & files removed
+        """
+        num_removed = self.collect([blob["_id"] for blob in self._blobs.find({"refs": {"$size": 0}}, {"_id": 1})])
+        return num_removed + self.collect_orphan_files()
+
+    def collect_orphan_files(self) -> int:
+        """
+        Removes the blob files older than orphan_min_age_s without blob doc & the temp files of interrupted writes
+        or collections. Returns num of files removed
+        """
+        num_removed, min_mtime = 0, time.time() - self.orphan_min_age_s
+        for path in glob.glob(os.path.join(glob.escape(self.root_dir), "*", "*")):
+            try:
+                if os.path.getmtime(path) > min_mtime:
+                    continue
+            except FileNotFoundError:
+                continue
+            digest, ext = os.path.basename(path).split(".", 1)
+            if ext in ("zz", "raw"):
+                if self._blobs.find_one({"_id": digest}, {"_id": 1}) is not None:
+                    continue
+                # moved away & restored if the same content was uploaded meanwhile, like in _collect
+                gc_path = f"{path}.gc{os.getpid()}_{threading.get_ident()}"
+                os.replace(path, gc_path)
+                if (self._blobs.find_one({"_id": digest}, {"_id": 1}) is not None
+                        or os.path.getmtime(gc_path) > min_mtime):
+                    os.replace(gc_path, path)
+                    continue
+                path = gc_path
+            os.remove(path)
+            num_removed += 1
+            logger.info("Orphan blob file %s garbage collected", path)
+        return num_removed
+
+    def drop_all(self) -> None:
+        """Removes all blobs & their refs"""
+        self._blobs.delete_many({})
+        for path in glob.glob(os.path.join(glob.escape(self.root_dir), "*", "*")):
+            os.remove(path)
+
+    def metrics(self) -> Dict:
+        """Num of blobs & refs, uncompressed & stored sizes"""
+        stats = list(self._blobs.aggregate([{"$group": {
+            "_id": None, "blobs": {"$sum": 1}, "refs": {"$sum": {"$size": "$refs"}},
+            "size": {"$sum": "$size"}, "stored_size": {"$sum": "$stored_size"}}}]))
+        stats = stats[0] if stats else {"blobs": 0, "refs": 0, "size": 0, "stored_size": 0}
+        stats.pop("_id", None)
+        return stats
@@ -0,0 +1,124 @@
+"""
+Per-document chunk text files read through mmap
+
+With CHUNK_TEXT_STORE=file, milvus only stores the chunk offsets (chunk_index, text_start, text_end) of each
+entity & not its text, so loaded partitions hold little more than the vectors. The chunk texts of a doc are
+concatenated in one utf-8 file at root_dir/user_<user_id>/<doc_id>.chunks & search hits are resolved by
+slicing the memory-mapped file with the byte offsets of the hit. Files are written once per doc id
+"""
+import os
+import mmap
+import glob
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+logger = logging.getLogger('chunk_text_store')
+
+# entity fields needed to resolve the text of a hit
+CHUNK_TEXT_REF_FIELDS = ("user_id", "doc_id", "text_start", "text_end")
+
+
+def chunk_offsets(chunks: Sequence[str]) -> List[Tuple[int, int]]:
+    """(start, end) utf-8 byte offsets of each chunk in the doc text file of the chunks"""
+    offsets, start = [], 0
+    for chunk in chunks:
+        end = start + len(chunk.encode("utf-8"))
+        offsets.append((start, end))
+        start = end
+    return offsets
+
+
+class ChunkTextStore:
+    """
+    Write-once per-doc chunk text files with an LRU cache of open memory maps
+    Arguments:
+        root_dir: str = dir holding the user dirs, i.e. FILE_STORAGE_DIR
+        cache_size: int = num of doc text files kept memory-mapped
+    """
+    def __init__(self, root_dir: str, cache_size: int = 1024) -> None:
+        self.root_dir = root_dir
+        self.cache_size = cache_size
+        self._maps: "OrderedDict[str, mmap.mmap]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def doc_path(self, user_id: str, doc_id: str) -> str:
+        """Path of the chunk text file of a doc"""
+        return os.path.join(self.root_dir, f"user_{user_id}", f"{doc_id}.chunks")
+
+    def write_doc(self, user_id: str, doc_id: str, chunks: Sequence[str]) -> List[Tuple[int, int]]:
+        """
+        Writes the chunk texts of a doc to its text file & returns the (start, end) byte offsets of each chunk
+        """
+        path = self.doc_path(user_id, doc_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as fptr:
+            fptr.write("".join(chunks).encode("utf-8"))
+        os.replace(tmp_path, path)
+        return chunk_offsets(chunks)
+
+    def _get_map(self, path: str) -> Optional[mmap.mmap]:
+        # called with self._lock held
+        text_map = self._maps.get(path)
+        if text_map is not None:
+            self._maps.move_to_end(path)
+            return text_map
+        if not os.path.exists(path) or not os.path.getsize(path):
+            return None
+        with open(path, 'rb') as fptr:
+            text_map = mmap.mmap(fptr.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps[path] = text_map
+        while len(self._maps) > self.cache_size:
+            self._maps.popitem(last=False)[1].close()
+        return text_map
+
+    def read(self, user_id: str, doc_id: str, start: int, end: int) -> Optional[str]:
+        """Returns the text between the byte offsets start & end of the doc, None if the doc text is missing"""
+        with self._lock:
+            text_map = self._get_map(self.doc_path(user_id, doc_id))
+            if text_map is None:
+                return "" if start == end else None
+            return text_map[start:end].decode("utf-8")
+
+    def fill_hits_content(self, hits: List[Dict], ref_fields: Iterable[str] = CHUNK_TEXT_REF_FIELDS) -> List[Dict]:
+        """
+        Sets the content of hits from their doc text file & removes the ref_fields only fetched to resolve it
+        """
+        for hit in hits:
+            hit["content"] = self.read(hit["user_id"], hit["doc_id"], hit["text_start"], hit["text_end"])
+            for field_name in ref_fields:
+                hit.pop(field_name, None)
+        return hits
+
+    def _close(self, paths: Iterable[str]) -> None:
+        with self._lock:
+            for path in paths:
+                text_map = self._maps.pop(path, None)
+                if text_map is not None:
+                    text_map.close()
+
+    def delete_docs(self, user_id: str, doc_ids: List[str]) -> None:
+        """Removes the text files of doc_ids"""
+        paths = [self.doc_path(user_id, doc_id) for doc_id in doc_ids]
+        self._close(paths)
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def drop_user(self, user_id: str) -> None:
+        """Removes the text files of all docs of the user"""
+        user_dir = os.path.join(self.root_dir, f"user_{user_id}")
+        with self._lock:
+            paths = [path for path in self._maps if os.path.dirname(path) == user_dir]
+        self._close(paths)
+        for path in glob.glob(os.path.join(glob.escape(user_dir), "*.chunks")):
+            os.remove(path)
+
+    def drop_all(self) -> None:
+        """Closes all memory maps, the text files are removed with the user dirs"""
+        with self._lock:
+            paths = list(self._maps)
+        self._close(paths)
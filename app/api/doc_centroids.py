@@ -0,0 +1,184 @@
+"""
+Per-document centroid vectors for two-stage document-routed search
+
+Each doc is summarized by the mean of its chunk embeddings. A two-stage search first ranks the user's docs
+by centroid similarity with the query & then runs the chunk level ann search restricted to the top docs,
+so large tenants scan a much smaller candidate set per query.
+The centroids of a user are stored under root_dir/user_<user_id>/centroids.npz with the arrays:
+    doc_ids     doc_id of each centroid
+    centroids   float32 mean chunk embedding of each doc
+    counts      num of chunks of each doc
+The file is rewritten atomically on every change & reloaded when another process replaced it
+"""
+import os
+import shutil
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+logger = logging.getLogger('doc_centroids')
+
+
+class _UserCentroids:
+    """Centroid arrays of one user"""
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.signature = None
+        self.doc_ids = np.empty(0, dtype=str)
+        self.centroids = np.empty((0, 0), dtype=np.float32)
+        self.counts = np.empty(0, dtype=np.int64)
+        self.reload()
+
+    def _signature(self):
+        if not os.path.exists(self.path):
+            return None
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def reload(self) -> None:
+        signature = self._signature()
+        if signature == self.signature:
+            return
+        if signature is None:
+            self.doc_ids = np.empty(0, dtype=str)
+            self.centroids = np.empty((0, 0), dtype=np.float32)
+            self.counts = np.empty(0, dtype=np.int64)
+        else:
+            with np.load(self.path) as data:
+                self.doc_ids, self.centroids, self.counts = data["doc_ids"], data["centroids"], data["counts"]
+        self.signature = signature
+
+    def save(self, doc_ids: np.ndarray, centroids: np.ndarray, counts: np.ndarray) -> None:
+        """Writes to a temporary file & renames it so readers never see a partial file"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp.npz"
+        np.savez(tmp_path, doc_ids=doc_ids, centroids=centroids.astype(np.float32), counts=counts)
+        os.replace(tmp_path, self.path)
+        self.reload()
+
+
+class DocCentroidStore:
+    """
+    Per-user doc centroid vectors used to route queries to the most similar docs
+    Arguments:
+        root_dir: str = dir holding the user centroid dirs
+        cache_size: int = num of users whose centroids are kept in memory
+    """
+    def __init__(self, root_dir: str, cache_size: int = 256) -> None:
+        self.root_dir = root_dir
+        self.cache_size = cache_size
+        self._users: "OrderedDict[str, _UserCentroids]" = OrderedDict()
+        self._lock = threading.RLock()
+        os.makedirs(root_dir, exist_ok=True)
+
+    def _user_path(self, user_id: str) -> str:
+        return os.path.join(self.root_dir, f"user_{user_id}")
+
+    def _get_user(self, user_id: str) -> _UserCentroids:
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is None:
+                user = self._users[user_id] = _UserCentroids(os.path.join(self._user_path(user_id), "centroids.npz"))
+            else:
+                user.reload()
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.cache_size:
+                self._users.popitem(last=False)
+            return user
+
+    def num_docs(self, user_id: str) -> int:
+        """Num of docs with a centroid"""
+        return len(self._get_user(user_id).doc_ids)
+
+    def add_doc(self, user_id: str, doc_id: str, emb_vecs: Sequence[Sequence[float]]) -> None:
+        """
+        Sets the centroid of doc_id to the mean of its chunk embeddings, replacing any previous centroid
+        """
+        self.add_docs(user_id, {doc_id: emb_vecs})
+
+    def add_docs(self, user_id: str, doc_emb_vecs: Dict[str, Sequence[Sequence[float]]]) -> None:
+        """
+        Sets the centroids of several docs from their chunk embeddings with a single write
+        """
+        doc_emb_vecs = {doc_id: np.asarray(emb_vecs, dtype=np.float32)
+                        for doc_id, emb_vecs in doc_emb_vecs.items() if len(emb_vecs)}
+        if not doc_emb_vecs:
+            return
+        new_ids = list(doc_emb_vecs)
+        new_centroids = np.vstack([doc_emb_vecs[doc_id].mean(axis=0) for doc_id in new_ids])
+        with self._lock:
+            user = self._get_user(user_id)
+            keep = ~np.isin(user.doc_ids, new_ids)
+            centroids = user.centroids[keep] if len(user.doc_ids) else np.empty((0, new_centroids.shape[1]), np.float32)
+            user.save(np.append(user.doc_ids[keep], new_ids),
+                      np.vstack([centroids, new_centroids]),
+                      np.append(user.counts[keep], [len(doc_emb_vecs[doc_id]) for doc_id in new_ids]))
+
+    def rebuild_user(
+            self, user_id: str, doc_ids: List[str], centroids: Sequence[Sequence[float]], counts: List[int]) -> None:
+        """
+        Replaces all centroids of the user with the precomputed centroids of doc_ids & their num of chunks
+        """
+        if not doc_ids:
+            self.drop_user(user_id)
+            return
+        with self._lock:
+            self._get_user(user_id).save(
+                np.asarray(doc_ids), np.asarray(centroids, dtype=np.float32), np.asarray(counts, dtype=np.int64))
+
+    def delete_docs(self, user_id: str, doc_ids: List[str]) -> None:
+        """Removes the centroids of doc_ids"""
+        if not os.path.isdir(self._user_path(user_id)):
+            return
+        with self._lock:
+            user = self._get_user(user_id)
+            keep = ~np.isin(user.doc_ids, list(doc_ids))
+            if keep.all():
+                return
+            user.save(user.doc_ids[keep], user.centroids[keep], user.counts[keep])
+
+    def drop_user(self, user_id: str) -> None:
+        """Removes the user centroids"""
+        with self._lock:
+            self._users.pop(user_id, None)
+            shutil.rmtree(self._user_path(user_id), ignore_errors=True)
+
+    def drop_all(self) -> None:
+        """Removes the centroids of all users"""
+        with self._lock:
+            self._users.clear()
+            shutil.rmtree(self.root_dir, ignore_errors=True)
+            os.makedirs(self.root_dir, exist_ok=True)
+
+    def top_docs(
+            self,
+            user_id: str,
+            query_vec: Sequence[float],
+            num_docs: int,
+            metric_type: str = "IP",
+            doc_id_list: Optional[List[str]] = None) -> List[Tuple[str, float]]:
+        """
+        Returns the (doc_id, score) of the num_docs docs most similar to query_vec by centroid, best first.
+        IP & COSINE rank by cosine similarity with the centroid, L2 by negated squared distance.
+        doc_id_list restricts the candidate docs
+        """
+        user = self._get_user(user_id)
+        doc_ids, centroids = user.doc_ids, user.centroids
+        if doc_id_list is not None and len(doc_ids):
+            keep = np.isin(doc_ids, list(doc_id_list))
+            doc_ids, centroids = doc_ids[keep], centroids[keep]
+        if not len(doc_ids) or num_docs <= 0:
+            return []
+        query = np.asarray(query_vec, dtype=np.float32)
+        if metric_type.upper() == "L2":
+            scores = -np.einsum("ij,ij->i", centroids - query, centroids - query)
+        else:
+            scores = (centroids @ query) / np.maximum(np.linalg.norm(centroids, axis=1), 1e-12)
+        num_docs = min(num_docs, len(doc_ids))
+        top = np.argpartition(-scores, num_docs - 1)[:num_docs]
+        top = top[np.argsort(-scores[top])]
+        return [(str(doc_ids[idx]), float(scores[idx])) for idx in top]
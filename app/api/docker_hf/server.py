@@ -1,18 +1,22 @@
 """
 fastapi setup with huggingface feature extraction api exposed
 """
+import os
 import logging
 import argparse
 import traceback
+from typing import List
 
 import uvicorn
-from fastapi import FastAPI, status, HTTPException
-from sentence_transformers import SentenceTransformer
+from fastapi import FastAPI, Body, status, HTTPException
+from sentence_transformers import SentenceTransformer, CrossEncoder
 
-MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+MODEL_NAME = os.getenv("EMB_MODEL_NAME", default="sentence-transformers/all-MiniLM-L6-v2")
+RERANK_MODEL_NAME = "cross-encoder/ms-marco-MiniLM-L-6-v2"
 
 app = FastAPI()
 feature_ext = SentenceTransformer(MODEL_NAME)
+cross_encoder = CrossEncoder(RERANK_MODEL_NAME)
 logger = logging.getLogger('hf_emb_server_api')
 
 
@@ -41,6 +45,41 @@ def get_embedding(query: str):
     return response_data
 
 
+@app.post("/embeddings", status_code=status.HTTP_200_OK,)
+def get_embeddings(queries: List[str] = Body(...), batch_size: int = 32):
+    """
+    Get embeddings of a batch of query texts with a single model forward pass per batch_size texts
+    """
+    response_data = {}
+    try:
+        embeddings = feature_ext.encode(queries, batch_size=batch_size)
+        response_data["detail"] = f"embeddings extracted for {len(queries)} texts"
+        response_data["embeddings"] = embeddings.tolist()
+    except Exception as excep:
+        logger.error("%s: %s", excep, traceback.print_exc())
+        detail = response_data.get("detail", "failed to get text embeddings")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST , detail=detail) from excep
+    return response_data
+
+
+@app.post("/rerank", status_code=status.HTTP_200_OK,)
+def rerank(query: str = Body(...), passages: List[str] = Body(...), batch_size: int = 32):
+    """
+    Get cross-encoder relevance scores of (query, passage) pairs, higher is more relevant
+    All pairs are scored in forward passes of batch_size pairs
+    """
+    response_data = {}
+    try:
+        scores = cross_encoder.predict([(query, passage) for passage in passages], batch_size=batch_size)
+        response_data["detail"] = f"rerank scores computed for {len(passages)} passages"
+        response_data["scores"] = scores.tolist()
+    except Exception as excep:
+        logger.error("%s: %s", excep, traceback.print_exc())
+        detail = response_data.get("detail", "failed to get rerank scores")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST , detail=detail) from excep
+    return response_data
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         """Start FastAPI with uvicorn server hosting inference models""")
@@ -0,0 +1,164 @@
+"""
+TTL cache of the user & partition existence checks done before every upsert, search & qa request
+
+Every hot-path request first checks that the user exists in mongodb & that the user partition exists in milvus.
+The results are cached in process for a short ttl & invalidated explicitly when users are registered or removed.
+With several uvicorn workers, invalidations are also published on a redis pub/sub channel so that the other
+workers drop their entry as well. Without redis, other workers see the change after at most ttl_s.
+A check may be cached per scope, i.e. per collection of the user partition, & invalidating a key drops all its
+scopes. Other per-process caches of the users, i.e. the user -> shard mapping, subscribe to the invalidations
+with add_invalidation_callback
+"""
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+
+logger = logging.getLogger('existence_cache')
+
+
+class ExistenceCache:
+    """
+    In-process TTL cache of boolean existence checks keyed by (kind, key, scope), i.e. ("user", user_id, "")
+    Arguments:
+        ttl_s: float = seconds a cached check result is valid, <= 0 disables caching
+        max_size: int = max num of cached entries, least recently used entries are evicted
+        redis_client: redis.Redis = client used for pub/sub invalidation across workers, optional
+        channel: str = redis pub/sub invalidation channel
+    """
+    def __init__(
+            self,
+            ttl_s: float = 5.0,
+            max_size: int = 100000,
+            redis_client=None,
+            channel: str = "existence_cache_invalidation") -> None:
+        self.ttl_s = ttl_s
+        self.max_size = max_size
+        self.redis_client = redis_client
+        self.channel = channel
+        self._origin = uuid.uuid4().hex  # skips our own invalidation messages
+        self._entries: "OrderedDict[Tuple[str, str, str], Tuple[bool, float]]" = OrderedDict()
+        self._callbacks: List[Callable[[Optional[str], Optional[str]], None]] = []
+        self._generation = 0  # bumped by invalidations so that checks started before one are not cached
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0, "remote_invalidations": 0}
+        self._listener: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def get(self, kind: str, key: str, scope: str = "") -> Optional[bool]:
+        """Returns the cached check result or None if missing or expired"""
+        with self._lock:
+            entry = self._entries.get((kind, key, scope))
+            if entry is None or entry[1] < time.monotonic():
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end((kind, key, scope))
+            self._stats["hits"] += 1
+            return entry[0]
+
+    def set(self, kind: str, key: str, value: bool, generation: Optional[int] = None, scope: str = "") -> None:
+        """Caches a check result for ttl_s, unless an invalidation happened since generation"""
+        if self.ttl_s <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._entries[(kind, key, scope)] = (bool(value), time.monotonic() + self.ttl_s)
+            self._entries.move_to_end((kind, key, scope))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    async def get_or_check(
+            self, kind: str, key: str, check: Callable[[], Awaitable[bool]], scope: str = "") -> bool:
+        """Returns the cached check result or awaits check() & caches its result"""
+        value = self.get(kind, key, scope)
+        if value is None:
+            with self._lock:
+                generation = self._generation
+            value = bool(await check())
+            self.set(kind, key, value, generation, scope)
+        return value
+
+    def add_invalidation_callback(self, callback: Callable[[Optional[str], Optional[str]], None]) -> None:
+        """Calls callback(kind, key) on every invalidation of this process or received from the other workers"""
+        self._callbacks.append(callback)
+
+    def _invalidate_local(self, kind: Optional[str], key: Optional[str]) -> None:
+        with self._lock:
+            self._generation += 1
+            if kind is None:
+                self._entries.clear()
+            else:
+                for entry_key in [entry_key for entry_key in self._entries
+                                  if entry_key[0] == kind and (key is None or entry_key[1] == key)]:
+                    del self._entries[entry_key]
+        for callback in self._callbacks:
+            try:
+                callback(kind, key)
+            except Exception as excep:
+                logger.warning("%s: existence cache invalidation callback failed", excep)
+
+    def invalidate(self, kind: Optional[str] = None, key: Optional[str] = None) -> None:
+        """
+        Drops the (kind, key) entry, all entries of kind if key is None or all entries if kind is None,
+        in this process & in the other workers subscribed to the redis channel
+        """
+        self._invalidate_local(kind, key)
+        with self._lock:
+            self._stats["invalidations"] += 1
+        if self.redis_client is None:
+            return
+        try:
+            self.redis_client.publish(self.channel, json.dumps({"origin": self._origin, "kind": kind, "key": key}))
+        except Exception as excep:
+            logger.warning("%s: could not publish existence cache invalidation, other workers expire in %ss",
+                           excep, self.ttl_s)
+
+    def _listen(self, retry_interval_s: float) -> None:
+        warned = False
+        while not self._stop.is_set():
+            try:
+                pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                warned = False
+                while not self._stop.is_set():
+                    message = pubsub.get_message(timeout=1.0)
+                    if not message:
+                        continue
+                    data = json.loads(message["data"])
+                    if data.get("origin") == self._origin:
+                        continue
+                    self._invalidate_local(data.get("kind"), data.get("key"))
+                    with self._lock:
+                        self._stats["remote_invalidations"] += 1
+                pubsub.close()
+            except Exception as excep:
+                if not warned:
+                    logger.warning("%s: existence cache invalidation listener disconnected, retrying every %ss",
+                                   excep, retry_interval_s)
+                    warned = True
+                self._stop.wait(retry_interval_s)
+
+    def start_listener(self, retry_interval_s: float = 5.0) -> None:
+        """Subscribes to the redis invalidation channel in a daemon thread, reconnecting on failures"""
+        if self.redis_client is None or self._listener is not None:
+            return
+        self._listener = threading.Thread(
+            target=self._listen, args=(retry_interval_s,), name="existence_cache_listener", daemon=True)
+        self._listener.start()
+
+    def stop_listener(self) -> None:
+        """Stops the redis invalidation listener"""
+        self._stop.set()
+        if self._listener is not None:
+            self._listener.join(timeout=5)
+            self._listener = None
+
+    def metrics(self) -> Dict:
+        """Hit, miss & invalidation counts"""
+        with self._lock:
+            return dict(self._stats, size=len(self._entries), ttl_s=self.ttl_s)
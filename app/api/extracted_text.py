@@ -0,0 +1,99 @@
+"""
+Extracted text & chunk manifest cache of the stored documents
+
+Text extraction, i.e. pypdf for pdfs or selenium for html pages, is the slowest step of an upsert. The
+extracted text of each doc & its chunk manifest are saved in the user doc dir as <doc_id>.text.zz & the
+path is recorded as text_path in the mongodb doc record, so re-chunking, re-embedding or model migrations
+read the text back instead of re-extracting the file.
+File format, zlib compressed utf-8 json:
+    version     format version
+    extractor   pypdf, text, html or youtube_transcript
+    text        extracted text of the doc
+    chunk_size  num of chars per chunk
+    chunks      [start, end, hash] char offsets of each chunk in text & blake2b-64 hex digest of its utf-8 bytes
+"""
+import os
+import json
+import zlib
+import hashlib
+from typing import Dict, List, Sequence
+
+
+EXTRACTED_TEXT_EXT = ".text.zz"
+EXTRACTED_TEXT_FORMAT_VERSION = 1
+
+
+def split_text_chunks(text: str, chunk_size: int = 1024) -> List[str]:
+    """Splits text in chunks of chunk_size chars"""
+    return [text[i: i + chunk_size] for i in range(0, len(text), chunk_size)]
+
+
+def chunk_hash(chunk: str) -> str:
+    """blake2b-64 hex digest of the utf-8 bytes of a chunk"""
+    return hashlib.blake2b(chunk.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def build_chunk_manifest(chunks: Sequence[str]) -> List[List]:
+    """[start, end, hash] of each chunk, chunks are consecutive slices of the doc text"""
+    manifest, start = [], 0
+    for chunk in chunks:
+        manifest.append([start, start + len(chunk), chunk_hash(chunk)])
+        start += len(chunk)
+    return manifest
+
+
+def get_extracted_text_path(doc_path: str) -> str:
+    """Path of the extracted text cache of the doc at doc_path, the extension of doc_path is replaced"""
+    return os.path.splitext(doc_path)[0] + EXTRACTED_TEXT_EXT
+
+
+def write_extracted_text(
+        path: str,
+        text: str,
+        chunks: Sequence[str],
+        extractor: str,
+        chunk_size: int = 1024,
+        compression_level: int = 6) -> int:
+    """
+    Writes the extracted text & chunk manifest of a doc, chunks must be consecutive slices of text.
+    Returns the num of bytes written
+    """
+    data = {"version": EXTRACTED_TEXT_FORMAT_VERSION, "extractor": extractor, "text": text,
+            "chunk_size": chunk_size, "chunks": build_chunk_manifest(chunks)}
+    payload = zlib.compress(json.dumps(data, ensure_ascii=False).encode("utf-8"), compression_level)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as fptr:
+        fptr.write(payload)
+    os.replace(tmp_path, path)
+    return len(payload)
+
+
+def read_extracted_text(path: str) -> Dict:
+    """
+    Reads the extracted text cache of a doc. A ValueError is raised if the file is corrupt or of another version
+    """
+    with open(path, 'rb') as fptr:
+        try:
+            data = json.loads(zlib.decompress(fptr.read()).decode("utf-8"))
+        except (zlib.error, UnicodeDecodeError, json.JSONDecodeError) as excep:
+            raise ValueError(f"{path} is not a valid extracted text file: {excep}") from excep
+    if data.get("version") != EXTRACTED_TEXT_FORMAT_VERSION:
+        raise ValueError(f"{path} has extracted text format version {data.get('version')}, "
+                         f"expected {EXTRACTED_TEXT_FORMAT_VERSION}")
+    return data
+
+
+def read_doc_chunks(path: str) -> List[str]:
+    """
+    Returns the chunks of a doc from its extracted text cache. A ValueError is raised if a chunk does not match
+    its manifest hash
+    """
+    data = read_extracted_text(path)
+    chunks = []
+    for start, end, digest in data["chunks"]:
+        chunk = data["text"][start:end]
+        if chunk_hash(chunk) != digest:
+            raise ValueError(f"chunk [{start}, {end}) of {path} does not match its manifest hash")
+        chunks.append(chunk)
+    return chunks
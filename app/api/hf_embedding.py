@@ -2,6 +2,8 @@
 Huggingface api functions
 """
 import os
+from typing import List
+
 import requests
 from utils.common import timeit_decorator
 
@@ -35,10 +37,40 @@ def query_api_docker(payload: str, hf_api_url: str = "http://hf_text_embedding_a
     return response.json()["embedding"]
 
 
+def query_api_docker_batch(
+        payload: List[str],
+        hf_api_url: str = "http://hf_text_embedding_api:8009/embeddings",
+        timeout: float = 60) -> List[List[float]]:
+    """
+    Get embeddings of a batch of texts using a single call to a dockerized api endpoint
+    Returns the embeddings in the same order as the payload texts
+    """
+    headers = {"accept": "application/json"}
+    response = requests.post(hf_api_url, headers=headers, json=payload, timeout=timeout)
+    return response.json()["embeddings"]
+
+
+def query_api_docker_rerank(
+        query: str,
+        passages: List[str],
+        hf_api_url: str = "http://hf_text_embedding_api:8009/rerank",
+        timeout: float = 30) -> List[float]:
+    """
+    Get cross-encoder relevance scores of the query with each passage using a single call to a dockerized api endpoint
+    Returns the scores in the same order as the passages, higher is more relevant
+    """
+    headers = {"accept": "application/json"}
+    response = requests.post(hf_api_url, headers=headers, json={"query": query, "passages": passages}, timeout=timeout)
+    response.raise_for_status()
+    return response.json()["scores"]
+
+
 # if DEBUG is true, function runs are time
 if DEBUG:
     query_api_online = timeit_decorator(query_api_online)
     query_api_docker = timeit_decorator(query_api_docker)
+    query_api_docker_batch = timeit_decorator(query_api_docker_batch)
+    query_api_docker_rerank = timeit_decorator(query_api_docker_rerank)
 
 
 if __name__ == "__main__":
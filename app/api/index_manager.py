@@ -0,0 +1,98 @@
+"""
+Background rebuilds of the embedding index of collections
+
+Rebuilding an index releases the collection & blocks until milvus has built the new index, so rebuilds run on
+a background thread & the admin api only reports their state. One rebuild per collection can run at a time.
+Note: the rebuild state is per process, the index itself & its build progress are read from milvus
+"""
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Dict, Optional
+
+from pymilvus import Collection
+from api.milvus import (
+    get_vector_index_milvus, index_building_progress_milvus, rebuild_vector_index_milvus,
+    estimate_index_memory_bytes, get_vector_precision)
+
+
+logger = logging.getLogger('index_manager')
+
+
+class IndexRebuildManager:
+    """
+    Runs embedding index rebuilds in the background & keeps the state of the last rebuild of each collection
+    Arguments:
+        release_collection: Callable[[Collection], None] = releases a collection before its index is dropped,
+            i.e. PartitionLoadManager.release_all so released partitions are loaded again on demand
+        metric_type: str = metric of the rebuilt indexes
+        num_workers: int = max num of rebuilds running at the same time
+    """
+    def __init__(
+            self,
+            release_collection: Callable[[Collection], None],
+            metric_type: str = "IP",
+            num_workers: int = 1) -> None:
+        self.release_collection = release_collection
+        self.metric_type = metric_type
+        self._rebuilds: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="index_rebuild")
+
+    def start(self, milvus_client: Collection, index_type: str, build_params: Dict) -> Dict:
+        """
+        Queues the rebuild of the collection embedding index. A ValueError is raised if a rebuild of the
+        collection is already queued or running. Returns the rebuild state
+        """
+        with self._lock:
+            rebuild = self._rebuilds.get(milvus_client.name)
+            if rebuild is not None and rebuild["state"] in ("queued", "building"):
+                raise ValueError(f"Index of collection {milvus_client.name} is already being rebuilt")
+            rebuild = self._rebuilds[milvus_client.name] = {
+                "state": "queued", "index_type": index_type.upper(), "params": build_params,
+                "queued_at": datetime.now(timezone.utc), "error": None}
+        self._pool.submit(self._rebuild, milvus_client, index_type, build_params)
+        return dict(rebuild)
+
+    def status(self, collection_name: str) -> Optional[Dict]:
+        """State of the last rebuild of the collection or None if it was not rebuilt by this process"""
+        with self._lock:
+            rebuild = self._rebuilds.get(collection_name)
+            return None if rebuild is None else dict(rebuild)
+
+    def describe(self, milvus_client: Collection, vector_dim: int) -> Dict:
+        """
+        Returns the collection embedding index, its build progress, num of entities, estimated memory & the
+        state of its last rebuild
+        """
+        vector_index = get_vector_index_milvus(milvus_client, use_cache=False)
+        num_entities = milvus_client.num_entities
+        info = {"collection_name": milvus_client.name, "num_entities": num_entities, "index": vector_index,
+                "progress": None, "est_memory_bytes": None, "rebuild": self.status(milvus_client.name)}
+        if vector_index is not None:
+            info["progress"] = index_building_progress_milvus(milvus_client, vector_index["index_name"])
+            vector_bytes = 2 if get_vector_precision(milvus_client) == "float16" else 4
+            info["est_memory_bytes"] = estimate_index_memory_bytes(
+                vector_index["index_type"], vector_index.get("params") or {}, num_entities, vector_dim, vector_bytes)
+        return info
+
+    def _rebuild(self, milvus_client: Collection, index_type: str, build_params: Dict) -> None:
+        rebuild = self._rebuilds[milvus_client.name]
+        t_0 = time.perf_counter()
+        with self._lock:
+            rebuild.update(state="building", started_at=datetime.now(timezone.utc))
+        try:
+            self.release_collection(milvus_client)
+            rebuild_vector_index_milvus(milvus_client, index_type, build_params, self.metric_type)
+            with self._lock:
+                rebuild.update(state="done")
+        except Exception as excep:
+            logger.error("%s: index rebuild of collection %s failed", excep, milvus_client.name)
+            with self._lock:
+                rebuild.update(state="failed", error=str(excep))
+        with self._lock:
+            rebuild.update(finished_at=datetime.now(timezone.utc), duration_s=time.perf_counter() - t_0)
+        logger.info("Index rebuild of collection %s %s in %.1fs", milvus_client.name, rebuild["state"],
+                    rebuild["duration_s"])
@@ -0,0 +1,320 @@
+"""
+Per-user BM25 lexical index for hybrid search
+
+Dense retrieval handles exact identifiers, error codes & names badly. Each user has a lexical inverted index
+over their chunks under root_dir/user_<user_id>, built incrementally by the upsert routes.
+Every upsert writes one immutable segment directory:
+    vocab.json          term -> [postings offset, document frequency]
+    postings_rows.i32   chunk rows of the postings of all terms, sorted by term
+    postings_tfs.u16    term frequencies aligned with postings_rows.i32
+    chunk_ids.i64       milvus primary keys of the segment chunks
+    chunk_lens.u32      num of tokens of the segment chunks
+    chunk_docs.json     doc_id of the segment chunks
+Postings are memory-mapped. Deleted docs are recorded in deleted_docs.json & dropped when segments are merged.
+Segment writes, merges & deleted_docs.json updates of a user hold an exclusive flock on the user dir .lock file
+& segments are loaded under a shared flock, as the api workers share the index dir.
+Postings reference milvus primary keys, so the index of a user whose entities were inserted again under new
+keys, i.e. by the partition key migration, is rebuilt from the collection with rebuild_user
+"""
+import os
+import re
+import json
+import uuid
+import fcntl
+import shutil
+import logging
+import threading
+from contextlib import contextmanager
+from collections import Counter, OrderedDict
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+
+logger = logging.getLogger('lexical_index')
+
+_TOKEN_RE = re.compile(r"\w+(?:[-.:/]\w+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercased word tokens. Compound tokens like error codes (ERR-404), versions (1.2.3) or paths are
+    kept whole & also split into their parts so that both exact & partial matches score
+    """
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        tokens.append(token)
+        if not token.isalnum() and "_" not in token:
+            tokens.extend(re.findall(r"\w+", token))
+    return tokens
+
+
+class _Segment:
+    """Memory-mapped immutable index segment"""
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(os.path.join(path, "vocab.json"), 'r', encoding="utf-8") as fptr:
+            self.vocab: Dict[str, List[int]] = json.load(fptr)
+        with open(os.path.join(path, "chunk_docs.json"), 'r', encoding="utf-8") as fptr:
+            self.chunk_docs: List[str] = json.load(fptr)
+        self.chunk_ids = np.fromfile(os.path.join(path, "chunk_ids.i64"), dtype=np.int64)
+        self.chunk_lens = np.fromfile(os.path.join(path, "chunk_lens.u32"), dtype=np.uint32).astype(np.float32)
+        num_postings = sum(df for _, df in self.vocab.values())
+        self.postings_rows = (np.memmap(os.path.join(path, "postings_rows.i32"), dtype=np.int32, mode="r")
+                              if num_postings else np.empty(0, dtype=np.int32))
+        self.postings_tfs = (np.memmap(os.path.join(path, "postings_tfs.u16"), dtype=np.uint16, mode="r")
+                             if num_postings else np.empty(0, dtype=np.uint16))
+
+    def postings(self, term: str):
+        offset, doc_freq = self.vocab.get(term, (0, 0))
+        return self.postings_rows[offset: offset + doc_freq], self.postings_tfs[offset: offset + doc_freq]
+
+
+def _write_segment(path: str, chunk_ids: List[int], doc_ids: List[str], chunk_tokens: List[List[str]]) -> None:
+    """Writes a segment to a temporary dir & renames it to path so readers never see partial segments"""
+    postings: Dict[str, List] = {}
+    for row, tokens in enumerate(chunk_tokens):
+        for term, freq in Counter(tokens).items():
+            postings.setdefault(term, []).append((row, min(freq, np.iinfo(np.uint16).max)))
+    vocab, rows, tfs, offset = {}, [], [], 0
+    for term in sorted(postings):
+        vocab[term] = [offset, len(postings[term])]
+        rows.extend(row for row, _ in postings[term])
+        tfs.extend(freq for _, freq in postings[term])
+        offset += len(postings[term])
+
+    tmp_path = path + ".tmp"
+    os.makedirs(tmp_path, exist_ok=True)
+    np.asarray(rows, dtype=np.int32).tofile(os.path.join(tmp_path, "postings_rows.i32"))
+    np.asarray(tfs, dtype=np.uint16).tofile(os.path.join(tmp_path, "postings_tfs.u16"))
+    np.asarray(chunk_ids, dtype=np.int64).tofile(os.path.join(tmp_path, "chunk_ids.i64"))
+    np.asarray([len(tokens) for tokens in chunk_tokens], dtype=np.uint32).tofile(
+        os.path.join(tmp_path, "chunk_lens.u32"))
+    with open(os.path.join(tmp_path, "chunk_docs.json"), 'w', encoding="utf-8") as fptr:
+        json.dump(list(doc_ids), fptr)
+    with open(os.path.join(tmp_path, "vocab.json"), 'w', encoding="utf-8") as fptr:
+        json.dump(vocab, fptr)
+    os.rename(tmp_path, path)
+
+
+class _UserIndex:
+    """Segments & deleted docs of one user, reloaded when another process changes the user dir"""
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.signature = None
+        self.segments: List[_Segment] = []
+        self.deleted_docs = set()
+        self.reload()
+
+    def _signature(self):
+        if not os.path.isdir(self.path):
+            return None
+        deleted_path = os.path.join(self.path, "deleted_docs.json")
+        return (tuple(sorted(name for name in os.listdir(self.path) if name.startswith("seg_")
+                             and not name.endswith(".tmp"))),
+                os.path.getmtime(deleted_path) if os.path.exists(deleted_path) else 0)
+
+    def reload(self) -> None:
+        signature = self._signature()
+        if signature == self.signature:
+            return
+        self.segments = [_Segment(os.path.join(self.path, name)) for name in signature[0]] if signature else []
+        deleted_path = os.path.join(self.path, "deleted_docs.json")
+        self.deleted_docs = set()
+        if os.path.exists(deleted_path):
+            with open(deleted_path, 'r', encoding="utf-8") as fptr:
+                self.deleted_docs = set(json.load(fptr))
+        self.signature = signature
+
+
+class LexicalIndexStore:
+    """
+    Per-user BM25 inverted indexes stored as memory-mapped segments
+    Arguments:
+        root_dir: str = dir holding the user index dirs
+        cache_size: int = num of user indexes kept open in process
+        max_segments: int = num of segments of a user index above which segments are merged
+        k1: float = bm25 term frequency saturation
+        b: float = bm25 document length normalization
+    """
+    def __init__(
+            self,
+            root_dir: str,
+            cache_size: int = 256,
+            max_segments: int = 8,
+            k1: float = 1.2,
+            b: float = 0.75) -> None:
+        self.root_dir = root_dir
+        self.cache_size = cache_size
+        self.max_segments = max_segments
+        self.k1 = k1
+        self.b = b
+        self._indexes: "OrderedDict[str, _UserIndex]" = OrderedDict()
+        self._lock = threading.RLock()
+        os.makedirs(root_dir, exist_ok=True)
+
+    def _user_path(self, user_id: str) -> str:
+        return os.path.join(self.root_dir, f"user_{user_id}")
+
+    @contextmanager
+    def _user_lock(self, user_id: str, shared: bool = False) -> Iterator[None]:
+        """Locks the user index across threads & worker processes, exclusively unless shared"""
+        with self._lock, open(os.path.join(self._user_path(user_id), ".lock"), 'a+b') as fptr:
+            fcntl.flock(fptr.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            yield
+
+    def _get_index(self, user_id: str) -> _UserIndex:
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is None:
+                index = self._indexes[user_id] = _UserIndex(self._user_path(user_id))
+            else:
+                index.reload()
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self.cache_size:
+                self._indexes.popitem(last=False)
+            return index
+
+    def add_chunks(self, user_id: str, chunk_ids: List[int], doc_ids: List[str], contents: List[str]) -> None:
+        """
+        Indexes the chunks inserted into milvus with primary keys chunk_ids as a new segment of the user index.
+        Deleted docs indexed again, i.e. by a re-run reindex pass, have their old chunks merged out first
+        """
+        if not chunk_ids:
+            return
+        user_path = self._user_path(user_id)
+        os.makedirs(user_path, exist_ok=True)
+        with self._user_lock(user_id):
+            index = self._get_index(user_id)
+            if not index.deleted_docs.isdisjoint(doc_ids):
+                self._merge_segments(user_id, index)
+            # zero padded counter & a random suffix keep segment names ordered & unique across workers
+            num_segments = len([name for name in os.listdir(user_path) if name.startswith("seg_")])
+            segment_path = os.path.join(user_path, f"seg_{num_segments:06d}_{uuid.uuid4().hex[:8]}")
+            _write_segment(segment_path, chunk_ids, doc_ids, [tokenize(content) for content in contents])
+            index = self._get_index(user_id)
+            if len(index.segments) > self.max_segments:
+                self._merge_segments(user_id, index)
+
+    def delete_docs(self, user_id: str, doc_ids: List[str]) -> None:
+        """
+        Excludes the chunks of doc_ids from searches, they are removed when segments are merged.
+        Docs without chunks in the index are not recorded
+        """
+        if not os.path.isdir(self._user_path(user_id)):
+            return
+        with self._user_lock(user_id):
+            index = self._get_index(user_id)
+            indexed_docs = {doc_id for segment in index.segments for doc_id in segment.chunk_docs}
+            if index.deleted_docs.issuperset(indexed_docs.intersection(doc_ids)):
+                return
+            deleted_path = os.path.join(self._user_path(user_id), "deleted_docs.json")
+            with open(deleted_path + ".tmp", 'w', encoding="utf-8") as fptr:
+                json.dump(sorted(index.deleted_docs | indexed_docs.intersection(doc_ids)), fptr)
+            os.replace(deleted_path + ".tmp", deleted_path)
+            index.reload()
+
+    def rebuild_user(self, user_id: str, chunk_ids: List[int], doc_ids: List[str], contents: List[str]) -> None:
+        """
+        Replaces the user index with one segment of the chunks with milvus primary keys chunk_ids, i.e. all the
+        chunks of the user in the collection
+        """
+        os.makedirs(self._user_path(user_id), exist_ok=True)
+        with self._user_lock(user_id):
+            index = self._get_index(user_id)
+            self._replace_segments(user_id, index, chunk_ids, doc_ids, [tokenize(content) for content in contents])
+        logger.info("Rebuilt the lexical index of user %s with %s chunks", user_id, len(chunk_ids))
+
+    def drop_user(self, user_id: str) -> None:
+        """Removes the user index"""
+        if not os.path.isdir(self._user_path(user_id)):
+            with self._lock:
+                self._indexes.pop(user_id, None)
+            return
+        with self._user_lock(user_id):
+            self._indexes.pop(user_id, None)
+            shutil.rmtree(self._user_path(user_id), ignore_errors=True)
+
+    def drop_all(self) -> None:
+        """Removes the indexes of all users"""
+        with self._lock:
+            self._indexes.clear()
+            shutil.rmtree(self.root_dir, ignore_errors=True)
+            os.makedirs(self.root_dir, exist_ok=True)
+
+    def _merge_segments(self, user_id: str, index: _UserIndex) -> None:
+        """Rewrites all segments of a user as one segment without the deleted docs, the user lock must be held"""
+        chunk_ids, doc_ids, chunk_tokens = [], [], []
+        for segment in index.segments:
+            segment_tokens: List[List[str]] = [[] for _ in segment.chunk_docs]
+            for term, (offset, doc_freq) in segment.vocab.items():
+                for row, freq in zip(segment.postings_rows[offset: offset + doc_freq],
+                                     segment.postings_tfs[offset: offset + doc_freq]):
+                    segment_tokens[row].extend([term] * int(freq))
+            for row, doc_id in enumerate(segment.chunk_docs):
+                if doc_id not in index.deleted_docs:
+                    chunk_ids.append(int(segment.chunk_ids[row]))
+                    doc_ids.append(doc_id)
+                    chunk_tokens.append(segment_tokens[row])
+        num_segments = len(index.segments)
+        self._replace_segments(user_id, index, chunk_ids, doc_ids, chunk_tokens)
+        logger.info("Merged %s lexical index segments of user %s", num_segments, user_id)
+
+    def _replace_segments(
+            self,
+            user_id: str,
+            index: _UserIndex,
+            chunk_ids: List[int],
+            doc_ids: List[str],
+            chunk_tokens: List[List[str]]) -> None:
+        """Replaces all segments & deleted docs of a user with one segment, the user lock must be held"""
+        merged_path = os.path.join(self._user_path(user_id), f"seg_{0:06d}_{uuid.uuid4().hex[:8]}")
+        _write_segment(merged_path, chunk_ids, doc_ids, chunk_tokens)
+        for segment in index.segments:
+            shutil.rmtree(segment.path, ignore_errors=True)
+        deleted_path = os.path.join(self._user_path(user_id), "deleted_docs.json")
+        if os.path.exists(deleted_path):
+            os.remove(deleted_path)
+        index.reload()
+
+    def search(
+            self,
+            user_id: str,
+            query: str,
+            limit: int = 10,
+            doc_id_list: Optional[List[str]] = None) -> List[Dict]:
+        """
+        Returns the limit chunks with the highest bm25 scores as {"id", "doc_id", "score"} dicts,
+        where id is the milvus primary key of the chunk. Only chunks of doc_id_list are scored if given
+        """
+        if not os.path.isdir(self._user_path(user_id)):
+            return []
+        # a merge in another worker may remove the segments being loaded otherwise, loaded segments stay readable
+        with self._user_lock(user_id, shared=True):
+            index = self._get_index(user_id)
+            segments, deleted_docs = index.segments, index.deleted_docs
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not segments or not terms:
+            return []
+        num_chunks = sum(len(segment.chunk_ids) for segment in segments)
+        avg_len = max(sum(float(segment.chunk_lens.sum()) for segment in segments) / max(num_chunks, 1), 1.0)
+        doc_freqs = {term: sum(segment.vocab.get(term, (0, 0))[1] for segment in segments) for term in terms}
+        idfs = {term: np.log(1 + (num_chunks - df + 0.5) / (df + 0.5)) for term, df in doc_freqs.items() if df}
+        allowed_docs = set(doc_id_list) if doc_id_list is not None else None
+
+        candidates = []
+        for segment in segments:
+            scores = np.zeros(len(segment.chunk_ids), dtype=np.float32)
+            norm = self.k1 * (1 - self.b + self.b * segment.chunk_lens / avg_len)
+            for term, idf in idfs.items():
+                rows, tfs = segment.postings(term)
+                if len(rows):
+                    tfs = tfs.astype(np.float32)
+                    scores[rows] += idf * tfs * (self.k1 + 1) / (tfs + norm[rows])
+            for row in np.flatnonzero(scores):
+                doc_id = segment.chunk_docs[row]
+                if doc_id in deleted_docs or (allowed_docs is not None and doc_id not in allowed_docs):
+                    continue
+                candidates.append({"id": int(segment.chunk_ids[row]), "doc_id": doc_id, "score": float(scores[row])})
+        candidates.sort(key=lambda hit: hit["score"], reverse=True)
+        return candidates[:limit]
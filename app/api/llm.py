@@ -0,0 +1,109 @@
+"""
+LLM answer generation clients
+
+Any backend exposing the LLMClient protocol can generate /qa answers. OpenAICompatibleLLM talks to the
+OpenAI chat completions api & compatible servers (vLLM, llama.cpp, ollama, api.llm_stub.server)
+"""
+import json
+import logging
+from typing import AsyncIterator, Dict, List, Optional, Protocol
+
+import httpx
+
+
+logger = logging.getLogger('llm_api')
+
+QA_SYSTEM_PROMPT = (
+    "You answer questions using only the context passages provided by the user. "
+    "Some passages may be unrelated to the question, ignore them. "
+    "If the context does not contain the answer, say that there is no relevant information to answer the question.")
+
+QA_USER_PROMPT_TMPL = (
+    "Context information is below.\n"
+    "---------------------\n"
+    "{context_str}\n"
+    "---------------------\n"
+    "Given the context information and not prior knowledge, answer the query.\n"
+    "Query: {query_str}\n"
+    "Answer: ")
+
+
+def format_sse_event(event: str, data: Dict) -> str:
+    """
+    Formats a server-sent event with a json data payload
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def build_qa_messages(query: str, context_chunks: List[str]) -> List[Dict[str, str]]:
+    """
+    Builds the chat messages of a question with the packed context chunks
+    """
+    context_str = "\n\n".join(f"[{idx}] {chunk}" for idx, chunk in enumerate(context_chunks, start=1))
+    return [{"role": "system", "content": QA_SYSTEM_PROMPT},
+            {"role": "user", "content": QA_USER_PROMPT_TMPL.format(context_str=context_str, query_str=query)}]
+
+
+class LLMClient(Protocol):
+    """Streams the tokens of a chat completion"""
+
+    def stream_chat(self, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        ...
+
+
+class OpenAICompatibleLLM:
+    """
+    Streaming client of an OpenAI compatible /chat/completions endpoint
+    The http connection pool is reused across requests so that the first token is not delayed by a new handshake
+    Arguments:
+        base_url: str = api base url up to the version prefix i.e. http://llm:8000/v1
+        model: str = model name
+        api_key: str = bearer token, optional for local servers
+        max_tokens: int = max num of generated tokens
+        temperature: float = sampling temperature
+        timeout: float = read timeout between streamed chunks in seconds
+        transport: httpx.AsyncBaseTransport = custom transport, i.e. an ASGITransport of the stub server in tests
+    """
+    def __init__(
+            self,
+            base_url: str,
+            model: str,
+            api_key: Optional[str] = None,
+            max_tokens: int = 512,
+            temperature: float = 0.1,
+            timeout: float = 60,
+            transport: Optional[httpx.AsyncBaseTransport] = None) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        headers = {"accept": "text/event-stream"}
+        if api_key:
+            headers["Authorization"] = f"Bearer {api_key}"
+        self._client = httpx.AsyncClient(
+            headers=headers, timeout=httpx.Timeout(timeout, connect=10), transport=transport)
+
+    async def stream_chat(self, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        """
+        Yields the content deltas of a streamed chat completion as soon as they arrive
+        """
+        payload = {"model": self.model, "messages": messages, "stream": True,
+                   "max_tokens": self.max_tokens, "temperature": self.temperature}
+        async with self._client.stream("POST", f"{self.base_url}/chat/completions", json=payload) as response:
+            if response.status_code != 200:
+                body = await response.aread()
+                raise RuntimeError(f"llm api returned {response.status_code}: {body[:512]!r}")
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                choices = json.loads(data).get("choices") or [{}]
+                delta = choices[0].get("delta", {}).get("content")
+                if delta:
+                    yield delta
+
+    async def aclose(self) -> None:
+        """Closes the http connection pool"""
+        await self._client.aclose()
@@ -0,0 +1,85 @@
+"""
+OpenAI compatible llm stand-in server for local development & tests
+
+Streams a deterministic answer listing the context passages & the query of the last user message
+token by token, so /qa answer streaming can be tested without an llm
+"""
+import re
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import logging
+from typing import Dict, List
+
+import uvicorn
+from fastapi import FastAPI, Body, status
+from fastapi.responses import StreamingResponse
+
+MODEL_NAME = "stub-llm"
+TOKEN_DELAY_S = 0.005
+
+app = FastAPI()
+logger = logging.getLogger('llm_stub_server_api')
+
+
+def _stub_answer(messages: List[Dict]) -> List[str]:
+    prompt = next((msg["content"] for msg in reversed(messages) if msg.get("role") == "user"), "")
+    num_passages = len(re.findall(r"^\[\d+\] ", prompt, flags=re.MULTILINE))
+    query = re.search(r"Query: (.*)\n", prompt)
+    answer = f"Stub answer from {num_passages} context passage(s) for: {query.group(1) if query else prompt}"
+    return re.findall(r"\S+\s*", answer)
+
+
+def _chunk(completion_id: str, delta: Dict, finish_reason: str = None) -> str:
+    chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+             "model": MODEL_NAME, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+    return f"data: {json.dumps(chunk)}\n\n"
+
+
+@app.get("/v1/models", status_code=status.HTTP_200_OK)
+def list_models():
+    """
+    List the served models
+    """
+    return {"object": "list", "data": [{"id": MODEL_NAME, "object": "model", "owned_by": "stub"}]}
+
+
+@app.post("/v1/chat/completions", status_code=status.HTTP_200_OK)
+async def chat_completions(
+        messages: List[Dict] = Body(...),
+        model: str = Body(MODEL_NAME),
+        stream: bool = Body(False),
+        max_tokens: int = Body(512)):
+    """
+    Chat completion with the stub answer, streamed as server-sent events if stream is true
+    """
+    tokens = _stub_answer(messages)[:max_tokens]
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    if not stream:
+        return {"id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": "".join(tokens)}}]}
+
+    async def event_stream():
+        yield _chunk(completion_id, {"role": "assistant"})
+        for token in tokens:
+            await asyncio.sleep(TOKEN_DELAY_S)
+            yield _chunk(completion_id, {"content": token})
+        yield _chunk(completion_id, {}, finish_reason="stop")
+        yield "data: [DONE]\n\n"
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        """Start FastAPI with uvicorn server hosting an OpenAI compatible stub llm""")
+    parser.add_argument('-ip', '--host_ip', type=str, default="0.0.0.0",
+                        help='host ip address. (default: %(default)s)')
+    parser.add_argument('-p', '--port', type=int, default=8010,
+                        help='uvicorn port number. (default: %(default)s)')
+    args = parser.parse_args()
+
+    logger.info("Uvicorn server running on %s:%s", args.host_ip, args.port)
+    uvicorn.run("server:app", host=args.host_ip, port=args.port)
@@ -0,0 +1,930 @@
+"""
+Embedded local vector store backend for single-node deployments
+
+Mirrors the subset of the pymilvus Collection api used by the routes (see api.vector_store.VectorCollection)
+so the full api runs without the etcd/minio/milvus services. Each collection is a directory under root_dir:
+    meta.json                   collection schema & index params
+    quantizer.json              int8 calibration of collections with int8 vector precision
+    <partition>/vectors.f32     float32 embeddings, memory-mapped, vectors.f16 or vectors.i8 for reduced precision
+    <partition>/vectors.b1      packed embedding sign bits of collections with a binary prefilter
+    <partition>/ids.i64         int64 primary keys in the row order of the vectors
+    <partition>/scalars.jsonl   doc_id, user_id & content (or the chunk text offsets) of each row
+    <partition>/deleted.i64     primary keys of deleted rows, compacted away on load
+    <partition>/hnsw.bin        hnswlib index of partitions with at least ann_threshold rows
+
+Partitions below ann_threshold rows, i.e. most tenants, are searched exactly with numpy brute force.
+Larger partitions of HNSW indexed collections use an hnswlib index for unfiltered searches if hnswlib is installed.
+Filtered searches always run brute force on the rows matching the filter. In partition key mode, rows are
+grouped by user_id so `user_id == "x"` filters only scan the rows of that user.
+Writes are appended to the partition files & picked up by other processes through file size checks.
+"""
+import os
+import re
+import ast
+import json
+import time
+import shutil
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from api.quantization import (
+    VECTOR_PRECISIONS, ScalarQuantizer, load_quantizer, normalize_vectors, to_precision, from_precision,
+    hamming_distances)
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+
+logger = logging.getLogger('local_store')
+
+DEFAULT_PARTITION = "_default"
+# compact a partition on load once this fraction of its rows are deleted
+COMPACTION_DELETED_RATIO = 0.3
+_SCALAR_FIELDS = ("doc_id", "user_id", "content")
+# scalar fields of collections keeping the chunk text in api.chunk_text_store files
+_CHUNK_OFFSET_SCALAR_FIELDS = ("doc_id", "user_id", "chunk_index", "text_start", "text_end")
+_NAME_RE = re.compile(r"^[A-Za-z0-9_\-]+$")
+_VECTOR_FILES = {"float32": "vectors.f32", "float16": "vectors.f16", "int8": "vectors.i8"}
+# binary vector field of collections with a binary prefilter, searched with the HAMMING metric
+_BINARY_FIELD = "binary_embedding"
+
+
+@dataclass
+class LocalMutationResult:
+    """Insert & delete result with the attributes of the pymilvus MutationResult"""
+    primary_keys: List[int] = field(default_factory=list)
+    insert_count: int = 0
+    delete_count: int = 0
+
+
+@dataclass
+class LocalFieldSchema:
+    """Field with the attributes of the pymilvus FieldSchema used by the api"""
+    name: str
+
+
+@dataclass
+class LocalCollectionSchema:
+    """Schema with the attributes of the pymilvus CollectionSchema used by the api"""
+    fields: List[LocalFieldSchema]
+
+
+@dataclass
+class LocalIndex:
+    """Index with the attributes of the pymilvus Index used by the api"""
+    field_name: str
+    index_name: str
+    params: Dict[str, Any]
+
+
+@dataclass
+class LocalHit:
+    """Search hit with the attributes of the pymilvus Hit"""
+    id: int
+    distance: float
+    entity: Dict[str, Any]
+
+
+# ############## filter expressions ##############
+
+_TOKEN_RE = re.compile(
+    r"\s*(?:(?P<num>-?\d+(?:\.\d+)?)"
+    r"|(?P<str>\"(?:[^\"\\]|\\.)*\"|'(?:[^'\\]|\\.)*')"
+    r"|(?P<op>==|!=|<=|>=|&&|\|\||[<>\[\](),])"
+    r"|(?P<name>[A-Za-z_][A-Za-z0-9_]*))")
+_KEYWORDS = {"and", "or", "not", "in"}
+_COMPARATORS = {
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+}
+
+
+def _tokenize(expr: str) -> List[Tuple[str, Any]]:
+    tokens, pos, expr = [], 0, expr.strip()
+    while pos < len(expr):
+        match = _TOKEN_RE.match(expr, pos)
+        if not match:
+            raise ValueError(f"Invalid filter expression {expr!r} at position {pos}")
+        pos, kind, text = match.end(), match.lastgroup, match.group(match.lastgroup)
+        if kind in ("num", "str"):
+            tokens.append(("lit", ast.literal_eval(text)))
+        elif kind == "name" and text.lower() in _KEYWORDS:
+            tokens.append(("op", text.lower()))
+        else:
+            tokens.append((kind, text))
+    return tokens
+
+
+class _ExprParser:
+    """
+    Recursive descent parser of the milvus boolean expression subset used by the api:
+    comparisons (== != < <= > >=), [not] in lists, and/&&, or/||, not & parentheses
+    """
+    def __init__(self, expr: str) -> None:
+        self.expr = expr
+        self.tokens = _tokenize(expr)
+        self.pos = 0
+
+    def parse(self) -> tuple:
+        node = self._or()
+        if self.pos != len(self.tokens):
+            raise ValueError(f"Unexpected token {self.tokens[self.pos][1]!r} in filter expression {self.expr!r}")
+        return node
+
+    def _peek(self) -> Tuple[str, Any]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else ("end", None)
+
+    def _take(self, kind: str, value: Any = None) -> Any:
+        tok_kind, tok_value = self._peek()
+        if tok_kind != kind or (value is not None and tok_value != value):
+            raise ValueError(f"Expected {value or kind} in filter expression {self.expr!r}, got {tok_value!r}")
+        self.pos += 1
+        return tok_value
+
+    def _or(self) -> tuple:
+        node = self._and()
+        while self._peek() in (("op", "or"), ("op", "||")):
+            self.pos += 1
+            node = ("or", node, self._and())
+        return node
+
+    def _and(self) -> tuple:
+        node = self._unary()
+        while self._peek() in (("op", "and"), ("op", "&&")):
+            self.pos += 1
+            node = ("and", node, self._unary())
+        return node
+
+    def _unary(self) -> tuple:
+        if self._peek() == ("op", "not"):
+            self.pos += 1
+            return ("not", self._unary())
+        if self._peek() == ("op", "("):
+            self.pos += 1
+            node = self._or()
+            self._take("op", ")")
+            return node
+        field_name = self._take("name")
+        if self._peek() == ("op", "not"):
+            self.pos += 1
+            self._take("op", "in")
+            return ("in", field_name, self._list(), True)
+        if self._peek() == ("op", "in"):
+            self.pos += 1
+            return ("in", field_name, self._list(), False)
+        operator = self._take("op")
+        if operator not in _COMPARATORS:
+            raise ValueError(f"Unsupported operator {operator!r} in filter expression {self.expr!r}")
+        return ("cmp", operator, field_name, self._take("lit"))
+
+    def _list(self) -> list:
+        self._take("op", "[")
+        values = []
+        while self._peek() != ("op", "]"):
+            values.append(self._take("lit"))
+            if self._peek() == ("op", ","):
+                self.pos += 1
+        self._take("op", "]")
+        return values
+
+
+def parse_expr(expr: Optional[str]) -> Optional[tuple]:
+    """
+    Parses a milvus filter expression into a node tree, None for an empty expression
+    """
+    return _ExprParser(expr).parse() if expr and expr.strip() else None
+
+
+def _eval_expr(node: tuple, get_value: Callable[[str], Any]) -> bool:
+    kind = node[0]
+    if kind == "and":
+        return _eval_expr(node[1], get_value) and _eval_expr(node[2], get_value)
+    if kind == "or":
+        return _eval_expr(node[1], get_value) or _eval_expr(node[2], get_value)
+    if kind == "not":
+        return not _eval_expr(node[1], get_value)
+    if kind == "in":
+        return (get_value(node[1]) in node[2]) != node[3]
+    return _COMPARATORS[node[1]](get_value(node[2]), node[3])
+
+
+def _pinned_values(node: Optional[tuple], field_name: str) -> Optional[list]:
+    """
+    Values field_name must take for node to hold, None if the expression does not pin the field
+    """
+    if node is None:
+        return None
+    if node[0] == "cmp" and node[1] == "==" and node[2] == field_name:
+        return [node[3]]
+    if node[0] == "in" and node[1] == field_name and not node[3]:
+        return list(node[2])
+    if node[0] == "and":
+        left = _pinned_values(node[1], field_name)
+        return left if left is not None else _pinned_values(node[2], field_name)
+    return None
+
+
+# ############## partition storage ##############
+
+@dataclass
+class _Snapshot:
+    """Consistent view of the first num_rows rows of a partition"""
+    num_rows: int
+    vectors: np.ndarray
+    ids: np.ndarray
+    scalars: List[Dict]
+    alive: np.ndarray
+    user_rows: Dict[str, List[int]]
+    codes: Optional[np.ndarray] = None
+
+    def rows_of_users(self, user_ids: list) -> np.ndarray:
+        rows = [row for user_id in user_ids for row in self.user_rows.get(user_id, ())]
+        rows = np.asarray(sorted(rows), dtype=np.int64)
+        rows = rows[rows < self.num_rows]
+        return rows[self.alive[rows]]
+
+    def alive_rows(self) -> np.ndarray:
+        return np.flatnonzero(self.alive)
+
+
+class _PartitionData:
+    """
+    Memory-mapped rows of one partition directory, reloaded when the files grow
+    """
+    def __init__(
+            self,
+            path: str,
+            dim: int,
+            precision: str = "float32",
+            decode: Callable[[np.ndarray], np.ndarray] = None,
+            binary: bool = False) -> None:
+        self.path = path
+        self.dim = dim
+        self.dtype = np.dtype(precision)
+        self.vectors_file = _VECTOR_FILES[precision]
+        # packed sign bits per row, 0 without a binary prefilter
+        self.code_size = (dim + 7) // 8 if binary else 0
+        # converts stored vectors to float32, i.e. int8 codes with the collection calibration
+        self.decode = decode or (lambda vectors: np.asarray(vectors, dtype=np.float32))
+        self.lock = threading.RLock()
+        self.hnsw = None
+        self.hnsw_dirty = False
+        self._hnsw_deleted = set()
+        self._reset()
+
+    def _reset(self) -> None:
+        self.vectors = np.empty((0, self.dim), dtype=self.dtype)
+        self.codes = np.empty((0, self.code_size), dtype=np.uint8)
+        self.ids = np.empty(0, dtype=np.int64)
+        self.scalars: List[Dict] = []
+        self.user_rows: Dict[str, List[int]] = {}
+        self.deleted = np.empty(0, dtype=np.int64)
+        self.alive = np.empty(0, dtype=bool)
+        self._scalars_offset = 0
+        self._sizes = None
+
+    def file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _file_sizes(self) -> Tuple[int, ...]:
+        stats = [os.stat(self.file(name)) if os.path.exists(self.file(name)) else None
+                 for name in (self.vectors_file, "ids.i64", "scalars.jsonl", "deleted.i64", "vectors.b1")]
+        # the ids file inode changes when the partition is compacted
+        sizes = tuple(stat.st_size if stat else 0 for stat in stats)
+        return sizes[:4] + (stats[1].st_ino if stats[1] else 0,) + sizes[4:]
+
+    def snapshot(self) -> _Snapshot:
+        """Reloads the appended rows & tombstones if the files changed & returns a consistent view"""
+        with self.lock:
+            sizes = self._file_sizes()
+            if sizes != self._sizes:
+                if self._sizes is not None and (sizes[4] != self._sizes[4] or sizes[3] < self._sizes[3]):
+                    self._reset()  # compacted by another process
+                self._refresh(sizes)
+            return _Snapshot(
+                len(self.ids), self.vectors, self.ids, self.scalars, self.alive, self.user_rows, self.codes)
+
+    def _refresh(self, sizes: Tuple[int, ...]) -> None:
+        if sizes[2] > self._scalars_offset:
+            with open(self.file("scalars.jsonl"), 'rb') as fptr:
+                fptr.seek(self._scalars_offset)
+                chunk = fptr.read(sizes[2] - self._scalars_offset)
+            # only consume complete lines, a concurrent writer may be mid-line
+            chunk = chunk[:chunk.rfind(b"\n") + 1]
+            self._scalars_offset += len(chunk)
+            for line in chunk.splitlines():
+                row = json.loads(line)
+                self.user_rows.setdefault(row.get("user_id"), []).append(len(self.scalars))
+                self.scalars.append(row)
+        num_rows = min(sizes[0] // (self.dtype.itemsize * self.dim), sizes[1] // 8, len(self.scalars))
+        if self.code_size:
+            num_rows = min(num_rows, sizes[5] // self.code_size)
+            self.codes = (np.memmap(self.file("vectors.b1"), dtype=np.uint8, mode="r", shape=(num_rows, self.code_size))
+                          if num_rows else np.empty((0, self.code_size), dtype=np.uint8))
+        self.vectors = (np.memmap(self.file(self.vectors_file), dtype=self.dtype, mode="r", shape=(num_rows, self.dim))
+                        if num_rows else np.empty((0, self.dim), dtype=self.dtype))
+        self.ids = (np.memmap(self.file("ids.i64"), dtype=np.int64, mode="r", shape=(num_rows,))
+                    if num_rows else np.empty(0, dtype=np.int64))
+        if sizes[3] // 8:
+            self.deleted = np.fromfile(self.file("deleted.i64"), dtype=np.int64, count=sizes[3] // 8)
+        self.alive = ~np.isin(self.ids, self.deleted)
+        self._sizes = sizes
+
+    def append(self, vectors: np.ndarray, ids: np.ndarray, scalars: List[Dict], codes: np.ndarray = None) -> None:
+        with self.lock:
+            with open(self.file(self.vectors_file), 'ab') as fptr:
+                fptr.write(vectors.astype(self.dtype, copy=False).tobytes())
+            if self.code_size:
+                with open(self.file("vectors.b1"), 'ab') as fptr:
+                    fptr.write(np.asarray(codes, dtype=np.uint8).tobytes())
+            with open(self.file("ids.i64"), 'ab') as fptr:
+                fptr.write(ids.astype(np.int64, copy=False).tobytes())
+            with open(self.file("scalars.jsonl"), 'ab') as fptr:
+                fptr.write(b"".join(json.dumps(row).encode("utf-8") + b"\n" for row in scalars))
+
+    def mark_deleted(self, ids: np.ndarray) -> None:
+        with self.lock:
+            with open(self.file("deleted.i64"), 'ab') as fptr:
+                fptr.write(ids.astype(np.int64, copy=False).tobytes())
+
+    def compact_if_needed(self) -> None:
+        """Rewrites the partition without its deleted rows once they exceed COMPACTION_DELETED_RATIO"""
+        with self.lock:
+            snap = self.snapshot()
+            num_deleted = snap.num_rows - int(snap.alive.sum())
+            if not snap.num_rows or num_deleted / snap.num_rows < COMPACTION_DELETED_RATIO:
+                return
+            rows = snap.alive_rows()
+            tmp_path = self.path + ".compact"
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            os.makedirs(tmp_path)
+            np.asarray(snap.vectors[rows], dtype=self.dtype).tofile(os.path.join(tmp_path, self.vectors_file))
+            if self.code_size:
+                np.asarray(snap.codes[rows], dtype=np.uint8).tofile(os.path.join(tmp_path, "vectors.b1"))
+            np.asarray(snap.ids[rows], dtype=np.int64).tofile(os.path.join(tmp_path, "ids.i64"))
+            with open(os.path.join(tmp_path, "scalars.jsonl"), 'wb') as fptr:
+                fptr.write(b"".join(json.dumps(snap.scalars[row]).encode("utf-8") + b"\n" for row in rows))
+            self.close()
+            old_path = self.path + ".old"
+            os.rename(self.path, old_path)
+            os.rename(tmp_path, self.path)
+            shutil.rmtree(old_path, ignore_errors=True)
+            logger.info("Partition %s compacted, %s deleted rows removed", self.path, num_deleted)
+
+    def close(self) -> None:
+        """Saves a modified hnsw index & drops the memory maps"""
+        with self.lock:
+            self.save_ann_index()
+            self.hnsw = None
+            self._hnsw_deleted = set()
+            self._reset()
+
+    def get_ann_index(self, snap: _Snapshot, metric_type: str, index_params: Dict, ann_threshold: int):
+        """
+        Returns the hnswlib index of the partition, built or updated from the snapshot rows.
+        None if hnswlib is not installed or the partition has less than ann_threshold live rows
+        """
+        if hnswlib is None or ann_threshold <= 0 or int(snap.alive.sum()) < ann_threshold:
+            return None
+        with self.lock:
+            if self.hnsw is None:
+                space = {"IP": "ip", "COSINE": "cosine", "L2": "l2"}[metric_type.upper()]
+                self.hnsw = hnswlib.Index(space=space, dim=self.dim)
+                if os.path.exists(self.file("hnsw.bin")):
+                    self.hnsw.load_index(self.file("hnsw.bin"), max_elements=snap.num_rows)
+                else:
+                    self.hnsw.init_index(max_elements=snap.num_rows,
+                                         ef_construction=int(index_params.get("efConstruction", 64)),
+                                         M=int(index_params.get("M", 8)))
+            num_indexed = self.hnsw.get_current_count()
+            if num_indexed < snap.num_rows:
+                if self.hnsw.get_max_elements() < snap.num_rows:
+                    self.hnsw.resize_index(max(snap.num_rows, int(self.hnsw.get_max_elements() * 1.5)))
+                self.hnsw.add_items(self.decode(snap.vectors[num_indexed:snap.num_rows]),
+                                    np.arange(num_indexed, snap.num_rows))
+                self.hnsw_dirty = True
+                logger.info("%s rows added to the hnsw index of %s", snap.num_rows - num_indexed, self.path)
+            for row in np.flatnonzero(~snap.alive):
+                if row not in self._hnsw_deleted:
+                    try:
+                        self.hnsw.mark_deleted(int(row))
+                    except RuntimeError:  # already deleted in the saved index
+                        pass
+                    self._hnsw_deleted.add(row)
+                    self.hnsw_dirty = True
+            if num_indexed == 0:
+                self.save_ann_index()
+            return self.hnsw
+
+    def save_ann_index(self) -> None:
+        with self.lock:
+            if self.hnsw is not None and self.hnsw_dirty:
+                self.hnsw.save_index(self.file("hnsw.bin"))
+                self.hnsw_dirty = False
+
+
+def _distances(vectors: np.ndarray, queries: np.ndarray, metric_type: str) -> np.ndarray:
+    """
+    Distances of shape (num_queries, num_vectors) as reported by milvus:
+    inner product for IP & COSINE (normalized), squared euclidean distance for L2
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if metric_type == "COSINE":
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+    scores = queries @ vectors.T
+    if metric_type == "L2":
+        scores = (np.einsum("ij,ij->i", queries, queries)[:, None] - 2 * scores
+                  + np.einsum("ij,ij->i", vectors, vectors)[None, :])
+    return scores
+
+
+# ############## collection ##############
+
+class LocalPartition:
+    """Partition handle with the attributes of the pymilvus Partition used by the api"""
+    def __init__(self, collection: "LocalCollection", name: str) -> None:
+        self.collection = collection
+        self.name = name
+
+    @property
+    def num_entities(self) -> int:
+        return self.collection._num_partition_rows(self.name)
+
+    def release(self) -> None:
+        self.collection._release_partition(self.name)
+
+
+class LocalCollection:
+    """
+    Local collection with the subset of the pymilvus Collection api used by the routes
+    Arguments:
+        name: str = collection name
+        root_dir: str = dir holding the collection dirs
+        ann_threshold: int = min num of partition rows for which an hnsw index is used
+    """
+    def __init__(self, name: str, root_dir: str, ann_threshold: int = 20000) -> None:
+        self.name = name
+        self.path = os.path.join(root_dir, name)
+        self.ann_threshold = ann_threshold
+        with open(os.path.join(self.path, "meta.json"), 'r', encoding="utf-8") as fptr:
+            self.meta = json.load(fptr)
+        self.dim = self.meta["vector_dim"]
+        self.precision = self.meta.get("vector_precision", "float32")
+        self.binary_prefilter = bool(self.meta.get("binary_prefilter", False))
+        self._quantizer: Optional[ScalarQuantizer] = None
+        self.scalar_fields = tuple(self.meta.get("scalar_fields", _SCALAR_FIELDS))
+        self._partitions: Dict[str, _PartitionData] = {}
+        self._lock = threading.RLock()
+        self._id_lock = threading.Lock()
+        self._last_id = 0
+
+    def _save_meta(self) -> None:
+        tmp_path = os.path.join(self.path, "meta.json.tmp")
+        with open(tmp_path, 'w', encoding="utf-8") as fptr:
+            json.dump(self.meta, fptr, indent=2)
+        os.replace(tmp_path, os.path.join(self.path, "meta.json"))
+
+    def _partition_path(self, partition_name: str) -> str:
+        if not _NAME_RE.match(partition_name or ""):
+            raise ValueError(f"Invalid partition name {partition_name!r}")
+        return os.path.join(self.path, partition_name)
+
+    def _get_partition_data(self, partition_name: str) -> _PartitionData:
+        with self._lock:
+            if partition_name not in self._partitions:
+                if not self.has_partition(partition_name):
+                    raise ValueError(f"Partition {partition_name} does not exist in collection {self.name}")
+                self._partitions[partition_name] = _PartitionData(
+                    self._partition_path(partition_name), self.dim, self.precision, self._decode, self.binary_prefilter)
+            return self._partitions[partition_name]
+
+    def _get_quantizer(self, sample: Optional[np.ndarray] = None) -> Optional[ScalarQuantizer]:
+        """
+        Int8 calibration of the collection, calibrated on sample & saved if there is none yet
+        """
+        if self._quantizer is None:
+            path = os.path.join(self.path, "quantizer.json")
+            self._quantizer = load_quantizer(path)
+            if self._quantizer is None and sample is not None:
+                self._quantizer = ScalarQuantizer.fit(normalize_vectors(sample)).save(path)
+                logger.info("Int8 quantizer of collection %s calibrated on %s vectors", self.name, len(sample))
+        return self._quantizer
+
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        """Normalizes & converts float32 vectors to the collection precision"""
+        quantizer = self._get_quantizer(vectors) if self.precision == "int8" else None
+        return to_precision(vectors, self.precision, quantizer)
+
+    def _decode(self, vectors: np.ndarray) -> np.ndarray:
+        """Converts stored vectors to float32"""
+        return from_precision(vectors, self.precision, self._get_quantizer() if self.precision == "int8" else None)
+
+    def _num_partition_rows(self, partition_name: str) -> int:
+        ids_path = os.path.join(self._partition_path(partition_name), "ids.i64")
+        return os.path.getsize(ids_path) // 8 if os.path.exists(ids_path) else 0
+
+    def _release_partition(self, partition_name: str) -> None:
+        with self._lock:
+            data = self._partitions.pop(partition_name, None)
+        if data is not None:
+            data.close()
+
+    def _next_ids(self, num_ids: int) -> np.ndarray:
+        # snowflake-like ids: ms timestamp, 8 pid bits & a 12 bit sequence, unique across workers of a node
+        with self._id_lock:
+            base = (int(time.time() * 1000) << 20) | ((os.getpid() & 0xff) << 12)
+            start = max(base, self._last_id + 1)
+            self._last_id = start + num_ids - 1
+        return np.arange(start, start + num_ids, dtype=np.int64)
+
+    def _resolve_partitions(self, partition_names: Optional[List[str]]) -> List[str]:
+        if partition_names:
+            return list(partition_names)
+        return [partition.name for partition in self.partitions]
+
+    @property
+    def partitions(self) -> List[LocalPartition]:
+        names = sorted(name for name in os.listdir(self.path)
+                       if os.path.isdir(os.path.join(self.path, name)) and _NAME_RE.match(name))
+        return [LocalPartition(self, name) for name in names]
+
+    @property
+    def schema(self) -> LocalCollectionSchema:
+        binary_fields = (_BINARY_FIELD,) if self.binary_prefilter else ()
+        return LocalCollectionSchema(
+            [LocalFieldSchema(name) for name in ("id", "embedding") + self.scalar_fields + binary_fields])
+
+    @property
+    def num_entities(self) -> int:
+        return sum(self._num_partition_rows(partition.name) for partition in self.partitions)
+
+    def has_partition(self, partition_name: str) -> bool:
+        return os.path.isdir(self._partition_path(partition_name))
+
+    def create_partition(self, partition_name: str, **kwargs) -> LocalPartition:
+        os.makedirs(self._partition_path(partition_name), exist_ok=True)
+        return LocalPartition(self, partition_name)
+
+    def drop_partition(self, partition_name: str, **kwargs) -> None:
+        if partition_name == DEFAULT_PARTITION:
+            raise ValueError("The default partition cannot be dropped")
+        self._release_partition(partition_name)
+        shutil.rmtree(self._partition_path(partition_name), ignore_errors=True)
+
+    def partition(self, partition_name: str, **kwargs) -> LocalPartition:
+        if not self.has_partition(partition_name):
+            raise ValueError(f"Partition {partition_name} does not exist in collection {self.name}")
+        return LocalPartition(self, partition_name)
+
+    @property
+    def indexes(self) -> List[LocalIndex]:
+        indexes = [LocalIndex(params.get("field_name", name), name,
+                              {key: val for key, val in params.items() if key != "field_name"})
+                   for name, params in self.meta.get("indexes", {}).items()]
+        if self.meta.get("index_type"):
+            indexes.insert(0, LocalIndex("embedding", "embedding", {
+                "metric_type": self.meta["metric_type"], "index_type": self.meta["index_type"],
+                "params": self.meta.get("index_metric_params") or {}}))
+        return indexes
+
+    def create_index(self, field_name: str, index_params: Dict, **kwargs) -> None:
+        if field_name == "embedding":
+            # searches only use hnswlib for HNSW indexes, other index types are searched brute force
+            self._drop_ann_indexes()
+            self.meta["index_type"] = index_params["index_type"]
+            self.meta["index_metric_params"] = index_params.get("params") or {}
+        else:
+            self.meta.setdefault("indexes", {})[kwargs.get("index_name", field_name)] = {
+                "field_name": field_name, **(index_params or {})}
+        self._save_meta()
+
+    def drop_index(self, index_name: str = "embedding", **kwargs) -> None:
+        if index_name == "embedding":
+            self._drop_ann_indexes()
+            self.meta["index_type"] = None
+        else:
+            self.meta.get("indexes", {}).pop(index_name, None)
+        self._save_meta()
+
+    def index_building_progress(self, index_name: str = "embedding") -> Dict[str, int]:
+        """Indexes are built on load, all rows always count as indexed"""
+        num_entities = self.num_entities
+        return {"total_rows": num_entities, "indexed_rows": num_entities, "pending_index_rows": 0}
+
+    def _drop_ann_indexes(self) -> None:
+        self.release()
+        for partition in self.partitions:
+            hnsw_path = os.path.join(self._partition_path(partition.name), "hnsw.bin")
+            if os.path.exists(hnsw_path):
+                os.remove(hnsw_path)
+
+    def load(self, partition_names: Optional[List[str]] = None, replica_number: int = 1, **kwargs) -> None:
+        for partition_name in self._resolve_partitions(partition_names):
+            data = self._get_partition_data(partition_name)
+            data.compact_if_needed()
+            data.snapshot()
+
+    def release(self, **kwargs) -> None:
+        with self._lock:
+            partition_names = list(self._partitions)
+        for partition_name in partition_names:
+            self._release_partition(partition_name)
+
+    def flush(self, **kwargs) -> None:
+        with self._lock:
+            partition_data = list(self._partitions.values())
+        for data in partition_data:
+            data.save_ann_index()
+
+    def insert(self, data: List[List], partition_name: Optional[str] = None, **kwargs) -> LocalMutationResult:
+        """
+        Inserts columns in the non auto_id schema field order: embedding, doc_id, user_id, content
+        or embedding, doc_id, user_id, chunk_index, text_start, text_end without chunk text,
+        followed by the packed binary embeddings with a binary prefilter
+        """
+        num_columns = 1 + len(self.scalar_fields) + int(self.binary_prefilter)
+        if len(data) != num_columns:
+            raise ValueError(f"Expected {num_columns} columns, got {len(data)}")
+        vectors = np.asarray(data[0], dtype=np.float32).reshape(-1, self.dim)
+        if any(len(column) != len(vectors) for column in data[1:]):
+            raise ValueError("All inserted columns must have the same length")
+        codes = None
+        if self.binary_prefilter:
+            codes = np.frombuffer(b"".join(data[-1]), dtype=np.uint8).reshape(len(vectors), -1)
+            data = data[:-1]
+        scalars = [dict(zip(self.scalar_fields, values)) for values in zip(*data[1:])]
+        vectors = self._encode(vectors)
+        ids = self._next_ids(len(vectors))
+        self._get_partition_data(partition_name or DEFAULT_PARTITION).append(vectors, ids, scalars, codes)
+        return LocalMutationResult(primary_keys=ids.tolist(), insert_count=len(ids))
+
+    def _match_rows(self, snap: _Snapshot, node: Optional[tuple]) -> np.ndarray:
+        """Live rows of the snapshot matching the filter expression node"""
+        pinned_ids = _pinned_values(node, "id")
+        pinned_users = _pinned_values(node, "user_id")
+        if pinned_ids is not None:
+            rows = np.flatnonzero(snap.alive & np.isin(snap.ids, np.asarray(pinned_ids, dtype=np.int64)))
+        elif pinned_users is not None:
+            rows = snap.rows_of_users(pinned_users)
+        else:
+            rows = snap.alive_rows()
+        if node is None:
+            return rows
+
+        def matches(row: int) -> bool:
+            return _eval_expr(node, lambda name: int(snap.ids[row]) if name == "id" else snap.scalars[row].get(name))
+        return np.asarray([row for row in rows if matches(row)], dtype=np.int64)
+
+    def _entity(self, snap: _Snapshot, row: int, output_fields: List[str]) -> Dict:
+        entity = {}
+        for name in output_fields:
+            if name == "embedding":
+                entity[name] = self._decode(snap.vectors[row]).tolist()
+            elif name == "id":
+                entity[name] = int(snap.ids[row])
+            else:
+                entity[name] = snap.scalars[row].get(name)
+        return entity
+
+    def delete(self, expr: str, partition_name: Optional[str] = None, **kwargs) -> LocalMutationResult:
+        node = parse_expr(expr)
+        if node is None:
+            raise ValueError("Delete expression must not be empty")
+        num_deleted = 0
+        for name in self._resolve_partitions([partition_name] if partition_name else None):
+            data = self._get_partition_data(name)
+            with data.lock:
+                snap = data.snapshot()
+                rows = self._match_rows(snap, node)
+                if len(rows):
+                    data.mark_deleted(np.asarray(snap.ids[rows]))
+                    num_deleted += len(rows)
+        return LocalMutationResult(delete_count=num_deleted)
+
+    def query(
+            self,
+            expr: str,
+            output_fields: Optional[List[str]] = None,
+            partition_names: Optional[List[str]] = None,
+            offset: int = 0,
+            limit: int = -1,
+            **kwargs) -> List[Dict]:
+        """
+        Returns the entities matching expr with their id & output_fields, output_fields=["count(*)"] counts them
+        """
+        node = parse_expr(expr)
+        output_fields = list(output_fields or [])
+        count_only = output_fields == ["count(*)"]
+        results, num_matched = [], 0
+        for name in self._resolve_partitions(partition_names):
+            snap = self._get_partition_data(name).snapshot()
+            rows = self._match_rows(snap, node)
+            num_matched += len(rows)
+            if not count_only:
+                fields = ["id"] + [field_name for field_name in output_fields if field_name != "id"]
+                results.extend(self._entity(snap, row, fields) for row in rows)
+        if count_only:
+            return [{"count(*)": num_matched}]
+        return results[offset:] if limit is None or limit < 0 else results[offset: offset + limit]
+
+    def query_iterator(
+            self,
+            batch_size: int = 1000,
+            expr: Optional[str] = None,
+            output_fields: Optional[List[str]] = None,
+            partition_names: Optional[List[str]] = None,
+            **kwargs) -> "LocalQueryIterator":
+        """
+        Returns an iterator over the entities matching expr in batches of batch_size, in row order per partition
+        """
+        return LocalQueryIterator(self, batch_size, parse_expr(expr), list(output_fields or []),
+                                  self._resolve_partitions(partition_names))
+
+    def search(
+            self,
+            data: List[np.ndarray],
+            anns_field: str,
+            param: Dict,
+            limit: int,
+            expr: Optional[str] = None,
+            partition_names: Optional[List[str]] = None,
+            output_fields: Optional[List[str]] = None,
+            **kwargs) -> List[List[LocalHit]]:
+        """
+        Returns the limit nearest hits of each query vector over the given partitions
+        Honors the milvus search params metric_type & params.ef, radius, range_filter
+        The binary_embedding anns_field is searched with packed binary queries & the HAMMING metric
+        """
+        param = param or {}
+        metric_type = param.get("metric_type", self.meta["metric_type"]).upper()
+        search_params = param.get("params", {}) or {}
+        radius, range_filter = search_params.get("radius"), search_params.get("range_filter")
+        similarity = metric_type in {"IP", "COSINE"}
+        if anns_field == _BINARY_FIELD:
+            if not self.binary_prefilter:
+                raise ValueError(f"Collection {self.name} has no {_BINARY_FIELD} field")
+            if metric_type != "HAMMING":
+                raise ValueError(f"{_BINARY_FIELD} can only be searched with the HAMMING metric")
+            queries = np.frombuffer(b"".join(data), dtype=np.uint8).reshape(len(data), -1)
+        else:
+            queries = np.asarray(data, dtype=np.float32).reshape(-1, self.dim)
+            if self.precision != "float32":  # stored vectors are normalized
+                queries = normalize_vectors(queries)
+        node = parse_expr(expr)
+        output_fields = list(output_fields or [])
+        hits: List[List[LocalHit]] = [[] for _ in range(len(queries))]
+        for name in self._resolve_partitions(partition_names):
+            part_data = self._get_partition_data(name)
+            snap = part_data.snapshot()
+            for query_idx, (rows, dists) in enumerate(
+                    self._search_partition(part_data, snap, node, queries, limit, metric_type, search_params)):
+                for row, dist in zip(rows, dists):
+                    if radius is not None and (dist <= radius if similarity else dist >= radius):
+                        continue
+                    if range_filter is not None and (dist > range_filter if similarity else dist < range_filter):
+                        continue
+                    hits[query_idx].append(LocalHit(
+                        int(snap.ids[row]), float(dist), self._entity(snap, row, output_fields)))
+        for query_hits in hits:
+            query_hits.sort(key=lambda hit: hit.distance, reverse=similarity)
+            del query_hits[limit:]
+        return hits
+
+    def _search_partition(
+            self,
+            part_data: _PartitionData,
+            snap: _Snapshot,
+            node: Optional[tuple],
+            queries: np.ndarray,
+            limit: int,
+            metric_type: str,
+            search_params: Dict) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """(rows, distances) of the nearest snapshot rows of each query"""
+        # the hnsw index is built with the collection metric, other metrics & index types are searched brute force
+        if node is None and metric_type == self.meta["metric_type"].upper() and self.meta.get("index_type") == "HNSW":
+            index = part_data.get_ann_index(
+                snap, metric_type, self.meta.get("index_metric_params") or {}, self.ann_threshold)
+            num_alive = int(snap.alive.sum())
+            if index is not None:
+                k = min(limit, num_alive)
+                try:
+                    with part_data.lock:
+                        index.set_ef(max(int(search_params.get("ef", 64)), k))
+                        labels, dists = index.knn_query(queries, k=k)
+                    # hnswlib reports 1 - similarity for ip & cosine
+                    dists = 1.0 - dists if metric_type in {"IP", "COSINE"} else dists
+                    return list(zip(labels.astype(np.int64), dists))
+                except RuntimeError as excep:
+                    logger.warning("%s: hnsw search failed on %s, falling back to brute force", excep, part_data.path)
+        rows = self._match_rows(snap, node)
+        if not len(rows):
+            return [(rows, np.empty(0, dtype=np.float32)) for _ in range(len(queries))]
+        if metric_type == "HAMMING":
+            scores = hamming_distances(snap.codes if len(rows) == snap.num_rows else snap.codes[rows], queries)
+        else:
+            vectors = self._decode(snap.vectors if len(rows) == snap.num_rows else snap.vectors[rows])
+            scores = _distances(vectors, queries, metric_type)
+        scores = scores if metric_type in {"IP", "COSINE"} else -scores
+        k = min(limit, len(rows))
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for query_idx in range(len(queries)):
+            dists = scores[query_idx, top[query_idx]]
+            results.append((rows[top[query_idx]], dists if metric_type in {"IP", "COSINE"} else -dists))
+        return results
+
+
+class LocalQueryIterator:
+    """Query iterator with the next & close methods of the pymilvus QueryIterator"""
+    def __init__(
+            self,
+            collection: LocalCollection,
+            batch_size: int,
+            node: Optional[tuple],
+            output_fields: List[str],
+            partition_names: List[str]) -> None:
+        self.collection = collection
+        self.batch_size = batch_size
+        self.node = node
+        self.fields = ["id"] + [field_name for field_name in output_fields if field_name != "id"]
+        self._partition_names = list(partition_names)
+        self._snap, self._rows, self._pos = None, np.empty(0, dtype=np.int64), 0
+
+    def next(self) -> List[Dict]:
+        """Returns the next batch of entities, an empty list once all are returned"""
+        while self._pos >= len(self._rows):
+            if not self._partition_names:
+                return []
+            self._snap = self.collection._get_partition_data(self._partition_names.pop(0)).snapshot()
+            self._rows, self._pos = self.collection._match_rows(self._snap, self.node), 0
+        rows = self._rows[self._pos: self._pos + self.batch_size]
+        self._pos += len(rows)
+        return [self.collection._entity(self._snap, row, self.fields) for row in rows]
+
+    def close(self) -> None:
+        self._partition_names, self._rows = [], np.empty(0, dtype=np.int64)
+
+
+# ############## connections ##############
+
+_collections: Dict[str, LocalCollection] = {}
+_collections_lock = threading.Lock()
+
+
+def has_local_collection(collection_name: str, root_dir: str) -> bool:
+    """
+    Checks if the local collection exists under root_dir
+    """
+    return os.path.isfile(os.path.join(root_dir, collection_name, "meta.json"))
+
+
+def get_local_collec_conn(
+        collection_name: str,
+        vector_dim: int = 128,
+        metric_type: str = "IP",
+        index_type: str = "HNSW",
+        index_metric_params: dict = None,
+        partition_key_mode: bool = False,
+        num_partitions: int = 64,
+        store_chunk_text: bool = True,
+        vector_precision: str = "float32",
+        binary_prefilter: bool = False,
+        root_dir: str = "volumes/vector_store",
+        ann_threshold: int = 20000) -> LocalCollection:
+    """
+    Gets the local collection with the given collection name otherwise creates a new one
+    Takes the arguments of api.milvus.get_milvus_collec_conn. In partition_key_mode, all rows are stored in
+    the _default partition & searches filtered on user_id only scan the user's rows, num_partitions is unused
+    vector_precision float16 or int8 stores normalized vectors with 2 or 1 bytes per dimension.
+    binary_prefilter also stores the embedding sign bits, searched brute force with the hamming distance
+    """
+    with _collections_lock:
+        if collection_name in _collections:
+            return _collections[collection_name]
+        if not has_local_collection(collection_name, root_dir):
+            if vector_precision not in VECTOR_PRECISIONS:
+                raise ValueError(f"Unknown vector precision {vector_precision}, must be one of {VECTOR_PRECISIONS}")
+            collection_path = os.path.join(root_dir, collection_name)
+            os.makedirs(os.path.join(collection_path, DEFAULT_PARTITION), exist_ok=True)
+            meta = {"vector_dim": vector_dim, "metric_type": metric_type, "index_type": index_type,
+                    "index_metric_params": index_metric_params or {},
+                    "partition_key_mode": partition_key_mode, "num_partitions": num_partitions,
+                    "scalar_fields": list(_SCALAR_FIELDS if store_chunk_text else _CHUNK_OFFSET_SCALAR_FIELDS),
+                    "vector_precision": vector_precision, "binary_prefilter": binary_prefilter}
+            with open(os.path.join(collection_path, "meta.json"), 'w', encoding="utf-8") as fptr:
+                json.dump(meta, fptr, indent=2)
+            logger.info("Local collection %s created.✅️", collection_name)
+        else:
+            logger.info("Local collection %s present already.✅️", collection_name)
+        _collections[collection_name] = LocalCollection(collection_name, root_dir, ann_threshold)
+        return _collections[collection_name]
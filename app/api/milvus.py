@@ -2,17 +2,137 @@
 pymilvus api function wrappers
 """
 import os
+import re
+import json
+import time
 import logging
-from typing import List, Dict
+from typing import Callable, List, Dict, Optional
 
 import numpy as np
 from pymilvus import Collection
-from pymilvus import CollectionSchema, FieldSchema, DataType, utility, MilvusException
+from pymilvus import CollectionSchema, FieldSchema, DataType, utility
+from api.chunk_text_store import ChunkTextStore, CHUNK_TEXT_REF_FIELDS
+from api.quantization import to_precision, binary_quantize
 from utils.common import timeit_decorator
 
 
 DEBUG: bool = os.environ.get("DEBUG", "") != "False"
 logger = logging.getLogger('milvus_api')
+# nprobe of searches on IVF indexed collections, the per-request ef is only used by HNSW & DISKANN
+MILVUS_EMB_SEARCH_PARAM_NPROBE: int = int(os.environ.get("MILVUS_EMB_SEARCH_PARAM_NPROBE", "16"))
+
+
+MILVUS_VECTOR_DTYPES = {"float32": DataType.FLOAT_VECTOR, "float16": DataType.FLOAT16_VECTOR}
+# sign bits of the embeddings searched with the hamming distance before rescoring, see binary_rescore_search_milvus
+BINARY_VECTOR_FIELD = "binary_embedding"
+# doc ids are uuids, ids from requests are checked against it before they are used in filter expressions
+DOC_ID_RE = re.compile(r"^[A-Za-z0-9_\-]{1,64}$")
+# default build params of the embedding index types that can be selected per collection
+VECTOR_INDEX_BUILD_PARAMS = {
+    "HNSW": {"M": 8, "efConstruction": 64},
+    "IVF_FLAT": {"nlist": 1024},
+    "IVF_PQ": {"nlist": 1024, "m": 16, "nbits": 8},
+    "DISKANN": {},
+    "FLAT": {},
+}
+# cached embedding index of each collection by name, see get_vector_index_milvus
+_vector_index_cache: Dict[str, tuple] = {}
+VECTOR_INDEX_CACHE_TTL_S = 30.0
+
+
+def get_emb_collection_fields(
+        vector_dim: int,
+        partition_key_mode: bool = False,
+        store_chunk_text: bool = True,
+        vector_precision: str = "float32",
+        binary_prefilter: bool = False) -> List[FieldSchema]:
+    """
+    Returns the text embedding collection schema fields shared by all vector store backends
+    Data inserted into the collection is a list of columns in the order of the non auto_id fields
+    Without store_chunk_text, the content field is replaced by the chunk offsets into the doc text file
+    of api.chunk_text_store.ChunkTextStore
+    vector_precision float16 stores FLOAT16_VECTOR embeddings, milvus 2.4 has no int8 vector type
+    binary_prefilter adds a last BINARY_VECTOR field with the embedding sign bits, filled by insert_into_milvus
+    """
+    if vector_precision not in MILVUS_VECTOR_DTYPES:
+        raise ValueError(f"Milvus collections support {list(MILVUS_VECTOR_DTYPES)} vectors, "
+                         f"{vector_precision} vectors require the local vector store backend")
+    fields = [
+        FieldSchema(name="id", dtype=DataType.INT64,
+                    description="ids", is_primary=True, auto_id=True),
+        FieldSchema(name="embedding", dtype=MILVUS_VECTOR_DTYPES[vector_precision],
+                    description="embedding vectors", dim=vector_dim),
+        FieldSchema(name="doc_id", dtype=DataType.VARCHAR,
+                    description="unique parent doc id", max_length=256),
+        FieldSchema(name="user_id", dtype=DataType.VARCHAR,
+                    description="unique user id", max_length=128, is_partition_key=partition_key_mode),
+    ]
+    if store_chunk_text:
+        fields.append(FieldSchema(name="content", dtype=DataType.VARCHAR,
+                                  description="plaintext data content", max_length=4096))
+    else:
+        fields.extend([
+            FieldSchema(name="chunk_index", dtype=DataType.INT64, description="chunk index in the doc"),
+            FieldSchema(name="text_start", dtype=DataType.INT64, description="chunk start byte in the doc text file"),
+            FieldSchema(name="text_end", dtype=DataType.INT64, description="chunk end byte in the doc text file"),
+        ])
+    if binary_prefilter:
+        fields.append(FieldSchema(name=BINARY_VECTOR_FIELD, dtype=DataType.BINARY_VECTOR,
+                                  description="embedding sign bits", dim=vector_dim))
+    return fields
+
+
+def stores_chunk_text(milvus_client: Collection) -> bool:
+    """
+    True if the collection stores the chunk text in its content field, False if it only stores chunk offsets
+    """
+    return any(field.name == "content" for field in milvus_client.schema.fields)
+
+
+def has_binary_prefilter(milvus_client: Collection) -> bool:
+    """
+    True if the collection stores the binary embeddings searched by binary_rescore_search_milvus
+    """
+    return any(field.name == BINARY_VECTOR_FIELD for field in milvus_client.schema.fields)
+
+
+def get_vector_precision(milvus_client: Collection) -> str:
+    """
+    Returns the precision vectors must be sent in to the collection. The local backend converts float32
+    vectors to its storage precision itself
+    """
+    for field in milvus_client.schema.fields:
+        if field.name == "embedding" and getattr(field, "dtype", None) == DataType.FLOAT16_VECTOR:
+            return "float16"
+    return "float32"
+
+
+def prepare_vectors_milvus(milvus_client: Collection, vectors: List) -> List:
+    """
+    Normalizes & converts float vectors to the collection vector precision with one vectorized conversion
+    """
+    precision = get_vector_precision(milvus_client)
+    if precision == "float32":
+        return vectors
+    return list(to_precision(np.asarray(vectors, dtype=np.float32), precision))
+
+
+def binary_vectors_milvus(vectors: List) -> List[bytes]:
+    """
+    Sign-quantizes float vectors to the packed bytes of milvus BINARY_VECTOR fields
+    """
+    return [code.tobytes() for code in binary_quantize(np.asarray(vectors, dtype=np.float32))]
+
+
+def decode_vector_field(value) -> List[float]:
+    """
+    Returns a fetched embedding field as a float list, float16 vector fields are returned as raw bytes
+    """
+    if isinstance(value, list) and value and isinstance(value[0], bytes):
+        value = b"".join(value)
+    if isinstance(value, bytes):
+        return np.frombuffer(value, dtype=np.float16).astype(np.float32).tolist()
+    return value
 
 
 def get_milvus_collec_conn(
@@ -20,29 +140,32 @@ def get_milvus_collec_conn(
         vector_dim: int = 128,
         metric_type: str = "IP",
         index_type: str = "HNSW",
-        index_metric_params: dict = None) -> Collection:
+        index_metric_params: dict = None,
+        partition_key_mode: bool = False,
+        num_partitions: int = 64,
+        store_chunk_text: bool = True,
+        vector_precision: str = "float32",
+        binary_prefilter: bool = False) -> Collection:
     """
     Gets the milvus connection with the given collection name otherwise creates a new one
     For using cosine similarity later when metric_type is IP, the embeddings must be normalized as emb / np.linalg.norm(emb)
+    In partition_key_mode, user_id is the partition key hashed into num_partitions partitions so milvus prunes
+    searches by tenant, & user_id/doc_id get INVERTED scalar indexes for filtered searches & deletes
+    Without store_chunk_text, the chunk text is kept out of milvus memory in api.chunk_text_store files.
+    vector_precision float16 halves the vector memory. With binary_prefilter, the embedding sign bits get a
+    BIN_FLAT hamming index for binary_rescore_search_milvus while the float embeddings only used for rescoring
+    get a FLAT index & are memory-mapped instead of an in-memory hnsw graph.
+    Existing collections keep the schema they were created with
     """
     if not utility.has_collection(collection_name):
-        fields = [
-            FieldSchema(name="id", dtype=DataType.INT64,
-                        description="ids", is_primary=True, auto_id=True),
-            FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR,
-                        description="embedding vectors", dim=vector_dim),
-            FieldSchema(name="doc_id", dtype=DataType.VARCHAR,
-                        description="unique parent doc id", max_length=256),
-            FieldSchema(name="user_id", dtype=DataType.VARCHAR,
-                        description="unique user id", max_length=128),
-            FieldSchema(name="content", dtype=DataType.VARCHAR,
-                        description="plaintext data content", max_length=4096),
-        ]
+        fields = get_emb_collection_fields(
+            vector_dim, partition_key_mode, store_chunk_text, vector_precision, binary_prefilter)
         schema = CollectionSchema(
             fields=fields, description='text embedding system')
+        collec_kwargs = {"num_partitions": num_partitions} if partition_key_mode else {}
         milvus_client = Collection(name=collection_name,
                                    consistency_level="Strong",
-                                   schema=schema, using='default')
+                                   schema=schema, using='default', **collec_kwargs)
         logger.info("Collection %s created.✅️", collection_name)
 
         # Index the milvus_client
@@ -51,8 +174,18 @@ def get_milvus_collec_conn(
             'index_type': index_type,
             'params': index_metric_params
         }
+        if binary_prefilter:
+            index_params = {'metric_type': metric_type, 'index_type': "FLAT", 'params': {}}
+            milvus_client.set_properties({"mmap.enabled": True})
+            milvus_client.create_index(
+                field_name=BINARY_VECTOR_FIELD,
+                index_params={'metric_type': "HAMMING", 'index_type': "BIN_FLAT", 'params': {}})
         milvus_client.create_index(
             field_name="embedding", index_params=index_params)
+        if partition_key_mode:
+            for field_name in ("user_id", "doc_id"):
+                milvus_client.create_index(
+                    field_name=field_name, index_params={"index_type": "INVERTED"}, index_name=f"{field_name}_idx")
         logger.info("Collection %s indexed.✅️", collection_name)
     else:
         logger.info("Collection %s present already.✅️", collection_name)
@@ -60,6 +193,104 @@ def get_milvus_collec_conn(
     return milvus_client
 
 
+def get_index_build_params(index_type: str, params: dict = None, vector_dim: int = None) -> dict:
+    """
+    Returns the build params of an embedding index type, params override the VECTOR_INDEX_BUILD_PARAMS defaults.
+    A ValueError is raised for unknown index types & params or params milvus would reject
+    """
+    index_type = index_type.upper()
+    if index_type not in VECTOR_INDEX_BUILD_PARAMS:
+        raise ValueError(f"Unknown index type {index_type}, must be one of {list(VECTOR_INDEX_BUILD_PARAMS)}")
+    build_params = dict(VECTOR_INDEX_BUILD_PARAMS[index_type])
+    for key, val in (params or {}).items():
+        if key not in build_params:
+            raise ValueError(f"Unknown {index_type} index param {key}, must be one of {list(build_params)}")
+        if isinstance(val, bool) or not isinstance(val, int) or val <= 0:
+            raise ValueError(f"{index_type} index param {key} must be a positive integer")
+        build_params[key] = val
+    if index_type == "IVF_PQ":
+        if vector_dim is not None and vector_dim % build_params["m"]:
+            raise ValueError(f"IVF_PQ param m={build_params['m']} must divide the vector dim {vector_dim}")
+        if build_params["nbits"] > 16:
+            raise ValueError("IVF_PQ param nbits must be at most 16")
+    return build_params
+
+
+def estimate_index_memory_bytes(
+        index_type: str,
+        build_params: dict,
+        num_entities: int,
+        vector_dim: int,
+        vector_bytes: int = 4) -> int:
+    """
+    Rough query node memory of an embedding index, used to compare index types before a rebuild
+    HNSW keeps the raw vectors & 2 * M links per vector, IVF_FLAT the raw vectors & the nlist centroids,
+    IVF_PQ m codes of nbits per vector & the codebooks, DISKANN only its PQ codes (1/8 of the vectors) in memory
+    """
+    index_type = index_type.upper()
+    raw_bytes = num_entities * vector_dim * vector_bytes
+    if index_type == "HNSW":
+        return raw_bytes + num_entities * 2 * build_params.get("M", 8) * 4
+    if index_type == "IVF_FLAT":
+        return raw_bytes + num_entities * 8 + build_params.get("nlist", 1024) * vector_dim * 4
+    if index_type == "IVF_PQ":
+        nbits, num_codes = build_params.get("nbits", 8), build_params.get("m", 16)
+        return (num_entities * (num_codes * nbits // 8 + 8) + build_params.get("nlist", 1024) * vector_dim * 4
+                + (1 << nbits) * vector_dim * 4)
+    if index_type == "DISKANN":
+        return raw_bytes // 8
+    return raw_bytes
+
+
+def get_vector_index_milvus(milvus_client: Collection, use_cache: bool = True) -> Optional[Dict]:
+    """
+    Returns the index_name, index_type, metric_type & params of the collection embedding index or None if it has
+    no index. Cached for VECTOR_INDEX_CACHE_TTL_S as searches need the index type, indexes rebuilt by another
+    worker are picked up after the ttl
+    """
+    cached = _vector_index_cache.get(milvus_client.name)
+    if use_cache and cached is not None and time.monotonic() - cached[0] < VECTOR_INDEX_CACHE_TTL_S:
+        return cached[1]
+    vector_index = None
+    for index in milvus_client.indexes:
+        if index.field_name == "embedding":
+            vector_index = {"index_name": index.index_name, **index.params}
+            vector_index["index_type"] = vector_index["index_type"].upper()
+    _vector_index_cache[milvus_client.name] = (time.monotonic(), vector_index)
+    return vector_index
+
+
+def index_building_progress_milvus(milvus_client: Collection, index_name: str) -> Dict:
+    """
+    Returns the total_rows & indexed_rows of an index being built
+    """
+    if hasattr(milvus_client, "index_building_progress"):  # local backend
+        return milvus_client.index_building_progress(index_name)
+    return dict(utility.index_building_progress(milvus_client.name, index_name=index_name))
+
+
+def rebuild_vector_index_milvus(
+        milvus_client: Collection,
+        index_type: str,
+        build_params: dict,
+        metric_type: str = "IP") -> Dict:
+    """
+    Replaces the embedding index of a collection & waits for the new index to be built.
+    Milvus only allows one index per field & indexes can't be dropped while loaded, so the collection must be
+    released first & can't be searched until the rebuild is done. Returns the new embedding index
+    """
+    if has_binary_prefilter(milvus_client):
+        raise ValueError(f"Collection {milvus_client.name} searches a binary prefilter, its FLAT index is fixed")
+    vector_index = get_vector_index_milvus(milvus_client, use_cache=False)
+    if vector_index is not None:
+        milvus_client.drop_index(index_name=vector_index["index_name"])
+        logger.info("Index %s of collection %s dropped", vector_index["index_type"], milvus_client.name)
+    index_params = {'metric_type': metric_type, 'index_type': index_type.upper(), 'params': build_params}
+    milvus_client.create_index(field_name="embedding", index_params=index_params)
+    logger.info("Collection %s re-indexed with %s %s.✅️", milvus_client.name, index_type, build_params)
+    return get_vector_index_milvus(milvus_client, use_cache=False)
+
+
 def create_partition_if_not_exist_milvus(
         milvus_client: Collection,
         partition_name: str,) -> None:
@@ -80,17 +311,12 @@ def load_partition_milvus(
         partition_name: str,
         partition_replica_number: int = 1):
     """
-    load partition into memory
+    load partition into memory, the whole collection is loaded if partition_name is None
+    A MilvusException is raised if milvus refuses the load, i.e. when memory is exhausted.
+    Use api.partition_manager.PartitionLoadManager to skip redundant loads & evict LRU partitions instead
     """
-    # TODO fix this, manage partition loading with user sessions instead
-    try:
-        milvus_client.load([partition_name], replica_number=partition_replica_number)
-    except MilvusException as excep:
-        # WARNING can be very inefficient
-        milvus_client.release()
-        logger.warning("%s: Current collection released from memory", excep)
-        milvus_client.load([partition_name], replica_number=partition_replica_number)
-    logger.info("Partition %s loaded into memory", partition_name)
+    milvus_client.load([partition_name] if partition_name else None, replica_number=partition_replica_number)
+    logger.info("Partition %s loaded into memory", partition_name or milvus_client.name)
 
 
 def insert_into_milvus(
@@ -99,40 +325,291 @@ def insert_into_milvus(
         data: list) -> Dict:
     """
     Insert data with user_id into milvus collection 
+    The binary embeddings of binary prefilter collections are derived from the float embeddings of data[0]
+    The primary keys of the inserted entities are returned as content
     """
-    milvus_client.insert(data, partition_name=partition_name)
+    columns = [prepare_vectors_milvus(milvus_client, data[0])] + list(data[1:])
+    if has_binary_prefilter(milvus_client):
+        columns.append(binary_vectors_milvus(data[0]))
+    data = columns
+    insert_res = milvus_client.insert(data, partition_name=partition_name)
     logger.info("data inserted into milvus ✅️")
     return {"status": "success",
-            "detail": "data inserted in vector db"}
+            "detail": "data inserted in vector db",
+            "content": list(insert_res.primary_keys)}
 
 
-def search_milvus(
+def is_valid_doc_id(doc_id: str) -> bool:
+    """
+    Checks that a doc id from a request is a uuid like id, letters, digits, _ & - only
+    """
+    return isinstance(doc_id, str) and DOC_ID_RE.fullmatch(doc_id) is not None
+
+
+def get_doc_expr(doc_ids: List[str]) -> str:
+    """
+    Returns the filter expression matching the entities of doc_ids, the ids are json escaped string literals
+    so they cannot extend the expression
+    """
+    return f"doc_id in {json.dumps(list(doc_ids))}"
+
+
+def count_entities_milvus(
+        milvus_client: Collection,
+        expr: str,
+        partition_name: Optional[str] = None) -> int:
+    """
+    Counts the entities matching expr server side without fetching them
+    """
+    query_res = milvus_client.query(
+        expr=expr,
+        output_fields=["count(*)"],
+        partition_names=[partition_name] if partition_name else None,
+        consistency_level="Strong")
+    return int(query_res[0]["count(*)"]) if query_res else 0
+
+
+def delete_by_expr_milvus(
+        milvus_client: Collection,
+        expr: str,
+        partition_name: Optional[str] = None) -> int:
+    """
+    Deletes all entities matching expr, i.e. get_doc_expr(doc_ids), with a single server side delete
+    Returns the num of deleted entities
+    """
+    if not expr:
+        raise ValueError("Delete expression must not be empty")
+    delete_res = milvus_client.delete(expr, partition_name=partition_name)
+    logger.info("%s entities matching %s deleted from milvus", delete_res.delete_count, expr)
+    return delete_res.delete_count
+
+
+def delete_docs_in_batches_milvus(
+        milvus_client: Collection,
+        doc_ids: List[str],
+        partition_name: Optional[str] = None,
+        batch_size: int = 100,
+        get_expr: Optional[Callable[[str], str]] = None) -> int:
+    """
+    Deletes the entities of doc_ids with one server side expression delete per batch_size docs so that deleting
+    many docs does not produce a single huge delete. get_expr restricts the doc expressions, i.e. to the user
+    entities in partition key mode. Returns the num of deleted entities
+    """
+    num_deleted = 0
+    for start in range(0, len(doc_ids), batch_size):
+        expr = get_doc_expr(doc_ids[start:start + batch_size])
+        num_deleted += delete_by_expr_milvus(
+            milvus_client, get_expr(expr) if get_expr else expr, partition_name)
+    logger.info("%s entities of %s docs deleted from milvus in batches of %s docs",
+                num_deleted, len(doc_ids), batch_size)
+    return num_deleted
+
+
+def is_similarity_metric(metric_type: str) -> bool:
+    """
+    Returns True if a larger distance means a more similar match for the metric i.e. IP & COSINE
+    and False for distance metrics where smaller is more similar i.e. L2, HAMMING & JACCARD
+    """
+    return metric_type.upper() in {"IP", "COSINE"}
+
+
+def get_search_params(
+        metric_type: str,
+        ef: int = None,
+        radius: float = None,
+        range_filter: float = None) -> dict:
+    """
+    Builds the milvus search params. A range search is done when radius is set
+    For similarity metrics (IP, COSINE), returned hits satisfy radius < distance <= range_filter
+    For distance metrics (L2, HAMMING, JACCARD), returned hits satisfy range_filter <= distance < radius
+    """
+    params = {}
+    if ef is not None:
+        params["ef"] = ef
+    if radius is not None:
+        params["radius"] = radius
+        if range_filter is not None:
+            if is_similarity_metric(metric_type) and range_filter <= radius:
+                raise ValueError(f"range_filter must be larger than radius for the {metric_type} metric")
+            if not is_similarity_metric(metric_type) and range_filter >= radius:
+                raise ValueError(f"range_filter must be smaller than radius for the {metric_type} metric")
+            params["range_filter"] = range_filter
+    elif range_filter is not None:
+        raise ValueError("range_filter can only be used along with radius in a range search")
+    return {"metric_type": metric_type, "params": params}
+
+
+_ef_calibration_cache = {}
+
+
+def get_auto_search_ef(
+        calibration_path: str,
+        recall_target: float,
+        index_params: dict = None) -> Optional[int]:
+    """
+    Returns the smallest benchmarked ef whose recall meets recall_target from the calibration file
+    written by scripts/benchmark_hnsw.py. If no ef meets the target, the ef with the best recall is returned.
+    Only calibration runs with matching index_params (i.e. M & efConstruction) are used.
+    Returns None if no calibration is available
+    """
+    if not calibration_path or not os.path.exists(calibration_path):
+        return None
+    mtime = os.path.getmtime(calibration_path)
+    cached = _ef_calibration_cache.get(calibration_path)
+    if cached is None or cached[0] != mtime:
+        with open(calibration_path, 'r', encoding="utf-8") as fptr:
+            cached = (mtime, json.load(fptr))
+        _ef_calibration_cache[calibration_path] = cached
+    calibration = cached[1]
+    if index_params and any(calibration.get("index_params", {}).get(key) != val for key, val in index_params.items()):
+        logger.warning("ef calibration at %s was run with different index params, ignoring it", calibration_path)
+        return None
+    runs = sorted(calibration.get("results", []), key=lambda run: run["ef"])
+    if not runs:
+        return None
+    for run in runs:
+        if run["recall"] >= recall_target:
+            return int(run["ef"])
+    return int(max(runs, key=lambda run: run["recall"])["ef"])
+
+
+def resolve_search_ef(
+        ef: Optional[str],
+        limit: int,
+        default_ef: int,
+        calibration_path: str = None,
+        recall_target: float = 0.95,
+        index_params: dict = None) -> int:
+    """
+    Resolves a per-request ef override. None uses default_ef, "auto" uses the smallest calibrated ef
+    meeting recall_target (default_ef if uncalibrated) & any other value is parsed as an int.
+    ef is never smaller than limit as milvus hnsw searches require ef >= top_k
+    """
+    if ef is None:
+        resolved = default_ef
+    elif str(ef).lower() == "auto":
+        auto_ef = get_auto_search_ef(calibration_path, recall_target, index_params)
+        resolved = default_ef if auto_ef is None else auto_ef
+    else:
+        resolved = int(ef)
+        if resolved <= 0:
+            raise ValueError(f"ef must be a positive integer or auto, got {ef}")
+    return max(resolved, limit)
+
+
+def get_index_search_params(
+        milvus_client: Collection,
+        search_params: dict,
+        limit: int,
+        anns_field: str = "embedding") -> dict:
+    """
+    Adapts search params built for HNSW to the index type of the collection: IVF indexes are searched with
+    MILVUS_EMB_SEARCH_PARAM_NPROBE clusters, DISKANN with a search_list of ef & FLAT without params
+    """
+    params = (search_params or {}).get("params")
+    if anns_field != "embedding" or not params or "ef" not in params:
+        return search_params
+    vector_index = get_vector_index_milvus(milvus_client)
+    index_type = "HNSW" if vector_index is None else vector_index["index_type"]
+    if index_type == "HNSW":
+        return search_params
+    params = {key: val for key, val in params.items() if key != "ef"}
+    if index_type.startswith("IVF"):
+        params["nprobe"] = min(MILVUS_EMB_SEARCH_PARAM_NPROBE, vector_index.get("params", {}).get("nlist", 1024))
+    elif index_type == "DISKANN":
+        params["search_list"] = max(search_params["params"]["ef"], limit)
+    return dict(search_params, params=params)
+
+
+def _search_hits_milvus(
         milvus_client: Collection,
         partition_name: str,
         vector_list: List[np.ndarray],
-        limit: int = 10,
-        dist_thres: float = 0.3,
-        search_params: dict = None,
-        expr: str = None) -> Dict:
+        limit: int,
+        search_params: dict,
+        expr: str,
+        output_fields: List[str] = None,
+        text_store: Optional[ChunkTextStore] = None,
+        anns_field: str = "embedding") -> List[List[Dict]]:
     """
-    Searches vector in milvus collection
+    Runs a single ann search for all vectors & returns the hits of each query vector
+    ordered from the most to the least similar according to the search metric
+    The content of collections without chunk text is read from text_store
+    Float query vectors are sign-quantized when searching the BINARY_VECTOR_FIELD anns_field
     """
+    output_fields = ["content", "doc_id"] if output_fields is None else output_fields
+    read_text = "content" in output_fields and not stores_chunk_text(milvus_client)
+    if read_text:
+        if text_store is None:
+            raise ValueError(f"Collection {milvus_client.name} keeps the chunk text out of milvus, text_store required")
+        ref_fields = [field for field in CHUNK_TEXT_REF_FIELDS if field not in output_fields]
+        output_fields = [field for field in output_fields if field != "content"] + ref_fields
     results = milvus_client.search(
-        data=vector_list,
-        anns_field="embedding",
-        param=search_params,
+        data=(binary_vectors_milvus(vector_list) if anns_field == BINARY_VECTOR_FIELD
+              else prepare_vectors_milvus(milvus_client, vector_list)),
+        anns_field=anns_field,
+        param=get_index_search_params(milvus_client, search_params, limit, anns_field),
         limit=limit,
         expr=expr,
         partition_names=[partition_name] if partition_name else None,
-        output_fields=["content", "doc_id"])
+        output_fields=output_fields)
+    metric_type = (search_params or {}).get("metric_type", "IP")
+    results = [[dict({"id": res.id, "distance": res.distance},
+                     **{field: res.entity.get(field) for field in output_fields})
+                for res in hits]
+               for hits in results]
+    if "embedding" in output_fields:
+        for hits in results:
+            for hit in hits:
+                hit["embedding"] = decode_vector_field(hit["embedding"])
+    for hits in results:
+        hits.sort(key=lambda hit: hit["distance"], reverse=is_similarity_metric(metric_type))
+        if read_text:
+            text_store.fill_hits_content(hits, ref_fields)
+    return results
+
+
+def fetch_chunk_text_milvus(
+        milvus_client: Collection,
+        partition_name: str,
+        entity_ids: List[int],
+        text_store: Optional[ChunkTextStore] = None) -> Dict[int, str]:
+    """
+    Returns the chunk text of the entities with the given primary keys by id
+    """
+    in_milvus = stores_chunk_text(milvus_client)
+    entities = milvus_client.query(
+        expr=f"id in {list(entity_ids)}",
+        output_fields=["content"] if in_milvus else list(CHUNK_TEXT_REF_FIELDS),
+        partition_names=[partition_name] if partition_name else None)
+    if not in_milvus:
+        if text_store is None:
+            raise ValueError(f"Collection {milvus_client.name} keeps the chunk text out of milvus, text_store required")
+        text_store.fill_hits_content(entities)
+    return {entity["id"]: entity["content"] for entity in entities}
+
+
+def search_milvus(
+        milvus_client: Collection,
+        partition_name: str,
+        vector_list: List[np.ndarray],
+        limit: int = 10,
+        search_params: dict = None,
+        expr: str = None,
+        output_fields: List[str] = None,
+        text_store: Optional[ChunkTextStore] = None) -> Dict:
+    """
+    Searches vector in milvus collection & returns the hits of the first query vector
+    Use get_search_params to build search_params for a top-k or a server-side range search
+    output_fields defaults to content & doc_id, add embedding to get the hit vectors i.e. for mmr
+    text_store resolves the content of collections without chunk text
+    """
+    results = _search_hits_milvus(
+        milvus_client, partition_name, vector_list, limit, search_params, expr, output_fields, text_store)
     if not results:
         return {"status": "success",
                 "detail": "no vector entries found in vector db"}
-    results = sorted(results, key=lambda k: k.distances)
-    results = [{"distance": res.distance,
-                "doc_id": res.entity.get("doc_id"),
-                "content": res.entity.get("content")}
-               for res in results[0] if res.distance < dist_thres]
+    results = results[0]
     if not results:
         return {"status": "success",
                 "detail": "no similar entities found in vector db"}
@@ -141,6 +618,90 @@ def search_milvus(
             "content": results}
 
 
+def rescore_hits(hits: List[Dict], query_vec: np.ndarray, metric_type: str = "IP") -> List[Dict]:
+    """
+    Sets the distance of hits fetched with their float embedding to the metric_type distance to query_vec,
+    computed with one matrix product, & returns the hits ordered from the most to the least similar
+    """
+    if not hits:
+        return hits
+    embs = np.asarray([hit["embedding"] for hit in hits], dtype=np.float32)
+    query = np.asarray(query_vec, dtype=np.float32).reshape(-1)
+    distances = embs @ query
+    if metric_type.upper() == "COSINE":
+        distances /= np.maximum(np.linalg.norm(embs, axis=1) * np.linalg.norm(query), 1e-12)
+    elif metric_type.upper() == "L2":
+        distances = np.einsum("ij,ij->i", embs, embs) - 2 * distances + query @ query
+    for hit, distance in zip(hits, distances.tolist()):
+        hit["distance"] = distance
+    hits.sort(key=lambda hit: hit["distance"], reverse=is_similarity_metric(metric_type))
+    return hits
+
+
+def binary_rescore_search_milvus(
+        milvus_client: Collection,
+        partition_name: str,
+        vector_list: List[np.ndarray],
+        limit: int = 10,
+        search_params: dict = None,
+        expr: str = None,
+        output_fields: List[str] = None,
+        text_store: Optional[ChunkTextStore] = None,
+        oversample: int = 8) -> Dict:
+    """
+    Searches the hamming nearest limit * oversample binary embeddings of the first query vector & returns the
+    limit candidates most similar by their float embeddings, fetched along with the binary search hits.
+    The search_params metric_type is used for rescoring, range search params are not supported.
+    Requires a collection created with binary_prefilter, the num of candidates & stage latencies are returned
+    """
+    if not has_binary_prefilter(milvus_client):
+        raise ValueError(f"Collection {milvus_client.name} has no binary embeddings, create it with binary_prefilter")
+    output_fields = ["content", "doc_id"] if output_fields is None else output_fields
+    fetch_fields = output_fields if "embedding" in output_fields else output_fields + ["embedding"]
+    metric_type = (search_params or {}).get("metric_type", "IP")
+    t_0 = time.perf_counter()
+    candidates = _search_hits_milvus(
+        milvus_client, partition_name, vector_list[:1], limit * max(oversample, 1),
+        {"metric_type": "HAMMING", "params": {}}, expr, fetch_fields, text_store, anns_field=BINARY_VECTOR_FIELD)
+    candidates = candidates[0] if candidates else []
+    t_1 = time.perf_counter()
+    results = rescore_hits(candidates, vector_list[0], metric_type)[:limit]
+    if "embedding" not in output_fields:
+        for hit in results:
+            hit.pop("embedding", None)
+    latency_ms = {"prefilter": (t_1 - t_0) * 1000, "rescore": (time.perf_counter() - t_1) * 1000}
+    if not results:
+        return {"status": "success",
+                "detail": "no similar entities found in vector db",
+                "candidates": 0,
+                "latency_ms": latency_ms}
+    return {"status": "success",
+            "detail": f"{len(results)} similar entitie(s) found in vector db",
+            "content": results,
+            "candidates": len(candidates),
+            "latency_ms": latency_ms}
+
+
+def batch_search_milvus(
+        milvus_client: Collection,
+        partition_name: str,
+        vector_list: List[np.ndarray],
+        limit: int = 10,
+        search_params: dict = None,
+        expr: str = None,
+        text_store: Optional[ChunkTextStore] = None) -> Dict:
+    """
+    Searches a batch of vectors in milvus collection with a single ann call
+    The similar entities of each query vector are returned in the same order as vector_list
+    """
+    results = _search_hits_milvus(
+        milvus_client, partition_name, vector_list, limit, search_params, expr, text_store=text_store)
+    num_found = sum(len(hits) for hits in results)
+    return {"status": "success",
+            "detail": f"{num_found} similar entitie(s) found in vector db for {len(results)} queries",
+            "content": results}
+
+
 # if DEBUG is true, function runs are time
 if DEBUG:
     get_milvus_collec_conn = timeit_decorator(get_milvus_collec_conn)
@@ -148,3 +709,5 @@ if DEBUG:
     load_partition_milvus = timeit_decorator(load_partition_milvus)
     insert_into_milvus = timeit_decorator(insert_into_milvus)
     search_milvus = timeit_decorator(search_milvus)
+    binary_rescore_search_milvus = timeit_decorator(binary_rescore_search_milvus)
+    batch_search_milvus = timeit_decorator(batch_search_milvus)
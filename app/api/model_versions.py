@@ -0,0 +1,258 @@
+"""
+Embedding model versions
+
+Vectors of different embedding models can't be searched together, so each model version has its own collection
+shards, user -> shard mapping, lexical indexes (they reference the milvus primary keys) & doc centroids.
+The versions are stored in mongodb, one doc per version:
+    _id                 version name, i.e. v1, v2
+    model_name          embedding model, vector_dim & emb_api_url of the embedding api serving it
+    state               building -> active -> retired
+    collection_name_fmt, pk_collection_name, shard_collection, lexical_index_dir, doc_centroid_dir
+    progress            re-embed job progress of building versions
+The version serving reads & writes is set by a single pointer doc, so the switch to a new version is atomic.
+Each worker re-reads the pointer every refresh_s & requests resolve the active version once, i.e. a search
+embeds its query & searches the collection of the same version even if the switch happens meanwhile
+"""
+import re
+import time
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
+from api.hf_embedding import query_api_docker, query_api_docker_batch
+from api.tenant_placement import TenantPlacement
+from api.lexical_index import LexicalIndexStore
+from api.doc_centroids import DocCentroidStore
+
+
+logger = logging.getLogger('model_versions')
+
+ACTIVE_POINTER_ID = "_active"
+MODEL_VERSION_RE = re.compile(r"^[A-Za-z0-9]+$")
+
+
+class ModelVersion:
+    """
+    Embedding model of a version & the collections & indexes built with its embeddings
+    Arguments:
+        spec: Dict = version doc of the registry
+        placement: TenantPlacement = user -> collection shard placement of the version
+        lexical_index: LexicalIndexStore = lexical indexes of the chunks of the version collections
+        doc_centroids: DocCentroidStore = doc centroids of the version embeddings
+    """
+    def __init__(
+            self,
+            spec: Dict,
+            placement: TenantPlacement,
+            lexical_index: LexicalIndexStore,
+            doc_centroids: DocCentroidStore) -> None:
+        self.spec = spec
+        self.placement = placement
+        self.lexical_index = lexical_index
+        self.doc_centroids = doc_centroids
+
+    @property
+    def version(self) -> str:
+        """Version name"""
+        return self.spec["_id"]
+
+    @property
+    def model_name(self) -> str:
+        """Embedding model name"""
+        return self.spec["model_name"]
+
+    @property
+    def vector_dim(self) -> int:
+        """Embedding dim of the model"""
+        return int(self.spec["vector_dim"])
+
+    def embed(self, text: str) -> List[float]:
+        """Embedding of one text"""
+        return query_api_docker(text, hf_api_url=self.spec["emb_api_url"] + "/embedding/{text}")
+
+    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Embeddings of a batch of texts with a single embedding api call"""
+        return query_api_docker_batch(texts, hf_api_url=self.spec["emb_api_url"] + "/embeddings")
+
+
+class ModelVersionRegistry:
+    """
+    Model versions stored in mongodb & the active version pointer, refreshed in the background
+    Arguments:
+        mongodb_client: MongoClient = mongodb client where the versions are stored
+        database: str = mongodb database of the versions collection
+        collection: str = mongodb collection of the versions
+        default_spec: Dict = version doc of the configured model & collections, active if the registry is empty
+        make_version: Callable[[Dict], ModelVersion] = opens the collections & indexes of a version doc
+        refresh_s: float = max age of the active version pointer
+    """
+    def __init__(
+            self,
+            mongodb_client: MongoClient,
+            database: str,
+            collection: str,
+            default_spec: Dict,
+            make_version: Callable[[Dict], ModelVersion],
+            refresh_s: float = 5.0) -> None:
+        self.mongodb_client = mongodb_client
+        self.database = database
+        self.collection = collection
+        self.default_spec = default_spec
+        self.make_version = make_version
+        self.refresh_s = refresh_s
+
+        self._versions: Dict[str, ModelVersion] = {}
+        self._active_name: Optional[str] = None
+        self._lock = threading.RLock()
+        self._refresher: Optional[threading.Thread] = None
+
+    @property
+    def _specs(self):
+        return self.mongodb_client[self.database][self.collection]
+
+    def refresh(self) -> str:
+        """
+        Re-reads the active version pointer, the registry is seeded with the default version if empty.
+        Returns the active version name
+        """
+        pointer = self._specs.find_one({"_id": ACTIVE_POINTER_ID})
+        if pointer is None:
+            self._specs.update_one(
+                {"_id": self.default_spec["_id"]}, {"$setOnInsert": self.default_spec}, upsert=True)
+            self._specs.update_one(
+                {"_id": ACTIVE_POINTER_ID}, {"$setOnInsert": {"version": self.default_spec["_id"]}}, upsert=True)
+            pointer = self._specs.find_one({"_id": ACTIVE_POINTER_ID})
+        # open the collections & indexes of a newly activated version before requests are switched to it
+        self.get(pointer["version"])
+        with self._lock:
+            if pointer["version"] != self._active_name:
+                logger.info("Active model version %s -> %s", self._active_name, pointer["version"])
+            self._active_name = pointer["version"]
+        return pointer["version"]
+
+    def _refresh_loop(self) -> None:
+        while True:
+            try:
+                self.refresh()
+            except Exception as excep:
+                logger.warning("%s: could not refresh the active model version", excep)
+            time.sleep(self.refresh_s)
+
+    def start_refresher(self) -> None:
+        """Starts the daemon thread re-reading the active version pointer every refresh_s"""
+        if self._refresher is None:
+            self._refresher = threading.Thread(target=self._refresh_loop, name="model_version_refresh", daemon=True)
+            self._refresher.start()
+
+    def get_spec(self, version: str) -> Optional[Dict]:
+        """Version doc or None if the version does not exist"""
+        if version == ACTIVE_POINTER_ID:
+            return None
+        return self._specs.find_one({"_id": version})
+
+    def opened(self) -> List[ModelVersion]:
+        """Versions whose collections & indexes were opened by this process"""
+        with self._lock:
+            return list(self._versions.values())
+
+    def list_specs(self) -> List[Dict]:
+        """All version docs in creation order"""
+        return list(self._specs.find({"_id": {"$ne": ACTIVE_POINTER_ID}}).sort("created_at", 1))
+
+    def registered(self) -> List[ModelVersion]:
+        """All versions in creation order, i.e. to remove user data from retired versions too"""
+        return [self.get(spec["_id"]) for spec in self.list_specs()]
+
+    def get(self, version: str) -> ModelVersion:
+        """
+        Returns the model version, its collections & indexes are opened on first use.
+        A ValueError is raised if the version does not exist
+        """
+        with self._lock:
+            model = self._versions.get(version)
+        if model is None:
+            spec = self.get_spec(version)
+            if spec is None:
+                raise ValueError(f"Model version {version} does not exist")
+            with self._lock:
+                model = self._versions.get(version)
+                if model is None:
+                    model = self._versions[version] = self.make_version(spec)
+        return model
+
+    def active(self) -> ModelVersion:
+        """Model version serving reads & writes"""
+        with self._lock:
+            active_name = self._active_name
+        if active_name is None:
+            active_name = self.refresh()
+        return self.get(active_name)
+
+    def create_version(self, version: str, model_name: str, vector_dim: int, emb_api_url: str) -> Dict:
+        """
+        Registers a building version of model_name with collection, mapping & index names suffixed with the
+        version. Returns the version doc, an existing version of the same model is returned as is
+        """
+        if not MODEL_VERSION_RE.match(version):
+            raise ValueError(f"Model version {version} must be alphanumeric")
+        default = self.default_spec
+        spec = {"_id": version,
+                "model_name": model_name,
+                "vector_dim": vector_dim,
+                "emb_api_url": emb_api_url.rstrip("/"),
+                "state": "building",
+                "created_at": datetime.now(timezone.utc),
+                "collection_name_fmt": default["collection_name_fmt"].replace("%", f"{version}_%", 1),
+                "pk_collection_name": f"{default['pk_collection_name']}_{version}",
+                "shard_collection": f"{default['shard_collection']}_{version}",
+                "lexical_index_dir": f"{default['lexical_index_dir']}_{version}",
+                "doc_centroid_dir": f"{default['doc_centroid_dir']}_{version}",
+                "progress": {}}
+        try:
+            self._specs.insert_one(spec)
+            logger.info("Model version %s of %s created", version, model_name)
+        except DuplicateKeyError:
+            spec = self.get_spec(version)
+            if spec["model_name"] != model_name or int(spec["vector_dim"]) != vector_dim:
+                raise ValueError(f"Model version {version} already exists with model {spec['model_name']}") from None
+        return spec
+
+    def update_spec(self, version: str, **fields) -> None:
+        """Sets fields of the version doc, i.e. the state & progress of building versions"""
+        self._specs.update_one({"_id": version}, {"$set": fields})
+        with self._lock:
+            model = self._versions.get(version)
+            if model is not None:
+                model.spec.update(fields)
+
+    def claim_build(self, version: str, lease_s: float) -> bool:
+        """
+        Claims the re-embed job of a building version. False if the version is not building or the job of
+        another worker renewed its claim, the job_heartbeat, within lease_s
+        """
+        now = datetime.now(timezone.utc)
+        update_res = self._specs.update_one(
+            {"_id": version, "state": "building",
+             "$or": [{"job_heartbeat": None}, {"job_heartbeat": {"$lt": now - timedelta(seconds=lease_s)}}]},
+            {"$set": {"job_heartbeat": now}})
+        return update_res.modified_count == 1
+
+    def activate(self, version: str) -> None:
+        """
+        Switches reads & writes of all workers to version with a single pointer update.
+        Workers pick up the switch within refresh_s, the previous version is retired & kept
+        """
+        if self.get_spec(version) is None:
+            raise ValueError(f"Model version {version} does not exist")
+        previous = self._specs.find_one_and_update(
+            {"_id": ACTIVE_POINTER_ID}, {"$set": {"version": version}}, upsert=True)
+        now = datetime.now(timezone.utc)
+        self.update_spec(version, state="active", activated_at=now)
+        if previous and previous["version"] != version:
+            self.update_spec(previous["version"], state="retired", retired_at=now)
+        with self._lock:
+            self._active_name = version
+        logger.info("Model version %s activated", version)
@@ -0,0 +1,347 @@
+"""
+Milvus partition residency manager
+
+Tracks which user partitions are loaded into milvus query-node memory so that
+redundant load calls are skipped and the least recently used partitions are
+released to stay within a partition count and memory budget.
+Partitions are pinned while a search or query runs on them & pinned partitions are never evicted.
+Note: the residency state is per process, each uvicorn worker keeps its own view. A partition released by
+another worker is loaded again when a search or query run with run_loaded fails as not loaded
+"""
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from pymilvus import Collection, MilvusException
+from api.milvus import load_partition_milvus
+
+
+logger = logging.getLogger('partition_manager')
+
+
+def is_not_loaded_error(excep: MilvusException) -> bool:
+    """Checks if milvus refused a search or query because the collection or partition is not loaded"""
+    return "not loaded" in str(excep).lower()
+
+
+class PartitionLoadManager:
+    """
+    LRU based partition load manager.
+    Partitions are keyed by (collection name, partition name) so one manager can serve several collections
+    A partition_name of None refers to the whole collection i.e. for partition key collections, it is shared by all
+    users & never evicted
+    Arguments:
+        max_loaded_partitions: int = max num of partitions kept in memory, <= 0 disables the limit
+        max_memory_bytes: int = estimated memory budget of loaded partitions, <= 0 disables the limit
+        entity_bytes: int = estimated memory used by a single entity (vector + index links + scalar fields)
+        replica_number: int = num of replicas used when loading a partition
+        preload_workers: int = num of background threads used for preloading partitions
+        recent_history_size: int = num of recently active partitions remembered for preloading
+        preload_interval_s: float = seconds between background preloads of recently active partitions
+    """
+    def __init__(
+            self,
+            max_loaded_partitions: int = 512,
+            max_memory_bytes: int = 0,
+            entity_bytes: int = 2048,
+            replica_number: int = 1,
+            preload_workers: int = 1,
+            recent_history_size: int = 1024,
+            latency_window: int = 1024,
+            preload_interval_s: float = 30.0) -> None:
+        self.max_loaded_partitions = max_loaded_partitions
+        self.max_memory_bytes = max_memory_bytes
+        self.entity_bytes = entity_bytes
+        self.replica_number = replica_number
+        self.recent_history_size = recent_history_size
+        self.preload_interval_s = preload_interval_s
+
+        # (collection_name, partition_name) -> (milvus_client, est_bytes), ordered from least to most recently used
+        self._resident: "OrderedDict[Tuple[str, str], Tuple[Collection, int]]" = OrderedDict()
+        # (collection_name, partition_name) -> (milvus_client, last access time)
+        self._recent: "OrderedDict[Tuple[str, str], Tuple[Collection, float]]" = OrderedDict()
+        self._resident_bytes = 0
+        # (collection_name, partition_name) -> num of searches & queries running on the partition
+        self._pins: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.RLock()
+        self._load_locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._preload_pool = ThreadPoolExecutor(max_workers=preload_workers, thread_name_prefix="partition_preload")
+        self._preload_pending = set()
+        self._preloader: Optional[threading.Thread] = None
+
+        self._load_latencies = deque(maxlen=latency_window)
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "load_failures": 0, "reloads": 0,
+                          "preloads": 0, "preload_skips": 0}
+
+    def ensure_loaded(self, milvus_client: Collection, partition_name: str, pin: bool = False) -> bool:
+        """
+        Make sure the partition is loaded into memory, loading it & evicting LRU partitions if required
+        With pin the partition is also pinned until unpin is called, so it is not evicted in between
+        Returns True if the partition was already resident (cache hit)
+        """
+        key = (milvus_client.name, partition_name)
+        with self._lock:
+            self._touch_recent(key, milvus_client)
+            if pin:
+                # pinned before the load so the partition cannot be evicted once it is resident
+                self._pins[key] = self._pins.get(key, 0) + 1
+            if key in self._resident:
+                self._resident.move_to_end(key)
+                self._counters["hits"] += 1
+                return True
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        # serialize loads of the same partition, other partitions are not blocked
+        try:
+            with load_lock:
+                with self._lock:
+                    if key in self._resident:  # loaded by a concurrent request
+                        self._resident.move_to_end(key)
+                        self._counters["hits"] += 1
+                        return True
+                    self._counters["misses"] += 1
+                self._load(milvus_client, partition_name, evict=True)
+        except Exception:
+            if pin:
+                self.unpin(milvus_client, partition_name)
+            raise
+        return False
+
+    def unpin(self, milvus_client: Collection, partition_name: str) -> None:
+        """Unpins a partition pinned with ensure_loaded, it can be evicted again once it has no pins left"""
+        key = (milvus_client.name, partition_name)
+        with self._lock:
+            num_pins = self._pins.get(key, 0) - 1
+            if num_pins > 0:
+                self._pins[key] = num_pins
+            else:
+                self._pins.pop(key, None)
+
+    def run_loaded(self, milvus_client: Collection, partition_name: str, func: Callable, *args, **kwargs) -> Any:
+        """
+        Runs a search or query func(*args, **kwargs) on the partition, which is loaded first & pinned while func
+        runs. If milvus reports the partition as not loaded, i.e. it was released by another worker, it is loaded
+        again & func is retried once
+        """
+        self.ensure_loaded(milvus_client, partition_name, pin=True)
+        try:
+            try:
+                return func(*args, **kwargs)
+            except MilvusException as excep:
+                if not is_not_loaded_error(excep):
+                    raise
+                logger.warning("%s: partition %s is not loaded, loading it again", excep, partition_name)
+            self._reload(milvus_client, partition_name)
+            return func(*args, **kwargs)
+        finally:
+            self.unpin(milvus_client, partition_name)
+
+    def preload_async(self, milvus_client: Collection, partition_names: List[str]) -> None:
+        """
+        Preload partitions in a background thread.
+        Preloads only use free budget and never evict other resident partitions
+        """
+        for partition_name in partition_names:
+            key = (milvus_client.name, partition_name)
+            with self._lock:
+                self._touch_recent(key, milvus_client)
+                if key in self._resident or key in self._preload_pending:
+                    continue
+                self._preload_pending.add(key)
+            self._preload_pool.submit(self._preload, milvus_client, partition_name)
+
+    def preload_recent(self, num_partitions: int = 16) -> None:
+        """
+        Preload the most recently active partitions that are not currently resident
+        """
+        with self._lock:
+            recent = [(key, collec) for key, (collec, _) in reversed(self._recent.items())
+                      if key not in self._resident][:num_partitions]
+        for (_, partition_name), milvus_client in recent:
+            self.preload_async(milvus_client, [partition_name])
+
+    def _preload_loop(self, num_partitions: int) -> None:
+        while True:
+            time.sleep(self.preload_interval_s)
+            try:
+                self.preload_recent(num_partitions)
+            except Exception as excep:
+                logger.warning("%s: could not preload recently active partitions", excep)
+
+    def start_preloader(self, num_partitions: int = 16) -> None:
+        """
+        Starts the daemon thread preloading the num_partitions most recently active partitions that are not
+        resident every preload_interval_s, i.e. after they were evicted, as far as the free budget allows
+        """
+        if self._preloader is None and self.preload_interval_s > 0:
+            self._preloader = threading.Thread(
+                target=self._preload_loop, args=(num_partitions,), name="partition_preload_recent", daemon=True)
+            self._preloader.start()
+
+    def release(self, milvus_client: Collection, partition_name: str) -> None:
+        """
+        Release a partition from memory & stop tracking it. Used before a partition is dropped
+        """
+        key = (milvus_client.name, partition_name)
+        self._release_partition(milvus_client, partition_name)
+        with self._lock:
+            self._forget(key)
+            self._recent.pop(key, None)
+            self._load_locks.pop(key, None)
+        logger.info("Partition %s released from memory", partition_name)
+
+    def release_all(self, milvus_client: Collection) -> None:
+        """
+        Release the whole collection from memory & stop tracking all of its partitions
+        """
+        milvus_client.release()
+        with self._lock:
+            for key in [key for key in self._resident if key[0] == milvus_client.name]:
+                self._forget(key)
+            for key in [key for key in self._recent if key[0] == milvus_client.name]:
+                self._recent.pop(key)
+        logger.info("Collection %s released from memory", milvus_client.name)
+
+    def metrics(self) -> Dict:
+        """
+        Returns load hit/miss, eviction & load latency metrics
+        """
+        with self._lock:
+            latencies = np.asarray(self._load_latencies, dtype=np.float64)
+            lookups = self._counters["hits"] + self._counters["misses"]
+            metrics = dict(self._counters)
+            metrics.update({
+                "hit_ratio": self._counters["hits"] / lookups if lookups else 0.0,
+                "loaded_partitions": len(self._resident),
+                "pinned_partitions": len(self._pins),
+                "loaded_bytes_est": self._resident_bytes,
+                "max_loaded_partitions": self.max_loaded_partitions,
+                "max_memory_bytes": self.max_memory_bytes,
+                "load_count": int(latencies.size),
+                "load_latency_ms_mean": float(latencies.mean()) if latencies.size else 0.0,
+                "load_latency_ms_p50": float(np.percentile(latencies, 50)) if latencies.size else 0.0,
+                "load_latency_ms_p99": float(np.percentile(latencies, 99)) if latencies.size else 0.0,
+                "load_latency_ms_max": float(latencies.max()) if latencies.size else 0.0,
+            })
+        return metrics
+
+    # ############## internal helpers ##############
+
+    def _touch_recent(self, key: Tuple[str, str], milvus_client: Collection) -> None:
+        self._recent[key] = (milvus_client, time.time())
+        self._recent.move_to_end(key)
+        while len(self._recent) > self.recent_history_size:
+            self._recent.popitem(last=False)
+
+    def _forget(self, key: Tuple[str, str]) -> None:
+        _, est_bytes = self._resident.pop(key, (None, 0))
+        self._resident_bytes -= est_bytes
+
+    @staticmethod
+    def _release_partition(milvus_client: Collection, partition_name: str) -> None:
+        if partition_name is None:
+            milvus_client.release()
+        else:
+            milvus_client.partition(partition_name).release()
+
+    def _estimate_bytes(self, milvus_client: Collection, partition_name: str) -> int:
+        try:
+            if partition_name is None:
+                return milvus_client.num_entities * self.entity_bytes
+            return milvus_client.partition(partition_name).num_entities * self.entity_bytes
+        except MilvusException as excep:
+            logger.warning("%s: could not get num entities of partition %s", excep, partition_name)
+            return 0
+
+    def _has_headroom(self, est_bytes: int) -> bool:
+        if 0 < self.max_loaded_partitions <= len(self._resident):
+            return False
+        if 0 < self.max_memory_bytes < self._resident_bytes + est_bytes:
+            return False
+        return True
+
+    def _evict_lru(self) -> bool:
+        """
+        Release the least recently used partition that is not pinned & not a whole shared collection.
+        Returns False if nothing is left to evict
+        """
+        with self._lock:
+            key = next((key for key in self._resident if key[1] is not None and key not in self._pins), None)
+            if key is None:
+                return False
+            milvus_client, _ = self._resident[key]
+            self._forget(key)
+            self._counters["evictions"] += 1
+        try:
+            self._release_partition(milvus_client, key[1])
+            logger.info("Partition %s evicted from memory", key[1] or milvus_client.name)
+        except MilvusException as excep:
+            logger.warning("%s: failed to release evicted partition %s", excep, key[1])
+        return True
+
+    def _load(self, milvus_client: Collection, partition_name: str, evict: bool) -> bool:
+        key = (milvus_client.name, partition_name)
+        est_bytes = self._estimate_bytes(milvus_client, partition_name)
+        while True:
+            with self._lock:
+                headroom = self._has_headroom(est_bytes)
+            if headroom:
+                break
+            if not evict:
+                return False
+            if not self._evict_lru():
+                break  # partition alone exceeds the budget, try loading anyway
+
+        t_0 = time.perf_counter()
+        while True:
+            try:
+                load_partition_milvus(milvus_client, partition_name, self.replica_number)
+                break
+            except MilvusException as excep:
+                # milvus refused the load (i.e. out of memory), free the LRU partition & retry
+                with self._lock:
+                    self._counters["load_failures"] += 1
+                if not evict or not self._evict_lru():
+                    raise
+                logger.warning("%s: evicted LRU partition to load partition %s", excep, partition_name)
+        with self._lock:
+            self._load_latencies.append((time.perf_counter() - t_0) * 1000)
+            self._resident[key] = (milvus_client, est_bytes)
+            self._resident_bytes += est_bytes
+        return True
+
+    def _reload(self, milvus_client: Collection, partition_name: str) -> None:
+        """Loads a partition tracked as resident that milvus reports as not loaded"""
+        key = (milvus_client.name, partition_name)
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        with load_lock:
+            with self._lock:
+                self._forget(key)
+                self._counters["reloads"] += 1
+            self._load(milvus_client, partition_name, evict=True)
+
+    def _preload(self, milvus_client: Collection, partition_name: str) -> None:
+        key = (milvus_client.name, partition_name)
+        try:
+            with self._lock:
+                load_lock = self._load_locks.setdefault(key, threading.Lock())
+            with load_lock:
+                with self._lock:
+                    if key in self._resident:
+                        return
+                if self._load(milvus_client, partition_name, evict=False):
+                    with self._lock:
+                        self._counters["preloads"] += 1
+                else:
+                    with self._lock:
+                        self._counters["preload_skips"] += 1
+        except Exception as excep:
+            logger.warning("%s: background preload of partition %s failed", excep, partition_name)
+        finally:
+            with self._lock:
+                self._preload_pending.discard(key)
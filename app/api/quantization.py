@@ -0,0 +1,135 @@
+"""
+Reduced precision vector storage
+
+Embeddings are stored as is in float32 by default. float16 halves the vector memory with a negligible recall loss
+for normalized sentence embeddings. int8 quarters it with symmetric per-dimension scalar quantization, the
+scales being calibrated once per collection from its first inserted vectors.
+Reduced precision vectors are L2 normalized before being converted so that their components are bounded by 1
+Binary codes keep 1 sign bit per dimension, i.e. 32x less than float32, & are only precise enough to prefilter
+candidates that are then rescored with the float vectors
+"""
+import json
+import os
+from typing import Dict, Optional
+
+import numpy as np
+from utils.benchmark import normalize_vectors
+
+
+VECTOR_PRECISIONS = ("float32", "float16", "int8")
+# bytes used per vector component at rest
+PRECISION_ITEMSIZE = {"float32": 4, "float16": 2, "int8": 1}
+# num of set bits of each byte value
+_POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+class ScalarQuantizer:
+    """
+    Symmetric per-dimension int8 quantizer, code = round(value / scale) clipped to [-127, 127]
+    Arguments:
+        scale: np.ndarray = per-dimension step of shape (dim,)
+    """
+    def __init__(self, scale: np.ndarray) -> None:
+        self.scale = np.asarray(scale, dtype=np.float32)
+
+    @classmethod
+    def fit(
+            cls,
+            vectors: np.ndarray,
+            percentile: float = 99.9,
+            margin: float = 1.1,
+            min_rows: int = 256) -> "ScalarQuantizer":
+        """
+        Calibrates the scales on sample vectors. Each dimension covers margin * the percentile of its absolute
+        values so that later vectors are rarely clipped. With less than min_rows samples, per-dimension
+        percentiles are unreliable & one scale covering the largest absolute value is used for all dimensions
+        """
+        vectors = np.abs(np.asarray(vectors, dtype=np.float32))
+        if len(vectors) >= min_rows:
+            bound = np.percentile(vectors, percentile, axis=0)
+        else:
+            bound = np.full(vectors.shape[1], vectors.max() if vectors.size else 1.0, dtype=np.float32)
+        # a dimension with only zeros in the sample still gets a usable range
+        bound = np.maximum(bound * margin, 1e-3)
+        return cls(bound / 127.0)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        """Quantizes float vectors of shape (n, dim) to int8 codes"""
+        codes = np.rint(np.asarray(vectors, dtype=np.float32) / self.scale)
+        return np.clip(codes, -127, 127).astype(np.int8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        """Reconstructs float32 vectors from int8 codes"""
+        return np.asarray(codes, dtype=np.float32) * self.scale
+
+    def to_dict(self) -> Dict:
+        return {"type": "int8_symmetric", "scale": self.scale.tolist()}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "ScalarQuantizer":
+        return cls(np.asarray(data["scale"], dtype=np.float32))
+
+    def save(self, path: str) -> "ScalarQuantizer":
+        """
+        Saves the calibration unless another process saved one first, in which case that one is loaded
+        & returned so that all writers of a collection use the same scales
+        """
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding="utf-8") as fptr:
+            json.dump(self.to_dict(), fptr)
+        try:
+            os.link(tmp_path, path)  # fails if the calibration already exists
+            return self
+        except FileExistsError:
+            return load_quantizer(path)
+        finally:
+            os.remove(tmp_path)
+
+
+def load_quantizer(path: str) -> Optional[ScalarQuantizer]:
+    """Loads a saved calibration, None if the collection has none yet"""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding="utf-8") as fptr:
+        return ScalarQuantizer.from_dict(json.load(fptr))
+
+
+def to_precision(vectors: np.ndarray, precision: str, quantizer: Optional[ScalarQuantizer] = None) -> np.ndarray:
+    """
+    Normalizes float vectors of shape (n, dim) & converts them to the storage precision.
+    int8 requires a calibrated quantizer
+    """
+    if precision not in VECTOR_PRECISIONS:
+        raise ValueError(f"Unknown vector precision {precision}, must be one of {VECTOR_PRECISIONS}")
+    if precision == "float32":
+        return np.asarray(vectors, dtype=np.float32)
+    vectors = normalize_vectors(vectors)
+    if precision == "float16":
+        return vectors.astype(np.float16)
+    if quantizer is None:
+        raise ValueError("int8 vectors require a calibrated quantizer")
+    return quantizer.encode(vectors)
+
+
+def from_precision(vectors: np.ndarray, precision: str, quantizer: Optional[ScalarQuantizer] = None) -> np.ndarray:
+    """Converts stored vectors back to float32"""
+    if precision == "int8":
+        return quantizer.decode(vectors)
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def binary_quantize(vectors: np.ndarray) -> np.ndarray:
+    """
+    1-bit sign quantization of float vectors of shape (n, dim), bit = value > 0, packed to (n, ceil(dim / 8)) uint8
+    """
+    return np.packbits(np.asarray(vectors, dtype=np.float32) > 0, axis=-1)
+
+
+def hamming_distances(codes: np.ndarray, query_codes: np.ndarray) -> np.ndarray:
+    """Hamming distances of shape (num_queries, num_codes) between packed binary codes"""
+    codes = np.asarray(codes, dtype=np.uint8)
+    query_codes = np.atleast_2d(np.asarray(query_codes, dtype=np.uint8))
+    distances = np.empty((len(query_codes), len(codes)), dtype=np.int32)
+    for query_idx, query_code in enumerate(query_codes):
+        distances[query_idx] = _POPCOUNT[np.bitwise_xor(codes, query_code)].sum(axis=1, dtype=np.int32)
+    return distances
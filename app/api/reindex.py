@@ -0,0 +1,287 @@
+"""
+Background re-embedding of the stored chunks with the model of a new model version
+
+The job reads the chunk text of every doc user by user from its extracted text cache, or streams it from the active
+version collections (or the doc text files with CHUNK_TEXT_STORE=file) for docs without one, embeds it with the
+new model in large batches & writes it to the new version collections & indexes. Searches & upserts keep using the
+active version meanwhile.
+Re-embedded docs are recorded in a mongodb progress collection, one doc per (version, doc_id), so an
+interrupted job resumes with the docs left. Docs upserted while the job runs are picked up by further passes &
+docs deleted meanwhile are removed from the new version. Once a pass finds no doc left, the new version is
+activated & a last pass catches the docs upserted by workers before they picked up the switch
+"""
+import time
+import logging
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Set
+
+import numpy as np
+from pymilvus import Collection
+from pymongo import MongoClient
+from api.chunk_text_store import ChunkTextStore, chunk_offsets
+from api.extracted_text import read_doc_chunks
+from api.lexical_index import LexicalIndexStore
+from api.doc_centroids import DocCentroidStore
+from api.milvus import insert_into_milvus, stores_chunk_text, get_doc_expr, delete_by_expr_milvus
+from api.model_versions import ModelVersion, ModelVersionRegistry
+from api.snapshot import iter_snapshot_batches_milvus, group_doc_rows
+
+
+logger = logging.getLogger('reindex')
+
+
+def rebuild_user_indexes(
+        milvus_client: Collection,
+        partition_name: Optional[str],
+        expr: Optional[str],
+        user_id: str,
+        lexical_index: LexicalIndexStore,
+        doc_centroids: DocCentroidStore,
+        text_store: Optional[ChunkTextStore] = None,
+        batch_size: int = 2000) -> int:
+    """
+    Rebuilds the lexical index & doc centroids of a user from their entities matching expr in the collection,
+    i.e. after the entities were inserted again under new primary keys or to backfill docs upserted before the
+    indexes existed. Returns num of chunks indexed
+    """
+    chunk_ids, doc_ids, contents = [], [], []
+    centroid_doc_ids, centroids, counts = [], [], []
+    batches = iter_snapshot_batches_milvus(milvus_client, partition_name, expr, batch_size, text_store)
+    for batch in batches:
+        chunk_ids.extend(batch["id"])
+        doc_ids.extend(batch["doc_id"])
+        contents.extend(batch["content"])
+        # batches are only cut at doc boundaries, so each batch holds all the chunks of its docs
+        for doc_id, doc_rows in group_doc_rows(batch).items():
+            centroid_doc_ids.append(doc_id)
+            centroids.append(batch["embedding"][doc_rows].mean(axis=0))
+            counts.append(len(doc_rows))
+    lexical_index.rebuild_user(user_id, chunk_ids, doc_ids, contents)
+    doc_centroids.rebuild_user(user_id, centroid_doc_ids, centroids, counts)
+    return len(chunk_ids)
+
+
+class ReindexJob:
+    """
+    Re-embeds all docs into the collections & indexes of a model version, then activates it
+    Arguments:
+        registry: ModelVersionRegistry = model versions, the active one is the source of the chunk text
+        version: str = version to build, created with registry.create_version
+        mongodb_client: MongoClient = mongodb client of the user, doc & progress collections
+        database: str = mongodb database of the user, doc & progress collections
+        user_collection: str = mongodb collection of the users
+        doc_collection: str = mongodb collection of the doc records
+        progress_collection: str = mongodb collection of the re-embedded docs
+        chunk_text_store: ChunkTextStore = doc text files of the collections keeping the chunk text out of milvus
+        load_partition: Callable[[Collection, Optional[str]], None] = loads a partition before it is queried
+        batch_size: int = num of entities read per batch
+        embed_batch_size: int = num of chunk texts per embedding api call
+        switch_delay_s: float = wait after the switch for all workers to use the new version
+    """
+    def __init__(
+            self,
+            registry: ModelVersionRegistry,
+            version: str,
+            mongodb_client: MongoClient,
+            database: str,
+            user_collection: str,
+            doc_collection: str,
+            progress_collection: str,
+            chunk_text_store: ChunkTextStore,
+            load_partition: Callable[[Collection, Optional[str]], None],
+            batch_size: int = 2000,
+            embed_batch_size: int = 256,
+            switch_delay_s: float = 10.0) -> None:
+        self.registry = registry
+        self.version = version
+        self.users = mongodb_client[database][user_collection]
+        self.docs = mongodb_client[database][doc_collection]
+        self.progress = mongodb_client[database][progress_collection]
+        self.chunk_text_store = chunk_text_store
+        self.load_partition = load_partition
+        self.batch_size = batch_size
+        self.embed_batch_size = embed_batch_size
+        self.switch_delay_s = switch_delay_s
+        self.stats = {"docs": 0, "chunks": 0, "deleted_docs": 0, "passes": 0}
+
+    def _done_doc_ids(self, user_id: str) -> Set[str]:
+        return {entry["doc_id"] for entry in self.progress.find(
+            {"version": self.version, "user_id": user_id}, {"doc_id": 1})}
+
+    def _record_docs(self, user_id: str, doc_chunks: Dict[str, int]) -> None:
+        if doc_chunks:
+            self.progress.insert_many([
+                {"_id": f"{self.version}/{doc_id}", "version": self.version, "user_id": user_id, "doc_id": doc_id,
+                 "num_chunks": num_chunks} for doc_id, num_chunks in doc_chunks.items()])
+        self.stats["docs"] += len(doc_chunks)
+        now = datetime.now(timezone.utc)
+        self.registry.update_spec(self.version, progress=dict(self.stats, updated_at=now), job_heartbeat=now)
+
+    def _embed(self, target: ModelVersion, contents: List[str]) -> np.ndarray:
+        emb_vecs = []
+        for start in range(0, len(contents), self.embed_batch_size):
+            emb_vecs.extend(target.embed_batch(contents[start: start + self.embed_batch_size]))
+        return np.asarray(emb_vecs, dtype=np.float32).reshape(len(contents), target.vector_dim)
+
+    def _index_batch(self, target: ModelVersion, milvus_client: Collection, user_id: str, batch: Dict) -> Dict:
+        """
+        Embeds & inserts the chunks of a batch of whole docs like the upsert routes. Returns num chunks per doc
+        """
+        doc_rows = group_doc_rows(batch)
+        rows = [row for doc_rows_ in doc_rows.values() for row in doc_rows_]
+        doc_ids = [batch["doc_id"][row] for row in rows]
+        contents = [batch["content"][row] for row in rows]
+        partition_name = target.placement.get_partition_name(user_id)
+        # entities left by an interrupted run
+        expr = target.placement.get_user_expr(user_id, get_doc_expr(list(doc_rows)))
+        delete_by_expr_milvus(milvus_client, expr, partition_name)
+        target.lexical_index.delete_docs(user_id, list(doc_rows))
+
+        emb_vecs = self._embed(target, contents)
+        data = [emb_vecs, doc_ids, [user_id] * len(rows)]
+        if stores_chunk_text(milvus_client):
+            data.append(contents)
+        else:
+            # the doc text files are shared by all versions, only the offsets are stored
+            chunk_indexes, starts, ends = [], [], []
+            for doc_rows_ in doc_rows.values():
+                offsets = chunk_offsets([batch["content"][row] for row in doc_rows_])
+                chunk_indexes.extend(range(len(offsets)))
+                starts.extend(start for start, _ in offsets)
+                ends.extend(end for _, end in offsets)
+            data.extend([chunk_indexes, starts, ends])
+        insert_res = insert_into_milvus(milvus_client, partition_name, data)
+        target.lexical_index.add_chunks(user_id, insert_res["content"], doc_ids, contents)
+        row_pos = {row: pos for pos, row in enumerate(rows)}
+        target.doc_centroids.add_docs(user_id, {
+            doc_id: emb_vecs[[row_pos[row] for row in doc_rows_]] for doc_id, doc_rows_ in doc_rows.items()})
+        self.stats["chunks"] += len(rows)
+        return {doc_id: len(doc_rows_) for doc_id, doc_rows_ in doc_rows.items()}
+
+    def _index_and_record(self, target: ModelVersion, milvus_client: Collection, user_id: str, batch: Dict) -> Set:
+        """Indexes a batch of whole docs & records them as re-embedded. Returns the doc ids of the batch"""
+        doc_chunks = self._index_batch(target, milvus_client, user_id, batch)
+        self._record_docs(user_id, doc_chunks)
+        return set(doc_chunks)
+
+    def _reindex_cached_docs(
+            self, target: ModelVersion, milvus_client: Collection, user_id: str, doc_ids: Set[str]) -> Set[str]:
+        """
+        Re-embeds the docs of doc_ids with an extracted text cache from the chunks of their cache, so the active
+        version collections are not read. Returns the doc ids re-embedded
+        """
+        done: Set[str] = set()
+        batch: Dict[str, List] = {"doc_id": [], "chunk_index": [], "content": []}
+        cached_docs = self.docs.find(
+            {"_id": {"$in": sorted(doc_ids)}, "text_path": {"$exists": True}}, {"_id": 1, "text_path": 1})
+        for doc in cached_docs:
+            try:
+                chunks = read_doc_chunks(doc["text_path"])
+            except (OSError, ValueError) as excep:
+                logger.warning("%s: doc %s is re-embedded from the active version instead", excep, doc["_id"])
+                continue
+            batch["doc_id"].extend([doc["_id"]] * len(chunks))
+            batch["chunk_index"].extend(range(len(chunks)))
+            batch["content"].extend(chunks)
+            if len(batch["doc_id"]) >= self.batch_size:
+                done |= self._index_and_record(target, milvus_client, user_id, batch)
+                batch = {"doc_id": [], "chunk_index": [], "content": []}
+        if batch["doc_id"]:
+            done |= self._index_and_record(target, milvus_client, user_id, batch)
+        return done
+
+    def _reindex_user(self, source: ModelVersion, target: ModelVersion, user_id: str) -> int:
+        """
+        Re-embeds the docs of the user not in the target version yet. Docs with an extracted text cache are
+        re-chunked from it & the others are streamed from the active version. Returns num of docs re-embedded
+        """
+        user_doc_ids = {doc["_id"] for doc in self.docs.find({"user_id": user_id}, {"_id": 1})}
+        pending = user_doc_ids - self._done_doc_ids(user_id)
+        if not pending:
+            return 0
+        target_client = target.placement.place_user(user_id)
+        self.load_partition(target_client, target.placement.get_partition_name(user_id))
+        cached = self._reindex_cached_docs(target, target_client, user_id, pending)
+        pending -= cached
+        num_docs = len(cached)
+        source_client = source.placement.get_collection(user_id) if pending else None
+        if source_client is not None:
+            source_partition = source.placement.get_partition_name(user_id)
+            self.load_partition(source_client, source_partition)
+            doc_expr = None if pending == user_doc_ids else get_doc_expr(sorted(pending))
+            batches = iter_snapshot_batches_milvus(
+                source_client, source_partition, source.placement.get_user_expr(user_id, doc_expr),
+                self.batch_size, self.chunk_text_store, with_embeddings=False)
+            for batch in batches:
+                keep = [row for row, doc_id in enumerate(batch["doc_id"]) if doc_id in pending]
+                if not keep:
+                    continue
+                batch = {name: [column[row] for row in keep] for name, column in batch.items()}
+                doc_ids = self._index_and_record(target, target_client, user_id, batch)
+                pending -= doc_ids
+                num_docs += len(doc_ids)
+        # docs without any chunk, i.e. empty files
+        self._record_docs(user_id, {doc_id: 0 for doc_id in pending})
+        return num_docs + len(pending)
+
+    def _remove_deleted(self, target: ModelVersion) -> None:
+        """Removes the docs & users deleted from the active version since they were re-embedded"""
+        user_ids = {user["_id"] for user in self.users.find({}, {"_id": 1})}
+        entries = list(self.progress.find({"version": self.version}, {"doc_id": 1, "user_id": 1}))
+        existing = {doc["_id"] for doc in self.docs.find(
+            {"_id": {"$in": [entry["doc_id"] for entry in entries]}}, {"_id": 1})}
+        deleted: Dict[str, List[str]] = {}
+        for entry in entries:
+            if entry["doc_id"] not in existing:
+                deleted.setdefault(entry["user_id"], []).append(entry["doc_id"])
+        for user_id, doc_ids in deleted.items():
+            milvus_client = target.placement.get_collection(user_id)
+            if milvus_client is not None:
+                partition_name = target.placement.get_partition_name(user_id)
+                self.load_partition(milvus_client, partition_name)
+                delete_by_expr_milvus(
+                    milvus_client, target.placement.get_user_expr(user_id, get_doc_expr(doc_ids)), partition_name)
+            target.lexical_index.delete_docs(user_id, doc_ids)
+            target.doc_centroids.delete_docs(user_id, doc_ids)
+            if user_id not in user_ids:
+                target.placement.remove_user(user_id)
+                target.lexical_index.drop_user(user_id)
+                target.doc_centroids.drop_user(user_id)
+            self.progress.delete_many({"version": self.version, "doc_id": {"$in": doc_ids}})
+            self.stats["deleted_docs"] += len(doc_ids)
+
+    def run_pass(self, source: ModelVersion, target: ModelVersion) -> int:
+        """Re-embeds the docs left of all users & removes the deleted ones. Returns num of docs re-embedded"""
+        num_docs = 0
+        for user in self.users.find({}, {"_id": 1}).sort("_id", 1):
+            num_docs += self._reindex_user(source, target, user["_id"])
+        self._remove_deleted(target)
+        self.stats["passes"] += 1
+        logger.info("Model version %s pass %s: %s docs re-embedded", self.version, self.stats["passes"], num_docs)
+        return num_docs
+
+    def run(self) -> Dict:
+        """
+        Re-embeds all docs until none is left, activates the version & catches up with the last upserts.
+        Returns the job stats
+        """
+        target = self.registry.get(self.version)
+        source = self.registry.active()
+        if source.version == target.version:
+            raise ValueError(f"Model version {self.version} is already active")
+        t_0 = time.perf_counter()
+        try:
+            while self.run_pass(source, target):
+                pass
+            self.registry.activate(self.version)
+            # workers still on the previous version until their next refresh may have upserted docs
+            time.sleep(self.switch_delay_s)
+            self.run_pass(source, target)
+        except Exception as excep:
+            self.registry.update_spec(self.version, error=str(excep), job_heartbeat=None)
+            raise
+        self.stats["duration_s"] = time.perf_counter() - t_0
+        self.registry.update_spec(self.version, error=None, job_heartbeat=None,
+                                  progress=dict(self.stats, updated_at=datetime.now(timezone.utc)))
+        logger.info("Model version %s built & activated: %s", self.version, self.stats)
+        return self.stats
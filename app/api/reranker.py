@@ -0,0 +1,127 @@
+"""
+Cross-encoder reranking stage
+
+ANN hits are ordered by embedding similarity only. The reranker sends the (query, chunk) pairs of over-fetched
+candidates in one batched request to the cross-encoder rerank endpoint of the docker_hf server & reorders them
+by the cross-encoder scores. A lower ef ANN search followed by a rerank keeps precision at a lower cost.
+Reranking is skipped & the ANN order kept when the predicted rerank latency would breach the latency budget
+"""
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+
+logger = logging.getLogger('reranker')
+
+
+class Reranker:
+    """
+    Reranks search hits with a cross-encoder scoring function within a latency budget
+    Arguments:
+        score_fn: Callable[[str, List[str]], List[float]] = scores (query, passage) pairs in one batched call
+        max_candidates: int = max num of hits sent for reranking
+        latency_budget_ms: float = max request latency, reranking is skipped if it would exceed it. <= 0 disables
+        ewma_alpha: float = smoothing factor of the per candidate rerank latency estimate
+        probe_interval: int = rerank anyway after this many consecutive budget skips to refresh the estimate
+    """
+    def __init__(
+            self,
+            score_fn: Callable[[str, List[str]], List[float]],
+            max_candidates: int = 50,
+            latency_budget_ms: float = 300,
+            ewma_alpha: float = 0.2,
+            probe_interval: int = 20) -> None:
+        self.score_fn = score_fn
+        self.max_candidates = max_candidates
+        self.latency_budget_ms = latency_budget_ms
+        self.ewma_alpha = ewma_alpha
+        self.probe_interval = probe_interval
+
+        self._lock = threading.Lock()
+        self._ms_per_candidate = None
+        self._consecutive_skips = 0
+        self._stats = {"reranked": 0, "budget_skips": 0, "failures": 0}
+
+    def predict_latency_ms(self, num_candidates: int) -> float:
+        """Predicted rerank latency of num_candidates hits, 0 until the first rerank is measured"""
+        with self._lock:
+            return (self._ms_per_candidate or 0.0) * num_candidates
+
+    def _record_latency(self, latency_ms: float, num_candidates: int) -> None:
+        with self._lock:
+            sample = latency_ms / max(num_candidates, 1)
+            self._ms_per_candidate = sample if self._ms_per_candidate is None else (
+                self.ewma_alpha * sample + (1 - self.ewma_alpha) * self._ms_per_candidate)
+
+    def rerank(
+            self,
+            query: str,
+            hits: List[Dict],
+            top_k: int,
+            elapsed_ms: float = 0.0) -> Tuple[List[Dict], Dict]:
+        """
+        Reorders the first max_candidates hits by cross-encoder score & returns the top_k hits with a
+        rerank info dict. elapsed_ms is the request time already spent, counted against the latency budget.
+        Hits are returned in their original order if the budget would be breached or the rerank call fails
+        """
+        candidates = [hit for hit in hits[:self.max_candidates] if hit.get("content")]
+        predicted_ms = self.predict_latency_ms(len(candidates))
+        info = {"reranked": False, "candidates": len(candidates), "predicted_ms": predicted_ms}
+        if not candidates:
+            return hits[:top_k], info
+        if self.latency_budget_ms > 0 and elapsed_ms + predicted_ms > self.latency_budget_ms:
+            with self._lock:
+                self._consecutive_skips += 1
+                probe = self._consecutive_skips >= self.probe_interval
+            if not probe:
+                with self._lock:
+                    self._stats["budget_skips"] += 1
+                info["reason"] = "latency budget"
+                return hits[:top_k], info
+        with self._lock:
+            self._consecutive_skips = 0
+
+        t_0 = time.perf_counter()
+        try:
+            scores = self.score_fn(query, [hit["content"] for hit in candidates])
+        except Exception as excep:
+            logger.warning("%s: rerank failed, keeping the ann order", excep)
+            with self._lock:
+                self._stats["failures"] += 1
+            info["reason"] = "rerank failed"
+            return hits[:top_k], info
+        latency_ms = (time.perf_counter() - t_0) * 1000
+        self._record_latency(latency_ms, len(candidates))
+
+        reranked = [dict(hit, rerank_score=float(score)) for hit, score in zip(candidates, scores)]
+        reranked.sort(key=lambda hit: hit["rerank_score"], reverse=True)
+        with self._lock:
+            self._stats["reranked"] += 1
+        info.update({"reranked": True, "latency_ms": latency_ms})
+        return reranked[:top_k], info
+
+    def rerank_search_results(
+            self,
+            query: str,
+            search_results: Dict,
+            top_k: int,
+            elapsed_ms: float = 0.0) -> Dict:
+        """
+        Reranks the content hits of a search response dict to top_k hits & adds the rerank info
+        """
+        if not search_results.get("content"):
+            return search_results
+        hits, info = self.rerank(query, search_results["content"], top_k, elapsed_ms)
+        search_results["content"] = hits
+        search_results["detail"] = f"{len(hits)} similar entitie(s) found in vector db"
+        search_results["rerank"] = info
+        return search_results
+
+    def metrics(self) -> Dict:
+        """Rerank counts & the current per candidate latency estimate"""
+        with self._lock:
+            return dict(self._stats,
+                        ms_per_candidate=self._ms_per_candidate or 0.0,
+                        max_candidates=self.max_candidates,
+                        latency_budget_ms=self.latency_budget_ms)
@@ -0,0 +1,221 @@
+"""
+Compact columnar snapshots of a user's vector entities
+
+A snapshot holds everything needed to restore a tenant without re-embedding: the float32 embeddings, doc_id,
+chunk index & chunk text of every entity plus the mongodb doc records & user profile in the header.
+Layout, all integers are little-endian uint32:
+    magic               b"CBSNAP01"
+    header length       followed by the utf-8 json header with the column names & types
+    blocks              num of rows, then for each column its payload length & payload
+    end marker          a block with 0 rows
+Column payloads:
+    float32_vector      raw float32 rows of shape (num_rows, vector_dim)
+    string              zlib compressed uint32 utf-8 byte lengths followed by the concatenated strings
+    int64               zlib compressed int64 values
+Blocks are written & read one at a time so neither side holds more than one batch in memory.
+Rows of a doc are never split across blocks
+"""
+import json
+import uuid
+import zlib
+import struct
+from datetime import datetime, timezone
+from typing import BinaryIO, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+from api.chunk_text_store import ChunkTextStore, CHUNK_TEXT_REF_FIELDS
+from api.milvus import stores_chunk_text, decode_vector_field
+
+
+SNAPSHOT_MAGIC = b"CBSNAP01"
+SNAPSHOT_VERSION = 1
+# (name, type) of the snapshot columns in block order
+SNAPSHOT_COLUMNS = (
+    ("embedding", "float32_vector"),
+    ("doc_id", "string"),
+    ("chunk_index", "int64"),
+    ("content", "string"),
+)
+_UINT32 = struct.Struct("<I")
+
+
+def make_snapshot_header(
+        user_id: str,
+        vector_dim: int,
+        docs: List[Dict],
+        user: Optional[Dict] = None,
+        metric_type: str = "IP",
+        model_name: Optional[str] = None) -> Dict:
+    """
+    Returns the snapshot header, docs are the mongodb doc records & user the user profile.
+    model_name is the embedding model of the vectors, snapshots are only restored into versions of the same model
+    """
+    return {"version": SNAPSHOT_VERSION,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "user_id": user_id,
+            "user": user or {},
+            "vector_dim": vector_dim,
+            "metric_type": metric_type,
+            "model_name": model_name,
+            "columns": [{"name": name, "type": col_type} for name, col_type in SNAPSHOT_COLUMNS],
+            "docs": docs}
+
+
+def encode_snapshot_header(header: Dict) -> bytes:
+    """Magic & length prefixed json header"""
+    data = json.dumps(header, default=str).encode("utf-8")
+    return SNAPSHOT_MAGIC + _UINT32.pack(len(data)) + data
+
+
+def encode_snapshot_block(columns: Dict[str, Sequence], vector_dim: int, compression_level: int = 6) -> bytes:
+    """
+    Encodes the columns of one batch of rows, an empty batch encodes the end marker
+    """
+    num_rows = len(columns["doc_id"]) if columns else 0
+    parts = [_UINT32.pack(num_rows)]
+    if not num_rows:
+        return parts[0]
+    for name, col_type in SNAPSHOT_COLUMNS:
+        if col_type == "float32_vector":
+            payload = np.asarray(columns[name], dtype="<f4").reshape(num_rows, vector_dim).tobytes()
+        elif col_type == "int64":
+            payload = zlib.compress(np.asarray(columns[name], dtype="<i8").tobytes(), compression_level)
+        else:
+            encoded = [value.encode("utf-8") for value in columns[name]]
+            lengths = np.asarray([len(value) for value in encoded], dtype="<u4")
+            payload = zlib.compress(lengths.tobytes() + b"".join(encoded), compression_level)
+        parts.append(_UINT32.pack(len(payload)))
+        parts.append(payload)
+    return b"".join(parts)
+
+
+def get_restored_doc_id(doc_id: str, snapshot_user_id: Optional[str], user_id: str) -> str:
+    """
+    Id of a snapshot doc restored into user_id. Doc ids are global, so docs of another user get a new id derived
+    from user_id & their snapshot id, a re-run import maps them to the same ids
+    """
+    if snapshot_user_id == user_id:
+        return doc_id
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"snapshot/{user_id}/{doc_id}"))
+
+
+def group_doc_rows(batch: Dict) -> Dict[str, List[int]]:
+    """Rows of each doc in a snapshot batch ordered by chunk index"""
+    doc_rows: Dict[str, List[int]] = {}
+    for row, doc_id in enumerate(batch["doc_id"]):
+        doc_rows.setdefault(doc_id, []).append(row)
+    return {doc_id: sorted(rows, key=lambda row: batch["chunk_index"][row]) for doc_id, rows in doc_rows.items()}
+
+
+def _read_exact(fptr: BinaryIO, size: int) -> bytes:
+    data = fptr.read(size)
+    if len(data) != size:
+        raise ValueError("Truncated snapshot file")
+    return data
+
+
+class SnapshotReader:
+    """
+    Reads a snapshot header on init & its blocks one at a time with iter_batches
+    Arguments:
+        fptr: BinaryIO = binary file object positioned at the start of the snapshot
+    """
+    def __init__(self, fptr: BinaryIO) -> None:
+        self.fptr = fptr
+        if fptr.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            raise ValueError("Not a snapshot file")
+        header_len = _UINT32.unpack(_read_exact(fptr, 4))[0]
+        self.header = json.loads(_read_exact(fptr, header_len))
+        if self.header.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot version {self.header.get('version')}")
+        self.vector_dim = int(self.header["vector_dim"])
+        self.columns = [(column["name"], column["type"]) for column in self.header["columns"]]
+
+    def read_batch(self) -> Optional[Dict]:
+        """Returns the columns of the next block, None at the end marker"""
+        num_rows = _UINT32.unpack(_read_exact(self.fptr, 4))[0]
+        if not num_rows:
+            return None
+        batch = {}
+        for name, col_type in self.columns:
+            payload = _read_exact(self.fptr, _UINT32.unpack(_read_exact(self.fptr, 4))[0])
+            if col_type == "float32_vector":
+                batch[name] = np.frombuffer(payload, dtype="<f4").reshape(num_rows, self.vector_dim)
+            elif col_type == "int64":
+                batch[name] = np.frombuffer(zlib.decompress(payload), dtype="<i8")
+            else:
+                data = zlib.decompress(payload)
+                lengths = np.frombuffer(data[:4 * num_rows], dtype="<u4")
+                ends = np.cumsum(lengths, dtype=np.int64) + 4 * num_rows
+                starts = ends - lengths
+                batch[name] = [data[start:end].decode("utf-8") for start, end in zip(starts, ends)]
+        return batch
+
+    def iter_batches(self) -> Iterator[Dict]:
+        """Yields the columns of each block"""
+        while True:
+            batch = self.read_batch()
+            if batch is None:
+                return
+            yield batch
+
+
+def iter_snapshot_batches_milvus(
+        milvus_client,
+        partition_name: Optional[str],
+        expr: str,
+        batch_size: int = 2000,
+        text_store: Optional[ChunkTextStore] = None,
+        with_embeddings: bool = True) -> Iterator[Dict]:
+    """
+    Yields the snapshot columns of the entities matching expr in batches of about batch_size rows.
+    Entities are read with a query iterator in primary key order, so the chunks of a doc inserted in one call
+    are contiguous. Batches are only cut at doc boundaries & chunk_index is the rank of the chunk in its doc.
+    The embedding column is left out if not with_embeddings, i.e. to re-embed the chunk text. The id column holds
+    the milvus primary keys & is not part of the snapshot format
+    """
+    in_milvus = stores_chunk_text(milvus_client)
+    output_fields = (["embedding"] if with_embeddings else []) + ["doc_id"]
+    output_fields += ["content"] if in_milvus else list(CHUNK_TEXT_REF_FIELDS)
+    iterator = milvus_client.query_iterator(
+        batch_size=batch_size, expr=expr or "", output_fields=output_fields,
+        partition_names=[partition_name] if partition_name else None)
+    pending: List[Dict] = []
+    chunk_counts: Dict[str, int] = {}
+
+    def to_columns(rows: List[Dict]) -> Dict:
+        if not in_milvus:
+            text_store.fill_hits_content(rows, ())
+        indexes = []
+        for row in rows:
+            indexes.append(chunk_counts.get(row["doc_id"], 0))
+            chunk_counts[row["doc_id"]] = indexes[-1] + 1
+        columns = {"id": [row["id"] for row in rows],
+                   "doc_id": [row["doc_id"] for row in rows],
+                   "chunk_index": indexes,
+                   "content": [row["content"] or "" for row in rows]}
+        if with_embeddings:
+            columns["embedding"] = np.asarray(
+                [decode_vector_field(row["embedding"]) for row in rows], dtype=np.float32)
+        return columns
+
+    try:
+        while True:
+            page = iterator.next()
+            if not page:
+                break
+            pending.extend(sorted(page, key=lambda row: row["id"]))
+            if len(pending) < batch_size:
+                continue
+            # keep the rows of the last doc for the next batch as more of its chunks may follow
+            cut = len(pending)
+            while cut > 0 and pending[cut - 1]["doc_id"] == pending[-1]["doc_id"]:
+                cut -= 1
+            if not cut:  # a single doc so far, docs are never split
+                continue
+            yield to_columns(pending[:cut])
+            pending = pending[cut:]
+    finally:
+        iterator.close()
+    if pending:
+        yield to_columns(pending)
@@ -0,0 +1,229 @@
+"""
+Tenant placement layer
+
+Milvus limits the number of partitions in a collection (4096 by default) & a single huge collection
+slows down partition operations. Users are placed on collection shards named with
+MILVUS_EMB_COLLECTION_NAME_FMT i.e. collection_00001, collection_00002, ... each holding at most
+max_partitions_per_collection user partitions. New shards are created on demand.
+The user -> shard mapping is stored in mongodb & cached in process for cache_ttl_s, users removed or placed again
+by another worker are dropped from the cache with forget_user
+
+In partition key mode, all users share one collection with user_id as the milvus partition key.
+Users have no dedicated partition (partition name None) & their entities are selected with a user_id filter
+"""
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+
+from pymilvus import Collection, utility
+from pymongo import MongoClient
+from pymongo.client_session import ClientSession
+from api.milvus import create_partition_if_not_exist_milvus
+
+
+logger = logging.getLogger('tenant_placement')
+
+
+def get_user_partition_name(user_id: str) -> str:
+    """
+    Returns the name of the milvus partition holding the user's entities
+    """
+    return f"partition_{user_id}"
+
+
+def get_user_id_expr(user_id: str) -> str:
+    """
+    Returns the filter expression selecting the user's entities, the user id is json escaped
+    """
+    return f"user_id == {json.dumps(user_id)}"
+
+
+class TenantPlacement:
+    """
+    Assigns users to collection shards & resolves the shard of a user
+    Arguments:
+        mongodb_client: MongoClient = mongodb client where the user -> shard mapping is stored
+        database: str = mongodb database of the mapping collection
+        collection: str = mongodb collection of the user -> shard mapping
+        get_collec_conn: Callable[[str], Collection] = gets or creates a milvus collection shard by name
+        collection_name_fmt: str = shard collection name format with the shard number
+        max_partitions_per_collection: int = max num of partitions (incl. the _default partition) per shard
+        cache_size: int = num of user -> shard mappings cached in process
+        cache_ttl_s: float = seconds a cached user -> shard mapping is used before it is read again
+        partition_key_collection: Collection = shared partition key collection, enables partition key mode
+        has_collection: Callable[[str], bool] = checks if a collection shard exists in the vector store backend
+    """
+    def __init__(
+            self,
+            mongodb_client: MongoClient,
+            database: str,
+            collection: str,
+            get_collec_conn: Callable[[str], Collection],
+            collection_name_fmt: str = "collection_%05d",
+            max_partitions_per_collection: int = 4000,
+            cache_size: int = 100000,
+            cache_ttl_s: float = 300.0,
+            partition_key_collection: Optional[Collection] = None,
+            has_collection: Callable[[str], bool] = utility.has_collection) -> None:
+        self.mongodb_client = mongodb_client
+        self.database = database
+        self.collection = collection
+        self.get_collec_conn = get_collec_conn
+        self.collection_name_fmt = collection_name_fmt
+        self.max_partitions_per_collection = max_partitions_per_collection
+        self.cache_size = cache_size
+        self.cache_ttl_s = cache_ttl_s
+        self.partition_key_collection = partition_key_collection
+        self.has_collection = has_collection
+
+        self._user_cache: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._collections = {}
+        self._lock = threading.RLock()
+        self._num_shards = 0 if self.partition_key_mode else self._count_existing_shards()
+        if self._num_shards == 0 and not self.partition_key_mode:  # always have the first shard available
+            self._open_shard(1)
+            self._num_shards = 1
+
+    @property
+    def partition_key_mode(self) -> bool:
+        """True if users share a partition key collection instead of having their own partition"""
+        return self.partition_key_collection is not None
+
+    def get_partition_name(self, user_id: str) -> Optional[str]:
+        """
+        Returns the user partition name or None in partition key mode
+        """
+        return None if self.partition_key_mode else get_user_partition_name(user_id)
+
+    def get_user_expr(self, user_id: str, expr: str = None) -> Optional[str]:
+        """
+        Restricts a filter expression to the user's entities in partition key mode.
+        In partition mode, the user partition already restricts the entities & expr is returned as is
+        """
+        if not self.partition_key_mode:
+            return expr
+        user_expr = get_user_id_expr(user_id)
+        return user_expr if not expr else f"({user_expr}) and ({expr})"
+
+    def has_user_partition(self, milvus_client: Collection, user_id: str) -> bool:
+        """
+        Checks if the user partition exists in the collection, always True in partition key mode
+        """
+        return self.partition_key_mode or milvus_client.has_partition(get_user_partition_name(user_id))
+
+    @property
+    def _shard_mapping(self):
+        return self.mongodb_client[self.database][self.collection]
+
+    def _count_existing_shards(self) -> int:
+        num_shards = 0
+        while self.has_collection(self.collection_name_fmt % (num_shards + 1)):
+            num_shards += 1
+        return num_shards
+
+    def _open_shard(self, shard_idx: int) -> Collection:
+        collection_name = self.collection_name_fmt % shard_idx
+        return self._open_collection(collection_name)
+
+    def _open_collection(self, collection_name: str) -> Collection:
+        with self._lock:
+            if collection_name not in self._collections:
+                self._collections[collection_name] = self.get_collec_conn(collection_name)
+            return self._collections[collection_name]
+
+    def _cache_user(self, user_id: str, collection_name: str) -> None:
+        with self._lock:
+            self._user_cache[user_id] = (collection_name, time.monotonic() + self.cache_ttl_s)
+            self._user_cache.move_to_end(user_id)
+            while len(self._user_cache) > self.cache_size:
+                self._user_cache.popitem(last=False)
+
+    def get_collection(self, user_id: str) -> Optional[Collection]:
+        """
+        Returns the collection shard of the user or None if the user was never placed
+        Users registered before sharding without a mapping are resolved to the first shard
+        """
+        if self.partition_key_mode:
+            return self.partition_key_collection
+        with self._lock:
+            cached = self._user_cache.get(user_id)
+        collection_name = cached[0] if cached is not None and cached[1] >= time.monotonic() else None
+        if collection_name is None:
+            mapping = self._shard_mapping.find_one({"_id": user_id})
+            if mapping:
+                collection_name = mapping["collection"]
+            else:
+                legacy_collec = self._open_shard(1)
+                if not legacy_collec.has_partition(get_user_partition_name(user_id)):
+                    return None
+                collection_name = legacy_collec.name
+                self._shard_mapping.update_one(
+                    {"_id": user_id}, {"$set": {"collection": collection_name}}, upsert=True)
+                logger.info("Legacy user %s mapped to shard %s", user_id, collection_name)
+            self._cache_user(user_id, collection_name)
+        return self._open_collection(collection_name)
+
+    def place_user(self, user_id: str, session: ClientSession = None) -> Collection:
+        """
+        Places the user on the latest shard with free partition slots, creating a new shard if all are full,
+        creates the user partition & stores the mapping. Returns the user's collection shard
+        """
+        if self.partition_key_mode:
+            return self.partition_key_collection
+        existing = self.get_collection(user_id)
+        partition_name = get_user_partition_name(user_id)
+        with self._lock:
+            if existing is not None:
+                milvus_client = existing
+            else:
+                milvus_client = self._open_shard(self._num_shards)
+                # move to the next shard (created on demand) when the latest one is full
+                while len(milvus_client.partitions) >= self.max_partitions_per_collection:
+                    self._num_shards += 1
+                    milvus_client = self._open_shard(self._num_shards)
+                    logger.info("Latest shard full, placing users on shard %s", milvus_client.name)
+            create_partition_if_not_exist_milvus(milvus_client, partition_name)
+        self._shard_mapping.update_one(
+            {"_id": user_id}, {"$set": {"collection": milvus_client.name}}, upsert=True, session=session)
+        self._cache_user(user_id, milvus_client.name)
+        return milvus_client
+
+    def remove_user(self, user_id: str, session: ClientSession = None) -> None:
+        """
+        Removes the user -> shard mapping. The user partition must be dropped separately
+        """
+        self._shard_mapping.delete_one({"_id": user_id}, session=session)
+        with self._lock:
+            self._user_cache.pop(user_id, None)
+
+    def forget_user(self, user_id: Optional[str] = None) -> None:
+        """
+        Drops the cached shard of the user or of all users if user_id is None, i.e. when another worker removed
+        them, so it is read again from the mapping
+        """
+        with self._lock:
+            if user_id is None:
+                self._user_cache.clear()
+            else:
+                self._user_cache.pop(user_id, None)
+
+    def remove_all_users(self, session: ClientSession = None) -> None:
+        """
+        Removes all user -> shard mappings. The user partitions must be dropped separately
+        """
+        self._shard_mapping.delete_many({}, session=session)
+        with self._lock:
+            self._user_cache.clear()
+
+    def get_all_collections(self) -> List[Collection]:
+        """
+        Returns all collection shards, including the ones created by other workers
+        """
+        if self.partition_key_mode:
+            return [self.partition_key_collection]
+        with self._lock:
+            self._num_shards = max(self._num_shards, self._count_existing_shards())
+        return [self._open_shard(idx) for idx in range(1, self._num_shards + 1)]
@@ -0,0 +1,229 @@
+"""
+Resumable chunked uploads
+
+An upload session appends numbered parts to root_dir/<upload_id>.upload as they are streamed in, so a failed part
+is sent again instead of the whole file & no part is held in memory. Each session has a mongodb doc:
+    _id             upload id
+    user_id         uploading user & file_name of the uploaded file
+    size            declared file size or None if unknown
+    offset          num of bytes received, the file is truncated back to it when a part fails
+    parts           [part_number, size, md5] of each received part
+    expires_at      sessions not written to until then are removed by expire
+A session is written to by one request at a time, the upload file is locked with flock while a part is appended
+or the file is ingested, concurrent requests get None from open_part & open_file
+"""
+import os
+import uuid
+import fcntl
+import hashlib
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import BinaryIO, Dict, Optional
+
+from pymongo import MongoClient, ReturnDocument
+
+
+logger = logging.getLogger('upload_sessions')
+
+
+def _lock_file(path: str, mode: str = 'r+b') -> Optional[BinaryIO]:
+    """Opens & exclusively locks the file, returns None if it is missing or locked by another request"""
+    try:
+        fptr = open(path, mode)
+    except FileNotFoundError:
+        return None
+    try:
+        fcntl.flock(fptr.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        fptr.close()
+        return None
+    return fptr
+
+
+def get_upload_status(upload: Dict) -> Dict:
+    """Client view of an upload session, offset is where the next part starts"""
+    return {"upload_id": upload["_id"], "file_name": upload["file_name"], "size": upload["size"],
+            "offset": upload["offset"], "next_part": len(upload["parts"]) + 1, "expires_at": upload["expires_at"]}
+
+
+class UploadPart:
+    """
+    A part being appended to an upload file, the file stays locked until the part is closed & is truncated back
+    to the session offset unless the part was committed
+    """
+    def __init__(self, upload_store: "UploadSessionStore", upload: Dict, part_number: int, fptr: BinaryIO) -> None:
+        self.upload_store = upload_store
+        self.upload = upload
+        self.part_number = part_number
+        self.size = 0
+        self.committed = False
+        self._fptr = fptr
+        self._md5 = hashlib.md5()
+        self._max_size = upload_store.max_part_size
+        if upload["size"] is not None:
+            self._max_size = min(self._max_size, upload["size"] - upload["offset"])
+        fptr.seek(upload["offset"])
+        # bytes of a part that failed in a crashed process
+        fptr.truncate()
+
+    def write(self, data: bytes) -> None:
+        """Appends data to the upload file. A ValueError is raised if the part gets too large"""
+        self.size += len(data)
+        if self.size > self._max_size:
+            raise ValueError(f"part {self.part_number} exceeds {self._max_size} bytes, the max part size or "
+                             f"the bytes left of the declared file size")
+        self._md5.update(data)
+        self._fptr.write(data)
+
+    def commit(self, md5: str) -> Dict:
+        """
+        Records the part in the session if its md5 hex digest matches. A ValueError is raised otherwise.
+        Returns the updated session
+        """
+        if self.size == 0:
+            raise ValueError(f"part {self.part_number} is empty")
+        if self._md5.hexdigest() != md5.lower():
+            raise ValueError(f"md5 {self._md5.hexdigest()} of part {self.part_number} does not match {md5}")
+        self._fptr.flush()
+        os.fsync(self._fptr.fileno())
+        upload = self.upload_store._uploads.find_one_and_update(
+            {"_id": self.upload["_id"], "offset": self.upload["offset"]},
+            {"$push": {"parts": [self.part_number, self.size, md5.lower()]}, "$inc": {"offset": self.size},
+             "$set": {"expires_at": self.upload_store._expires_at()}},
+            return_document=ReturnDocument.AFTER)
+        if upload is None:
+            raise ValueError(f"upload {self.upload['_id']} was removed while part {self.part_number} was written")
+        self.committed = True
+        return upload
+
+    def close(self) -> None:
+        """Drops the part bytes unless it was committed & unlocks the upload file"""
+        try:
+            if not self.committed:
+                self._fptr.truncate(self.upload["offset"])
+        finally:
+            self._fptr.close()
+
+    def __enter__(self) -> "UploadPart":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class UploadSessionStore:
+    """
+    Upload sessions of resumable chunked uploads
+    Arguments:
+        root_dir: str = dir holding the files being uploaded
+        mongodb_client: MongoClient = mongodb client of the upload sessions collection
+        database: str = mongodb database of the upload sessions collection
+        collection: str = mongodb collection of the upload sessions
+        max_part_size: int = max num of bytes of a part
+        max_file_size: int = max num of bytes of an uploaded file
+        ttl_s: int = seconds after the last written part a session expires
+    """
+    def __init__(
+            self,
+            root_dir: str,
+            mongodb_client: MongoClient,
+            database: str,
+            collection: str,
+            max_part_size: int = 64 << 20,
+            max_file_size: int = 1 << 30,
+            ttl_s: int = 86400) -> None:
+        self.root_dir = root_dir
+        self.mongodb_client = mongodb_client
+        self.database = database
+        self.collection = collection
+        self.max_part_size = max_part_size
+        self.max_file_size = max_file_size
+        self.ttl_s = ttl_s
+        os.makedirs(root_dir, exist_ok=True)
+
+    @property
+    def _uploads(self):
+        return self.mongodb_client[self.database][self.collection]
+
+    def _expires_at(self) -> datetime:
+        return datetime.now(timezone.utc) + timedelta(seconds=self.ttl_s)
+
+    def _upload_path(self, upload_id: str) -> str:
+        return os.path.join(self.root_dir, upload_id + ".upload")
+
+    def create(self, user_id: str, file_name: str, size: Optional[int] = None) -> Dict:
+        """
+        Creates an upload session of the file with the declared size in bytes if known. A ValueError is raised
+        if size exceeds max_file_size. Returns the session
+        """
+        if size is not None and not 0 < size <= self.max_file_size:
+            raise ValueError(f"file size must be between 1 and {self.max_file_size} bytes, got {size}")
+        upload_id = str(uuid.uuid4())
+        open(self._upload_path(upload_id), 'wb').close()
+        upload = {"_id": upload_id, "user_id": user_id, "file_name": file_name, "size": size, "offset": 0,
+                  "parts": [], "created_at": datetime.now(timezone.utc), "expires_at": self._expires_at()}
+        self._uploads.insert_one(upload)
+        return upload
+
+    def get(self, upload_id: str) -> Optional[Dict]:
+        """Returns the upload session or None if it does not exist"""
+        return self._uploads.find_one({"_id": upload_id})
+
+    def open_part(self, upload_id: str, part_number: int) -> Optional[UploadPart]:
+        """
+        Locks the upload file to append part_number, the part following the last received one. Returns None if
+        the session is removed, another request is writing to it or part_number is not the next part
+        """
+        fptr = _lock_file(self._upload_path(upload_id))
+        if fptr is None:
+            return None
+        # the session is read again under the lock as a concurrent request may have added a part meanwhile
+        upload = self.get(upload_id)
+        if upload is None or part_number != len(upload["parts"]) + 1:
+            fptr.close()
+            return None
+        if upload["offset"] >= (self.max_file_size if upload["size"] is None else upload["size"]):
+            fptr.close()
+            raise ValueError(f"upload {upload_id} already received {upload['offset']} bytes, complete it")
+        return UploadPart(self, upload, part_number, fptr)
+
+    def open_file(self, upload_id: str) -> Optional[BinaryIO]:
+        """
+        Locks the upload file & opens it for reading, i.e. to ingest the uploaded file. Returns None if the
+        session is removed or another request is writing to it
+        """
+        fptr = _lock_file(self._upload_path(upload_id), 'rb')
+        if fptr is not None and self.get(upload_id) is None:
+            fptr.close()
+            return None
+        return fptr
+
+    def remove(self, upload_id: str) -> None:
+        """Removes the upload session & its file, a request holding the file lock keeps its open file"""
+        self._uploads.delete_one({"_id": upload_id})
+        path = self._upload_path(upload_id)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def expire(self) -> int:
+        """Removes the sessions past their expiry that no request is writing to. Returns num of sessions removed"""
+        num_removed = 0
+        for upload in self._uploads.find({"expires_at": {"$lt": datetime.now(timezone.utc)}}, {"_id": 1}):
+            fptr = _lock_file(self._upload_path(upload["_id"]))
+            if fptr is None and os.path.exists(self._upload_path(upload["_id"])):
+                continue
+            try:
+                self.remove(upload["_id"])
+            finally:
+                if fptr is not None:
+                    fptr.close()
+            num_removed += 1
+        if num_removed:
+            logger.info("%d expired upload session(s) removed", num_removed)
+        return num_removed
+
+    def drop_all(self) -> None:
+        """Removes all upload sessions & their files"""
+        self._uploads.delete_many({})
+        for name in os.listdir(self.root_dir):
+            os.remove(os.path.join(self.root_dir, name))
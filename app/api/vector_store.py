@@ -0,0 +1,130 @@
+"""
+Pluggable vector store interface
+
+The routes & api.milvus wrappers only use a subset of the pymilvus Collection api. Any backend exposing
+the VectorCollection protocol below can replace milvus. Backends:
+    milvus: pymilvus collections on the milvus standalone/cluster service
+    local:  embedded memory-mapped store in api.local_store, no etcd/minio/milvus services needed
+"""
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Protocol, Tuple
+
+import numpy as np
+from pymilvus import utility
+
+
+class VectorPartition(Protocol):
+    """Partition handle as returned by VectorCollection.partitions & VectorCollection.partition"""
+    name: str
+
+    @property
+    def num_entities(self) -> int:
+        ...
+
+    def release(self) -> None:
+        ...
+
+
+class VectorCollection(Protocol):
+    """Collection operations used by the routes, a subset of the pymilvus Collection api"""
+    name: str
+
+    @property
+    def partitions(self) -> List[VectorPartition]:
+        ...
+
+    @property
+    def schema(self) -> Any:
+        ...
+
+    @property
+    def num_entities(self) -> int:
+        ...
+
+    def has_partition(self, partition_name: str) -> bool:
+        ...
+
+    def create_partition(self, partition_name: str) -> VectorPartition:
+        ...
+
+    def drop_partition(self, partition_name: str) -> None:
+        ...
+
+    def partition(self, partition_name: str) -> VectorPartition:
+        ...
+
+    @property
+    def indexes(self) -> List[Any]:
+        ...
+
+    def create_index(self, field_name: str, index_params: Dict, **kwargs) -> None:
+        ...
+
+    def drop_index(self, index_name: str = ..., **kwargs) -> None:
+        ...
+
+    def load(self, partition_names: Optional[List[str]] = None, replica_number: int = 1, **kwargs) -> None:
+        ...
+
+    def release(self, **kwargs) -> None:
+        ...
+
+    def insert(self, data: List[List], partition_name: Optional[str] = None, **kwargs) -> Any:
+        ...
+
+    def delete(self, expr: str, partition_name: Optional[str] = None, **kwargs) -> Any:
+        ...
+
+    def flush(self, **kwargs) -> None:
+        ...
+
+    def search(
+            self,
+            data: List[np.ndarray],
+            anns_field: str,
+            param: Dict,
+            limit: int,
+            expr: Optional[str] = None,
+            partition_names: Optional[List[str]] = None,
+            output_fields: Optional[List[str]] = None,
+            **kwargs) -> List[List[Any]]:
+        ...
+
+    def query(
+            self,
+            expr: str,
+            output_fields: Optional[List[str]] = None,
+            partition_names: Optional[List[str]] = None,
+            **kwargs) -> List[Dict]:
+        ...
+
+    def query_iterator(
+            self,
+            batch_size: int = 1000,
+            expr: Optional[str] = None,
+            output_fields: Optional[List[str]] = None,
+            partition_names: Optional[List[str]] = None,
+            **kwargs) -> Any:
+        ...
+
+
+def get_vector_store_backend(
+        backend: str,
+        root_dir: str = None,
+        ann_threshold: int = 20000) -> Tuple[Callable[..., VectorCollection], Callable[[str], bool]]:
+    """
+    Returns the (get_collec_conn, has_collection) functions of a vector store backend
+    get_collec_conn has the signature of api.milvus.get_milvus_collec_conn
+    Arguments:
+        backend: str = milvus or local
+        root_dir: str = storage dir of the local backend
+        ann_threshold: int = min num of partition entities for which the local backend builds an hnsw index
+    """
+    if backend == "milvus":
+        from api.milvus import get_milvus_collec_conn
+        return get_milvus_collec_conn, utility.has_collection
+    if backend == "local":
+        from api.local_store import get_local_collec_conn, has_local_collection
+        return (partial(get_local_collec_conn, root_dir=root_dir, ann_threshold=ann_threshold),
+                partial(has_local_collection, root_dir=root_dir))
+    raise ValueError(f"Unknown vector store backend {backend}, must be milvus or local")
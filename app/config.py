@@ -15,6 +15,9 @@ VERSION: str = "0.0.1"
 # save directories
 ROOT_STORAGE_DIR = os.getenv("ROOT_STORAGE_DIR", default="volumes/chatbot_backend")
 FILE_STORAGE_DIR = os.getenv("FILE_STORAGE_DIR", default=os.path.join(ROOT_STORAGE_DIR, "user_files"))
+# uploaded files are stored once per unique content, see api.blob_store
+BLOB_STORAGE_DIR = os.getenv("BLOB_STORAGE_DIR", default=os.path.join(ROOT_STORAGE_DIR, "blobs"))
+UPLOAD_STORAGE_DIR = os.getenv("UPLOAD_STORAGE_DIR", default=os.path.join(ROOT_STORAGE_DIR, "uploads"))
 LOG_STORAGE_DIR = os.getenv("LOG_STORAGE_DIR", default=os.path.join(ROOT_STORAGE_DIR, "logs"))
 
 os.makedirs(ROOT_STORAGE_DIR, exist_ok=True)
@@ -33,19 +36,124 @@ dictConfig(log_cfg.dict())
 REDIS_HOST = os.getenv("REDIS_HOST", default="127.0.0.1")
 REDIS_PORT = int(os.getenv("REDIS_PORT", default="6379"))
 
+# user & partition existence check cache conf, invalidations are published on redis for the other workers
+EXISTENCE_CACHE_TTL_S = float(os.getenv("EXISTENCE_CACHE_TTL_S", default="5"))
+EXISTENCE_CACHE_MAX_SIZE = int(os.getenv("EXISTENCE_CACHE_MAX_SIZE", default="100000"))
+EXISTENCE_CACHE_REDIS_INVALIDATION = os.getenv("EXISTENCE_CACHE_REDIS_INVALIDATION", default="True") == "True"
+EXISTENCE_CACHE_CHANNEL = os.getenv("EXISTENCE_CACHE_CHANNEL", default="chatbot_backend:existence_invalidation")
+
 # milvus conf
 MILVUS_HOST = os.getenv("MILVUS_HOST", default="127.0.0.1")
 MILVUS_PORT = int(os.getenv("MILVUS_PORT", default="19530"))
 ATTU_PORT = int(os.getenv("MILVUS_PORT", default="3000"))
 
+# vector store backend, "milvus" or "local" for the embedded memory-mapped store without the milvus services
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", default="milvus")
+LOCAL_VECTOR_STORE_DIR = os.getenv("LOCAL_VECTOR_STORE_DIR", default=os.path.join(ROOT_STORAGE_DIR, "vector_store"))
+# local store partitions with at least this many entities are searched with an hnswlib index if installed
+LOCAL_VECTOR_STORE_ANN_THRESHOLD = int(os.getenv("LOCAL_VECTOR_STORE_ANN_THRESHOLD", default="20000"))
+# chunk text storage of newly created collections, "milvus" keeps it in the collection content field,
+# "file" keeps it in per-doc text files under FILE_STORAGE_DIR & milvus only stores the chunk offsets
+CHUNK_TEXT_STORE = os.getenv("CHUNK_TEXT_STORE", default="milvus")
+# num of doc text files kept memory-mapped per worker
+CHUNK_TEXT_CACHE_SIZE = int(os.getenv("CHUNK_TEXT_CACHE_SIZE", default="1024"))
+
+# embedding model of the default model version, further versions with their own collections are built by
+# the background re-embed job, POST /admin/models/{version}/reindex
+EMB_MODEL_VERSION = os.getenv("EMB_MODEL_VERSION", default="v1")
+EMB_MODEL_NAME = os.getenv("EMB_MODEL_NAME", default="sentence-transformers/all-MiniLM-L6-v2")
+EMB_API_URL = os.getenv("EMB_API_URL", default="http://hf_text_embedding_api:8009")
+# workers re-read the active model version every MODEL_VERSION_REFRESH_S
+MODEL_VERSION_REFRESH_S = float(os.getenv("MODEL_VERSION_REFRESH_S", default="5"))
+# re-embed job entities read per batch & chunk texts per embedding api call
+REINDEX_BATCH_SIZE = int(os.getenv("REINDEX_BATCH_SIZE", default="2000"))
+REINDEX_EMBED_BATCH_SIZE = int(os.getenv("REINDEX_EMBED_BATCH_SIZE", default="256"))
+# a re-embed job that did not record progress for REINDEX_LEASE_S can be restarted by another worker
+REINDEX_LEASE_S = float(os.getenv("REINDEX_LEASE_S", default="600"))
+
 # milvus vector conf
-MILVUS_EMB_VECTOR_DIM = 384
+MILVUS_EMB_VECTOR_DIM = int(os.getenv("MILVUS_EMB_VECTOR_DIM", default="384"))
+# storage precision of the vectors of newly created collections, float32, float16 or int8 (local backend only)
+VECTOR_PRECISION = os.getenv("VECTOR_PRECISION", default="float32")
+# newly created collections also store the 1-bit sign quantized embeddings, search_mode=binary searches them with
+# the hamming distance & rescores top_k * BINARY_RESCORE_OVERSAMPLE candidates with their float embeddings
+BINARY_PREFILTER = os.getenv("BINARY_PREFILTER", default="False") == "True"
+BINARY_RESCORE_OVERSAMPLE = int(os.getenv("BINARY_RESCORE_OVERSAMPLE", default="8"))
+# rows per block & zlib level of the string columns of user snapshots, GET/POST /users/{user_id}/snapshot
+SNAPSHOT_BATCH_SIZE = int(os.getenv("SNAPSHOT_BATCH_SIZE", default="2000"))
+SNAPSHOT_COMPRESSION_LEVEL = int(os.getenv("SNAPSHOT_COMPRESSION_LEVEL", default="6"))
+# num of chunks of an upserted doc embedded per embedding api call
+UPSERT_EMBED_BATCH_SIZE = int(os.getenv("UPSERT_EMBED_BATCH_SIZE", default="64"))
+# zlib level of the extracted text & chunk manifest saved next to each uploaded doc
+EXTRACTED_TEXT_COMPRESSION_LEVEL = int(os.getenv("EXTRACTED_TEXT_COMPRESSION_LEVEL", default="6"))
+# zlib level of the stored files, files compressing by less than 5% like pdfs are stored as is
+BLOB_COMPRESSION_LEVEL = int(os.getenv("BLOB_COMPRESSION_LEVEL", default="6"))
+# resumable uploads, max bytes of a part & of a file, sessions expire UPLOAD_SESSION_TTL_S after their last part
+UPLOAD_MAX_PART_SIZE = int(os.getenv("UPLOAD_MAX_PART_SIZE", default=str(64 << 20)))
+UPLOAD_MAX_FILE_SIZE = int(os.getenv("UPLOAD_MAX_FILE_SIZE", default=str(1 << 30)))
+UPLOAD_SESSION_TTL_S = int(os.getenv("UPLOAD_SESSION_TTL_S", default="86400"))
 MILVUS_EMB_METRIC_TYPE = "IP"
 MILVUS_EMB_INDEX_TYPE = "HNSW"
-MILVUS_EMB_INDEX_PARAM_M = 8
-MILVUS_EMB_INDEX_PARAM_EF_CONS = 64
-MILVUS_EMB_SEARCH_PARAM_EF = 32
-MILVUS_EMB_COLLECTION_NAME_FMT = "collection_%05d"
+# hnsw params, tune with scripts/benchmark_hnsw.py
+MILVUS_EMB_INDEX_PARAM_M = int(os.getenv("MILVUS_EMB_INDEX_PARAM_M", default="8"))
+MILVUS_EMB_INDEX_PARAM_EF_CONS = int(os.getenv("MILVUS_EMB_INDEX_PARAM_EF_CONS", default="64"))
+MILVUS_EMB_SEARCH_PARAM_EF = int(os.getenv("MILVUS_EMB_SEARCH_PARAM_EF", default="32"))
+# num of embedding index rebuilds of POST /admin/indexes/{collection_name}/rebuild running at the same time
+MILVUS_INDEX_REBUILD_WORKERS = int(os.getenv("MILVUS_INDEX_REBUILD_WORKERS", default="1"))
+# ef=auto searches use the smallest benchmarked ef meeting the recall target
+MILVUS_EMB_SEARCH_RECALL_TARGET = float(os.getenv("MILVUS_EMB_SEARCH_RECALL_TARGET", default="0.95"))
+MILVUS_EMB_EF_CALIBRATION_PATH = os.getenv(
+    "MILVUS_EMB_EF_CALIBRATION_PATH", default=os.path.join(ROOT_STORAGE_DIR, "hnsw_ef_calibration.json"))
+# default lower similarity bound (upper distance bound for L2) of range searches
+MILVUS_EMB_SEARCH_RADIUS = float(os.getenv("MILVUS_EMB_SEARCH_RADIUS", default="0.3"))
+MILVUS_EMB_COLLECTION_NAME_FMT = os.getenv("MILVUS_EMB_COLLECTION_NAME_FMT", default="collection_%05d")
+# users are placed on a new collection shard once a shard holds this many partitions (milvus max is 4096)
+MILVUS_MAX_PARTITIONS_PER_COLLECTION = int(os.getenv("MILVUS_MAX_PARTITIONS_PER_COLLECTION", default="4000"))
+# seconds a worker uses its cached user -> shard mapping, users removed by another worker are also dropped from
+# the cache over the existence cache invalidation channel
+MILVUS_SHARD_CACHE_TTL_S = float(os.getenv("MILVUS_SHARD_CACHE_TTL_S", default="300"))
+# "partition": one partition per user on collection shards
+# "partition_key": all users in one collection with user_id as partition key & scalar indexes on user_id/doc_id
+MILVUS_TENANCY_MODE = os.getenv("MILVUS_TENANCY_MODE", default="partition")
+MILVUS_EMB_PK_COLLECTION_NAME = os.getenv("MILVUS_EMB_PK_COLLECTION_NAME", default="collection_pk")
+MILVUS_PARTITION_KEY_NUM_PARTITIONS = int(os.getenv("MILVUS_PARTITION_KEY_NUM_PARTITIONS", default="64"))
+
+# per-user bm25 lexical index conf for hybrid search
+LEXICAL_INDEX_DIR = os.getenv("LEXICAL_INDEX_DIR", default=os.path.join(ROOT_STORAGE_DIR, "lexical_index"))
+LEXICAL_INDEX_CACHE_SIZE = int(os.getenv("LEXICAL_INDEX_CACHE_SIZE", default="256"))
+LEXICAL_INDEX_MAX_SEGMENTS = int(os.getenv("LEXICAL_INDEX_MAX_SEGMENTS", default="8"))
+BM25_K1 = float(os.getenv("BM25_K1", default="1.2"))
+BM25_B = float(os.getenv("BM25_B", default="0.75"))
+# hybrid search reciprocal rank fusion weights & num of candidates fetched per retriever (top_k * multiplier)
+HYBRID_DENSE_WEIGHT = float(os.getenv("HYBRID_DENSE_WEIGHT", default="1.0"))
+HYBRID_LEXICAL_WEIGHT = float(os.getenv("HYBRID_LEXICAL_WEIGHT", default="1.0"))
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", default="60"))
+HYBRID_CANDIDATE_MULTIPLIER = int(os.getenv("HYBRID_CANDIDATE_MULTIPLIER", default="4"))
+
+# per-doc centroid vectors conf, two-stage search routes queries to the TWO_STAGE_NUM_DOCS most similar docs
+DOC_CENTROID_DIR = os.getenv("DOC_CENTROID_DIR", default=os.path.join(ROOT_STORAGE_DIR, "doc_centroids"))
+DOC_CENTROID_CACHE_SIZE = int(os.getenv("DOC_CENTROID_CACHE_SIZE", default="256"))
+TWO_STAGE_NUM_DOCS = int(os.getenv("TWO_STAGE_NUM_DOCS", default="20"))
+
+# cross-encoder rerank conf, rerank requests over-fetch top_k * multiplier hits capped to max candidates
+RERANK_OVERFETCH_MULTIPLIER = int(os.getenv("RERANK_OVERFETCH_MULTIPLIER", default="4"))
+RERANK_MAX_CANDIDATES = int(os.getenv("RERANK_MAX_CANDIDATES", default="50"))
+# reranking is skipped when the request would exceed this latency, <= 0 disables the budget
+RERANK_LATENCY_BUDGET_MS = float(os.getenv("RERANK_LATENCY_BUDGET_MS", default="300"))
+
+# maximal marginal relevance conf, lambda 1 is pure relevance & 0 pure diversity.
+# mmr requests over-fetch top_k * multiplier candidates with their embeddings
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", default="0.5"))
+MMR_OVERFETCH_MULTIPLIER = int(os.getenv("MMR_OVERFETCH_MULTIPLIER", default="4"))
+
+# milvus partition residency conf, budgets <= 0 are disabled
+MILVUS_MAX_LOADED_PARTITIONS = int(os.getenv("MILVUS_MAX_LOADED_PARTITIONS", default="512"))
+MILVUS_LOADED_PARTITIONS_MEM_BUDGET_MB = int(os.getenv("MILVUS_LOADED_PARTITIONS_MEM_BUDGET_MB", default="0"))
+MILVUS_PARTITION_PRELOAD_WORKERS = int(os.getenv("MILVUS_PARTITION_PRELOAD_WORKERS", default="1"))
+# the most recently active partitions that were evicted are preloaded every interval within the free budget, <= 0
+# disables the background preloads
+MILVUS_PARTITION_PRELOAD_INTERVAL_S = float(os.getenv("MILVUS_PARTITION_PRELOAD_INTERVAL_S", default="30"))
+MILVUS_PARTITION_PRELOAD_RECENT = int(os.getenv("MILVUS_PARTITION_PRELOAD_RECENT", default="16"))
 
 # mongodb conf
 MONGO_REPLICASET_NAME = "rs0"
@@ -56,7 +164,29 @@ MONGO_INITDB_ROOT_PASSWORD = os.getenv("MONGO_INITDB_ROOT_PASSWORD", default="ad
 MONGO_USER_DB = os.getenv("MONGO_USER_DB", default="user_db")
 MONGO_USER_COLLECTION = os.getenv("MONGO_USER_COLLECTION", default="users")
 MONGO_DOC_COLLECTION = os.getenv("MONGO_DOC_COLLECTION", default="docs")
+MONGO_SHARD_COLLECTION = os.getenv("MONGO_SHARD_COLLECTION", default="user_shards")
+MONGO_MODEL_COLLECTION = os.getenv("MONGO_MODEL_COLLECTION", default="emb_models")
+MONGO_REINDEX_COLLECTION = os.getenv("MONGO_REINDEX_COLLECTION", default="reindex_progress")
+MONGO_BLOB_COLLECTION = os.getenv("MONGO_BLOB_COLLECTION", default="blobs")
+MONGO_UPLOAD_COLLECTION = os.getenv("MONGO_UPLOAD_COLLECTION", default="uploads")
+
+# num of threads running the blocking mongo & milvus calls of the async routes per worker
+MONGO_THREAD_POOL_SIZE = int(os.getenv("MONGO_THREAD_POOL_SIZE", default="16"))
+MILVUS_THREAD_POOL_SIZE = int(os.getenv("MILVUS_THREAD_POOL_SIZE", default="8"))
+# docs with more vector entities are deleted after the response with one expression delete per MILVUS_DELETE_BATCH_DOCS
+MILVUS_DELETE_BACKGROUND_MIN_ENTITIES = int(os.getenv("MILVUS_DELETE_BACKGROUND_MIN_ENTITIES", default="50000"))
+MILVUS_DELETE_BATCH_DOCS = int(os.getenv("MILVUS_DELETE_BATCH_DOCS", default="100"))
+MILVUS_DELETE_WORKERS = int(os.getenv("MILVUS_DELETE_WORKERS", default="1"))
 
 # huggingface conf
 HF_API_TOKEN = os.getenv("HF_API_TOKEN", default="HUGGINGFACE_API_KEY")
 HF_API_URL = os.getenv("HF_API_URL", default="HUGGINGFACE_API_URL_ENDPOINT")
+
+# llm answer generation conf, any OpenAI compatible chat completions api e.g. app/api/llm_stub/server.py
+LLM_API_BASE_URL = os.getenv("LLM_API_BASE_URL", default="http://127.0.0.1:8010/v1")
+LLM_API_KEY = os.getenv("LLM_API_KEY", default="")
+LLM_MODEL_NAME = os.getenv("LLM_MODEL_NAME", default="stub-llm")
+LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", default="512"))
+LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", default="0.1"))
+# max num of context tokens packed into the qa prompt
+LLM_CONTEXT_TOKEN_BUDGET = int(os.getenv("LLM_CONTEXT_TOKEN_BUDGET", default="2048"))
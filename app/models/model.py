@@ -1,7 +1,9 @@
 """
 API data models
 """
-from pydantic import BaseModel
+from typing import List, Literal, Optional
+
+from pydantic import BaseModel, Field
 
 
 class InputModel(BaseModel):
@@ -9,3 +11,16 @@ class InputModel(BaseModel):
     API input model format
     """
     file_path: str
+
+
+class BatchSearchInput(BaseModel):
+    """
+    Batch search api input model format
+    """
+    queries: List[str] = Field(..., min_length=1, max_length=256)
+    top_k: int = 5
+    doc_id_list: Optional[List[str]] = None
+    search_mode: Literal["top_k", "range"] = "top_k"
+    radius: Optional[float] = None
+    range_filter: Optional[float] = None
+    ef: Optional[str] = Field(None, pattern=r"^(auto|[0-9]+)$")
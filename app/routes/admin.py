@@ -0,0 +1,280 @@
+"""
+Admin & monitoring api endpoints
+"""
+import asyncio
+import logging
+import threading
+import traceback
+from typing import Dict, Optional
+
+from fastapi import APIRouter, Body, Query, status, HTTPException
+
+from config import (
+    MONGO_USER_DB, MONGO_USER_COLLECTION, MONGO_DOC_COLLECTION, MONGO_REINDEX_COLLECTION,
+    REINDEX_BATCH_SIZE, REINDEX_EMBED_BATCH_SIZE, REINDEX_LEASE_S, MODEL_VERSION_REFRESH_S)
+from setup import (
+    mongodb_client, mongo_pool, milvus_pool, milvus_delete_pool, existence_cache, partition_manager, reranker,
+    model_versions, chunk_text_store, index_rebuilds, blob_store)
+from api.milvus import get_index_build_params, has_binary_prefilter
+from api.model_versions import ModelVersion
+from api.reindex import ReindexJob
+
+
+router = APIRouter()
+logger = logging.getLogger('admin_route')
+
+
+@router.get("/partitions/metrics", response_model=Dict,
+            status_code=status.HTTP_200_OK,
+            summary="Gets milvus partition load hit/miss, eviction & load latency metrics")
+async def get_partition_metrics():
+    """Gets milvus partition load hit/miss, eviction & load latency metrics"""
+    response_data = {}
+    try:
+        response_data["detail"] = "milvus partition residency metrics"
+        response_data["content"] = partition_manager.metrics()
+    except Exception as excep:
+        logger.error("%s: %s", excep, traceback.print_exc())
+        detail = response_data.get("detail", "failed to get partition metrics")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail) from excep
+    return response_data
+
+
+@router.get("/rerank/metrics", response_model=Dict,
+            status_code=status.HTTP_200_OK,
+            summary="Gets cross-encoder rerank counts, budget skips & the rerank latency estimate")
+async def get_rerank_metrics():
+    """Gets cross-encoder rerank counts, budget skips & the rerank latency estimate"""
+    response_data = {}
+    try:
+        response_data["detail"] = "cross-encoder rerank metrics"
+        response_data["content"] = reranker.metrics()
+    except Exception as excep:
+        logger.error("%s: %s", excep, traceback.print_exc())
+        detail = response_data.get("detail", "failed to get rerank metrics")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail) from excep
+    return response_data
+
+
+@router.get("/db_pools/metrics", response_model=Dict,
+            status_code=status.HTTP_200_OK,
+            summary="Gets the call counts & pending calls of the mongo & milvus thread pools")
+async def get_db_pool_metrics():
+    """Gets the call counts & pending calls of the mongo & milvus thread pools"""
+    response_data = {}
+    try:
+        response_data["detail"] = "mongo & milvus thread pool metrics"
+        response_data["content"] = {"mongo": mongo_pool.metrics(), "milvus": milvus_pool.metrics(),
+                                    "milvus_delete": milvus_delete_pool.metrics()}
+    except Exception as excep:
+        logger.error("%s: %s", excep, traceback.print_exc())
+        detail = response_data.get("detail", "failed to get db pool metrics")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail) from excep
+    return response_data
+
+
+@router.get("/existence_cache/metrics", response_model=Dict,
+            status_code=status.HTTP_200_OK,
+            summary="Gets the hit, miss & invalidation counts of the user & partition existence cache")
+async def get_existence_cache_metrics():
+    """Gets the hit, miss & invalidation counts of the user & partition existence cache"""
+    response_data = {}
+    try:
+        response_data["detail"] = "existence cache metrics"
+        response_data["content"] = existence_cache.metrics()
+    except Exception as excep:
+        logger.error("%s: %s", excep, traceback.print_exc())
+        detail = response_data.get("detail", "failed to get existence cache metrics")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail) from excep
+    return response_data
+
+
+@router.get("/blobs/metrics", response_model=Dict,
+            status_code=status.HTTP_200_OK,
+            summary="Gets the num of stored files & user doc refs with their uncompressed & stored sizes")
+async def get_blob_metrics():
+    """Gets the num of stored files & user doc refs with their uncompressed & stored sizes"""
+    response_data = {}
+    try:
+        response_data["detail"] = "content-addressed file storage metrics"
+        response_data["content"] = await mongo_pool.run(blob_store.metrics)
+    except Exception as excep:
+        logger.error("%s: %s", excep, traceback.print_exc())
+        detail = response_data.get("detail", "failed to get file storage metrics")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail) from excep
+    return response_data
+
+
+@router.post("/blobs/gc", response_model=Dict,
+             status_code=status.HTTP_200_OK,
+             summary="Removes the stored files no user doc references, i.e. left by an interrupted delete")
+async def collect_blob_garbage():
+    """Removes the stored files no user doc references, i.e. left by an interrupted delete"""
+    response_data = {}
+    try:
+        num_removed = await asyncio.to_thread(blob_store.collect_all)
+        response_data["detail"] = f"{num_removed} unreferenced stored file(s) removed"
+        response_data["content"] = num_removed
+    except Exception as excep:
+        logger.error("%s: %s", excep, traceback.print_exc())
+        detail = response_data.get("detail", "failed to garbage collect stored files")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail) from excep
+    return response_data
+
+
+@router.get("/models", response_model=Dict,
+            status_code=status.HTTP_200_OK,
+            summary="Gets the embedding model versions, their state & re-embed progress")
+async def get_model_versions():
+    """Gets the embedding model versions, their state & re-embed progress"""
+    response_data = {}
+    try:
+        response_data["detail"] = "embedding model versions"
+        response_data["content"] = {"active": model_versions.active().version,
+                                    "versions": await mongo_pool.run(model_versions.list_specs)}
+    except Exception as excep:
+        logger.error("%s: %s", excep, traceback.print_exc())
+        detail = response_data.get("detail", "failed to get model versions")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail) from excep
+    return response_data
+
+
+def run_reindex_job(version: str) -> None:
+    """Runs the re-embed job of version, errors are recorded in the version doc"""
+    job = ReindexJob(
+        model_versions, version, mongodb_client, MONGO_USER_DB, MONGO_USER_COLLECTION, MONGO_DOC_COLLECTION,
+        MONGO_REINDEX_COLLECTION, chunk_text_store, partition_manager.ensure_loaded,
+        batch_size=REINDEX_BATCH_SIZE, embed_batch_size=REINDEX_EMBED_BATCH_SIZE,
+        # all workers must have picked up the switch before the last pass
+        switch_delay_s=2 * MODEL_VERSION_REFRESH_S)
+    try:
+        job.run()
+    except Exception as excep:
+        logger.error("%s: re-embed job of model version %s failed", excep, version)
+
+
+@router.post("/models/{version}/reindex", response_model=Dict,
+             status_code=status.HTTP_200_OK,
+             summary="Creates a model version & re-embeds all docs with its model in the background")
+async def reindex_model_version(
+        version: str,
+        model_name: str,
+        vector_dim: int = Query(..., gt=0),
+        emb_api_url: str = Query(..., min_length=1)):
+    """
+    Creates a model version & re-embeds all docs with its model in the background, searches keep using the
+    active version until the new one is built & activated.
+    Calling it again for a building version resumes a failed or interrupted job
+    """
+    response_data = {}
+    try:
+        spec = await mongo_pool.run(model_versions.get_spec, version)
+        if spec is not None and spec["state"] != "building":
+            response_data["detail"] = f"model version {version} is already {spec['state']}"
+            raise ValueError(response_data["detail"])
+        try:
+            spec = await mongo_pool.run(model_versions.create_version, version, model_name, vector_dim, emb_api_url)
+        except ValueError as excep:
+            response_data["detail"] = str(excep)
+            raise
+        if not await mongo_pool.run(model_versions.claim_build, version, REINDEX_LEASE_S):
+            response_data["detail"] = f"re-embed job of model version {version} is already running"
+            raise ValueError(response_data["detail"])
+
+        threading.Thread(target=run_reindex_job, args=(version,), name=f"reindex_{version}", daemon=True).start()
+        response_data["detail"] = f"re-embed job of model version {version} started"
+        response_data["content"] = spec
+    except Exception as excep:
+        logger.error("%s: %s", excep, traceback.print_exc())
+        detail = response_data.get("detail", "failed to start the re-embed job")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail) from excep
+    return response_data
+
+
+def get_model_collection(model: ModelVersion, collection_name: str):
+    """Returns the collection shard of the model version named collection_name or None"""
+    return next((milvus_client for milvus_client in model.placement.get_all_collections()
+                 if milvus_client.name == collection_name), None)
+
+
+@router.get("/indexes", response_model=Dict,
+            status_code=status.HTTP_200_OK,
+            summary="Gets the embedding index, build progress & estimated memory of all collections")
+async def get_collection_indexes():
+    """Gets the embedding index, build progress & estimated memory of all collections of the active model"""
+    response_data = {}
+    try:
+        model = model_versions.active()
+        collections = await milvus_pool.run(model.placement.get_all_collections)
+        response_data["detail"] = f"embedding indexes of {len(collections)} collection(s)"
+        response_data["content"] = [await milvus_pool.run(index_rebuilds.describe, milvus_client, model.vector_dim)
+                                    for milvus_client in collections]
+    except Exception as excep:
+        logger.error("%s: %s", excep, traceback.print_exc())
+        detail = response_data.get("detail", "failed to get collection indexes")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail) from excep
+    return response_data
+
+
+@router.get("/indexes/{collection_name}", response_model=Dict,
+            status_code=status.HTTP_200_OK,
+            summary="Gets the embedding index, build progress & estimated memory of a collection")
+async def get_collection_index(collection_name: str):
+    """Gets the embedding index, build progress, estimated memory & the last rebuild of a collection"""
+    status_code = status.HTTP_200_OK
+    response_data = {}
+    try:
+        model = model_versions.active()
+        milvus_client = await milvus_pool.run(get_model_collection, model, collection_name)
+        if milvus_client is None:
+            status_code = status.HTTP_404_NOT_FOUND
+            response_data["detail"] = f"collection {collection_name} does not exist"
+            raise HTTPException(status_code=status_code, detail=response_data["detail"])
+        response_data["detail"] = f"embedding index of collection {collection_name}"
+        response_data["content"] = await milvus_pool.run(index_rebuilds.describe, milvus_client, model.vector_dim)
+    except Exception as excep:
+        logger.error("%s: %s", excep, traceback.print_exc())
+        status_code = status.HTTP_400_BAD_REQUEST if status_code == status.HTTP_200_OK else status_code
+        detail = response_data.get("detail", "failed to get the collection index")
+        raise HTTPException(status_code=status_code, detail=detail) from excep
+    return response_data
+
+
+@router.post("/indexes/{collection_name}/rebuild", response_model=Dict,
+             status_code=status.HTTP_200_OK,
+             summary="Rebuilds the embedding index of a collection with another index type in the background")
+async def rebuild_collection_index(
+        collection_name: str,
+        index_type: str,
+        params: Optional[Dict[str, int]] = Body(None)):
+    """
+    Rebuilds the embedding index of a collection with index_type (HNSW, IVF_FLAT, IVF_PQ, DISKANN or FLAT)
+    in the background. Unset params use the index type defaults, i.e. IVF_PQ uses far less memory for large,
+    rarely searched collections. The collection can't be searched until the rebuild is done,
+    follow it with GET /admin/indexes/{collection_name}
+    """
+    status_code = status.HTTP_200_OK
+    response_data = {}
+    try:
+        model = model_versions.active()
+        milvus_client = await milvus_pool.run(get_model_collection, model, collection_name)
+        if milvus_client is None:
+            status_code = status.HTTP_404_NOT_FOUND
+            response_data["detail"] = f"collection {collection_name} does not exist"
+            raise HTTPException(status_code=status_code, detail=response_data["detail"])
+        try:
+            build_params = get_index_build_params(index_type, params, model.vector_dim)
+            if has_binary_prefilter(milvus_client):
+                raise ValueError(f"collection {collection_name} searches a binary prefilter, its index is fixed")
+            rebuild = index_rebuilds.start(milvus_client, index_type, build_params)
+        except ValueError as excep:
+            response_data["detail"] = str(excep)
+            raise
+        response_data["detail"] = f"index rebuild of collection {collection_name} with {index_type.upper()} started"
+        response_data["content"] = rebuild
+    except Exception as excep:
+        logger.error("%s: %s", excep, traceback.print_exc())
+        status_code = status.HTTP_400_BAD_REQUEST if status_code == status.HTTP_200_OK else status_code
+        detail = response_data.get("detail", "failed to start the index rebuild")
+        raise HTTPException(status_code=status_code, detail=detail) from excep
+    return response_data
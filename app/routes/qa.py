@@ -1,20 +1,61 @@
 """
 Question Answer api endpoint
 """
+import time
+import asyncio
 import logging
 import traceback
-from typing import Dict, List, Optional
+from typing import AsyncIterator, Dict, List, Literal, Optional
 
 from fastapi import APIRouter, Query, status, HTTPException
+from fastapi.responses import StreamingResponse
 
-from config import MILVUS_EMB_METRIC_TYPE, MILVUS_EMB_SEARCH_PARAM_EF, MONGO_USER_DB, MONGO_USER_COLLECTION
-from setup import milvus_client, mongodb_client, query_hf_emb
-from api.milvus import search_milvus, load_partition_milvus
-from api.mongo import user_exists_in_mongo
+from config import (
+    MILVUS_EMB_METRIC_TYPE, MILVUS_EMB_SEARCH_PARAM_EF, MILVUS_EMB_SEARCH_RADIUS,
+    RERANK_OVERFETCH_MULTIPLIER, RERANK_MAX_CANDIDATES, MMR_LAMBDA, MMR_OVERFETCH_MULTIPLIER, LLM_CONTEXT_TOKEN_BUDGET)
+from setup import (
+    milvus_pool, model_versions, partition_manager, chunk_text_store, reranker, llm_client,
+    user_exists, user_partition_exists)
+from api.milvus import search_milvus, get_search_params, get_doc_expr, is_valid_doc_id
+from api.llm import build_qa_messages, format_sse_event
+from utils.context_packing import pack_context
+from utils.ranking import mmr_diversify_hits
 
 
 router = APIRouter()
 logger = logging.getLogger('qa_route')
+NO_CONTEXT_ANSWER = "There is no relevant information in your documents to answer the question."
+
+
+async def _no_context_tokens() -> AsyncIterator[str]:
+    yield NO_CONTEXT_ANSWER
+
+
+async def stream_answer(query: str, context: List[Dict], t_start: float) -> AsyncIterator[str]:
+    """
+    Streams the answer as server-sent events: a context event with the packed chunks, one token event per
+    llm token forwarded as soon as it arrives & a done event with the time to first token & total time
+    """
+    yield format_sse_event("context", {
+        "chunks": [{"id": chunk["id"], "doc_id": chunk["doc_id"], "num_tokens": chunk["num_tokens"]}
+                   for chunk in context],
+        "num_tokens": sum(chunk["num_tokens"] for chunk in context)})
+    ttft_ms, num_tokens = None, 0
+    try:
+        # nothing to answer from, skip the llm call
+        tokens = (llm_client.stream_chat(build_qa_messages(query, [chunk["content"] for chunk in context]))
+                  if context else _no_context_tokens())
+        async for token in tokens:
+            if ttft_ms is None:
+                ttft_ms = (time.perf_counter() - t_start) * 1000
+            num_tokens += 1
+            yield format_sse_event("token", {"token": token})
+    except Exception as excep:
+        logger.error("%s: %s", excep, traceback.print_exc())
+        yield format_sse_event("error", {"detail": "failed to generate answer"})
+        return
+    yield format_sse_event("done", {"num_tokens": num_tokens, "ttft_ms": ttft_ms,
+                                    "total_ms": (time.perf_counter() - t_start) * 1000})
 
 
 @router.post("/{user_id}", response_model=Dict,
@@ -23,34 +64,85 @@ logger = logging.getLogger('qa_route')
 async def question_answer(
         user_id: str,
         query: str,
-        doc_id_list: Optional[List[str]] = Query(None)):
-    """Extract query emb, find most similar embs from vector db & answer query with chatbot"""
+        doc_id_list: Optional[List[str]] = Query(None),
+        search_mode: Literal["top_k", "range"] = "top_k",
+        radius: Optional[float] = None,
+        range_filter: Optional[float] = None,
+        rerank: bool = False,
+        mmr: bool = False,
+        mmr_lambda: Optional[float] = Query(None, ge=0, le=1),
+        answer: bool = False):
+    """
+    Extract query emb, find most similar embs from vector db & answer query with chatbot
+    rerank over-fetches hits & reorders them with a cross-encoder unless it would breach the latency budget
+    mmr over-fetches hits & selects diverse hits with maximal marginal relevance so that the context is less redundant
+    answer packs the hits into the llm context token budget & streams the generated answer as server-sent events,
+    otherwise the hits are returned
+    """
+    t_start = time.perf_counter()
     status_code = status.HTTP_200_OK
     response_data = {}
     try:
-        if not user_exists_in_mongo(mongodb_client, user_id, MONGO_USER_DB, MONGO_USER_COLLECTION):
+        if not await user_exists(user_id):
             status_code = status.HTTP_404_NOT_FOUND
             response_data["detail"] = f"user with id: {user_id} does not exist in db. Register user first"
             raise HTTPException(status_code=status_code, detail=response_data["detail"])
 
-        partition_name = f"partition_{user_id}"
-        if not milvus_client.has_partition(partition_name):
+        model = model_versions.active()
+        partition_name = model.placement.get_partition_name(user_id)
+        milvus_client = await milvus_pool.run(model.placement.get_collection, user_id)
+        if milvus_client is None or not await user_partition_exists(milvus_client, user_id):
             logger.error("%s: User partition missing in milvus db. Control should not reach here.", traceback.print_exc())
             response_data["detail"] = f"user with id: {user_id} does not exist in db. Register user first"
             raise ValueError(response_data["detail"])
-        # TODO very inefficient to load partition like this, consider using user sessions
-        load_partition_milvus(milvus_client, partition_name)
+        # top_k mode returns the 10 most similar hits, range mode only returns hits within radius & range_filter
+        if search_mode == "range":
+            radius = MILVUS_EMB_SEARCH_RADIUS if radius is None else radius
+        else:
+            radius, range_filter = None, None
+        top_k = 10
+        num_results = max(top_k, min(top_k * RERANK_OVERFETCH_MULTIPLIER, RERANK_MAX_CANDIDATES)) if rerank else top_k
+        num_results = max(num_results, top_k * MMR_OVERFETCH_MULTIPLIER) if mmr else num_results
+        try:
+            search_params = get_search_params(
+                MILVUS_EMB_METRIC_TYPE, max(MILVUS_EMB_SEARCH_PARAM_EF, num_results), radius, range_filter)
+        except ValueError as excep:
+            response_data["detail"] = str(excep)
+            raise
 
         # TODO current if query is longer than emb model input size, it is auto-truncated
-        query_vec = query_hf_emb(query)
+        query_vec = await asyncio.to_thread(model.embed, query)
         # optionally filter searches/hybrid search with conditions i.e. specific docs only
-        expr = None if doc_id_list is None else f"doc_id in {doc_id_list}".replace("'", '"')
+        if doc_id_list is not None and not all(is_valid_doc_id(doc_id) for doc_id in doc_id_list):
+            response_data["detail"] = "doc ids may only contain letters, digits, _ & -"
+            raise ValueError(response_data["detail"])
+        expr = None if doc_id_list is None else get_doc_expr(doc_id_list)
+        expr = model.placement.get_user_expr(user_id, expr)
 
-        search_results = search_milvus(
-            milvus_client, partition_name, [query_vec], limit=10, dist_thres=3,
-            search_params={"metric_type": MILVUS_EMB_METRIC_TYPE, "ef": MILVUS_EMB_SEARCH_PARAM_EF}, expr=expr)
+        # the partition is loaded if it is not already resident & pinned during the search, LRU partitions are
+        # evicted if required
+        search_results = await milvus_pool.run(
+            partition_manager.run_loaded, milvus_client, partition_name, search_milvus,
+            milvus_client, partition_name, [query_vec], limit=num_results, search_params=search_params, expr=expr,
+            output_fields=["content", "doc_id", "embedding"] if mmr else None, text_store=chunk_text_store)
+        if rerank:
+            # with mmr all candidates are kept & the cross-encoder scores become the mmr relevance
+            search_results = await asyncio.to_thread(
+                reranker.rerank_search_results, query, search_results, num_results if mmr else top_k,
+                elapsed_ms=(time.perf_counter() - t_start) * 1000)
+        if mmr and search_results.get("content"):
+            reranked = search_results.get("rerank", {}).get("reranked", False)
+            search_results["content"] = mmr_diversify_hits(
+                query_vec, search_results["content"], top_k,
+                lambda_mult=MMR_LAMBDA if mmr_lambda is None else mmr_lambda,
+                score_key="rerank_score" if reranked else None)
+            search_results["detail"] = f"{len(search_results['content'])} similar entitie(s) found in vector db"
 
-        # TODO search result contents along with the original query must be sent to a chatbot api
+        if answer:
+            context = pack_context(search_results.get("content", []), LLM_CONTEXT_TOKEN_BUDGET)
+            return StreamingResponse(
+                stream_answer(query, context, t_start), media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
         response_data = search_results
     except Exception as excep:
         logger.error("%s: %s", excep, traceback.print_exc())
@@ -1,20 +1,158 @@
 """
 Vector and doc DB search api endpoints
 """
+import time
+import asyncio
 import logging
 import traceback
-from typing import Dict, List, Optional
+from functools import partial
+from typing import Dict, List, Literal, Optional
 
 from fastapi import APIRouter, Query, status, HTTPException
 
-from config import MILVUS_EMB_METRIC_TYPE, MILVUS_EMB_SEARCH_PARAM_EF, MONGO_USER_DB, MONGO_USER_COLLECTION
-from setup import milvus_client, mongodb_client, query_hf_emb
-from api.milvus import search_milvus, load_partition_milvus
-from api.mongo import user_exists_in_mongo
+from config import (
+    MILVUS_EMB_METRIC_TYPE, MILVUS_EMB_SEARCH_PARAM_EF, MILVUS_EMB_SEARCH_RADIUS,
+    MILVUS_EMB_INDEX_PARAM_M, MILVUS_EMB_INDEX_PARAM_EF_CONS,
+    MILVUS_EMB_SEARCH_RECALL_TARGET, MILVUS_EMB_EF_CALIBRATION_PATH,
+    HYBRID_DENSE_WEIGHT, HYBRID_LEXICAL_WEIGHT, HYBRID_RRF_K, HYBRID_CANDIDATE_MULTIPLIER, TWO_STAGE_NUM_DOCS,
+    BINARY_RESCORE_OVERSAMPLE,
+    RERANK_OVERFETCH_MULTIPLIER, RERANK_MAX_CANDIDATES, MMR_LAMBDA, MMR_OVERFETCH_MULTIPLIER)
+from setup import (
+    milvus_pool, model_versions, partition_manager, chunk_text_store, reranker, user_exists, user_partition_exists)
+from api.milvus import (
+    search_milvus, batch_search_milvus, binary_rescore_search_milvus, fetch_chunk_text_milvus, get_search_params,
+    resolve_search_ef, has_binary_prefilter, get_doc_expr, is_valid_doc_id)
+from api.model_versions import ModelVersion
+from models.model import BatchSearchInput
+from utils.ranking import reciprocal_rank_fusion, mmr_diversify_hits
 
 
 router = APIRouter()
 logger = logging.getLogger('search_route')
+# per-request ef overrides, ef=auto uses the benchmark calibration of the current index params
+resolve_ef = partial(
+    resolve_search_ef,
+    default_ef=MILVUS_EMB_SEARCH_PARAM_EF,
+    calibration_path=MILVUS_EMB_EF_CALIBRATION_PATH,
+    recall_target=MILVUS_EMB_SEARCH_RECALL_TARGET,
+    index_params={"M": MILVUS_EMB_INDEX_PARAM_M, "efConstruction": MILVUS_EMB_INDEX_PARAM_EF_CONS})
+
+
+async def hybrid_search(
+        model: ModelVersion,
+        milvus_client,
+        partition_name: str,
+        user_id: str,
+        query: str,
+        top_k: int,
+        doc_id_list: Optional[List[str]],
+        search_params: dict,
+        expr: Optional[str],
+        dense_weight: float,
+        lexical_weight: float) -> Dict:
+    """
+    Runs the dense ann search & the bm25 lexical search concurrently & merges their hits with weighted
+    reciprocal rank fusion. Each retriever returns top_k * HYBRID_CANDIDATE_MULTIPLIER candidates.
+    The latency of each stage is returned in ms
+    """
+    num_candidates = top_k * HYBRID_CANDIDATE_MULTIPLIER
+    latency_ms = {}
+    t_start = time.perf_counter()
+
+    def timed(stage: str, func, *args, **kwargs):
+        t_0 = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            latency_ms[stage] = (time.perf_counter() - t_0) * 1000
+
+    async def dense_search() -> List[Dict]:
+        # TODO current if query is longer than emb model input size, it is auto-truncated
+        query_vec = await asyncio.to_thread(timed, "embedding", model.embed, query)
+        results = await milvus_pool.run(timed, "dense", partition_manager.run_loaded, milvus_client, partition_name,
+                                        search_milvus, milvus_client, partition_name, [query_vec],
+                                        limit=num_candidates, search_params=search_params, expr=expr,
+                                        text_store=chunk_text_store)
+        return results.get("content", [])
+
+    dense_hits, lexical_hits = await asyncio.gather(
+        dense_search(),
+        asyncio.to_thread(timed, "lexical", model.lexical_index.search, user_id, query, num_candidates, doc_id_list))
+
+    t_0 = time.perf_counter()
+    fused = reciprocal_rank_fusion(
+        [[hit["id"] for hit in dense_hits], [hit["id"] for hit in lexical_hits]],
+        weights=[dense_weight, lexical_weight], rrf_k=HYBRID_RRF_K)[:top_k]
+    dense_by_id = {hit["id"]: hit for hit in dense_hits}
+    lexical_by_id = {hit["id"]: hit for hit in lexical_hits}
+    hits = []
+    for entity_id, score in fused:
+        dense_hit, lexical_hit = dense_by_id.get(entity_id, {}), lexical_by_id.get(entity_id, {})
+        hits.append({"id": entity_id, "score": score,
+                     "doc_id": dense_hit.get("doc_id", lexical_hit.get("doc_id")),
+                     "content": dense_hit.get("content"),
+                     "distance": dense_hit.get("distance"),
+                     "bm25": lexical_hit.get("score")})
+    latency_ms["fusion"] = (time.perf_counter() - t_0) * 1000
+
+    # hits only found by the lexical search have no content yet, fetch it from the vector db by primary key
+    missing_ids = [hit["id"] for hit in hits if hit["content"] is None]
+    if missing_ids:
+        contents = await milvus_pool.run(
+            timed, "fetch", partition_manager.run_loaded, milvus_client, partition_name,
+            fetch_chunk_text_milvus, milvus_client, partition_name, missing_ids, chunk_text_store)
+        for hit in hits:
+            if hit["content"] is None:
+                hit["content"] = contents.get(hit["id"])
+    latency_ms["total"] = (time.perf_counter() - t_start) * 1000
+
+    if not hits:
+        return {"status": "success",
+                "detail": "no similar entities found in vector db",
+                "latency_ms": latency_ms}
+    return {"status": "success",
+            "detail": f"{len(hits)} similar entitie(s) found with hybrid search",
+            "content": hits,
+            "latency_ms": latency_ms}
+
+
+def two_stage_search(
+        model: ModelVersion,
+        milvus_client,
+        partition_name: str,
+        user_id: str,
+        query_vec,
+        top_k: int,
+        doc_id_list: Optional[List[str]],
+        search_params: dict,
+        expr: Optional[str],
+        num_docs: int,
+        output_fields: Optional[List[str]] = None) -> Dict:
+    """
+    Routes the query to the num_docs docs with the most similar centroids & searches the chunks of these docs only.
+    Falls back to a flat search of the partition if the user has no doc centroids.
+    The latency of the routing & search stages is returned in ms
+    """
+    t_0 = time.perf_counter()
+    routed = model.doc_centroids.top_docs(user_id, query_vec, num_docs, MILVUS_EMB_METRIC_TYPE, doc_id_list)
+    routing_ms = (time.perf_counter() - t_0) * 1000
+    if routed:
+        routed_ids = [doc_id for doc_id, _ in routed]
+        expr = model.placement.get_user_expr(user_id, get_doc_expr(routed_ids))
+    elif model.doc_centroids.num_docs(user_id):
+        # none of the docs in doc_id_list have a centroid
+        return {"status": "success",
+                "detail": "no similar entities found in vector db",
+                "routed_docs": 0,
+                "latency_ms": {"routing": routing_ms, "search": 0.0}}
+
+    t_0 = time.perf_counter()
+    search_results = search_milvus(
+        milvus_client, partition_name, [query_vec], limit=top_k, search_params=search_params, expr=expr,
+        output_fields=output_fields, text_store=chunk_text_store)
+    search_results["routed_docs"] = len(routed) if routed else None
+    search_results["latency_ms"] = {"routing": routing_ms, "search": (time.perf_counter() - t_0) * 1000}
+    return search_results
 
 
 @router.post("/{user_id}", response_model=Dict,
@@ -24,32 +162,118 @@ async def search(
     user_id: str,
     query: str,
     top_k: int = 5,
-    doc_id_list: Optional[List[str]] = Query(None)):
-    """Extract query emb & find most similar embs from vector db"""
+    doc_id_list: Optional[List[str]] = Query(None),
+    search_mode: Literal["top_k", "range", "hybrid", "two_stage", "binary"] = "top_k",
+    radius: Optional[float] = None,
+    range_filter: Optional[float] = None,
+    ef: Optional[str] = Query(None, pattern=r"^(auto|[0-9]+)$"),
+    dense_weight: Optional[float] = Query(None, ge=0),
+    lexical_weight: Optional[float] = Query(None, ge=0),
+    num_docs: Optional[int] = Query(None, ge=1),
+    oversample: Optional[int] = Query(None, ge=1),
+    rerank: bool = False,
+    mmr: bool = False,
+    mmr_lambda: Optional[float] = Query(None, ge=0, le=1)):
+    """
+    Extract query emb & find most similar embs from vector db
+    search_mode top_k returns the top_k most similar hits.
+    search_mode range returns at most top_k hits within radius & range_filter filtered server-side by milvus
+    search_mode hybrid fuses the dense & bm25 lexical hits with weighted reciprocal rank fusion,
+    dense_weight & lexical_weight override the configured fusion weights
+    search_mode two_stage first picks the num_docs docs with the most similar centroid embs & then
+    returns the top_k most similar hits of these docs only
+    search_mode binary searches the top_k * oversample nearest binary embeddings by hamming distance & returns
+    the top_k most similar by their float embeddings. Only for collections created with BINARY_PREFILTER
+    ef overrides the hnsw search ef, auto picks the smallest benchmarked ef meeting the recall target
+    rerank over-fetches hits & reorders them with a cross-encoder unless it would breach the latency budget
+    mmr over-fetches hits with their embeddings & selects top_k diverse hits with maximal marginal relevance,
+    mmr_lambda overrides the configured relevance/diversity trade-off. Not available in hybrid mode
+    """
+    t_start = time.perf_counter()
     status_code = status.HTTP_200_OK
     response_data = {}
     try:
-        if not user_exists_in_mongo(mongodb_client, user_id, MONGO_USER_DB, MONGO_USER_COLLECTION):
+        if not await user_exists(user_id):
             status_code = status.HTTP_404_NOT_FOUND
             response_data["detail"] = f"user with id: {user_id} does not exist in db. Register user first"
             raise HTTPException(status_code=status_code, detail=response_data["detail"])
 
-        partition_name = f"partition_{user_id}"
-        if not milvus_client.has_partition(partition_name):
+        # queries are embedded & searched with the same model version even if the active one is switched meanwhile
+        model = model_versions.active()
+        partition_name = model.placement.get_partition_name(user_id)
+        milvus_client = await milvus_pool.run(model.placement.get_collection, user_id)
+        if milvus_client is None or not await user_partition_exists(milvus_client, user_id):
             logger.error("%s: User partition missing in milvus db. Control should not reach here.", traceback.print_exc())
             response_data["detail"] = f"user with id: {user_id} does not exist in db. Register user first"
             raise ValueError(response_data["detail"])
-        # TODO very inefficient to load partition like this, consider using user sessions
-        load_partition_milvus(milvus_client, partition_name)
+        # top_k mode returns the top_k most similar hits, range mode only returns hits within radius & range_filter
+        if search_mode == "range":
+            radius = MILVUS_EMB_SEARCH_RADIUS if radius is None else radius
+        else:
+            radius, range_filter = None, None
+        if mmr and search_mode == "hybrid":
+            response_data["detail"] = "mmr is not supported with search_mode hybrid"
+            raise ValueError(response_data["detail"])
+        if search_mode == "binary" and not has_binary_prefilter(milvus_client):
+            response_data["detail"] = "search_mode binary requires a collection created with BINARY_PREFILTER"
+            raise ValueError(response_data["detail"])
+        # rerank & mmr over-fetch candidates, hybrid mode fetches more dense candidates for the fusion
+        num_results = max(top_k, min(top_k * RERANK_OVERFETCH_MULTIPLIER, RERANK_MAX_CANDIDATES)) if rerank else top_k
+        num_results = max(num_results, top_k * MMR_OVERFETCH_MULTIPLIER) if mmr else num_results
+        limit = num_results * HYBRID_CANDIDATE_MULTIPLIER if search_mode == "hybrid" else num_results
+        try:
+            search_params = get_search_params(
+                MILVUS_EMB_METRIC_TYPE, resolve_ef(ef, limit), radius, range_filter)
+        except ValueError as excep:
+            response_data["detail"] = str(excep)
+            raise
 
-        # TODO current if query is longer than emb model input size, it is auto-truncated
-        query_vec = query_hf_emb(query)
         # optionally filter searches/hybrid search with conditions i.e. specific docs only
-        expr = None if doc_id_list is None else f"doc_id in {doc_id_list}".replace("'", '"')
+        if doc_id_list is not None and not all(is_valid_doc_id(doc_id) for doc_id in doc_id_list):
+            response_data["detail"] = "doc ids may only contain letters, digits, _ & -"
+            raise ValueError(response_data["detail"])
+        expr = None if doc_id_list is None else get_doc_expr(doc_id_list)
+        expr = model.placement.get_user_expr(user_id, expr)
 
-        search_results = search_milvus(
-            milvus_client, partition_name, [query_vec], limit=top_k, dist_thres=3,
-            search_params={"metric_type": MILVUS_EMB_METRIC_TYPE, "ef": MILVUS_EMB_SEARCH_PARAM_EF}, expr=expr)
+        if search_mode == "hybrid":
+            search_results = await hybrid_search(
+                model, milvus_client, partition_name, user_id, query, num_results, doc_id_list, search_params, expr,
+                dense_weight=HYBRID_DENSE_WEIGHT if dense_weight is None else dense_weight,
+                lexical_weight=HYBRID_LEXICAL_WEIGHT if lexical_weight is None else lexical_weight)
+        else:
+            # TODO current if query is longer than emb model input size, it is auto-truncated
+            query_vec = await asyncio.to_thread(model.embed, query)
+            output_fields = ["content", "doc_id", "embedding"] if mmr else None
+            # searches load the partition if it is not already resident & pin it while they run, LRU partitions
+            # are evicted if required
+            if search_mode == "two_stage":
+                search_results = await milvus_pool.run(
+                    partition_manager.run_loaded, milvus_client, partition_name, two_stage_search, model,
+                    milvus_client, partition_name, user_id, query_vec, num_results, doc_id_list, search_params, expr,
+                    num_docs=TWO_STAGE_NUM_DOCS if num_docs is None else num_docs, output_fields=output_fields)
+            elif search_mode == "binary":
+                search_results = await milvus_pool.run(
+                    partition_manager.run_loaded, milvus_client, partition_name, binary_rescore_search_milvus,
+                    milvus_client, partition_name, [query_vec], limit=num_results, search_params=search_params,
+                    expr=expr, output_fields=output_fields, text_store=chunk_text_store,
+                    oversample=BINARY_RESCORE_OVERSAMPLE if oversample is None else oversample)
+            else:
+                search_results = await milvus_pool.run(
+                    partition_manager.run_loaded, milvus_client, partition_name, search_milvus,
+                    milvus_client, partition_name, [query_vec], limit=num_results, search_params=search_params,
+                    expr=expr, output_fields=output_fields, text_store=chunk_text_store)
+        if rerank:
+            # with mmr all candidates are kept & the cross-encoder scores become the mmr relevance
+            search_results = await asyncio.to_thread(
+                reranker.rerank_search_results, query, search_results, num_results if mmr else top_k,
+                elapsed_ms=(time.perf_counter() - t_start) * 1000)
+        if mmr and search_results.get("content"):
+            reranked = search_results.get("rerank", {}).get("reranked", False)
+            search_results["content"] = mmr_diversify_hits(
+                query_vec, search_results["content"], top_k,
+                lambda_mult=MMR_LAMBDA if mmr_lambda is None else mmr_lambda,
+                score_key="rerank_score" if reranked else None)
+            search_results["detail"] = f"{len(search_results['content'])} similar entitie(s) found in vector db"
 
         response_data = search_results
     except Exception as excep:
@@ -58,3 +282,68 @@ async def search(
         detail = response_data.get("detail", "failed to conduct query search in server")
         raise HTTPException(status_code=status_code, detail=detail) from excep
     return response_data
+
+
+@router.post("/batch/{user_id}", response_model=Dict,
+             status_code=status.HTTP_200_OK,
+             summary="Extract embs of a batch of queries & find most similar embs for each query from vector db")
+async def batch_search(
+        user_id: str,
+        search_input: BatchSearchInput):
+    """
+    Extract embs of a batch of queries & find most similar embs for each query from vector db
+    All queries are embedded in one batch & searched with a single ann call.
+    Hits are returned per query in the same order as the input queries
+    """
+    status_code = status.HTTP_200_OK
+    response_data = {}
+    try:
+        if not await user_exists(user_id):
+            status_code = status.HTTP_404_NOT_FOUND
+            response_data["detail"] = f"user with id: {user_id} does not exist in db. Register user first"
+            raise HTTPException(status_code=status_code, detail=response_data["detail"])
+
+        model = model_versions.active()
+        partition_name = model.placement.get_partition_name(user_id)
+        milvus_client = await milvus_pool.run(model.placement.get_collection, user_id)
+        if milvus_client is None or not await user_partition_exists(milvus_client, user_id):
+            logger.error(
+                "%s: User partition missing in milvus db. Control should not reach here.", traceback.print_exc())
+            response_data["detail"] = f"user with id: {user_id} does not exist in db. Register user first"
+            raise ValueError(response_data["detail"])
+        # top_k mode returns the search_input.top_k most similar hits,
+        # range mode only returns hits within radius & range_filter
+        if search_input.search_mode == "range":
+            radius = MILVUS_EMB_SEARCH_RADIUS if search_input.radius is None else search_input.radius
+            range_filter = search_input.range_filter
+        else:
+            radius, range_filter = None, None
+        try:
+            search_params = get_search_params(
+                MILVUS_EMB_METRIC_TYPE, resolve_ef(search_input.ef, search_input.top_k), radius, range_filter)
+        except ValueError as excep:
+            response_data["detail"] = str(excep)
+            raise
+
+        query_vecs = await asyncio.to_thread(model.embed_batch, search_input.queries)
+        doc_id_list = search_input.doc_id_list
+        if doc_id_list is not None and not all(is_valid_doc_id(doc_id) for doc_id in doc_id_list):
+            response_data["detail"] = "doc ids may only contain letters, digits, _ & -"
+            raise ValueError(response_data["detail"])
+        expr = None if doc_id_list is None else get_doc_expr(doc_id_list)
+        expr = model.placement.get_user_expr(user_id, expr)
+
+        # the partition is loaded if it is not already resident & pinned during the search
+        search_results = await milvus_pool.run(
+            partition_manager.run_loaded, milvus_client, partition_name, batch_search_milvus,
+            milvus_client, partition_name, query_vecs, limit=search_input.top_k,
+            search_params=search_params, expr=expr, text_store=chunk_text_store)
+        search_results["content"] = [{"query": query, "content": hits}
+                                     for query, hits in zip(search_input.queries, search_results["content"])]
+        response_data = search_results
+    except Exception as excep:
+        logger.error("%s: %s", excep, traceback.print_exc())
+        status_code = status.HTTP_400_BAD_REQUEST if status_code == status.HTTP_200_OK else status_code
+        detail = response_data.get("detail", "failed to conduct batch query search in server")
+        raise HTTPException(status_code=status_code, detail=detail) from excep
+    return response_data
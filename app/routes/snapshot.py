@@ -0,0 +1,214 @@
+"""
+User snapshot export & import api endpoints
+"""
+import os
+import asyncio
+import logging
+import traceback
+from typing import Dict
+
+import numpy as np
+from fastapi import APIRouter, File, Query, UploadFile, status, HTTPException
+from fastapi.responses import StreamingResponse
+
+from config import (
+    FILE_STORAGE_DIR, MONGO_USER_DB, MONGO_USER_COLLECTION, MONGO_DOC_COLLECTION,
+    MILVUS_EMB_METRIC_TYPE, SNAPSHOT_BATCH_SIZE, SNAPSHOT_COMPRESSION_LEVEL)
+from setup import (
+    mongodb_client, mongo_pool, milvus_pool, model_versions, partition_manager, chunk_text_store,
+    user_exists, user_partition_exists)
+from api.milvus import insert_into_milvus, stores_chunk_text, get_doc_expr, delete_by_expr_milvus
+from api.model_versions import ModelVersion
+from api.snapshot import (
+    SnapshotReader, make_snapshot_header, encode_snapshot_header, encode_snapshot_block, iter_snapshot_batches_milvus,
+    group_doc_rows, get_restored_doc_id)
+
+
+router = APIRouter()
+logger = logging.getLogger('snapshot_route')
+
+
+async def restore_snapshot_batch(
+        model: ModelVersion, milvus_client, partition_name: str, user_id: str, batch: Dict) -> int:
+    """
+    Inserts the rows of a snapshot batch with one columnar insert & indexes them like the upsert routes,
+    the chunk text goes to the doc text files if the collection keeps it out of milvus. Returns num rows restored
+    """
+    doc_rows = group_doc_rows(batch)
+    rows = [row for doc_rows_ in doc_rows.values() for row in doc_rows_]
+    emb_vecs = batch["embedding"][rows]
+    doc_ids = [batch["doc_id"][row] for row in rows]
+    contents = [batch["content"][row] for row in rows]
+    data = [emb_vecs, doc_ids, [user_id] * len(rows)]
+    if stores_chunk_text(milvus_client):
+        data.append(contents)
+    else:
+        chunk_indexes, starts, ends = [], [], []
+        for doc_id, doc_rows_ in doc_rows.items():
+            offsets = await asyncio.to_thread(
+                chunk_text_store.write_doc, user_id, doc_id, [batch["content"][row] for row in doc_rows_])
+            chunk_indexes.extend(range(len(offsets)))
+            starts.extend(start for start, _ in offsets)
+            ends.extend(end for _, end in offsets)
+        data.extend([chunk_indexes, starts, ends])
+    insert_res = await milvus_pool.run(insert_into_milvus, milvus_client, partition_name, data)
+    await asyncio.to_thread(model.lexical_index.add_chunks, user_id, insert_res["content"], doc_ids, contents)
+    await asyncio.to_thread(model.doc_centroids.add_docs, user_id, {
+        doc_id: batch["embedding"][doc_rows_] for doc_id, doc_rows_ in doc_rows.items()})
+    return len(rows)
+
+
+@router.get("/{user_id}/snapshot",
+            status_code=status.HTTP_200_OK,
+            summary="Streams a snapshot of the user's vector entities, chunk text & doc records")
+async def export_user_snapshot(
+        user_id: str,
+        batch_size: int = Query(SNAPSHOT_BATCH_SIZE, ge=1, le=100000)):
+    """
+    Streams a snapshot of the user's vector entities, chunk text & doc records in the api.snapshot format.
+    Entities are read & written in blocks of about batch_size rows. Restore it with POST /users/{user_id}/snapshot
+    """
+    status_code = status.HTTP_200_OK
+    response_data = {}
+    pinned = False
+    try:
+        if not await user_exists(user_id):
+            status_code = status.HTTP_404_NOT_FOUND
+            response_data["detail"] = f"user with id: {user_id} does not exist in db. Register user first"
+            raise HTTPException(status_code=status_code, detail=response_data["detail"])
+
+        model = model_versions.active()
+        partition_name = model.placement.get_partition_name(user_id)
+        milvus_client = await milvus_pool.run(model.placement.get_collection, user_id)
+        if milvus_client is None or not await user_partition_exists(milvus_client, user_id):
+            logger.error(
+                "%s: User partition missing in milvus db. Control should not reach here.", traceback.print_exc())
+            response_data["detail"] = f"user with id: {user_id} does not exist in db. Register user first"
+            raise ValueError(response_data["detail"])
+        # the partition stays pinned until the snapshot is streamed so it is not evicted in between
+        await milvus_pool.run(partition_manager.ensure_loaded, milvus_client, partition_name, True)
+        pinned = True
+
+        users = mongodb_client[MONGO_USER_DB][MONGO_USER_COLLECTION]
+        docs = mongodb_client[MONGO_USER_DB][MONGO_DOC_COLLECTION]
+        user = await mongo_pool.run(users.find_one, {"_id": user_id}, {"_id": 0})
+        doc_list = await mongo_pool.run(lambda: list(docs.find({"user_id": user_id})))
+        header = make_snapshot_header(
+            user_id, model.vector_dim, doc_list, user, MILVUS_EMB_METRIC_TYPE, model_name=model.model_name)
+        batches = iter_snapshot_batches_milvus(
+            milvus_client, partition_name, model.placement.get_user_expr(user_id), batch_size, chunk_text_store)
+    except Exception as excep:
+        logger.error("%s: %s", excep, traceback.print_exc())
+        if pinned:
+            partition_manager.unpin(milvus_client, partition_name)
+        status_code = status.HTTP_400_BAD_REQUEST if status_code == status.HTTP_200_OK else status_code
+        detail = response_data.get("detail", f"failed to export snapshot for user with id {user_id}")
+        raise HTTPException(status_code=status_code, detail=detail) from excep
+
+    async def snapshot_stream():
+        try:
+            yield encode_snapshot_header(header)
+            num_rows = 0
+            while True:
+                batch = await milvus_pool.run(next, batches, None)
+                if batch is None:
+                    break
+                num_rows += len(batch["doc_id"])
+                yield await asyncio.to_thread(
+                    encode_snapshot_block, batch, model.vector_dim, SNAPSHOT_COMPRESSION_LEVEL)
+            yield encode_snapshot_block({}, model.vector_dim)
+            logger.info("snapshot of %s entities exported for user %s", num_rows, user_id)
+        finally:
+            await milvus_pool.run(batches.close)
+            partition_manager.unpin(milvus_client, partition_name)
+
+    return StreamingResponse(
+        snapshot_stream(), media_type="application/octet-stream",
+        headers={"Content-Disposition": f'attachment; filename="user_{user_id}.snap"'})
+
+
+@router.post("/{user_id}/snapshot", response_model=Dict,
+             status_code=status.HTTP_200_OK,
+             summary="Restores the docs of a snapshot into the user's vector entities, chunk text & doc records")
+async def import_user_snapshot(user_id: str, file: UploadFile = File(...)):
+    """
+    Restores the docs of a snapshot exported with GET /users/{user_id}/snapshot, possibly of another user or
+    cluster, without re-embedding. Docs of another user's snapshot get new doc ids. Docs whose record already
+    exists for the user are skipped so an interrupted import can be run again. The original uploaded files are not
+    part of snapshots
+    """
+    status_code = status.HTTP_200_OK
+    response_data = {}
+    try:
+        if not await user_exists(user_id):
+            status_code = status.HTTP_404_NOT_FOUND
+            response_data["detail"] = f"user with id: {user_id} does not exist in db. Register user first"
+            raise HTTPException(status_code=status_code, detail=response_data["detail"])
+
+        model = model_versions.active()
+        partition_name = model.placement.get_partition_name(user_id)
+        milvus_client = await milvus_pool.run(model.placement.get_collection, user_id)
+        if milvus_client is None or not await user_partition_exists(milvus_client, user_id):
+            logger.error(
+                "%s: User partition missing in milvus db. Control should not reach here.", traceback.print_exc())
+            response_data["detail"] = f"user with id: {user_id} does not exist in db. Register user first"
+            raise ValueError(response_data["detail"])
+
+        try:
+            reader = await asyncio.to_thread(SnapshotReader, file.file)
+        except ValueError as excep:
+            response_data["detail"] = f"{file.filename} is not a valid snapshot: {excep}"
+            raise
+        snapshot_model = reader.header.get("model_name") or model.model_name
+        if reader.vector_dim != model.vector_dim or snapshot_model != model.model_name:
+            response_data["detail"] = (f"snapshot vectors of {snapshot_model} with {reader.vector_dim} dims can't be "
+                                       f"restored into vectors of {model.model_name} with {model.vector_dim} dims")
+            raise ValueError(response_data["detail"])
+
+        docs = mongodb_client[MONGO_USER_DB][MONGO_DOC_COLLECTION]
+        snapshot_user_id = reader.header.get("user_id")
+        doc_records = {get_restored_doc_id(doc["_id"], snapshot_user_id, user_id): doc
+                       for doc in reader.header["docs"]}
+        existing_ids = {doc["_id"] for doc in await mongo_pool.run(
+            lambda: list(docs.find({"_id": {"$in": list(doc_records)}, "user_id": user_id}, {"_id": 1})))}
+        user_doc_dir = os.path.join(FILE_STORAGE_DIR, "user_" + user_id)
+        num_rows, restored_ids = 0, []
+        while True:
+            batch = await asyncio.to_thread(reader.read_batch)
+            if batch is None:
+                break
+            batch["doc_id"] = [get_restored_doc_id(doc_id, snapshot_user_id, user_id) for doc_id in batch["doc_id"]]
+            keep = np.asarray([doc_id not in existing_ids for doc_id in batch["doc_id"]], dtype=bool)
+            if not keep.any():
+                continue
+            batch = {name: (column[keep] if isinstance(column, np.ndarray)
+                            else [value for value, kept in zip(column, keep) if kept])
+                     for name, column in batch.items()}
+            batch_doc_ids = list(dict.fromkeys(batch["doc_id"]))
+            # entities of a doc whose record is missing are left over from an interrupted import
+            expr = model.placement.get_user_expr(user_id, get_doc_expr(batch_doc_ids))
+            await milvus_pool.run(
+                partition_manager.run_loaded, milvus_client, partition_name,
+                delete_by_expr_milvus, milvus_client, expr, partition_name)
+            num_rows += await restore_snapshot_batch(model, milvus_client, partition_name, user_id, batch)
+            # doc records are only written once their entities are restored
+            records = []
+            for doc_id in batch_doc_ids:
+                record = dict(doc_records.get(doc_id, {"doc_name": doc_id}), _id=doc_id, user_id=user_id)
+                record["doc_path"] = os.path.join(
+                    user_doc_dir, doc_id + os.path.splitext(record.get("doc_name", ""))[-1])
+                # the stored file & extracted text cache are not part of snapshots
+                record.pop("text_path", None)
+                record.pop("blob_id", None)
+                records.append(record)
+            await mongo_pool.run(docs.insert_many, records)
+            existing_ids.update(batch_doc_ids)
+            restored_ids.extend(batch_doc_ids)
+        response_data["detail"] = f"restored {len(restored_ids)} docs with {num_rows} entities for user {user_id}"
+        response_data["content"] = {"restored": restored_ids, "skipped": sorted(existing_ids - set(restored_ids))}
+    except Exception as excep:
+        logger.error("%s: %s", excep, traceback.print_exc())
+        status_code = status.HTTP_400_BAD_REQUEST if status_code == status.HTTP_200_OK else status_code
+        detail = response_data.get("detail", f"failed to import snapshot for user with id {user_id}")
+        raise HTTPException(status_code=status_code, detail=detail) from excep
+    return response_data
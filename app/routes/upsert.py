@@ -2,27 +2,36 @@
 Upsert file api
 """
 import os
-import os.path as osp
 import io
+import os.path as osp
 import json
 import uuid
+import asyncio
 import logging
 import traceback
-from typing import List, Dict
+from typing import BinaryIO, List, Dict, Optional, Tuple
 
-from fastapi import APIRouter, Query, File, UploadFile, status, HTTPException
+from fastapi import APIRouter, Path, Query, File, Request, UploadFile, status, HTTPException
 from pypdf import PdfReader
 
-from config import FILE_STORAGE_DIR, MONGO_USER_DB, MONGO_USER_COLLECTION, MONGO_DOC_COLLECTION
-from setup import milvus_client, mongodb_client, query_hf_emb, get_html_from_url
-from api.milvus import insert_into_milvus
-from api.mongo import user_exists_in_mongo
+from config import (
+    FILE_STORAGE_DIR, MONGO_USER_DB, MONGO_DOC_COLLECTION, EXTRACTED_TEXT_COMPRESSION_LEVEL, UPSERT_EMBED_BATCH_SIZE)
+from setup import (
+    mongodb_client, mongo_pool, milvus_pool, model_versions, partition_manager, chunk_text_store, blob_store,
+    upload_store, get_html_from_url, user_exists)
+from api.milvus import insert_into_milvus, stores_chunk_text, get_doc_expr, delete_by_expr_milvus
+from api.model_versions import ModelVersion
+from api.async_db import mongo_transaction, is_transient_transaction_error
+from api.extracted_text import get_extracted_text_path, write_extracted_text, split_text_chunks
 from api.html_extraction import get_text_from_html
 from api.yt_transcript import get_text_transcript_from_yt_video
-from utils.common import get_file_md5
+from api.upload_sessions import get_upload_status
+from utils.common import get_file_md5, remove_file
 
 
 SUPPORTED_EXT = {".txt", ".pdf"}
+# attempts of a doc upsert transaction conflicting with a concurrent upload of the same content
+DOC_TRANSACTION_ATTEMPTS = 3
 router = APIRouter()
 logger = logging.getLogger('upsert_route')
 
@@ -31,6 +40,144 @@ logger = logging.getLogger('upsert_route')
 # TODO change to llama index with langchain
 
 
+async def embed_and_index_chunks(
+        model: ModelVersion,
+        milvus_client,
+        partition_name: str,
+        user_id: str,
+        doc_id: str,
+        content_chunks: List[str]) -> None:
+    """
+    Saves the chunk embs of the model version in its vector db, adds the chunks to the user's lexical index for
+    hybrid search & the doc centroid for two-stage search
+    """
+    emb_vecs = []
+    for start in range(0, len(content_chunks), UPSERT_EMBED_BATCH_SIZE):
+        emb_vecs.extend(await asyncio.to_thread(
+            model.embed_batch, content_chunks[start: start + UPSERT_EMBED_BATCH_SIZE]))
+    # save emb in vector database with doc_id & user_id as metadata
+    data = [emb_vecs, [doc_id] * len(emb_vecs), [user_id] * len(emb_vecs)]
+    if stores_chunk_text(milvus_client):
+        data.append(content_chunks)
+    else:
+        # the chunk text goes to the doc text file, milvus only keeps the chunk offsets into it
+        offsets = await asyncio.to_thread(chunk_text_store.write_doc, user_id, doc_id, content_chunks)
+        data.extend([list(range(len(offsets))), [start for start, _ in offsets], [end for _, end in offsets]])
+    insert_res = await milvus_pool.run(insert_into_milvus, milvus_client, partition_name, data)
+    # lexical postings reference the milvus primary keys of the chunks
+    await asyncio.to_thread(
+        model.lexical_index.add_chunks, user_id, insert_res["content"], [doc_id] * len(content_chunks), content_chunks)
+    await asyncio.to_thread(model.doc_centroids.add_doc, user_id, doc_id, emb_vecs)
+
+
+async def delete_indexed_chunks(
+        model: ModelVersion,
+        milvus_client,
+        partition_name: str,
+        user_id: str,
+        doc_id: str) -> None:
+    """
+    Deletes the chunks of a doc from the vector db, the lexical index, the doc centroids & the chunk text store.
+    Used when the upsert of the doc fails, as they are not rolled back with its mongo transaction
+    """
+    expr = model.placement.get_user_expr(user_id, get_doc_expr([doc_id]))
+    await milvus_pool.run(
+        partition_manager.run_loaded, milvus_client, partition_name,
+        delete_by_expr_milvus, milvus_client, expr, partition_name)
+    await asyncio.to_thread(model.lexical_index.delete_docs, user_id, [doc_id])
+    await asyncio.to_thread(model.doc_centroids.delete_docs, user_id, [doc_id])
+    await asyncio.to_thread(chunk_text_store.delete_docs, user_id, [doc_id])
+
+
+async def save_extracted_text(
+        doc_obj: Dict, text: str, content_chunks: List[str], extractor: str, chunk_size: int) -> None:
+    """
+    Saves the extracted text & chunk manifest in the user doc dir & records its location in the doc record,
+    so re-processing the doc does not extract its text again
+    """
+    text_path = get_extracted_text_path(osp.join(FILE_STORAGE_DIR, "user_" + doc_obj["user_id"], doc_obj["_id"]))
+    await asyncio.to_thread(
+        write_extracted_text, text_path, text, content_chunks, extractor, chunk_size, EXTRACTED_TEXT_COMPRESSION_LEVEL)
+    doc_obj.update(text_path=text_path, num_chunks=len(content_chunks))
+
+
+def extract_file_text(f_name: str, fptr: BinaryIO) -> Tuple[str, str]:
+    """Returns the text of a ['.txt', '.pdf'] file read from the start of fptr & the name of its extractor"""
+    fptr.seek(0)
+    if osp.splitext(f_name)[-1] == ".pdf":
+        reader = PdfReader(fptr)
+        pages_content_str = [page.extract_text() for page in reader.pages]
+        return ''.join(pages_content_str), "pypdf"
+    # decode txt file contents
+    f_content = fptr.read()
+    enc = json.detect_encoding(f_content)
+    return f_content.decode(enc), "text"
+
+
+async def ingest_file(
+        model: ModelVersion,
+        milvus_client,
+        partition_name: str,
+        user_id: str,
+        f_name: str,
+        fptr: BinaryIO,
+        extractor: Optional[str] = None) -> bool:
+    """
+    Stores a ['.txt', '.pdf'] file read from the start of fptr, extracts its text & saves its chunk embs.
+    extractor names the extractor of text files holding already extracted text, i.e. of html pages.
+    Extracting & embedding a large file outlasts the mongo transaction lifetime limit, so they run before the
+    transaction, which only writes the blob ref & the doc record & is run again if it conflicts with a concurrent
+    upload of the same content. Returns False if the user already has a doc with the same content
+    """
+    user_docs = mongodb_client[MONGO_USER_DB][MONGO_DOC_COLLECTION]
+    # check if file alr exists in the db using md5sum
+    fmd5 = await asyncio.to_thread(get_file_md5, fptr)
+    if await mongo_pool.run(user_docs.find_one, {"doc_md5": fmd5, "user_id": user_id}):
+        logger.info("%s already stored and indexed in db. Skipping", f_name)
+        return False
+    doc_id = str(uuid.uuid4())
+    doc_obj = {"_id": doc_id, "user_id": user_id, "doc_name": f_name, "doc_md5": fmd5}
+    stored, indexing = False, False
+    try:
+        file_content_str, file_extractor = await asyncio.to_thread(extract_file_text, f_name, fptr)
+        # TODO improve chunking, check llama index chaining
+        # chunking here in sizes of 1024
+        chunk_sz = 1024
+        content_chunks = split_text_chunks(file_content_str, chunk_sz)
+        await save_extracted_text(doc_obj, file_content_str, content_chunks, extractor or file_extractor, chunk_sz)
+        indexing = True
+        await embed_and_index_chunks(model, milvus_client, partition_name, user_id, doc_id, content_chunks)
+
+        for attempt in range(1, DOC_TRANSACTION_ATTEMPTS + 1):
+            try:
+                async with mongo_transaction(mongodb_client, mongo_pool) as mongo_sess:  # atomic mongo transaction
+                    # a concurrent upload of the same content may have been stored meanwhile
+                    if await mongo_pool.run(
+                            user_docs.find_one, {"doc_md5": fmd5, "user_id": user_id}, session=mongo_sess):
+                        logger.info("%s already stored and indexed in db. Skipping", f_name)
+                        return False
+                    # files are stored once per unique content & shared by the docs of all users uploading it
+                    blob = await asyncio.to_thread(blob_store.put_file, fptr, user_id, doc_id, session=mongo_sess)
+                    doc_obj.update(doc_path=blob["path"], blob_id=blob["_id"])
+                    # insert doc info info into mongodb
+                    await mongo_pool.run(user_docs.insert_one, doc_obj, session=mongo_sess)
+                stored = True
+                return True
+            except Exception as excep:
+                if attempt == DOC_TRANSACTION_ATTEMPTS or not is_transient_transaction_error(excep):
+                    raise
+                logger.warning("%s: transaction of %s conflicted, retrying", excep, f_name)
+    finally:
+        if not stored:
+            # the extracted text & indexed chunks are not rolled back with the transaction, a blob file left
+            # without blob doc is removed by the blob gc
+            if doc_obj.get("text_path"):
+                await asyncio.to_thread(remove_file, doc_obj["text_path"])
+            if indexing:
+                await delete_indexed_chunks(model, milvus_client, partition_name, user_id, doc_id)
+    return False
+
+
 @router.post("/files/{user_id}", response_model=Dict,
              status_code=status.HTTP_200_OK,
              summary="Extract text from ['.txt', '.pdf'] file & save emb in a vector db")
@@ -42,7 +189,7 @@ async def file_upsert(user_id: str, files: List[UploadFile] = File(...)):
     status_code = status.HTTP_200_OK
     response_data = {}
     try:
-        if not user_exists_in_mongo(mongodb_client, user_id, MONGO_USER_DB, MONGO_USER_COLLECTION):
+        if not await user_exists(user_id):
             status_code = status.HTTP_404_NOT_FOUND
             response_data["detail"] = f"user with id: {user_id} does not exist in db. Register user first"
             raise HTTPException(status_code=status_code, detail=response_data["detail"])
@@ -53,52 +200,15 @@ async def file_upsert(user_id: str, files: List[UploadFile] = File(...)):
                 response_data["detail"] = f"Only files with extensions {SUPPORTED_EXT} supported. {file.filename} is invalid"
                 raise ValueError(response_data["detail"])
 
-        user_docs = mongodb_client[MONGO_USER_DB][MONGO_DOC_COLLECTION]
-        user_doc_dir = osp.join(FILE_STORAGE_DIR, "user_" + user_id)
-        partition_name = f"partition_{user_id}"
+        model = model_versions.active()
+        partition_name = model.placement.get_partition_name(user_id)
+        milvus_client = await milvus_pool.run(model.placement.get_collection, user_id)
 
         emb_files = []
         for file in files:
-            mongo_sess = mongodb_client.start_session()
-            with mongo_sess.start_transaction():  # atomic mongo transaction
-                f_content = file.file.read()
-                f_name = file.filename
-                # check if file alr exists in the db using md5sum
-                fmd5 = get_file_md5(f_content)
-                if user_docs.find_one({"doc_md5": fmd5, "user_id": user_id}):
-                    logger.info("%s already stored and indexed in db. Skipping", f_name)
-                    continue
-                doc_id = str(uuid.uuid4())
-                fsave_path = osp.join(user_doc_dir, doc_id + osp.splitext(f_name)[-1])
-
-                # insert doc info info into mongodb
-                doc_obj = {"_id": doc_id, "user_id": user_id,
-                           "doc_name": f_name, "doc_md5": fmd5, "doc_path": fsave_path}
-                user_docs.insert_one(doc_obj, session=mongo_sess)
-
-                # TODO improve this, right now they are just saved to the disk with a dir with the user_id as name
-                with open(fsave_path, 'wb') as f_write:
-                    f_write.write(f_content)
-
-                if osp.splitext(f_name)[-1] == ".pdf":
-                    reader = PdfReader(io.BytesIO(f_content))
-                    pages_content_str = [page.extract_text() for page in reader.pages]
-                    file_content_str = ''.join(pages_content_str)
-                else:
-                    # decode txt file contents
-                    enc = json.detect_encoding(f_content)
-                    file_content_str = f_content.decode(enc)
-                # TODO improve chunking, check llama index chaining
-                # chunking here in sizes of 1024
-                chunk_sz = 1024
-                content_chunks = [file_content_str[i: i + chunk_sz]
-                                  for i in range(0, len(file_content_str), chunk_sz)]
-                emb_vecs = [query_hf_emb(chunk) for chunk in content_chunks]
-                # save emb in vector database with doc_id & user_id as metadata
-                data = [emb_vecs, [doc_id] * len(emb_vecs), [user_id] * len(emb_vecs), content_chunks]
-                insert_into_milvus(milvus_client, partition_name, data)
-                emb_files.append(f_name)
-            mongo_sess.end_session()
+            # the spooled upload file is read from disk instead of being loaded in memory
+            if await ingest_file(model, milvus_client, partition_name, user_id, file.filename, file.file):
+                emb_files.append(file.filename)
         if len(emb_files) > 0:
             response_data["detail"] = f"uploaded and embedded {len(emb_files)} file(s). "
             if len(emb_files) != len(files):
@@ -115,6 +225,207 @@ async def file_upsert(user_id: str, files: List[UploadFile] = File(...)):
     return response_data
 
 
+async def get_user_upload(user_id: str, upload_id: str) -> Optional[Dict]:
+    """Returns the upload session of the user or None if it does not exist"""
+    upload = await mongo_pool.run(upload_store.get, upload_id)
+    return upload if upload is not None and upload["user_id"] == user_id else None
+
+
+@router.post("/files/{user_id}/uploads", response_model=Dict,
+             status_code=status.HTTP_200_OK,
+             summary="Creates a resumable upload session of a ['.txt', '.pdf'] file")
+async def create_file_upload(user_id: str, file_name: str, size: Optional[int] = Query(None, gt=0)):
+    """
+    Creates a resumable upload session of a ['.txt', '.pdf'] file of size bytes if known. Its parts are sent
+    with PUT /upsert/files/{user_id}/uploads/{upload_id}/parts/{part_number} & the file is extracted & embedded
+    with POST /upsert/files/{user_id}/uploads/{upload_id}/complete
+    """
+    status_code = status.HTTP_200_OK
+    response_data = {}
+    try:
+        if not await user_exists(user_id):
+            status_code = status.HTTP_404_NOT_FOUND
+            response_data["detail"] = f"user with id: {user_id} does not exist in db. Register user first"
+            raise HTTPException(status_code=status_code, detail=response_data["detail"])
+        if os.path.splitext(file_name)[1] not in SUPPORTED_EXT:
+            response_data["detail"] = f"Only files with extensions {SUPPORTED_EXT} supported. {file_name} is invalid"
+            raise ValueError(response_data["detail"])
+
+        await asyncio.to_thread(upload_store.expire)
+        try:
+            upload = await asyncio.to_thread(upload_store.create, user_id, file_name, size)
+        except ValueError as excep:
+            response_data["detail"] = str(excep)
+            raise
+        response_data["detail"] = f"upload session of {file_name} created"
+        response_data["content"] = {**get_upload_status(upload), "max_part_size": upload_store.max_part_size}
+    except Exception as excep:
+        logger.error("%s: %s", excep, traceback.print_exc())
+        status_code = status.HTTP_400_BAD_REQUEST if status_code == status.HTTP_200_OK else status_code
+        detail = response_data.get("detail", "failed to create upload session")
+        raise HTTPException(status_code=status_code, detail=detail) from excep
+    return response_data
+
+
+@router.get("/files/{user_id}/uploads/{upload_id}", response_model=Dict,
+            status_code=status.HTTP_200_OK,
+            summary="Gets the received offset & next part of a resumable upload")
+async def get_file_upload(user_id: str, upload_id: str):
+    """Gets the received offset & next part of a resumable upload, an interrupted upload resumes from them"""
+    status_code = status.HTTP_200_OK
+    response_data = {}
+    try:
+        upload = await get_user_upload(user_id, upload_id)
+        if upload is None:
+            status_code = status.HTTP_404_NOT_FOUND
+            response_data["detail"] = f"upload with id: {upload_id} does not exist for user {user_id}"
+            raise HTTPException(status_code=status_code, detail=response_data["detail"])
+        response_data["detail"] = f"upload received {upload['offset']} bytes"
+        response_data["content"] = get_upload_status(upload)
+    except Exception as excep:
+        logger.error("%s: %s", excep, traceback.print_exc())
+        status_code = status.HTTP_400_BAD_REQUEST if status_code == status.HTTP_200_OK else status_code
+        detail = response_data.get("detail", "failed to get upload session")
+        raise HTTPException(status_code=status_code, detail=detail) from excep
+    return response_data
+
+
+@router.put("/files/{user_id}/uploads/{upload_id}/parts/{part_number}", response_model=Dict,
+            status_code=status.HTTP_200_OK,
+            summary="Appends a part, the request body, to a resumable upload")
+async def put_file_upload_part(
+        request: Request,
+        user_id: str,
+        upload_id: str,
+        md5: str,
+        part_number: int = Path(..., ge=1)):
+    """
+    Appends a part, the request body, to a resumable upload. Parts are numbered from 1 & sent in order, md5 is
+    the hex digest of the part. The body is streamed to the upload file & dropped if it is incomplete or does
+    not match md5. A part already received with the same md5 is acknowledged again so it can be resent when its
+    response was lost
+    """
+    status_code = status.HTTP_200_OK
+    response_data = {}
+    try:
+        upload = await get_user_upload(user_id, upload_id)
+        if upload is None:
+            status_code = status.HTTP_404_NOT_FOUND
+            response_data["detail"] = f"upload with id: {upload_id} does not exist for user {user_id}"
+            raise HTTPException(status_code=status_code, detail=response_data["detail"])
+        if part_number <= len(upload["parts"]):
+            if upload["parts"][part_number - 1][2] != md5.lower():
+                status_code = status.HTTP_409_CONFLICT
+                response_data["detail"] = f"part {part_number} was already received with another md5"
+                raise HTTPException(status_code=status_code, detail=response_data["detail"])
+            response_data["detail"] = f"part {part_number} already received"
+            response_data["content"] = get_upload_status(upload)
+            return response_data
+
+        try:
+            part = await asyncio.to_thread(upload_store.open_part, upload_id, part_number)
+        except ValueError as excep:
+            response_data["detail"] = str(excep)
+            raise
+        if part is None:
+            status_code = status.HTTP_409_CONFLICT
+            response_data["detail"] = (f"part {part_number} is not the next part of upload {upload_id} or another "
+                                       "part is being written, get the upload offset & next part")
+            raise HTTPException(status_code=status_code, detail=response_data["detail"])
+        try:
+            async for data in request.stream():
+                await asyncio.to_thread(part.write, data)
+            upload = await asyncio.to_thread(part.commit, md5)
+        except ValueError as excep:
+            response_data["detail"] = str(excep)
+            raise
+        finally:
+            await asyncio.to_thread(part.close)
+        response_data["detail"] = f"part {part_number} of {part.size} bytes received"
+        response_data["content"] = get_upload_status(upload)
+    except Exception as excep:
+        logger.error("%s: %s", excep, traceback.print_exc())
+        status_code = status.HTTP_400_BAD_REQUEST if status_code == status.HTTP_200_OK else status_code
+        detail = response_data.get("detail", f"failed to receive part {part_number} of upload")
+        raise HTTPException(status_code=status_code, detail=detail) from excep
+    return response_data
+
+
+@router.post("/files/{user_id}/uploads/{upload_id}/complete", response_model=Dict,
+             status_code=status.HTTP_200_OK,
+             summary="Extract text from the file of a resumable upload & save emb in a vector db")
+async def complete_file_upload(user_id: str, upload_id: str):
+    """
+    Extract text from the file of a resumable upload & save emb in a vector db like POST /upsert/files/{user_id}
+    The upload session is removed once the file is upserted or found to exist already
+    """
+    status_code = status.HTTP_200_OK
+    response_data = {}
+    try:
+        if not await user_exists(user_id):
+            status_code = status.HTTP_404_NOT_FOUND
+            response_data["detail"] = f"user with id: {user_id} does not exist in db. Register user first"
+            raise HTTPException(status_code=status_code, detail=response_data["detail"])
+        upload = await get_user_upload(user_id, upload_id)
+        if upload is None:
+            status_code = status.HTTP_404_NOT_FOUND
+            response_data["detail"] = f"upload with id: {upload_id} does not exist for user {user_id}"
+            raise HTTPException(status_code=status_code, detail=response_data["detail"])
+        if not upload["parts"] or (upload["size"] is not None and upload["offset"] != upload["size"]):
+            size = "" if upload["size"] is None else f" of {upload['size']}"
+            response_data["detail"] = f"upload received {upload['offset']}{size} bytes, send all parts first"
+            raise ValueError(response_data["detail"])
+
+        fptr = await asyncio.to_thread(upload_store.open_file, upload_id)
+        if fptr is None:
+            status_code = status.HTTP_409_CONFLICT
+            response_data["detail"] = f"upload {upload_id} is being written or completed by another request"
+            raise HTTPException(status_code=status_code, detail=response_data["detail"])
+        try:
+            model = model_versions.active()
+            partition_name = model.placement.get_partition_name(user_id)
+            milvus_client = await milvus_pool.run(model.placement.get_collection, user_id)
+            ingested = await ingest_file(model, milvus_client, partition_name, user_id, upload["file_name"], fptr)
+            # removed under the file lock so no part is appended meanwhile
+            await asyncio.to_thread(upload_store.remove, upload_id)
+        finally:
+            fptr.close()
+        if not ingested:
+            response_data["detail"] = f"{upload['file_name']} already exists in system"
+            raise ValueError(response_data["detail"])
+        response_data["detail"] = f"uploaded and embedded {upload['file_name']} of {upload['offset']} bytes"
+        response_data["content"] = [upload["file_name"]]
+    except Exception as excep:
+        logger.error("%s: %s", excep, traceback.print_exc())
+        status_code = status.HTTP_400_BAD_REQUEST if status_code == status.HTTP_200_OK else status_code
+        detail = response_data.get("detail", "failed to upload file to server")
+        raise HTTPException(status_code=status_code, detail=detail) from excep
+    return response_data
+
+
+@router.delete("/files/{user_id}/uploads/{upload_id}", response_model=Dict,
+               status_code=status.HTTP_200_OK,
+               summary="Aborts a resumable upload & removes its received parts")
+async def delete_file_upload(user_id: str, upload_id: str):
+    """Aborts a resumable upload & removes its received parts"""
+    status_code = status.HTTP_200_OK
+    response_data = {}
+    try:
+        upload = await get_user_upload(user_id, upload_id)
+        if upload is None:
+            status_code = status.HTTP_404_NOT_FOUND
+            response_data["detail"] = f"upload with id: {upload_id} does not exist for user {user_id}"
+            raise HTTPException(status_code=status_code, detail=response_data["detail"])
+        await asyncio.to_thread(upload_store.remove, upload_id)
+        response_data["detail"] = f"upload with id {upload_id} removed"
+    except Exception as excep:
+        logger.error("%s: %s", excep, traceback.print_exc())
+        status_code = status.HTTP_400_BAD_REQUEST if status_code == status.HTTP_200_OK else status_code
+        detail = response_data.get("detail", "failed to remove upload session")
+        raise HTTPException(status_code=status_code, detail=detail) from excep
+    return response_data
+
+
 @router.post("/urls/html/{user_id}", response_model=Dict,
              status_code=status.HTTP_200_OK,
              summary="Extract text from an html page from url & save emb in a vector db")
@@ -125,51 +436,23 @@ async def url_html_upsert(user_id: str, urls: List[str] = Query(None)):
     status_code = status.HTTP_200_OK
     response_data = {}
     try:
-        if not user_exists_in_mongo(mongodb_client, user_id, MONGO_USER_DB, MONGO_USER_COLLECTION):
+        if not await user_exists(user_id):
             status_code = status.HTTP_404_NOT_FOUND
             response_data["detail"] = f"user with id: {user_id} does not exist in db. Register user first"
             raise HTTPException(status_code=status_code, detail=response_data["detail"])
 
-        user_docs = mongodb_client[MONGO_USER_DB][MONGO_DOC_COLLECTION]
-        user_doc_dir = osp.join(FILE_STORAGE_DIR, "user_" + user_id)
-        partition_name = f"partition_{user_id}"
+        model = model_versions.active()
+        partition_name = model.placement.get_partition_name(user_id)
+        milvus_client = await milvus_pool.run(model.placement.get_collection, user_id)
 
         emb_files = []
         for url in urls:
-            mongo_sess = mongodb_client.start_session()
-            with mongo_sess.start_transaction():  # atomic mongo transaction
-                html = get_html_from_url(url)
-                f_content = bytes(get_text_from_html(html), "utf-8")
-                f_name = str(uuid.uuid4())  # use a unique as the same
-                # check if file alr exists in the db using md5sum
-                fmd5 = get_file_md5(f_content)
-                if user_docs.find_one({"doc_md5": fmd5, "user_id": user_id}):
-                    logger.info("%s already stored and indexed in db. Skipping", f_name)
-                    continue
-                doc_id = str(uuid.uuid4())
-                fsave_path = osp.join(user_doc_dir, doc_id + osp.splitext(f_name)[-1])
-
-                # insert doc info info into mongodb
-                doc_obj = {"_id": doc_id, "user_id": user_id,
-                           "doc_name": f_name, "doc_md5": fmd5, "doc_path": fsave_path}
-                user_docs.insert_one(doc_obj, session=mongo_sess)
-
-                # TODO improve this, right now they are just saved to the disk with a dir with the user_id as name
-                with open(fsave_path, 'wb') as f_write:
-                    f_write.write(f_content)
-                enc = json.detect_encoding(f_content)
-                file_content_str = f_content.decode(enc)
-                # TODO improve chunking, check llama index chaining
-                # chunking here in sizes of 1024
-                chunk_sz = 1024
-                content_chunks = [file_content_str[i: i + chunk_sz]
-                                  for i in range(0, len(file_content_str), chunk_sz)]
-                emb_vecs = [query_hf_emb(chunk) for chunk in content_chunks]
-                # save emb in vector database with doc_id & user_id as metadata
-                data = [emb_vecs, [doc_id] * len(emb_vecs), [user_id] * len(emb_vecs), content_chunks]
-                insert_into_milvus(milvus_client, partition_name, data)
+            html = await asyncio.to_thread(get_html_from_url, url)
+            f_content = bytes(get_text_from_html(html), "utf-8")
+            f_name = str(uuid.uuid4())  # use a unique as the same
+            if await ingest_file(model, milvus_client, partition_name, user_id, f_name, io.BytesIO(f_content),
+                                 extractor="html"):
                 emb_files.append(f_name)
-            mongo_sess.end_session()
         if len(emb_files) > 0:
             response_data["detail"] = f"uploaded and embedded {len(emb_files)} urls. "
             if len(emb_files) != len(urls):
@@ -186,7 +469,6 @@ async def url_html_upsert(user_id: str, urls: List[str] = Query(None)):
     return response_data
 
 
-
 @router.post("/urls/youtube/{user_id}", response_model=Dict,
              status_code=status.HTTP_200_OK,
              summary="Extract transcript text from a youtube url if available & save emb in a vector db")
@@ -197,50 +479,22 @@ async def url_yt_upsert(user_id: str, urls: List[str] = Query(None)):
     status_code = status.HTTP_200_OK
     response_data = {}
     try:
-        if not user_exists_in_mongo(mongodb_client, user_id, MONGO_USER_DB, MONGO_USER_COLLECTION):
+        if not await user_exists(user_id):
             status_code = status.HTTP_404_NOT_FOUND
             response_data["detail"] = f"user with id: {user_id} does not exist in db. Register user first"
             raise HTTPException(status_code=status_code, detail=response_data["detail"])
 
-        user_docs = mongodb_client[MONGO_USER_DB][MONGO_DOC_COLLECTION]
-        user_doc_dir = osp.join(FILE_STORAGE_DIR, "user_" + user_id)
-        partition_name = f"partition_{user_id}"
+        model = model_versions.active()
+        partition_name = model.placement.get_partition_name(user_id)
+        milvus_client = await milvus_pool.run(model.placement.get_collection, user_id)
 
         emb_files = []
         for url in urls:
-            mongo_sess = mongodb_client.start_session()
-            with mongo_sess.start_transaction():  # atomic mongo transaction
-                f_content = bytes(get_text_transcript_from_yt_video(url), "utf-8")
-                f_name = str(uuid.uuid4())  # use a unique as the same
-                # check if file alr exists in the db using md5sum
-                fmd5 = get_file_md5(f_content)
-                if user_docs.find_one({"doc_md5": fmd5, "user_id": user_id}):
-                    logger.info("%s already stored and indexed in db. Skipping", f_name)
-                    continue
-                doc_id = str(uuid.uuid4())
-                fsave_path = osp.join(user_doc_dir, doc_id + osp.splitext(f_name)[-1])
-
-                # insert doc info info into mongodb
-                doc_obj = {"_id": doc_id, "user_id": user_id,
-                           "doc_name": f_name, "doc_md5": fmd5, "doc_path": fsave_path}
-                user_docs.insert_one(doc_obj, session=mongo_sess)
-
-                # TODO improve this, right now they are just saved to the disk with a dir with the user_id as name
-                with open(fsave_path, 'wb') as f_write:
-                    f_write.write(f_content)
-                enc = json.detect_encoding(f_content)
-                file_content_str = f_content.decode(enc)
-                # TODO improve chunking, check llama index chaining
-                # chunking here in sizes of 1024
-                chunk_sz = 1024
-                content_chunks = [file_content_str[i: i + chunk_sz]
-                                  for i in range(0, len(file_content_str), chunk_sz)]
-                emb_vecs = [query_hf_emb(chunk) for chunk in content_chunks]
-                # save emb in vector database with doc_id & user_id as metadata
-                data = [emb_vecs, [doc_id] * len(emb_vecs), [user_id] * len(emb_vecs), content_chunks]
-                insert_into_milvus(milvus_client, partition_name, data)
+            f_content = bytes(await asyncio.to_thread(get_text_transcript_from_yt_video, url), "utf-8")
+            f_name = str(uuid.uuid4())  # use a unique as the same
+            if await ingest_file(model, milvus_client, partition_name, user_id, f_name, io.BytesIO(f_content),
+                                 extractor="youtube_transcript"):
                 emb_files.append(f_name)
-            mongo_sess.end_session()
         if len(emb_files) > 0:
             response_data["detail"] = f"uploaded and embedded {len(emb_files)} youtube transcripts from urls. "
             if len(emb_files) != len(urls):
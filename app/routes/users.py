@@ -3,23 +3,141 @@ Upsert file api
 """
 import os
 import shutil
+import asyncio
 import logging
+import functools
+import mimetypes
 import traceback
-from typing import Dict
+from typing import Dict, List, Optional
+from urllib.parse import quote
 
-from fastapi import APIRouter, status, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Header, Query, Response, status, HTTPException
+from fastapi.responses import StreamingResponse
 from email_validator import validate_email, EmailNotValidError
 
-from config import FILE_STORAGE_DIR, MONGO_USER_DB, MONGO_USER_COLLECTION, MONGO_DOC_COLLECTION
-from setup import milvus_client, mongodb_client
-from api.milvus import create_partition_if_not_exist_milvus, load_partition_milvus
+from config import (
+    FILE_STORAGE_DIR, MONGO_USER_DB, MONGO_USER_COLLECTION, MONGO_DOC_COLLECTION,
+    MILVUS_DELETE_BACKGROUND_MIN_ENTITIES, MILVUS_DELETE_BATCH_DOCS)
+from setup import (
+    mongodb_client, mongo_pool, milvus_pool, milvus_delete_pool, model_versions, partition_manager,
+    chunk_text_store, blob_store, upload_store, existence_cache, user_exists)
 from api.mongo import user_exists_in_mongo
+from api.milvus import (
+    get_doc_expr, count_entities_milvus, delete_by_expr_milvus, delete_docs_in_batches_milvus,
+    create_partition_if_not_exist_milvus)
+from api.async_db import mongo_transaction
+from api.model_versions import ModelVersion
+from utils.common import remove_file
+from utils.http_range import parse_range_header, etag_matches
 
 
 router = APIRouter()
 logger = logging.getLogger('users_route')
 
 
+def preload_user_partition(model: ModelVersion, user_id: str) -> None:
+    """Resolves the user shard of the model version & preloads the user partition"""
+    try:
+        milvus_client = model.placement.get_collection(user_id)
+        if milvus_client is not None:
+            partition_manager.preload_async(milvus_client, [model.placement.get_partition_name(user_id)])
+    except Exception as excep:
+        logger.warning("%s: could not preload the partition of user %s", excep, user_id)
+
+
+async def delete_entities_in_background(
+        model: ModelVersion, milvus_client, user_id: str, doc_ids: List[str], all_docs: bool) -> None:
+    """
+    Deletes the user's entities of doc_ids with one expression delete per MILVUS_DELETE_BATCH_DOCS docs on the
+    milvus delete pool. If all_docs, the entities left without a doc, i.e. by failed upserts, are deleted last
+    """
+    partition_name = model.placement.get_partition_name(user_id)
+    try:
+        await milvus_delete_pool.run(
+            partition_manager.run_loaded, milvus_client, partition_name,
+            delete_docs_in_batches_milvus, milvus_client, doc_ids, partition_name, MILVUS_DELETE_BATCH_DOCS,
+            functools.partial(model.placement.get_user_expr, user_id))
+        if all_docs:
+            await milvus_delete_pool.run(
+                partition_manager.run_loaded, milvus_client, partition_name,
+                delete_by_expr_milvus, milvus_client, model.placement.get_user_expr(user_id), partition_name)
+    except Exception as excep:
+        logger.error("%s: background delete of the entities of user %s failed", excep, user_id)
+
+
+async def delete_user_entities(
+        model: ModelVersion,
+        milvus_client,
+        user_id: str,
+        doc_ids: List[str],
+        background_tasks: BackgroundTasks,
+        all_docs: bool = False) -> bool:
+    """
+    Deletes the user's vector entities of doc_ids in the model version, or all user entities if all_docs, with a
+    server side expression delete. More than MILVUS_DELETE_BACKGROUND_MIN_ENTITIES entities are deleted once the
+    response is sent with bounded expression deletes. Returns True if the delete was left to the background
+    """
+    partition_name = model.placement.get_partition_name(user_id)
+    expr = model.placement.get_user_expr(user_id, None if all_docs else get_doc_expr(doc_ids))
+    num_entities = await milvus_pool.run(
+        partition_manager.run_loaded, milvus_client, partition_name,
+        count_entities_milvus, milvus_client, expr, partition_name)
+    if num_entities <= MILVUS_DELETE_BACKGROUND_MIN_ENTITIES:
+        await milvus_pool.run(
+            partition_manager.run_loaded, milvus_client, partition_name,
+            delete_by_expr_milvus, milvus_client, expr, partition_name)
+        return False
+    background_tasks.add_task(delete_entities_in_background, model, milvus_client, user_id, doc_ids, all_docs)
+    return True
+
+
+async def delete_user_docs(user_id: str, doc_ids: List[str], background_tasks: BackgroundTasks) -> bool:
+    """
+    Deletes the vector entities, lexical postings & centroids of the user docs from every registered model version,
+    so retired versions do not keep them. Returns True if a vector delete was left to the background
+    """
+    in_background = False
+    for model in await mongo_pool.run(model_versions.registered):
+        milvus_client = await milvus_pool.run(model.placement.get_collection, user_id)
+        if milvus_client is not None:
+            in_background |= await delete_user_entities(model, milvus_client, user_id, doc_ids, background_tasks)
+        await asyncio.to_thread(model.lexical_index.delete_docs, user_id, doc_ids)
+        await asyncio.to_thread(model.doc_centroids.delete_docs, user_id, doc_ids)
+    return in_background
+
+
+async def drop_user_docs(
+        user_id: str,
+        doc_ids: List[str],
+        background_tasks: BackgroundTasks,
+        unregister: bool = False,
+        session=None) -> bool:
+    """
+    Drops the vector entities, lexical index & centroids of all docs of the user, doc_ids, from every registered
+    model version. The user partitions are recreated unless unregister, in which case the user shard mappings are
+    removed within the mongo session. Returns True if a vector delete was left to the background
+    """
+    in_background = False
+    for model in await mongo_pool.run(model_versions.registered):
+        partition_name = model.placement.get_partition_name(user_id)
+        milvus_client = await milvus_pool.run(model.placement.get_collection, user_id)
+        if milvus_client is not None and model.placement.partition_key_mode:
+            # users share partition key partitions, delete the user entities only
+            in_background |= await delete_user_entities(
+                model, milvus_client, user_id, doc_ids, background_tasks, all_docs=True)
+        elif milvus_client is not None and await milvus_pool.run(milvus_client.has_partition, partition_name):
+            # dropping & recreating the user partition is much cheaper than deleting its entities
+            await milvus_pool.run(partition_manager.release, milvus_client, partition_name)
+            await milvus_pool.run(milvus_client.drop_partition, partition_name)
+            if not unregister:
+                await milvus_pool.run(create_partition_if_not_exist_milvus, milvus_client, partition_name)
+        if unregister:
+            await mongo_pool.run(model.placement.remove_user, user_id, session=session)
+        await asyncio.to_thread(model.lexical_index.drop_user, user_id)
+        await asyncio.to_thread(model.doc_centroids.drop_user, user_id)
+    return in_background
+
+
 @router.get("/{user_id}", response_model=Dict,
             status_code=status.HTTP_200_OK,
             summary="Gets the registered user with the given user_id")
@@ -29,12 +147,15 @@ async def get_registered_user(user_id: str):
     response_data = {}
     try:
         users = mongodb_client[MONGO_USER_DB][MONGO_USER_COLLECTION]
-        user = users.find_one({"_id": user_id})
+        user = await mongo_pool.run(users.find_one, {"_id": user_id})
         if not user:
             status_code = status.HTTP_404_NOT_FOUND
             response_data["detail"] = f"user with id: {user_id} does not exist in db. Register user first"
             raise HTTPException(status_code=status_code, detail=response_data["detail"])
         user['_id'] = str(user['_id'])
+        # active user is likely to search next, preload their partition in the background. Resolving their shard
+        # is not awaited, so the lookup does not queue behind busy milvus pool workers
+        asyncio.get_running_loop().run_in_executor(None, preload_user_partition, model_versions.active(), user_id)
         response_data["detail"] = f"user with id {user_id} found in db"
         response_data["content"] = user
     except Exception as excep:
@@ -54,7 +175,7 @@ async def get_all_registered_user():
     response_data = {}
     try:
         users = mongodb_client[MONGO_USER_DB][MONGO_USER_COLLECTION]
-        user_list = list(users.find({}, {"_id": 1, "name": 1, "email": 1}))
+        user_list = await mongo_pool.run(lambda: list(users.find({}, {"_id": 1, "name": 1, "email": 1})))
         response_data["detail"] = "users currently registered in db"
         response_data["content"] = user_list
     except Exception as excep:
@@ -75,12 +196,12 @@ async def get_user_document(
     status_code = status.HTTP_200_OK
     response_data = {}
     try:
-        if not user_exists_in_mongo(mongodb_client, user_id, MONGO_USER_DB, MONGO_USER_COLLECTION):
+        if not await user_exists(user_id):
             status_code = status.HTTP_404_NOT_FOUND
             response_data["detail"] = f"user with id: {user_id} does not exist in db. Register user first"
             raise HTTPException(status_code=status_code, detail=response_data["detail"])
         docs = mongodb_client[MONGO_USER_DB][MONGO_DOC_COLLECTION]
-        doc = docs.find_one({"_id": doc_id})
+        doc = await mongo_pool.run(docs.find_one, {"_id": doc_id})
         if not doc:
             status_code = status.HTTP_404_NOT_FOUND
             response_data["detail"] = f"doc with id: {doc_id} does not exist in db for user {user_id}."
@@ -96,6 +217,64 @@ async def get_user_document(
     return response_data
 
 
+@router.get("/{user_id}/documents/{doc_id}/download",
+            status_code=status.HTTP_200_OK,
+            summary="Downloads the stored file of the document with id: doc_id for user with id: user_id")
+async def download_user_document(
+        user_id: str,
+        doc_id: str,
+        attachment: bool = False,
+        range_header: Optional[str] = Header(None, alias="Range"),
+        if_range: Optional[str] = Header(None),
+        if_none_match: Optional[str] = Header(None)):
+    """
+    Downloads the stored file of the document with id: doc_id for user with id: user_id
+    A single byte range is served as 206 partial content so clients can fetch only part of large files. The ETag is
+    the doc md5, If-None-Match returns 304 & a Range with a stale If-Range is served as the whole file
+    Compressed blobs are decompressed as they are streamed
+    """
+    status_code = status.HTTP_200_OK
+    response_data = {}
+    try:
+        docs = mongodb_client[MONGO_USER_DB][MONGO_DOC_COLLECTION]
+        doc = await mongo_pool.run(docs.find_one, {"_id": doc_id, "user_id": user_id})
+        blob = await asyncio.to_thread(blob_store.get, doc["blob_id"]) if doc and doc.get("blob_id") else None
+        if not doc or (doc.get("blob_id") and blob is None) or not os.path.isfile(doc.get("doc_path") or ""):
+            status_code = status.HTTP_404_NOT_FOUND
+            response_data["detail"] = f"file of doc with id: {doc_id} does not exist for user {user_id}."
+            raise HTTPException(status_code=status_code, detail=response_data["detail"])
+        # legacy docs stored before the blob store are uncompressed files
+        size = blob["size"] if blob is not None else os.path.getsize(doc["doc_path"])
+        etag = f'"{doc["doc_md5"]}"'
+        disposition = "attachment" if attachment else "inline"
+        headers = {"ETag": etag, "Accept-Ranges": "bytes",
+                   "Content-Disposition": f"{disposition}; filename*=UTF-8''{quote(doc['doc_name'], safe='')}"}
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        byte_range = None
+        if if_range is None or etag_matches(if_range, etag, weak=False):
+            try:
+                byte_range = parse_range_header(range_header, size)
+            except ValueError:
+                headers["Content-Range"] = f"bytes */{size}"
+                return Response(status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE, headers=headers)
+        start, end = (0, size - 1) if byte_range is None else byte_range
+        headers["Content-Length"] = str(end - start + 1)
+        if byte_range is not None:
+            status_code = status.HTTP_206_PARTIAL_CONTENT
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        media_type = mimetypes.guess_type(doc["doc_name"])[0] or "application/octet-stream"
+        return StreamingResponse(
+            blob_store.iter_range(doc["doc_path"], start, end), status_code=status_code, media_type=media_type,
+            headers=headers)
+    except Exception as excep:
+        logger.error("%s: %s", excep, traceback.print_exc())
+        status_code = status.HTTP_400_BAD_REQUEST if status_code == status.HTTP_200_OK else status_code
+        detail = response_data.get("detail", f"failed to download doc with id {doc_id} for user with id {user_id}")
+        raise HTTPException(status_code=status_code, detail=detail) from excep
+
+
 @router.get("/{user_id}/documents", response_model=Dict,
             status_code=status.HTTP_200_OK,
             summary="Gets all the uploaded documents for user with id: user_id")
@@ -104,13 +283,13 @@ async def get_all_user_documents(user_id: str):
     status_code = status.HTTP_200_OK
     response_data = {}
     try:
-        if not user_exists_in_mongo(mongodb_client, user_id, MONGO_USER_DB, MONGO_USER_COLLECTION):
+        if not await user_exists(user_id):
             status_code = status.HTTP_404_NOT_FOUND
             response_data["detail"] = f"user with id: {user_id} does not exist in db. Register user first"
             raise HTTPException(status_code=status_code, detail=response_data["detail"])
         docs = mongodb_client[MONGO_USER_DB][MONGO_DOC_COLLECTION]
-        doc_list = list(docs.find({"user_id": user_id}, {"_id": 1, "user_id": 1,
-                        "doc_name": 1, "doc_md5": 1, "doc_path": 1}))
+        doc_list = await mongo_pool.run(lambda: list(docs.find({"user_id": user_id}, {"_id": 1, "user_id": 1,
+                                        "doc_name": 1, "doc_md5": 1, "doc_path": 1})))
         response_data["detail"] = f"documents for registered user with id: {user_id}"
         response_data["content"] = doc_list
     except Exception as excep:
@@ -135,9 +314,9 @@ async def register_user(
     status_code = status.HTTP_200_OK
     response_data = {}
     try:
-        mongo_sess = mongodb_client.start_session()
-        with mongo_sess.start_transaction():  # atomic mongo transaction
-            if user_exists_in_mongo(mongodb_client, user_id, MONGO_USER_DB, MONGO_USER_COLLECTION):
+        async with mongo_transaction(mongodb_client, mongo_pool) as mongo_sess:  # atomic mongo transaction
+            if await mongo_pool.run(
+                    user_exists_in_mongo, mongodb_client, user_id, MONGO_USER_DB, MONGO_USER_COLLECTION):
                 status_code = status.HTTP_400_BAD_REQUEST
                 response_data["detail"] = f"user with id: {user_id} already exists in db"
                 raise HTTPException(status_code=status_code, detail=response_data["detail"])
@@ -158,15 +337,17 @@ async def register_user(
             user_obj = {"_id": user_id,
                         "name": user_name,
                         "email": user_email}
-            users.insert_one(user_obj, session=mongo_sess)
-            # create partition for user in milvus if it doesn't alr exist
-            partition_name = f"partition_{user_id}"
-            create_partition_if_not_exist_milvus(milvus_client, partition_name)
+            await mongo_pool.run(users.insert_one, user_obj, session=mongo_sess)
+            # place user on a milvus collection shard & create the user partition if it doesn't alr exist
+            model = model_versions.active()
+            await milvus_pool.run(model.placement.place_user, user_id, session=mongo_sess)
 
             # create user doc dir
             user_doc_dir = os.path.join(FILE_STORAGE_DIR, "user_" + user_id)
             os.makedirs(user_doc_dir, exist_ok=True)
-        mongo_sess.end_session()
+        # drop the cached existence checks of the user in all workers
+        await asyncio.to_thread(existence_cache.invalidate, "user", user_id)
+        await asyncio.to_thread(existence_cache.invalidate, "partition", user_id)
         response_data["detail"] = response_data.get("detail", f"registered user with id: {user_id} in db")
     except Exception as excep:
         logger.error("%s: %s", excep, traceback.print_exc())
@@ -179,40 +360,48 @@ async def register_user(
 @router.delete("/{user_id}", response_model=Dict,
                status_code=status.HTTP_200_OK,
                summary="Unregisters the user with the given user_id")
-async def unregister_user(user_id: str):
+async def unregister_user(user_id: str, background_tasks: BackgroundTasks):
     """
     Unregisters the user with the given user_id.
     Warning, all user information, document, & vector entries will be lost
     """
     status_code = status.HTTP_200_OK
     response_data = {}
+    in_background = False
     try:
-        mongo_sess = mongodb_client.start_session()
-        with mongo_sess.start_transaction():  # atomic mongo transaction
+        async with mongo_transaction(mongodb_client, mongo_pool) as mongo_sess:  # atomic mongo transaction
             users = mongodb_client[MONGO_USER_DB][MONGO_USER_COLLECTION]
             user_query = {"_id": user_id}
-            user = users.find_one(user_query)
+            user = await mongo_pool.run(users.find_one, user_query)
             if not user:
                 status_code = status.HTTP_404_NOT_FOUND
                 response_data["detail"] = f"user with id: {user_id} does not exist in db. Register user first"
                 raise HTTPException(status_code=status_code, detail=response_data["detail"])
-            users.delete_one(user_query, session=mongo_sess)
+            await mongo_pool.run(users.delete_one, user_query, session=mongo_sess)
 
             # delete all user documents in mongo documents collection
             docs = mongodb_client[MONGO_USER_DB][MONGO_DOC_COLLECTION]
-            docs.delete_many({"user_id": user_id}, session=mongo_sess)
+            doc_ids = await mongo_pool.run(
+                lambda: [doc["_id"] for doc in docs.find({"user_id": user_id}, {"_id": 1}, session=mongo_sess)])
+            await mongo_pool.run(docs.delete_many, {"user_id": user_id}, session=mongo_sess)
 
-            # drop user partition in milvus
-            partition_name = f"partition_{user_id}"
-            # release  partition from memory
-            milvus_client.partition(partition_name).release()
-            milvus_client.drop_partition(partition_name)
+            # drop the user partitions & shard mappings of every model version
+            in_background = await drop_user_docs(
+                user_id, doc_ids, background_tasks, unregister=True, session=mongo_sess)
+            await asyncio.to_thread(chunk_text_store.drop_user, user_id)
+            released = await mongo_pool.run(blob_store.release_user, user_id, session=mongo_sess)
 
             # delete user doc dir
             user_doc_dir = os.path.join(FILE_STORAGE_DIR, "user_" + user_id)
-            shutil.rmtree(user_doc_dir)
-        mongo_sess.end_session()
+            await asyncio.to_thread(shutil.rmtree, user_doc_dir)
+        # stored files no other user doc references are removed once the refs release is committed
+        await asyncio.to_thread(blob_store.collect, released)
+        # drop the cached existence checks of the user in all workers
+        await asyncio.to_thread(existence_cache.invalidate, "user", user_id)
+        await asyncio.to_thread(existence_cache.invalidate, "partition", user_id)
         response_data["detail"] = f"user with id {user_id} removed from db"
+        if in_background:
+            response_data["detail"] += ", vector entries are being removed in the background"
     except Exception as excep:
         logger.error("%s: %s", excep, traceback.print_exc())
         status_code = status.HTTP_400_BAD_REQUEST if status_code == status.HTTP_200_OK else status_code
@@ -226,7 +415,8 @@ async def unregister_user(user_id: str):
                summary="Deletes the document with the doc_id for the user with the given user_id")
 async def delete_user_document(
         user_id: str,
-        doc_id: str):
+        doc_id: str,
+        background_tasks: BackgroundTasks):
     """
     Deletes the document with the doc_id for the user with the given user_id
     Warning, user document & vector entry will be lost
@@ -234,49 +424,40 @@ async def delete_user_document(
     status_code = status.HTTP_200_OK
     response_data = {}
     try:
-        mongo_sess = mongodb_client.start_session()
-        with mongo_sess.start_transaction():  # atomic mongo transaction
-            if not user_exists_in_mongo(mongodb_client, user_id, MONGO_USER_DB, MONGO_USER_COLLECTION):
+        async with mongo_transaction(mongodb_client, mongo_pool) as mongo_sess:  # atomic mongo transaction
+            if not await mongo_pool.run(
+                    user_exists_in_mongo, mongodb_client, user_id, MONGO_USER_DB, MONGO_USER_COLLECTION):
                 status_code = status.HTTP_404_NOT_FOUND
                 response_data["detail"] = f"user with id: {user_id} does not exist in db. Register user first"
                 raise HTTPException(status_code=status_code, detail=response_data["detail"])
 
             docs = mongodb_client[MONGO_USER_DB][MONGO_DOC_COLLECTION]
-            # find doc with matching doc_id
-            doc = docs.find_one({"_id": doc_id})
+            # find the user doc with matching doc_id
+            doc_query = {"_id": doc_id, "user_id": user_id}
+            doc = await mongo_pool.run(docs.find_one, doc_query, session=mongo_sess)
             if not doc:
                 status_code = status.HTTP_404_NOT_FOUND
                 response_data["detail"] = f"doc with id: {doc_id} does not exist in db for user {user_id}."
                 raise HTTPException(status_code=status_code, detail=response_data["detail"])
 
             # delete the doc matching doc_id
-            docs.delete_one({"_id": doc_id}, session=mongo_sess)
-
-            # delete all entities matching doc_id in user partition
-            partition_name = f"partition_{user_id}"
-            load_partition_milvus(milvus_client, partition_name)
-            while True:
-                query_res = milvus_client.query(
-                    expr=f'user_id in ["{user_id}"]',
-                    offset=0,
-                    limit=10000,
-                    output_fields=["doc_id"],
-                    partition_names=[partition_name],
-                    consistency_level="Strong")
-                # break if all entities removed
-                if not query_res:
-                    break
-                doc_entity_ids = [res["id"] for res in query_res]
-
-                # delete all entities by PK id
-                milvus_client.delete(
-                    f"id in {doc_entity_ids}".replace("'", '"'),
-                    partition_name=partition_name)
-
-            # delete user doc from persistent storage
-            os.remove(doc["doc_path"])
-        mongo_sess.end_session()
+            await mongo_pool.run(docs.delete_one, doc_query, session=mongo_sess)
+
+            # delete all entities matching doc_id in the user partitions with server side expression deletes
+            in_background = await delete_user_docs(user_id, [doc_id], background_tasks)
+            await asyncio.to_thread(chunk_text_store.delete_docs, user_id, [doc_id])
+
+            # delete user doc & its extracted text from persistent storage, docs restored from a snapshot have no file
+            released = await mongo_pool.run(blob_store.release, user_id, [doc_id], session=mongo_sess)
+            if not doc.get("blob_id"):
+                remove_file(doc["doc_path"])
+            if doc.get("text_path"):
+                remove_file(doc["text_path"])
+        # the stored file is removed once the release is committed if no other user doc references it
+        await asyncio.to_thread(blob_store.collect, released)
         response_data["detail"] = f"doc with id {doc_id} removed for user with id {user_id}"
+        if in_background:
+            response_data["detail"] += ", vector entries are being removed in the background"
     except Exception as excep:
         logger.error("%s: %s", excep, traceback.print_exc())
         status_code = status.HTTP_400_BAD_REQUEST if status_code == status.HTTP_200_OK else status_code
@@ -287,55 +468,75 @@ async def delete_user_document(
 
 @router.delete("/{user_id}/documents", response_model=Dict,
                status_code=status.HTTP_200_OK,
-               summary="Deletes all documents for the user with the given user_id")
-async def delete_all_user_documents(
-        user_id: str):
+               summary="Deletes the documents in doc_id_list or all documents for the user with the given user_id")
+async def delete_user_documents(
+        user_id: str,
+        background_tasks: BackgroundTasks,
+        doc_id_list: Optional[List[str]] = Query(None)):
     """
-    Deletes all documents for the user with the given user_id
+    Deletes the documents in doc_id_list or all documents for the user with the given user_id
     Warning, user document & vector entry will be lost
     """
     status_code = status.HTTP_200_OK
     response_data = {}
+    in_background = False
     try:
-        mongo_sess = mongodb_client.start_session()
-        with mongo_sess.start_transaction():  # atomic mongo transaction
-            if not user_exists_in_mongo(mongodb_client, user_id, MONGO_USER_DB, MONGO_USER_COLLECTION):
+        async with mongo_transaction(mongodb_client, mongo_pool) as mongo_sess:  # atomic mongo transaction
+            if not await mongo_pool.run(
+                    user_exists_in_mongo, mongodb_client, user_id, MONGO_USER_DB, MONGO_USER_COLLECTION):
                 status_code = status.HTTP_404_NOT_FOUND
                 response_data["detail"] = f"user with id: {user_id} does not exist in db. Register user first"
                 raise HTTPException(status_code=status_code, detail=response_data["detail"])
 
-            # delete all docs matching doc_id
             docs = mongodb_client[MONGO_USER_DB][MONGO_DOC_COLLECTION]
-            docs.delete_many({"user_id": user_id}, session=mongo_sess)
-
-            # delete all entities matching user_id in user partition i.e. drop all user doc entities
-            partition_name = f"partition_{user_id}"
-            load_partition_milvus(milvus_client, partition_name)
-            while True:
-                query_res = milvus_client.query(
-                    expr=f'user_id in ["{user_id}"]',
-                    offset=0,
-                    limit=10000,
-                    output_fields=["user_id"],
-                    partition_names=[partition_name],
-                    consistency_level="Strong")
-                # break if all entities removed
-                if not query_res:
-                    break
-                user_entity_ids = [res["id"] for res in query_res]
-
-                # delete all entities by PK id
-                milvus_client.delete(
-                    f"id in {user_entity_ids}".replace("'", '"'),
-                    partition_name=partition_name)
-
-            # delete user doc dir
-            user_doc_dir = os.path.join(FILE_STORAGE_DIR, "user_" + user_id)
-            shutil.rmtree(user_doc_dir)
-            # recreate user doc dir
-            os.makedirs(user_doc_dir, exist_ok=True)
-        mongo_sess.end_session()
-        response_data["detail"] = f"deleted all documents for user with id: {user_id}"
+            if doc_id_list is not None:
+                # find the user docs matching doc_id_list
+                doc_query = {"_id": {"$in": doc_id_list}, "user_id": user_id}
+                doc_list = await mongo_pool.run(
+                    lambda: list(docs.find(doc_query, {"_id": 1, "doc_path": 1, "text_path": 1, "blob_id": 1})))
+                if not doc_list:
+                    status_code = status.HTTP_404_NOT_FOUND
+                    response_data["detail"] = f"docs with ids: {doc_id_list} do not exist in db for user {user_id}."
+                    raise HTTPException(status_code=status_code, detail=response_data["detail"])
+                found_ids = [doc["_id"] for doc in doc_list]
+                await mongo_pool.run(docs.delete_many, doc_query, session=mongo_sess)
+
+                # delete all entities of the docs in the user partitions with server side expression deletes
+                in_background = await delete_user_docs(user_id, found_ids, background_tasks)
+                await asyncio.to_thread(chunk_text_store.delete_docs, user_id, found_ids)
+
+                # delete user docs & their extracted text from persistent storage, docs restored from a snapshot
+                # have no file
+                released = await mongo_pool.run(blob_store.release, user_id, found_ids, session=mongo_sess)
+                for doc in doc_list:
+                    if not doc.get("blob_id"):
+                        remove_file(doc["doc_path"])
+                    if doc.get("text_path"):
+                        remove_file(doc["text_path"])
+                response_data["detail"] = f"deleted {len(found_ids)} documents for user with id: {user_id}"
+                response_data["content"] = {
+                    "deleted": found_ids, "not_found": [doc_id for doc_id in doc_id_list if doc_id not in found_ids]}
+            else:
+                # delete all docs of the user
+                doc_ids = await mongo_pool.run(
+                    lambda: [doc["_id"] for doc in docs.find({"user_id": user_id}, {"_id": 1}, session=mongo_sess)])
+                await mongo_pool.run(docs.delete_many, {"user_id": user_id}, session=mongo_sess)
+
+                # drop all user doc entities of every model version
+                in_background = await drop_user_docs(user_id, doc_ids, background_tasks)
+                await asyncio.to_thread(chunk_text_store.drop_user, user_id)
+                released = await mongo_pool.run(blob_store.release_user, user_id, session=mongo_sess)
+
+                # delete user doc dir
+                user_doc_dir = os.path.join(FILE_STORAGE_DIR, "user_" + user_id)
+                await asyncio.to_thread(shutil.rmtree, user_doc_dir)
+                # recreate user doc dir
+                os.makedirs(user_doc_dir, exist_ok=True)
+                response_data["detail"] = f"deleted all documents for user with id: {user_id}"
+        # stored files no other user doc references are removed once the refs release is committed
+        await asyncio.to_thread(blob_store.collect, released)
+        if in_background:
+            response_data["detail"] += ", vector entries are being removed in the background"
     except Exception as excep:
         logger.error("%s: %s", excep, traceback.print_exc())
         status_code = status.HTTP_400_BAD_REQUEST if status_code == status.HTTP_200_OK else status_code
@@ -355,26 +556,40 @@ async def delete_all_users():
     status_code = status.HTTP_200_OK
     response_data = {}
     try:
-        mongo_sess = mongodb_client.start_session()
-        with mongo_sess.start_transaction():  # atomic mongo transaction
+        async with mongo_transaction(mongodb_client, mongo_pool) as mongo_sess:  # atomic mongo transaction
             # delete all users and docs in mongodb
             users = mongodb_client[MONGO_USER_DB][MONGO_USER_COLLECTION]
             docs = mongodb_client[MONGO_USER_DB][MONGO_DOC_COLLECTION]
 
-            users.delete_many({}, session=mongo_sess)
-            docs.delete_many({}, session=mongo_sess)
-
-            # drop all milvus partitions in current collection
-            milvus_client.release()
-            for partition in milvus_client.partitions:
-                milvus_client.drop_partition(partition)
+            await mongo_pool.run(users.delete_many, {}, session=mongo_sess)
+            await mongo_pool.run(docs.delete_many, {}, session=mongo_sess)
+
+            # drop all user milvus partitions in all collection shards of every model version
+            for model in await mongo_pool.run(model_versions.registered):
+                for milvus_client in await milvus_pool.run(model.placement.get_all_collections):
+                    if model.placement.partition_key_mode:
+                        # partition key partitions are managed by milvus, delete all entities instead
+                        await milvus_pool.run(
+                            partition_manager.run_loaded, milvus_client, None, milvus_client.delete, 'user_id != ""')
+                        continue
+                    await milvus_pool.run(partition_manager.release_all, milvus_client)
+                    for partition in await milvus_pool.run(getattr, milvus_client, "partitions"):
+                        if partition.name != "_default":
+                            await milvus_pool.run(milvus_client.drop_partition, partition.name)
+                await mongo_pool.run(model.placement.remove_all_users, session=mongo_sess)
+                await asyncio.to_thread(model.lexical_index.drop_all)
+                await asyncio.to_thread(model.doc_centroids.drop_all)
+            await asyncio.to_thread(chunk_text_store.drop_all)
+            await asyncio.to_thread(blob_store.drop_all)
+            await asyncio.to_thread(upload_store.drop_all)
 
             # delete user doc dir
-            shutil.rmtree(FILE_STORAGE_DIR)
+            await asyncio.to_thread(shutil.rmtree, FILE_STORAGE_DIR)
             # recreate empty user doc dir
             os.makedirs(FILE_STORAGE_DIR, exist_ok=True)
 
-        mongo_sess.end_session()
+        # drop all cached existence checks in all workers
+        await asyncio.to_thread(existence_cache.invalidate)
         response_data["detail"] = "all users and docs removed from db"
     except Exception as excep:
         logger.error("%s: %s", excep, traceback.print_exc())
@@ -15,6 +15,8 @@ Args:
     upsert (module): Upsert API router
     search (module): Search API router
     qa (module): QA API router
+    admin (module): Admin & monitoring API router
+    snapshot (module): User snapshot export & import API router
 
 Returns:
     app (FastAPI): The FastAPI application object
@@ -32,7 +34,7 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 
 import config as cfg
-from routes import users, upsert, search, qa
+from routes import users, upsert, search, qa, admin, snapshot
 
 
 # openai app
@@ -85,6 +87,8 @@ app.include_router(users.router, prefix="/users", tags=["users"])
 app.include_router(upsert.router, prefix="/upsert", tags=["upsert"])
 app.include_router(search.router, prefix="/search", tags=["search"])
 app.include_router(qa.router, prefix="/qa", tags=["qa"])
+app.include_router(admin.router, prefix="/admin", tags=["admin"])
+app.include_router(snapshot.router, prefix="/users", tags=["snapshot"])
 app.openapi = custom_openapi
 
 
@@ -17,20 +17,55 @@ URI = 'mongodb://localhost:27017/?replicaSet=rs0  # 127.0.0.1 can also be used
 Add proper authentication details if uname and passwd are used.
 """
 import logging
+from datetime import datetime, timezone
 from functools import partial
+from typing import Dict, Optional
 
+import redis
 import pymongo
 from pymilvus import connections
 from config import (
-    MONGO_HOST, MONGO_PORT, MONGO_REPLICASET_NAME,
+    MONGO_HOST, MONGO_PORT, MONGO_REPLICASET_NAME, MONGO_USER_COLLECTION,
+    REDIS_HOST, REDIS_PORT, EXISTENCE_CACHE_TTL_S, EXISTENCE_CACHE_MAX_SIZE,
+    EXISTENCE_CACHE_REDIS_INVALIDATION, EXISTENCE_CACHE_CHANNEL,
     MONGO_INITDB_ROOT_USERNAME, MONGO_INITDB_ROOT_PASSWORD,
     MILVUS_HOST, MILVUS_PORT,
     MILVUS_EMB_VECTOR_DIM, MILVUS_EMB_METRIC_TYPE,
     MILVUS_EMB_INDEX_TYPE, MILVUS_EMB_COLLECTION_NAME_FMT,
-    MILVUS_EMB_INDEX_PARAM_M, MILVUS_EMB_INDEX_PARAM_EF_CONS)
-from config import HF_API_TOKEN, HF_API_URL
-from api.milvus import get_milvus_collec_conn
-from api.hf_embedding import query_api_online, query_api_docker
+    MILVUS_EMB_INDEX_PARAM_M, MILVUS_EMB_INDEX_PARAM_EF_CONS,
+    MILVUS_MAX_LOADED_PARTITIONS, MILVUS_LOADED_PARTITIONS_MEM_BUDGET_MB,
+    MILVUS_PARTITION_PRELOAD_WORKERS, MILVUS_MAX_PARTITIONS_PER_COLLECTION, MILVUS_SHARD_CACHE_TTL_S,
+    MILVUS_INDEX_REBUILD_WORKERS,
+    MILVUS_PARTITION_PRELOAD_INTERVAL_S, MILVUS_PARTITION_PRELOAD_RECENT,
+    MILVUS_TENANCY_MODE, MILVUS_EMB_PK_COLLECTION_NAME, MILVUS_PARTITION_KEY_NUM_PARTITIONS,
+    MONGO_USER_DB, MONGO_SHARD_COLLECTION, MONGO_MODEL_COLLECTION, MONGO_BLOB_COLLECTION, MONGO_UPLOAD_COLLECTION,
+    MONGO_THREAD_POOL_SIZE, MILVUS_THREAD_POOL_SIZE, MILVUS_DELETE_WORKERS,
+    VECTOR_STORE_BACKEND, LOCAL_VECTOR_STORE_DIR, LOCAL_VECTOR_STORE_ANN_THRESHOLD,
+    FILE_STORAGE_DIR, BLOB_STORAGE_DIR, BLOB_COMPRESSION_LEVEL,
+    UPLOAD_STORAGE_DIR, UPLOAD_MAX_PART_SIZE, UPLOAD_MAX_FILE_SIZE, UPLOAD_SESSION_TTL_S,
+    CHUNK_TEXT_STORE, CHUNK_TEXT_CACHE_SIZE, VECTOR_PRECISION, BINARY_PREFILTER,
+    LEXICAL_INDEX_DIR, LEXICAL_INDEX_CACHE_SIZE, LEXICAL_INDEX_MAX_SEGMENTS, BM25_K1, BM25_B,
+    DOC_CENTROID_DIR, DOC_CENTROID_CACHE_SIZE,
+    RERANK_MAX_CANDIDATES, RERANK_LATENCY_BUDGET_MS,
+    LLM_API_BASE_URL, LLM_API_KEY, LLM_MODEL_NAME, LLM_MAX_TOKENS, LLM_TEMPERATURE,
+    EMB_MODEL_VERSION, EMB_MODEL_NAME, EMB_API_URL, MODEL_VERSION_REFRESH_S)
+from api.vector_store import get_vector_store_backend
+from api.async_db import BackendExecutor
+from api.existence_cache import ExistenceCache
+from api.mongo import user_exists_in_mongo
+from api.partition_manager import PartitionLoadManager
+from api.index_manager import IndexRebuildManager
+from api.lexical_index import LexicalIndexStore
+from api.doc_centroids import DocCentroidStore
+from api.chunk_text_store import ChunkTextStore
+from api.blob_store import BlobStore
+from api.upload_sessions import UploadSessionStore
+from api.quantization import PRECISION_ITEMSIZE
+from api.reranker import Reranker
+from api.llm import OpenAICompatibleLLM
+from api.tenant_placement import TenantPlacement
+from api.model_versions import ModelVersion, ModelVersionRegistry
+from api.hf_embedding import query_api_docker_rerank
 from api.html_extraction import SeleniumScraper, RequestsScraper
 
 # logging
@@ -38,21 +73,16 @@ logger = logging.getLogger("setup")
 
 # ############## load relevant connections ##############
 
-# connect to milvus
-connections.connect(
-    alias="default",
-    host=MILVUS_HOST,
-    port=MILVUS_PORT)
-
-# connect to milvus standalone collection connection standalone
-milvus_client = get_milvus_collec_conn(
-    collection_name=MILVUS_EMB_COLLECTION_NAME_FMT % 1,
-    vector_dim=MILVUS_EMB_VECTOR_DIM,
-    metric_type=MILVUS_EMB_METRIC_TYPE,
-    index_type=MILVUS_EMB_INDEX_TYPE,
-    index_metric_params={
-        "M": MILVUS_EMB_INDEX_PARAM_M,
-        "efConstruction": MILVUS_EMB_INDEX_PARAM_EF_CONS})
+# connect to milvus, the local vector store backend runs in process without the milvus services
+if VECTOR_STORE_BACKEND == "milvus":
+    connections.connect(
+        alias="default",
+        host=MILVUS_HOST,
+        port=MILVUS_PORT)
+get_collec_conn, has_collection = get_vector_store_backend(
+    VECTOR_STORE_BACKEND,
+    root_dir=LOCAL_VECTOR_STORE_DIR,
+    ann_threshold=LOCAL_VECTOR_STORE_ANN_THRESHOLD)
 
 # connect to mongodb replicaset
 MONGO_URI = f'mongodb://{MONGO_HOST}:{MONGO_PORT}/?replicaSet={MONGO_REPLICASET_NAME}'
@@ -63,6 +93,144 @@ mongodb_client = pymongo.MongoClient(
     username=MONGO_INITDB_ROOT_USERNAME,
     password=MONGO_INITDB_ROOT_PASSWORD)
 
+# async routes run the blocking mongo & milvus calls in a bounded thread pool per backend
+mongo_pool = BackendExecutor("mongo", MONGO_THREAD_POOL_SIZE)
+milvus_pool = BackendExecutor("milvus", MILVUS_THREAD_POOL_SIZE)
+# batched deletes of very large docs run after the response on their own pool to not hold the route threads
+milvus_delete_pool = BackendExecutor("milvus_delete", MILVUS_DELETE_WORKERS)
+
+
+def make_model_version(spec: Dict) -> ModelVersion:
+    """
+    Opens the collection shards & indexes of an embedding model version
+    """
+    # users are placed on milvus collection shards, shards are created on demand with the same schema & index
+    get_shard_collec_conn = partial(
+        get_collec_conn,
+        vector_dim=int(spec["vector_dim"]),
+        metric_type=MILVUS_EMB_METRIC_TYPE,
+        index_type=MILVUS_EMB_INDEX_TYPE,
+        index_metric_params={
+            "M": MILVUS_EMB_INDEX_PARAM_M,
+            "efConstruction": MILVUS_EMB_INDEX_PARAM_EF_CONS},
+        store_chunk_text=CHUNK_TEXT_STORE == "milvus",
+        vector_precision=VECTOR_PRECISION,
+        binary_prefilter=BINARY_PREFILTER)
+    # in partition key mode all users share one collection with user_id as the partition key
+    partition_key_collection = None
+    if MILVUS_TENANCY_MODE == "partition_key":
+        partition_key_collection = get_shard_collec_conn(
+            spec["pk_collection_name"],
+            partition_key_mode=True,
+            num_partitions=MILVUS_PARTITION_KEY_NUM_PARTITIONS)
+    placement = TenantPlacement(
+        mongodb_client, MONGO_USER_DB, spec["shard_collection"],
+        get_collec_conn=get_shard_collec_conn,
+        collection_name_fmt=spec["collection_name_fmt"],
+        max_partitions_per_collection=MILVUS_MAX_PARTITIONS_PER_COLLECTION,
+        cache_ttl_s=MILVUS_SHARD_CACHE_TTL_S,
+        partition_key_collection=partition_key_collection,
+        has_collection=has_collection)
+    # per-user bm25 indexes of the upserted chunks for hybrid search
+    lexical_index = LexicalIndexStore(
+        spec["lexical_index_dir"],
+        cache_size=LEXICAL_INDEX_CACHE_SIZE,
+        max_segments=LEXICAL_INDEX_MAX_SEGMENTS,
+        k1=BM25_K1,
+        b=BM25_B)
+    # per-user doc centroid vectors for two-stage doc routed search
+    doc_centroids = DocCentroidStore(spec["doc_centroid_dir"], cache_size=DOC_CENTROID_CACHE_SIZE)
+    return ModelVersion(spec, placement, lexical_index, doc_centroids)
+
+
+# embedding model versions, the configured model & collections are the first version. Requests resolve the
+# active version once with model_versions.active() & use its embeddings, collections & indexes
+model_versions = ModelVersionRegistry(
+    mongodb_client, MONGO_USER_DB, MONGO_MODEL_COLLECTION,
+    default_spec={
+        "_id": EMB_MODEL_VERSION,
+        "model_name": EMB_MODEL_NAME,
+        "vector_dim": MILVUS_EMB_VECTOR_DIM,
+        "emb_api_url": EMB_API_URL,
+        "state": "active",
+        "created_at": datetime.now(timezone.utc),
+        "collection_name_fmt": MILVUS_EMB_COLLECTION_NAME_FMT,
+        "pk_collection_name": MILVUS_EMB_PK_COLLECTION_NAME,
+        "shard_collection": MONGO_SHARD_COLLECTION,
+        "lexical_index_dir": LEXICAL_INDEX_DIR,
+        "doc_centroid_dir": DOC_CENTROID_DIR},
+    make_version=make_model_version,
+    refresh_s=MODEL_VERSION_REFRESH_S)
+model_versions.start_refresher()
+
+# short ttl cache of the user & partition existence checks of the hot-path routes
+existence_cache = ExistenceCache(
+    ttl_s=EXISTENCE_CACHE_TTL_S,
+    max_size=EXISTENCE_CACHE_MAX_SIZE,
+    redis_client=redis.Redis(
+        host=REDIS_HOST, port=REDIS_PORT, socket_connect_timeout=1, socket_timeout=5
+    ) if EXISTENCE_CACHE_REDIS_INVALIDATION else None,
+    channel=EXISTENCE_CACHE_CHANNEL)
+existence_cache.start_listener()
+
+
+def forget_invalidated_users(kind: Optional[str], key: Optional[str]) -> None:
+    """Drops the cached shards of the users invalidated in the existence cache, i.e. removed by another worker"""
+    if kind in (None, "user"):
+        for model in model_versions.opened():
+            model.placement.forget_user(key)
+
+
+existence_cache.add_invalidation_callback(forget_invalidated_users)
+
+
+async def user_exists(user_id: str) -> bool:
+    """Cached check that the user exists in mongodb"""
+    return await existence_cache.get_or_check("user", user_id, lambda: mongo_pool.run(
+        user_exists_in_mongo, mongodb_client, user_id, MONGO_USER_DB, MONGO_USER_COLLECTION))
+
+
+async def user_partition_exists(milvus_client, user_id: str) -> bool:
+    """
+    Cached check that the user partition exists in the user's milvus collection shard, cached per model version &
+    collection as the user has a partition in the collections of each version
+    """
+    model = model_versions.active()
+    return await existence_cache.get_or_check(
+        "partition", user_id, lambda: milvus_pool.run(model.placement.has_user_partition, milvus_client, user_id),
+        scope=f"{model.version}/{milvus_client.name}")
+
+# track loaded user partitions & evict LRU partitions to stay within budget
+partition_manager = PartitionLoadManager(
+    max_loaded_partitions=MILVUS_MAX_LOADED_PARTITIONS,
+    max_memory_bytes=MILVUS_LOADED_PARTITIONS_MEM_BUDGET_MB * 1024 ** 2,
+    # vector + HNSW level-0 links (2*M int32 ids), or only the sign bits with the memory-mapped float vectors
+    # of a binary prefilter, + ~1024 char chunk text (or 3 int64 offsets) & ids
+    entity_bytes=(MILVUS_EMB_VECTOR_DIM // 8 if BINARY_PREFILTER else
+                  MILVUS_EMB_VECTOR_DIM * PRECISION_ITEMSIZE[VECTOR_PRECISION] + MILVUS_EMB_INDEX_PARAM_M * 2 * 4)
+    + (1024 if CHUNK_TEXT_STORE == "milvus" else 24) + 300,
+    preload_workers=MILVUS_PARTITION_PRELOAD_WORKERS,
+    preload_interval_s=MILVUS_PARTITION_PRELOAD_INTERVAL_S)
+partition_manager.start_preloader(MILVUS_PARTITION_PRELOAD_RECENT)
+
+# background embedding index rebuilds, rebuilt collections are released & their partitions loaded again on demand
+index_rebuilds = IndexRebuildManager(
+    release_collection=partition_manager.release_all,
+    metric_type=MILVUS_EMB_METRIC_TYPE,
+    num_workers=MILVUS_INDEX_REBUILD_WORKERS)
+
+# per-doc chunk text files of the collections keeping the chunk text out of milvus
+chunk_text_store = ChunkTextStore(FILE_STORAGE_DIR, cache_size=CHUNK_TEXT_CACHE_SIZE)
+
+# uploaded files stored once per unique content with per user doc refs in mongodb
+blob_store = BlobStore(
+    BLOB_STORAGE_DIR, mongodb_client, MONGO_USER_DB, MONGO_BLOB_COLLECTION, compression_level=BLOB_COMPRESSION_LEVEL)
+
+# resumable upload sessions, parts are appended to a file per session until it is ingested
+upload_store = UploadSessionStore(
+    UPLOAD_STORAGE_DIR, mongodb_client, MONGO_USER_DB, MONGO_UPLOAD_COLLECTION, max_part_size=UPLOAD_MAX_PART_SIZE,
+    max_file_size=UPLOAD_MAX_FILE_SIZE, ttl_s=UPLOAD_SESSION_TTL_S)
+
 # ############## load relevant functions ##############
 
 # choose html text extraction function
@@ -76,6 +244,16 @@ except Exception as excep:
     requests_scraper = RequestsScraper()
     get_html_from_url = requests_scraper.get_html_from_url
 
-# choose one hf embedding api endpoint
-query_hf_emb = partial(query_api_online, hf_api_tkn=HF_API_TOKEN, hf_api_url=HF_API_URL)
-query_hf_emb = query_api_docker
+# cross-encoder reranking of over-fetched search hits
+reranker = Reranker(
+    query_api_docker_rerank,
+    max_candidates=RERANK_MAX_CANDIDATES,
+    latency_budget_ms=RERANK_LATENCY_BUDGET_MS)
+
+# choose the llm answering qa queries
+llm_client = OpenAICompatibleLLM(
+    LLM_API_BASE_URL,
+    LLM_MODEL_NAME,
+    api_key=LLM_API_KEY,
+    max_tokens=LLM_MAX_TOKENS,
+    temperature=LLM_TEMPERATURE)
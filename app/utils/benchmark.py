@@ -0,0 +1,143 @@
+"""
+Benchmark utils for measuring ann search recall & latency against exact brute force search
+"""
+import time
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+
+def normalize_vectors(vectors: np.ndarray) -> np.ndarray:
+    """
+    L2 normalizes the rows of vectors so that an inner product equals the cosine similarity
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def make_synthetic_corpus(
+        num_vectors: int,
+        dim: int,
+        num_clusters: int = 64,
+        cluster_std: float = 0.35,
+        seed: int = 42) -> np.ndarray:
+    """
+    Generates a normalized clustered corpus which resembles sentence embeddings more than uniform noise
+    """
+    rng = np.random.default_rng(seed)
+    centers = normalize_vectors(rng.standard_normal((num_clusters, dim), dtype=np.float32))
+    labels = rng.integers(0, num_clusters, size=num_vectors)
+    noise = rng.standard_normal((num_vectors, dim), dtype=np.float32) * (cluster_std / np.sqrt(dim))
+    return normalize_vectors(centers[labels] + noise)
+
+
+def make_synthetic_documents(
+        num_docs: int,
+        chunks_per_doc: int,
+        dim: int,
+        num_topics: int = 64,
+        doc_std: float = 0.4,
+        chunk_std: float = 1.0,
+        seed: int = 42) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Generates a normalized corpus of docs whose chunks are spread around a doc center, doc centers being
+    spread around topic centers. Returns the (chunk vectors, doc index of each chunk) arrays
+    """
+    rng = np.random.default_rng(seed)
+    topics = normalize_vectors(rng.standard_normal((num_topics, dim), dtype=np.float32))
+    doc_noise = rng.standard_normal((num_docs, dim), dtype=np.float32) * (doc_std / np.sqrt(dim))
+    doc_centers = normalize_vectors(topics[rng.integers(0, num_topics, size=num_docs)] + doc_noise)
+    doc_labels = np.repeat(np.arange(num_docs), chunks_per_doc)
+    chunk_noise = rng.standard_normal((len(doc_labels), dim), dtype=np.float32) * (chunk_std / np.sqrt(dim))
+    return normalize_vectors(doc_centers[doc_labels] + chunk_noise), doc_labels
+
+
+def make_queries(
+        corpus: np.ndarray,
+        num_queries: int,
+        noise_std: float = 0.1,
+        seed: int = 7) -> np.ndarray:
+    """
+    Generates normalized queries by perturbing randomly sampled corpus vectors
+    """
+    rng = np.random.default_rng(seed)
+    idx = rng.choice(len(corpus), size=num_queries, replace=len(corpus) < num_queries)
+    noise_scale = noise_std / np.sqrt(corpus.shape[1])
+    noise = rng.standard_normal((num_queries, corpus.shape[1]), dtype=np.float32) * noise_scale
+    return normalize_vectors(corpus[idx] + noise)
+
+
+def brute_force_topk(
+        corpus: np.ndarray,
+        queries: np.ndarray,
+        k: int,
+        metric_type: str = "IP",
+        batch_size: int = 1024) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Exact top-k search with numpy. Returns the (ids, distances) arrays of shape (num_queries, k)
+    ordered from the most to the least similar match
+    """
+    k = min(k, len(corpus))
+    similarity = metric_type.upper() in {"IP", "COSINE"}
+    if metric_type.upper() == "COSINE":
+        corpus, queries = normalize_vectors(corpus), normalize_vectors(queries)
+    corpus_sq_norms = None if similarity else np.einsum("ij,ij->i", corpus, corpus)
+    all_ids, all_dists = [], []
+    for start in range(0, len(queries), batch_size):
+        query_batch = queries[start: start + batch_size]
+        scores = query_batch @ corpus.T
+        if not similarity:  # squared L2 distance, milvus also reports squared L2
+            scores = np.einsum("ij,ij->i", query_batch, query_batch)[:, None] - 2 * scores + corpus_sq_norms[None, :]
+            scores = -scores
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        ids = np.take_along_axis(top, order, axis=1)
+        dists = np.take_along_axis(top_scores, order, axis=1)
+        all_ids.append(ids)
+        all_dists.append(dists if similarity else -dists)
+    return np.vstack(all_ids), np.vstack(all_dists)
+
+
+def recall_at_k(
+        retrieved_ids: Sequence[Sequence[int]],
+        ground_truth_ids: np.ndarray,
+        k: int) -> float:
+    """
+    Mean fraction of the exact top-k ids found in the retrieved top-k ids over all queries
+    """
+    hits = 0
+    for retrieved, truth in zip(retrieved_ids, ground_truth_ids):
+        hits += len(set(list(retrieved)[:k]) & set(truth[:k].tolist()))
+    return hits / (len(ground_truth_ids) * k) if len(ground_truth_ids) else 0.0
+
+
+def latency_stats(latencies_ms: List[float]) -> Dict[str, float]:
+    """
+    Returns the mean, p50, p99 & max of a list of latencies in milliseconds
+    """
+    lat = np.asarray(latencies_ms, dtype=np.float64)
+    if not lat.size:
+        return {"mean_ms": 0.0, "p50_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+    return {"mean_ms": float(lat.mean()),
+            "p50_ms": float(np.percentile(lat, 50)),
+            "p99_ms": float(np.percentile(lat, 99)),
+            "max_ms": float(lat.max())}
+
+
+def time_queries(
+        search_fn: Callable[[np.ndarray], List[int]],
+        queries: np.ndarray,
+        num_warmup: int = 10) -> Tuple[List[List[int]], List[float]]:
+    """
+    Runs search_fn on each query one at a time & returns the retrieved ids and per query latencies in ms
+    """
+    for query in queries[:num_warmup]:
+        search_fn(query)
+    retrieved, latencies = [], []
+    for query in queries:
+        t_0 = time.perf_counter()
+        retrieved.append(search_fn(query))
+        latencies.append((time.perf_counter() - t_0) * 1000)
+    return retrieved, latencies
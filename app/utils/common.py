@@ -7,7 +7,7 @@ import hashlib
 import logging
 import functools
 import urllib.request as urllib2
-from typing import Callable, Union
+from typing import BinaryIO, Callable, Union
 
 logger = logging.getLogger("timeit_decorator")
 
@@ -66,10 +66,11 @@ async def cache_file_locally(file_cache_path: str, data: bytes) -> None:
         img_file_ptr.write(data)
 
 
-def get_file_md5(file: Union[str, bytes], byte_chunk: int = 8192):
+def get_file_md5(file: Union[str, bytes, BinaryIO], byte_chunk: int = 8192):
     """
     Calculates the MD5 hash of the file at the given path or using the file byte contents.
-    file (Union[str, bytes]): The path to the file or the file contents as bytes.
+    file (Union[str, bytes, BinaryIO]): The path to the file, the file contents as bytes or a file object read
+        from its start.
     byte_chunk (int): size of bytes to read and update
     Returns: The MD5 hash of the file (str).
     """
@@ -80,6 +81,10 @@ def get_file_md5(file: Union[str, bytes], byte_chunk: int = 8192):
                 hash_md5.update(chunk)
     elif isinstance(file, bytes):  # if file is the file byte contents
         hash_md5.update(file)
+    elif hasattr(file, "read"):  # if file is a file object
+        file.seek(0)
+        for chunk in iter(lambda: file.read(byte_chunk), b""):
+            hash_md5.update(chunk)
     else:
         raise NotImplementedError(f"md5sum calc not supported for file type {file}")
     return hash_md5.hexdigest()
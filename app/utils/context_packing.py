@@ -0,0 +1,81 @@
+"""
+Packs retrieved chunks into an llm context token budget
+"""
+import re
+import hashlib
+from typing import Callable, Dict, List, Set
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_SENTENCE_RE = re.compile(r"(?<=[.!?\n])\s+")
+
+
+def approx_num_tokens(text: str) -> int:
+    """
+    Approximate num of llm tokens, words & punctuation marks count as one token each plus ~30% for subword splits
+    """
+    return int(len(_TOKEN_RE.findall(text)) * 1.3) + 1
+
+
+def _shingles(words: List[str], size: int) -> Set[str]:
+    if len(words) < size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i: i + size]) for i in range(len(words) - size + 1)}
+
+
+def _truncate_to_tokens(text: str, max_tokens: int, count_tokens: Callable[[str], int]) -> str:
+    words = text.split()
+    low, high = 0, len(words)
+    while low < high:  # longest word prefix within max_tokens
+        mid = (low + high + 1) // 2
+        if count_tokens(" ".join(words[:mid])) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return " ".join(words[:low])
+
+
+def pack_context(
+        hits: List[Dict],
+        token_budget: int,
+        count_tokens: Callable[[str], int] = approx_num_tokens,
+        shingle_size: int = 8,
+        overlap_thres: float = 0.8,
+        min_tokens: int = 32) -> List[Dict]:
+    """
+    Selects hit contents in rank order until token_budget is used up.
+    Sentences already covered by higher ranked hits, i.e. duplicates & overlapping chunk windows,
+    are removed: a sentence is dropped if overlap_thres of its word shingles were already packed.
+    The last hit is truncated to the remaining budget if at least min_tokens remain.
+    Returns the packed hits as {"content", "doc_id", "id", "num_tokens"} dicts
+    """
+    packed, seen_shingles, seen_hashes = [], set(), set()
+    remaining = token_budget
+    for hit in hits:
+        content = hit.get("content") or ""
+        kept_sentences = []
+        for sentence in _SENTENCE_RE.split(content):
+            words = sentence.lower().split()
+            if not words:
+                continue
+            sentence_hash = hashlib.md5(" ".join(words).encode("utf-8")).hexdigest()
+            shingles = _shingles(words, shingle_size)
+            covered = len(shingles & seen_shingles) / len(shingles)
+            if sentence_hash in seen_hashes or covered >= overlap_thres:
+                continue
+            seen_hashes.add(sentence_hash)
+            seen_shingles |= shingles
+            kept_sentences.append(sentence.strip())
+        text = " ".join(kept_sentences)
+        if not text:
+            continue
+        num_tokens = count_tokens(text)
+        if num_tokens > remaining:
+            if remaining < min_tokens:
+                break
+            text = _truncate_to_tokens(text, remaining, count_tokens)
+            num_tokens = count_tokens(text)
+        packed.append({"id": hit.get("id"), "doc_id": hit.get("doc_id"), "content": text, "num_tokens": num_tokens})
+        remaining -= num_tokens
+        if remaining < min_tokens:
+            break
+    return packed
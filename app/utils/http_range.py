@@ -0,0 +1,50 @@
+"""
+HTTP range & conditional request utils
+"""
+from typing import Optional, Tuple
+
+
+def parse_range_header(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parses a single byte range, "bytes=start-end", "bytes=start-" or "bytes=-suffix_len", of a content of size
+    bytes. Returns the inclusive (start, end) byte offsets or None if the whole content should be sent, i.e. no,
+    malformed or multiple ranges. A ValueError is raised if the range cannot be satisfied
+    """
+    if not range_header:
+        return None
+    unit, _, ranges = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+    start, sep, end = ranges.strip().partition("-")
+    if not sep or not (start or end) or not all(part.isdigit() for part in (start, end) if part):
+        return None
+    if not start:
+        # suffix range, the last end bytes
+        if int(end) == 0 or size == 0:
+            raise ValueError(f"Range {range_header} not satisfiable for size {size}")
+        return max(size - int(end), 0), size - 1
+    start, end = int(start), size - 1 if not end else min(int(end), size - 1)
+    if start > end:
+        if start < size:
+            return None
+        raise ValueError(f"Range {range_header} not satisfiable for size {size}")
+    return start, end
+
+
+def _strip_weak(etag: str) -> str:
+    etag = etag.strip()
+    return etag[2:] if etag.startswith("W/") else etag
+
+
+def etag_matches(header: Optional[str], etag: str, weak: bool = True) -> bool:
+    """
+    Compares the list of etags or * of an If-None-Match header with etag, weak comparison ignores the W/ prefix
+    as required for If-None-Match, If-Range requires strong comparison
+    """
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    if not weak:
+        return etag.strip() in {tag.strip() for tag in header.split(",") if not tag.strip().startswith("W/")}
+    return _strip_weak(etag) in {_strip_weak(tag) for tag in header.split(",")}
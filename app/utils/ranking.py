@@ -0,0 +1,84 @@
+"""
+Result list fusion & diversification utils
+"""
+from typing import Dict, Hashable, List, Optional, Sequence
+
+import numpy as np
+
+
+def reciprocal_rank_fusion(
+        ranked_lists: Sequence[Sequence[Hashable]],
+        weights: Sequence[float] = None,
+        rrf_k: int = 60) -> List[tuple]:
+    """
+    Merges ranked lists of keys with weighted reciprocal rank fusion, score(key) = sum_i w_i / (rrf_k + rank_i)
+    with 1-based ranks. Only ranks are used so scores of different retrievers need not be comparable.
+    Returns (key, score) tuples ordered by decreasing fused score
+    """
+    weights = [1.0] * len(ranked_lists) if weights is None else weights
+    if len(weights) != len(ranked_lists):
+        raise ValueError(f"Expected {len(ranked_lists)} weights, got {len(weights)}")
+    scores: Dict[Hashable, float] = {}
+    for keys, weight in zip(ranked_lists, weights):
+        for rank, key in enumerate(keys, start=1):
+            scores[key] = scores.get(key, 0.0) + weight / (rrf_k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def maximal_marginal_relevance(
+        candidate_vecs: np.ndarray,
+        relevance: np.ndarray,
+        top_k: int,
+        lambda_mult: float = 0.5) -> List[int]:
+    """
+    Greedy maximal marginal relevance selection, each step picks the candidate maximizing
+    lambda_mult * relevance - (1 - lambda_mult) * max cosine similarity to the already selected candidates.
+    The candidate similarity matrix is computed once & each step is a vectorized update over all candidates.
+    Returns the selected candidate indexes in selection order
+    """
+    num_candidates = len(candidate_vecs)
+    top_k = min(top_k, num_candidates)
+    if top_k <= 0:
+        return []
+    vecs = np.asarray(candidate_vecs, dtype=np.float32)
+    vecs = vecs / np.maximum(np.linalg.norm(vecs, axis=1, keepdims=True), 1e-12)
+    similarity = vecs @ vecs.T
+    relevance = np.asarray(relevance, dtype=np.float32)
+    max_sim_selected = np.full(num_candidates, -np.inf, dtype=np.float32)
+    available = np.ones(num_candidates, dtype=bool)
+    selected = []
+    for step in range(top_k):
+        # the first pick is the most relevant candidate, there is nothing to be redundant with yet
+        redundancy = max_sim_selected if step else np.zeros(num_candidates, dtype=np.float32)
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_sim_selected, similarity[:, best], out=max_sim_selected)
+    return selected
+
+
+def mmr_diversify_hits(
+        query_vec: Sequence[float],
+        hits: List[Dict],
+        top_k: int,
+        lambda_mult: float = 0.5,
+        score_key: Optional[str] = None) -> List[Dict]:
+    """
+    Selects top_k diverse hits with maximal marginal relevance. Hits must have an embedding field which is
+    removed from the returned hits. Relevance is the cosine similarity to query_vec or, if score_key is given,
+    the min-max normalized hit[score_key] i.e. cross-encoder scores
+    """
+    if not hits:
+        return hits
+    candidate_vecs = np.asarray([hit["embedding"] for hit in hits], dtype=np.float32)
+    if score_key is None:
+        query = np.asarray(query_vec, dtype=np.float32)
+        relevance = (candidate_vecs @ query) / np.maximum(
+            np.linalg.norm(candidate_vecs, axis=1) * np.linalg.norm(query), 1e-12)
+    else:
+        scores = np.asarray([hit[score_key] for hit in hits], dtype=np.float32)
+        relevance = (scores - scores.min()) / max(float(scores.max() - scores.min()), 1e-12)
+    selected = maximal_marginal_relevance(candidate_vecs, relevance, top_k, lambda_mult)
+    return [{key: value for key, value in hits[idx].items() if key != "embedding"} for idx in selected]
@@ -0,0 +1,119 @@
+"""
+Binary prefilter with float rescoring recall/latency benchmark
+
+Inserts a synthetic corpus (or embeddings sampled from a milvus collection) into a local store collection with a
+binary prefilter & compares the exact float search with binary_rescore_search_milvus for several oversample
+factors. Reports recall@k against float32 exact search, p50/p99 latency & the binary vector bytes at rest.
+
+Runs without milvus unless --source_collection is set. Run from the repo root:
+    python scripts/benchmark_binary.py --num_vectors 100000 --oversample 2 4 8 16
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+sys.path.append("app")
+import config as cfg
+from api.local_store import get_local_collec_conn
+from api.milvus import insert_into_milvus, search_milvus, binary_rescore_search_milvus, get_search_params
+from utils.benchmark import (
+    make_synthetic_corpus, make_queries, brute_force_topk, recall_at_k, latency_stats, time_queries)
+
+
+def run_benchmark(args) -> dict:
+    """
+    Runs the float & binary rescoring searches for each oversample factor, returns the report dict
+    """
+    if args.source_collection:
+        from pymilvus import connections
+        from benchmark_hnsw import sample_collection_embeddings
+        connections.connect(alias="default", host=cfg.MILVUS_HOST, port=cfg.MILVUS_PORT)
+        corpus = sample_collection_embeddings(args.source_collection, args.num_vectors)
+    else:
+        corpus = make_synthetic_corpus(args.num_vectors, args.dim, seed=args.seed)
+    queries = make_queries(corpus, args.num_queries, seed=args.seed + 1)
+    gt_ids, _ = brute_force_topk(corpus, queries, args.k, args.metric_type)
+    print(f"corpus {corpus.shape}, {len(queries)} queries")
+
+    report = {"num_vectors": int(len(corpus)), "dim": int(corpus.shape[1]), "k": args.k,
+              "num_queries": int(len(queries)), "metric_type": args.metric_type, "results": []}
+    search_params = get_search_params(args.metric_type)
+    with tempfile.TemporaryDirectory() as root_dir:
+        collec = get_local_collec_conn(
+            "bench_binary", vector_dim=corpus.shape[1], metric_type=args.metric_type,
+            binary_prefilter=True, root_dir=root_dir, ann_threshold=0)
+        pk_rows = {}
+        for start in range(0, len(corpus), 10000):
+            batch = corpus[start: start + 10000]
+            insert_res = insert_into_milvus(collec, None, [batch, ["doc"] * len(batch), ["bench"] * len(batch),
+                                                           [""] * len(batch)])
+            pk_rows.update({pk: start + idx for idx, pk in enumerate(insert_res["content"])})
+        partition_dir = os.path.join(collec.path, "_default")
+        float_bytes = os.path.getsize(os.path.join(partition_dir, "vectors.f32"))
+        binary_bytes = os.path.getsize(os.path.join(partition_dir, "vectors.b1"))
+        report.update({"float_bytes_per_vector": float_bytes / len(corpus),
+                       "binary_bytes_per_vector": binary_bytes / len(corpus)})
+
+        def float_search_fn(query):
+            hits = search_milvus(collec, None, [query], limit=args.k, search_params=search_params,
+                                 output_fields=[]).get("content", [])
+            return [pk_rows[hit["id"]] for hit in hits]
+
+        runs = [("float", None, float_search_fn)]
+        for oversample in args.oversample:
+            def binary_search_fn(query, _oversample=oversample):
+                hits = binary_rescore_search_milvus(
+                    collec, None, [query], limit=args.k, search_params=search_params, output_fields=[],
+                    oversample=_oversample).get("content", [])
+                return [pk_rows[hit["id"]] for hit in hits]
+            runs.append(("binary", oversample, binary_search_fn))
+
+        for mode, oversample, search_fn in runs:
+            retrieved, latencies = time_queries(search_fn, queries)
+            run = {"mode": mode, "oversample": oversample,
+                   "recall": recall_at_k(retrieved, gt_ids, args.k),
+                   "latency": latency_stats(latencies)}
+            report["results"].append(run)
+            print(f"{mode:<7} oversample={str(oversample):<5} recall@{args.k}={run['recall']:.4f} "
+                  f"p50={run['latency']['p50_ms']:.2f}ms p99={run['latency']['p99_ms']:.2f}ms")
+    print(f"vectors at rest: float {report['float_bytes_per_vector']:.0f}B, "
+          f"binary {report['binary_bytes_per_vector']:.0f}B per vector")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser("Binary prefilter with float rescoring recall/latency benchmark")
+    parser.add_argument('-n', '--num_vectors', type=int, default=50000,
+                        help='num of corpus vectors. (default: %(default)s)')
+    parser.add_argument('-q', '--num_queries', type=int, default=200,
+                        help='num of queries. (default: %(default)s)')
+    parser.add_argument('--dim', type=int, default=cfg.MILVUS_EMB_VECTOR_DIM,
+                        help='synthetic vector dim. (default: %(default)s)')
+    parser.add_argument('-k', '--k', type=int, default=10,
+                        help='recall@k & search limit. (default: %(default)s)')
+    parser.add_argument('--metric_type', type=str, default=cfg.MILVUS_EMB_METRIC_TYPE,
+                        help='rescoring metric. (default: %(default)s)')
+    parser.add_argument('--oversample', type=int, nargs='+', default=[1, 2, 4, 8, 16],
+                        help='binary candidates rescored per result. (default: %(default)s)')
+    parser.add_argument('--source_collection', type=str, default=None,
+                        help='sample the corpus from this milvus collection instead. (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=42,
+                        help='random seed. (default: %(default)s)')
+    parser.add_argument('-o', '--output', type=str,
+                        default=os.path.join(cfg.ROOT_STORAGE_DIR, "bench", "binary_rescore.json"),
+                        help='report json path. (default: %(default)s)')
+    args = parser.parse_args()
+
+    t_0 = time.perf_counter()
+    report = run_benchmark(args)
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, 'w', encoding="utf-8") as fptr:
+        json.dump(report, fptr, indent=2)
+    print(f"report saved to {args.output} in {time.perf_counter() - t_0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
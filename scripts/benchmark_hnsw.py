@@ -0,0 +1,195 @@
+"""
+HNSW recall/latency benchmark for tuning the milvus index & search params
+
+Builds a synthetic corpus (or samples embeddings from an existing collection), computes the
+exact top-k ground truth with numpy brute force & sweeps the HNSW M, efConstruction & ef params.
+Reports recall@k, p50/p99 search latency, index build time & loaded segment memory for each setting.
+
+The milvus service must be running. Run from the repo root:
+    python scripts/benchmark_hnsw.py --num_vectors 100000 --m 8 16 --ef_cons 64 128 --ef 16 32 64 128
+    python scripts/benchmark_hnsw.py --source_collection collection_00001 --save_calibration
+
+With --save_calibration, the ef sweep of the index params set in config.py is saved to
+MILVUS_EMB_EF_CALIBRATION_PATH & used by /search requests with ef=auto
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+
+import numpy as np
+from pymilvus import connections, utility, Collection, CollectionSchema, FieldSchema, DataType
+
+sys.path.append("app")
+import config as cfg
+from utils.benchmark import (
+    make_synthetic_corpus, make_queries, normalize_vectors,
+    brute_force_topk, recall_at_k, latency_stats, time_queries)
+
+
+def sample_collection_embeddings(collection_name: str, num_vectors: int, batch_size: int = 1000) -> np.ndarray:
+    """
+    Samples up to num_vectors stored embeddings from an existing collection
+    """
+    collec = Collection(collection_name)
+    collec.load()
+    iterator = collec.query_iterator(batch_size=batch_size, limit=num_vectors, output_fields=["embedding"])
+    vectors = []
+    while True:
+        batch = iterator.next()
+        if not batch:
+            iterator.close()
+            break
+        vectors.extend(row["embedding"] for row in batch)
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def build_bench_collection(
+        collection_name: str,
+        corpus: np.ndarray,
+        metric_type: str,
+        index_params: dict,
+        insert_batch_size: int = 10000) -> float:
+    """
+    Creates a collection with the corpus rows as entities with ids equal to their row index,
+    builds the hnsw index & loads it. Returns the index build time in seconds
+    """
+    if utility.has_collection(collection_name):
+        utility.drop_collection(collection_name)
+    fields = [
+        FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=False),
+        FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=corpus.shape[1]),
+    ]
+    collec = Collection(name=collection_name, schema=CollectionSchema(fields=fields),
+                        consistency_level="Strong")
+    for start in range(0, len(corpus), insert_batch_size):
+        batch = corpus[start: start + insert_batch_size]
+        collec.insert([list(range(start, start + len(batch))), batch])
+    collec.flush()
+    t_0 = time.perf_counter()
+    collec.create_index(field_name="embedding", index_params={
+        "metric_type": metric_type, "index_type": "HNSW", "params": index_params})
+    utility.wait_for_index_building_complete(collection_name)
+    build_time = time.perf_counter() - t_0
+    collec.load()
+    return build_time
+
+
+def get_loaded_memory_bytes(collection_name: str) -> int:
+    """
+    Sum of the memory used by the loaded segments of a collection as reported by milvus query nodes
+    """
+    return int(sum(seg.mem_size for seg in utility.get_query_segment_info(collection_name)))
+
+
+def run_sweep(args) -> dict:
+    """
+    Runs the index & search param sweep, returns the report dict
+    """
+    if args.source_collection:
+        corpus = sample_collection_embeddings(args.source_collection, args.num_vectors)
+        corpus = normalize_vectors(corpus) if args.metric_type.upper() == "IP" else corpus
+    else:
+        corpus = make_synthetic_corpus(args.num_vectors, args.dim, seed=args.seed)
+    queries = make_queries(corpus, args.num_queries, seed=args.seed + 1)
+    t_0 = time.perf_counter()
+    gt_ids, _ = brute_force_topk(corpus, queries, args.k, args.metric_type)
+    print(f"corpus {corpus.shape}, {len(queries)} queries, "
+          f"brute force ground truth in {time.perf_counter() - t_0:.2f}s")
+
+    report = {"corpus_size": int(len(corpus)), "dim": int(corpus.shape[1]), "k": args.k,
+              "num_queries": int(len(queries)), "metric_type": args.metric_type,
+              "source": args.source_collection or "synthetic", "results": []}
+    for m, ef_cons in itertools.product(args.m, args.ef_cons):
+        collection_name = f"bench_hnsw_m{m}_efc{ef_cons}"
+        index_params = {"M": m, "efConstruction": ef_cons}
+        build_time = build_bench_collection(collection_name, corpus, args.metric_type, index_params)
+        memory_bytes = get_loaded_memory_bytes(collection_name)
+        collec = Collection(collection_name)
+        for ef in sorted(ef for ef in args.ef if ef >= args.k):
+            search_params = {"metric_type": args.metric_type, "params": {"ef": ef}}
+
+            def search_fn(query, _params=search_params):
+                hits = collec.search(data=[query], anns_field="embedding", param=_params, limit=args.k)
+                return [hit.id for hit in hits[0]]
+
+            retrieved, latencies = time_queries(search_fn, queries)
+            run = {"index_params": index_params, "ef": ef,
+                   "recall": recall_at_k(retrieved, gt_ids, args.k),
+                   "latency": latency_stats(latencies),
+                   "index_build_s": build_time,
+                   "memory_bytes": memory_bytes}
+            report["results"].append(run)
+            print(f"M={m:<4} efConstruction={ef_cons:<5} ef={ef:<5} recall@{args.k}={run['recall']:.4f} "
+                  f"p50={run['latency']['p50_ms']:.2f}ms p99={run['latency']['p99_ms']:.2f}ms "
+                  f"mem={memory_bytes / 1024 ** 2:.1f}MB build={build_time:.1f}s")
+        if not args.keep_collections:
+            collec.release()
+            utility.drop_collection(collection_name)
+    return report
+
+
+def save_calibration(report: dict, calibration_path: str) -> None:
+    """
+    Saves the ef sweep of the index params currently set in config.py for ef=auto searches
+    """
+    index_params = {"M": cfg.MILVUS_EMB_INDEX_PARAM_M, "efConstruction": cfg.MILVUS_EMB_INDEX_PARAM_EF_CONS}
+    runs = [{"ef": run["ef"], "recall": run["recall"], "p99_ms": run["latency"]["p99_ms"]}
+            for run in report["results"] if run["index_params"] == index_params]
+    if not runs:
+        print(f"No runs with the configured index params {index_params}, calibration not saved")
+        return
+    calibration = {"index_params": index_params, "k": report["k"], "metric_type": report["metric_type"],
+                   "corpus_size": report["corpus_size"], "source": report["source"], "results": runs}
+    with open(calibration_path, 'w', encoding="utf-8") as fptr:
+        json.dump(calibration, fptr, indent=2)
+    print(f"ef calibration saved to {calibration_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser("HNSW index & search param recall/latency sweep")
+    parser.add_argument('--source_collection', type=str, default=None,
+                        help='sample embeddings from this collection instead of a synthetic corpus. '
+                             '(default: %(default)s)')
+    parser.add_argument('-n', '--num_vectors', type=int, default=50000,
+                        help='corpus size. (default: %(default)s)')
+    parser.add_argument('-q', '--num_queries', type=int, default=500,
+                        help='num of queries. (default: %(default)s)')
+    parser.add_argument('--dim', type=int, default=cfg.MILVUS_EMB_VECTOR_DIM,
+                        help='synthetic vector dim. (default: %(default)s)')
+    parser.add_argument('-k', '--k', type=int, default=10,
+                        help='recall@k & search limit. (default: %(default)s)')
+    parser.add_argument('--metric_type', type=str, default=cfg.MILVUS_EMB_METRIC_TYPE,
+                        help='search metric. (default: %(default)s)')
+    parser.add_argument('--m', type=int, nargs='+', default=[8, 16, 32],
+                        help='hnsw M values. (default: %(default)s)')
+    parser.add_argument('--ef_cons', type=int, nargs='+', default=[64, 128, 256],
+                        help='hnsw efConstruction values. (default: %(default)s)')
+    parser.add_argument('--ef', type=int, nargs='+', default=[10, 16, 32, 64, 128, 256],
+                        help='hnsw search ef values, values < k are skipped. (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=42,
+                        help='random seed. (default: %(default)s)')
+    parser.add_argument('-o', '--output', type=str,
+                        default=os.path.join(cfg.ROOT_STORAGE_DIR, "bench", "hnsw_sweep.json"),
+                        help='report json path. (default: %(default)s)')
+    parser.add_argument('--save_calibration', action='store_true',
+                        help='save the ef sweep of the configured index params for ef=auto searches. '
+                             '(default: %(default)s)')
+    parser.add_argument('--keep_collections', action='store_true',
+                        help='keep the benchmark collections after the run. (default: %(default)s)')
+    args = parser.parse_args()
+
+    connections.connect(alias="default", host=cfg.MILVUS_HOST, port=cfg.MILVUS_PORT)
+    report = run_sweep(args)
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, 'w', encoding="utf-8") as fptr:
+        json.dump(report, fptr, indent=2)
+    print(f"report saved to {args.output}")
+    if args.save_calibration:
+        save_calibration(report, cfg.MILVUS_EMB_EF_CALIBRATION_PATH)
+
+
+if __name__ == "__main__":
+    main()
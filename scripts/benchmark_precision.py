@@ -0,0 +1,119 @@
+"""
+Vector storage precision recall/latency/memory benchmark
+
+Inserts a synthetic corpus (or embeddings sampled from a milvus collection) into local store collections with
+float32, float16 & int8 vectors & runs exact searches against each, so the recall loss is only due to the
+storage precision. Reports recall@k against float32 exact search, p50/p99 latency & the vector bytes at rest.
+
+Runs without milvus unless --source_collection is set. Run from the repo root:
+    python scripts/benchmark_precision.py --num_vectors 100000 --precisions float32 float16 int8
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+sys.path.append("app")
+import config as cfg
+from api.local_store import get_local_collec_conn
+from api.milvus import insert_into_milvus, search_milvus
+from utils.benchmark import (
+    make_synthetic_corpus, make_queries, brute_force_topk, recall_at_k, latency_stats, time_queries)
+
+
+def build_precision_collection(root_dir: str, corpus: np.ndarray, precision: str, metric_type: str,
+                               insert_batch_size: int = 10000):
+    """
+    Creates a local collection storing the corpus with the given precision, exact search only.
+    Returns the collection & the primary key -> corpus row mapping
+    """
+    collec = get_local_collec_conn(
+        f"bench_{precision}", vector_dim=corpus.shape[1], metric_type=metric_type,
+        vector_precision=precision, root_dir=root_dir, ann_threshold=0)
+    pk_rows = {}
+    for start in range(0, len(corpus), insert_batch_size):
+        batch = corpus[start: start + insert_batch_size]
+        insert_res = insert_into_milvus(collec, None, [batch, ["doc"] * len(batch), ["bench"] * len(batch),
+                                                       [""] * len(batch)])
+        pk_rows.update({pk: start + idx for idx, pk in enumerate(insert_res["content"])})
+    return collec, pk_rows
+
+
+def run_benchmark(args) -> dict:
+    """
+    Runs the exact searches for each precision, returns the report dict
+    """
+    if args.source_collection:
+        from pymilvus import connections
+        from benchmark_hnsw import sample_collection_embeddings
+        connections.connect(alias="default", host=cfg.MILVUS_HOST, port=cfg.MILVUS_PORT)
+        corpus = sample_collection_embeddings(args.source_collection, args.num_vectors)
+    else:
+        corpus = make_synthetic_corpus(args.num_vectors, args.dim, seed=args.seed)
+    queries = make_queries(corpus, args.num_queries, seed=args.seed + 1)
+    gt_ids, _ = brute_force_topk(corpus, queries, args.k, args.metric_type)
+    print(f"corpus {corpus.shape}, {len(queries)} queries")
+
+    report = {"num_vectors": int(len(corpus)), "dim": int(corpus.shape[1]), "k": args.k,
+              "num_queries": int(len(queries)), "metric_type": args.metric_type, "results": []}
+    with tempfile.TemporaryDirectory() as root_dir:
+        for precision in args.precisions:
+            collec, pk_rows = build_precision_collection(root_dir, corpus, precision, args.metric_type)
+
+            def search_fn(query, _collec=collec, _pk_rows=pk_rows):
+                hits = search_milvus(_collec, None, [query], limit=args.k, output_fields=[]).get("content", [])
+                return [_pk_rows[hit["id"]] for hit in hits]
+
+            retrieved, latencies = time_queries(search_fn, queries)
+            vectors_file = next(name for name in os.listdir(os.path.join(collec.path, "_default"))
+                                if name.startswith("vectors."))
+            vector_bytes = os.path.getsize(os.path.join(collec.path, "_default", vectors_file))
+            run = {"precision": precision,
+                   "recall": recall_at_k(retrieved, gt_ids, args.k),
+                   "latency": latency_stats(latencies),
+                   "bytes_per_vector": vector_bytes / len(corpus),
+                   "vector_mb": vector_bytes / 1024 ** 2}
+            report["results"].append(run)
+            print(f"{precision:<8} recall@{args.k}={run['recall']:.4f} "
+                  f"p50={run['latency']['p50_ms']:.2f}ms p99={run['latency']['p99_ms']:.2f}ms "
+                  f"vectors={run['vector_mb']:.1f}MB ({run['bytes_per_vector']:.0f}B/vector)")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser("Vector storage precision recall/latency/memory benchmark")
+    parser.add_argument('-n', '--num_vectors', type=int, default=50000,
+                        help='num of corpus vectors. (default: %(default)s)')
+    parser.add_argument('-q', '--num_queries', type=int, default=200,
+                        help='num of queries. (default: %(default)s)')
+    parser.add_argument('--dim', type=int, default=cfg.MILVUS_EMB_VECTOR_DIM,
+                        help='synthetic vector dim. (default: %(default)s)')
+    parser.add_argument('-k', '--k', type=int, default=10,
+                        help='recall@k & search limit. (default: %(default)s)')
+    parser.add_argument('--metric_type', type=str, default=cfg.MILVUS_EMB_METRIC_TYPE,
+                        help='search metric. (default: %(default)s)')
+    parser.add_argument('--precisions', type=str, nargs='+', default=["float32", "float16", "int8"],
+                        help='vector storage precisions. (default: %(default)s)')
+    parser.add_argument('--source_collection', type=str, default=None,
+                        help='sample the corpus from this milvus collection instead. (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=42,
+                        help='random seed. (default: %(default)s)')
+    parser.add_argument('-o', '--output', type=str,
+                        default=os.path.join(cfg.ROOT_STORAGE_DIR, "bench", "precision.json"),
+                        help='report json path. (default: %(default)s)')
+    args = parser.parse_args()
+
+    t_0 = time.perf_counter()
+    report = run_benchmark(args)
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, 'w', encoding="utf-8") as fptr:
+        json.dump(report, fptr, indent=2)
+    print(f"report saved to {args.output} in {time.perf_counter() - t_0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
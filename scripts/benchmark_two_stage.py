@@ -0,0 +1,118 @@
+"""
+Two-stage doc routed search recall/latency benchmark against flat search
+
+Builds a synthetic tenant of docs made of chunks, stores the doc centroids with DocCentroidStore & compares
+a flat exact search over all chunks with the two-stage search which first picks the num_docs docs with the
+most similar centroids & then searches their chunks only. Chunk search is exact in both cases so the recall
+loss is only due to routing. Reports recall@k, p50/p99 latency & the mean fraction of chunks scanned per query.
+
+Runs without milvus. Run from the repo root:
+    python scripts/benchmark_two_stage.py --num_docs 5000 --chunks_per_doc 20 --route_docs 5 10 20 50
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+sys.path.append("app")
+import config as cfg
+from api.doc_centroids import DocCentroidStore
+from utils.benchmark import (
+    make_synthetic_documents, make_queries, brute_force_topk, recall_at_k, latency_stats, time_queries)
+
+
+def build_centroid_store(root_dir: str, corpus: np.ndarray, doc_labels: np.ndarray) -> DocCentroidStore:
+    """
+    Stores the centroid of every synthetic doc for a single benchmark user
+    """
+    store = DocCentroidStore(root_dir)
+    # one write with all centroids, adding docs one at a time rewrites the file per doc
+    store.add_docs("bench", {f"doc_{label}": corpus[doc_labels == label] for label in range(doc_labels.max() + 1)})
+    return store
+
+
+def run_benchmark(args) -> dict:
+    """
+    Runs the flat & two-stage searches for each num of routed docs, returns the report dict
+    """
+    corpus, doc_labels = make_synthetic_documents(args.num_docs, args.chunks_per_doc, args.dim, seed=args.seed)
+    queries = make_queries(corpus, args.num_queries, seed=args.seed + 1)
+    gt_ids, _ = brute_force_topk(corpus, queries, args.k, args.metric_type)
+    doc_rows = {f"doc_{label}": np.flatnonzero(doc_labels == label) for label in range(args.num_docs)}
+    print(f"{args.num_docs} docs, corpus {corpus.shape}, {len(queries)} queries")
+
+    report = {"num_docs": args.num_docs, "chunks_per_doc": args.chunks_per_doc, "dim": args.dim, "k": args.k,
+              "num_queries": int(len(queries)), "metric_type": args.metric_type, "results": []}
+
+    def flat_fn(query):
+        ids, _ = brute_force_topk(corpus, query[None, :], args.k, args.metric_type)
+        return ids[0].tolist()
+
+    retrieved, latencies = time_queries(flat_fn, queries)
+    flat = {"mode": "flat", "recall": recall_at_k(retrieved, gt_ids, args.k),
+            "latency": latency_stats(latencies), "scanned_fraction": 1.0}
+    report["results"].append(flat)
+    print(f"flat            recall@{args.k}={flat['recall']:.4f} "
+          f"p50={flat['latency']['p50_ms']:.2f}ms p99={flat['latency']['p99_ms']:.2f}ms scanned=1.0000")
+
+    with tempfile.TemporaryDirectory() as root_dir:
+        store = build_centroid_store(root_dir, corpus, doc_labels)
+        for route_docs in args.route_docs:
+            scanned = []
+
+            def two_stage_fn(query, _route_docs=route_docs):
+                routed = store.top_docs("bench", query, _route_docs, args.metric_type)
+                rows = np.concatenate([doc_rows[doc_id] for doc_id, _ in routed])
+                scanned.append(len(rows) / len(corpus))
+                ids, _ = brute_force_topk(corpus[rows], query[None, :], args.k, args.metric_type)
+                return rows[ids[0]].tolist()
+
+            retrieved, latencies = time_queries(two_stage_fn, queries)
+            run = {"mode": "two_stage", "route_docs": route_docs,
+                   "recall": recall_at_k(retrieved, gt_ids, args.k),
+                   "latency": latency_stats(latencies),
+                   "scanned_fraction": float(np.mean(scanned))}
+            report["results"].append(run)
+            print(f"two_stage M={route_docs:<5} recall@{args.k}={run['recall']:.4f} "
+                  f"p50={run['latency']['p50_ms']:.2f}ms p99={run['latency']['p99_ms']:.2f}ms "
+                  f"scanned={run['scanned_fraction']:.4f}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser("Two-stage doc routed search vs flat search recall/latency benchmark")
+    parser.add_argument('--num_docs', type=int, default=2000,
+                        help='num of docs of the tenant. (default: %(default)s)')
+    parser.add_argument('--chunks_per_doc', type=int, default=20,
+                        help='num of chunks per doc. (default: %(default)s)')
+    parser.add_argument('-q', '--num_queries', type=int, default=200,
+                        help='num of queries. (default: %(default)s)')
+    parser.add_argument('--dim', type=int, default=cfg.MILVUS_EMB_VECTOR_DIM,
+                        help='synthetic vector dim. (default: %(default)s)')
+    parser.add_argument('-k', '--k', type=int, default=10,
+                        help='recall@k & search limit. (default: %(default)s)')
+    parser.add_argument('--metric_type', type=str, default=cfg.MILVUS_EMB_METRIC_TYPE,
+                        help='search metric. (default: %(default)s)')
+    parser.add_argument('--route_docs', type=int, nargs='+', default=[5, 10, 20, 50, 100],
+                        help='num of docs routed to in the first stage. (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=42,
+                        help='random seed. (default: %(default)s)')
+    parser.add_argument('-o', '--output', type=str,
+                        default=os.path.join(cfg.ROOT_STORAGE_DIR, "bench", "two_stage.json"),
+                        help='report json path. (default: %(default)s)')
+    args = parser.parse_args()
+
+    t_0 = time.perf_counter()
+    report = run_benchmark(args)
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, 'w', encoding="utf-8") as fptr:
+        json.dump(report, fptr, indent=2)
+    print(f"report saved to {args.output} in {time.perf_counter() - t_0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Migrates user entities from the per-user partition layout to the partition key collection
+
+Copies every user partition of the collection shards (MILVUS_EMB_COLLECTION_NAME_FMT) into the
+MILVUS_EMB_PK_COLLECTION_NAME collection where user_id is the partition key & user_id/doc_id have
+scalar indexes. Fully migrated users are skipped & partially migrated ones are copied again
+so an interrupted run can be resumed. The entities get new primary keys, so the lexical index & doc centroids
+of every user are rebuilt from the new collection.
+Set MILVUS_TENANCY_MODE=partition_key after the migration to serve from the new collection.
+
+The milvus service must be running. Run from the repo root:
+    python scripts/migrate_partition_key.py
+    python scripts/migrate_partition_key.py --drop_source  # drop migrated source partitions
+"""
+import sys
+import argparse
+
+from pymilvus import connections, utility
+
+sys.path.append("app")
+import config as cfg
+from api.milvus import (
+    BINARY_VECTOR_FIELD, get_milvus_collec_conn, load_partition_milvus, insert_into_milvus, decode_vector_field)
+from api.tenant_placement import get_user_id_expr
+from api.chunk_text_store import ChunkTextStore
+from api.lexical_index import LexicalIndexStore
+from api.doc_centroids import DocCentroidStore
+from api.reindex import rebuild_user_indexes
+
+
+def migrate_partition(source_collec, target_collec, partition_name: str, batch_size: int) -> int:
+    """
+    Copies all entities of a source partition to the target collection in batches. Returns num entities copied
+    """
+    # non auto_id fields in schema order, i.e. the chunk text offsets instead of content with CHUNK_TEXT_STORE=file
+    # binary embeddings are derived from the float embeddings by insert_into_milvus if the target has a prefilter
+    fields = [field.name for field in source_collec.schema.fields if field.name not in ("id", BINARY_VECTOR_FIELD)]
+    iterator = source_collec.query_iterator(
+        batch_size=batch_size, output_fields=fields, partition_names=[partition_name])
+    num_copied = 0
+    while True:
+        batch = iterator.next()
+        if not batch:
+            iterator.close()
+            break
+        columns = [[row[field] for row in batch] for field in fields]
+        columns[0] = [decode_vector_field(emb) for emb in columns[0]]
+        insert_into_milvus(target_collec, None, columns)
+        num_copied += len(batch)
+    return num_copied
+
+
+def main():
+    parser = argparse.ArgumentParser("Migrate per-user partitions to a partition key collection")
+    parser.add_argument('-b', '--batch_size', type=int, default=5000,
+                        help='num of entities copied per batch. (default: %(default)s)')
+    parser.add_argument('--drop_source', action='store_true',
+                        help='drop source partitions after they are migrated. (default: %(default)s)')
+    args = parser.parse_args()
+
+    connections.connect(alias="default", host=cfg.MILVUS_HOST, port=cfg.MILVUS_PORT)
+    target_collec = get_milvus_collec_conn(
+        collection_name=cfg.MILVUS_EMB_PK_COLLECTION_NAME,
+        vector_dim=cfg.MILVUS_EMB_VECTOR_DIM,
+        metric_type=cfg.MILVUS_EMB_METRIC_TYPE,
+        index_type=cfg.MILVUS_EMB_INDEX_TYPE,
+        index_metric_params={
+            "M": cfg.MILVUS_EMB_INDEX_PARAM_M,
+            "efConstruction": cfg.MILVUS_EMB_INDEX_PARAM_EF_CONS},
+        partition_key_mode=True,
+        num_partitions=cfg.MILVUS_PARTITION_KEY_NUM_PARTITIONS,
+        store_chunk_text=cfg.CHUNK_TEXT_STORE == "milvus",
+        vector_precision=cfg.VECTOR_PRECISION,
+        binary_prefilter=cfg.BINARY_PREFILTER)
+    target_collec.load()
+    # the lexical index postings reference the primary keys of the source entities
+    lexical_index = LexicalIndexStore(
+        cfg.LEXICAL_INDEX_DIR, cache_size=1, max_segments=cfg.LEXICAL_INDEX_MAX_SEGMENTS, k1=cfg.BM25_K1, b=cfg.BM25_B)
+    doc_centroids = DocCentroidStore(cfg.DOC_CENTROID_DIR, cache_size=1)
+    text_store = ChunkTextStore(cfg.FILE_STORAGE_DIR, cache_size=cfg.CHUNK_TEXT_CACHE_SIZE)
+
+    shard_idx = 1
+    total_users, total_entities = 0, 0
+    while utility.has_collection(cfg.MILVUS_EMB_COLLECTION_NAME_FMT % shard_idx):
+        source_collec = get_milvus_collec_conn(cfg.MILVUS_EMB_COLLECTION_NAME_FMT % shard_idx)
+        for partition in source_collec.partitions:
+            if not partition.name.startswith("partition_"):
+                continue
+            user_id = partition.name[len("partition_"):]
+            user_expr = get_user_id_expr(user_id)
+            load_partition_milvus(source_collec, partition.name)
+            num_source = source_collec.query(
+                expr="", output_fields=["count(*)"], partition_names=[partition.name])[0]["count(*)"]
+            num_target = target_collec.query(expr=user_expr, output_fields=["count(*)"])[0]["count(*)"]
+            if num_target and num_target == num_source:
+                print(f"{source_collec.name}/{partition.name} already migrated, skipping")
+            else:
+                if num_target:  # partially migrated by an interrupted run
+                    target_collec.delete(user_expr)
+                num_copied = migrate_partition(source_collec, target_collec, partition.name, args.batch_size)
+                target_collec.flush()
+                total_entities += num_copied
+                print(f"{source_collec.name}/{partition.name}: {num_copied} entities migrated")
+            # also for skipped users as an interrupted run may have stopped before their indexes were rebuilt
+            num_indexed = rebuild_user_indexes(
+                target_collec, None, user_expr, user_id, lexical_index, doc_centroids, text_store, args.batch_size)
+            print(f"{source_collec.name}/{partition.name}: lexical index & doc centroids of {num_indexed} chunks "
+                  f"rebuilt")
+            total_users += 1
+            source_collec.partition(partition.name).release()
+            if args.drop_source:
+                source_collec.drop_partition(partition.name)
+        shard_idx += 1
+    print(f"migrated {total_entities} entities of {total_users} users to {target_collec.name}")
+
+
+if __name__ == "__main__":
+    main()
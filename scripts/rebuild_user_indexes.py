@@ -0,0 +1,55 @@
+"""
+Rebuilds the lexical indexes & doc centroids of users from the collections of a model version
+
+Hybrid & two-stage searches only find the docs indexed by the upsert routes, so docs upserted before the lexical
+index & doc centroids existed are backfilled with this script. The rebuilt indexes replace the existing ones &
+reference the current milvus primary keys of the user entities.
+
+The milvus & mongodb services must be running. Run from the repo root:
+    python scripts/rebuild_user_indexes.py                 # all users of the active version
+    python scripts/rebuild_user_indexes.py --user_id 0 1   # some users
+    python scripts/rebuild_user_indexes.py --version v2    # users of another version
+"""
+import sys
+import argparse
+
+sys.path.append("app")
+from config import MONGO_USER_DB, MONGO_USER_COLLECTION
+from setup import mongodb_client, model_versions, chunk_text_store
+from api.milvus import load_partition_milvus
+from api.reindex import rebuild_user_indexes
+
+
+def main():
+    parser = argparse.ArgumentParser("Rebuild the lexical indexes & doc centroids of users")
+    parser.add_argument('-u', '--user_id', type=str, nargs='+', default=None,
+                        help='users to rebuild, all registered users if not set. (default: %(default)s)')
+    parser.add_argument('-v', '--version', type=str, default=None,
+                        help='model version, the active version if not set. (default: %(default)s)')
+    parser.add_argument('-b', '--batch_size', type=int, default=2000,
+                        help='num of entities read per batch. (default: %(default)s)')
+    args = parser.parse_args()
+
+    model = model_versions.get(args.version) if args.version else model_versions.active()
+    user_ids = args.user_id
+    if user_ids is None:
+        users = mongodb_client[MONGO_USER_DB][MONGO_USER_COLLECTION]
+        user_ids = [user["_id"] for user in users.find({}, {"_id": 1})]
+    total_chunks = 0
+    for user_id in user_ids:
+        milvus_client = model.placement.get_collection(user_id)
+        if milvus_client is None:
+            print(f"user {user_id} has no collection in version {model.version}, skipping")
+            continue
+        partition_name = model.placement.get_partition_name(user_id)
+        load_partition_milvus(milvus_client, partition_name)
+        num_chunks = rebuild_user_indexes(
+            milvus_client, partition_name, model.placement.get_user_expr(user_id), user_id,
+            model.lexical_index, model.doc_centroids, chunk_text_store, args.batch_size)
+        total_chunks += num_chunks
+        print(f"user {user_id}: lexical index & doc centroids of {num_chunks} chunks rebuilt")
+    print(f"rebuilt the indexes of {len(user_ids)} users with {total_chunks} chunks in version {model.version}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Export & import user snapshots through the api
+
+export streams GET /users/{user_id}/snapshot to a file, import registers the user from the snapshot user profile
+if they do not exist yet & restores the snapshot with POST /users/{user_id}/snapshot. The vectors are restored
+as is, both deployments must use the same embedding model.
+
+Run from the repo root:
+    python scripts/snapshot.py export --user_id 0 --path user_0.snap
+    python scripts/snapshot.py import --user_id 0 --path user_0.snap --api_url http://other-host:8080
+"""
+import sys
+import time
+import argparse
+
+import requests
+
+sys.path.append("app")
+from api.snapshot import SnapshotReader
+
+
+def export_snapshot(api_url: str, user_id: str, path: str, batch_size: int = None) -> int:
+    """
+    Streams the snapshot of user_id to path, returns num of bytes written
+    """
+    params = {"batch_size": batch_size} if batch_size else None
+    num_bytes = 0
+    with requests.get(f"{api_url}/users/{user_id}/snapshot", params=params, stream=True, timeout=600) as resp:
+        resp.raise_for_status()
+        with open(path, "wb") as fptr:
+            for data in resp.iter_content(chunk_size=1 << 20):
+                fptr.write(data)
+                num_bytes += len(data)
+    return num_bytes
+
+
+def import_snapshot(api_url: str, user_id: str, path: str) -> dict:
+    """
+    Restores the snapshot at path into user_id, the user is registered first if they do not exist
+    """
+    with open(path, "rb") as fptr:
+        user = SnapshotReader(fptr).header.get("user", {})
+    if requests.get(f"{api_url}/users/{user_id}", timeout=60).status_code == 404:
+        resp = requests.post(f"{api_url}/users", timeout=60, params={
+            "user_id": user_id, "user_name": user.get("name", user_id), "user_email": user.get("email", "")})
+        resp.raise_for_status()
+        print(resp.json()["detail"])
+    with open(path, "rb") as fptr:
+        resp = requests.post(f"{api_url}/users/{user_id}/snapshot", timeout=3600,
+                             files={"file": (path, fptr, "application/octet-stream")})
+    resp.raise_for_status()
+    return resp.json()
+
+
+def main():
+    parser = argparse.ArgumentParser("Export & import user snapshots through the api")
+    parser.add_argument('command', choices=["export", "import"],
+                        help='export the snapshot of a user to path or import the snapshot at path')
+    parser.add_argument('-u', '--user_id', type=str, required=True,
+                        help='user to export or to import into')
+    parser.add_argument('-p', '--path', type=str, required=True,
+                        help='snapshot file path')
+    parser.add_argument('--api_url', type=str, default="http://127.0.0.1:8080",
+                        help='chatbot backend api url. (default: %(default)s)')
+    parser.add_argument('--batch_size', type=int, default=None,
+                        help='export rows per block, the server default if unset. (default: %(default)s)')
+    args = parser.parse_args()
+
+    t_0 = time.perf_counter()
+    if args.command == "export":
+        num_bytes = export_snapshot(args.api_url, args.user_id, args.path, args.batch_size)
+        print(f"snapshot of user {args.user_id} saved to {args.path}, {num_bytes / 1024 ** 2:.1f}MB")
+    else:
+        print(import_snapshot(args.api_url, args.user_id, args.path)["detail"])
+    print(f"done in {time.perf_counter() - t_0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
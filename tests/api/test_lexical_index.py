@@ -0,0 +1,32 @@
+"""
+Test the per-user lexical index
+"""
+from api.lexical_index import LexicalIndexStore
+
+
+def test_lexical_index_rebuild_user_replaces_ids(tmp_path):
+    index = LexicalIndexStore(str(tmp_path))
+    index.add_chunks("u", [1, 2], ["d1", "d2"], ["error ERR-404 page", "other text"])
+    index.delete_docs("u", ["d2"])
+    # entities inserted again under new primary keys, i.e. by the partition key migration
+    index.rebuild_user("u", [11, 12], ["d1", "d2"], ["error ERR-404 page", "other text"])
+    assert [hit["id"] for hit in index.search("u", "ERR-404")] == [11]
+    assert [hit["id"] for hit in index.search("u", "other")] == [12]
+    assert len([name for name in (tmp_path / "user_u").iterdir() if name.name.startswith("seg_")]) == 1
+
+
+def test_lexical_index_readd_deleted_doc(tmp_path):
+    index = LexicalIndexStore(str(tmp_path))
+    index.add_chunks("u", [1], ["d1"], ["old text"])
+    index.delete_docs("u", ["d1"])
+    index.add_chunks("u", [2], ["d1"], ["new text"])
+    assert index.search("u", "old") == []
+    assert [hit["id"] for hit in index.search("u", "new text")] == [2]
+
+
+def test_lexical_index_drop_user(tmp_path):
+    index = LexicalIndexStore(str(tmp_path))
+    index.add_chunks("u", [1], ["d1"], ["some text"])
+    index.drop_user("u")
+    assert index.search("u", "text") == []
+    index.drop_user("missing")
@@ -0,0 +1,24 @@
+"""
+Test the milvus api helpers
+"""
+from types import SimpleNamespace
+
+from api.milvus import delete_docs_in_batches_milvus
+
+
+class FakeCollection:
+    def __init__(self):
+        self.deletes = []
+
+    def delete(self, expr, partition_name=None):
+        self.deletes.append(expr)
+        return SimpleNamespace(delete_count=2)
+
+
+def test_delete_docs_in_batches_uses_bounded_expressions():
+    milvus_client = FakeCollection()
+    num_deleted = delete_docs_in_batches_milvus(
+        milvus_client, ["a", "b", "c"], batch_size=2, get_expr=lambda expr: f'(user_id == "u") and ({expr})')
+    assert num_deleted == 4
+    assert milvus_client.deletes == [
+        '(user_id == "u") and (doc_id in ["a", "b"])', '(user_id == "u") and (doc_id in ["c"])']
@@ -0,0 +1,83 @@
+"""
+Test the partition load manager, a fake collection tracks the loaded partitions
+"""
+from pymilvus import MilvusException
+
+from api.partition_manager import PartitionLoadManager
+
+
+class FakePartition:
+    def __init__(self, collection, name):
+        self.collection, self.name = collection, name
+        self.num_entities = collection.partition_entities
+
+    def release(self):
+        self.collection.loaded.discard(self.name)
+
+
+class FakeCollection:
+    def __init__(self, name="fake", partition_entities=100):
+        self.name, self.partition_entities = name, partition_entities
+        self.loaded = set()
+        self.num_entities = partition_entities
+
+    def load(self, partition_names=None, replica_number=1):
+        self.loaded.update(partition_names or [None])
+
+    def partition(self, partition_name):
+        return FakePartition(self, partition_name)
+
+    def release(self):
+        self.loaded.clear()
+
+    def search(self, partition_name):
+        if partition_name not in self.loaded:
+            raise MilvusException(message=f"partition {partition_name} not loaded")
+        return partition_name
+
+
+def test_partition_manager_lru_order():
+    manager = PartitionLoadManager(max_loaded_partitions=2, preload_interval_s=0)
+    collection = FakeCollection()
+    assert not manager.ensure_loaded(collection, "p1")
+    assert not manager.ensure_loaded(collection, "p2")
+    assert manager.ensure_loaded(collection, "p1")
+    # p2 is the least recently used partition
+    manager.ensure_loaded(collection, "p3")
+    assert collection.loaded == {"p1", "p3"}
+    assert manager.metrics()["evictions"] == 1
+
+
+def test_partition_manager_memory_budget():
+    manager = PartitionLoadManager(max_loaded_partitions=0, max_memory_bytes=250, entity_bytes=1, preload_interval_s=0)
+    collection = FakeCollection(partition_entities=100)
+    for partition_name in ["p1", "p2", "p3"]:
+        manager.ensure_loaded(collection, partition_name)
+    assert collection.loaded == {"p2", "p3"}
+    assert manager.metrics()["loaded_bytes_est"] == 200
+
+
+def test_partition_manager_pinned_not_evicted():
+    manager = PartitionLoadManager(max_loaded_partitions=2, preload_interval_s=0)
+    collection, shared = FakeCollection(), FakeCollection(name="shared")
+    manager.ensure_loaded(collection, "p1", pin=True)
+    # a whole shared partition key collection is never evicted
+    manager.ensure_loaded(shared, None)
+    manager.ensure_loaded(collection, "p2")
+    assert collection.loaded == {"p1", "p2"} and shared.loaded == {None}
+    assert manager.metrics()["evictions"] == 0
+    # the budget was exceeded as nothing could be evicted, unpinned partitions are evicted until it is met
+    manager.unpin(collection, "p1")
+    manager.ensure_loaded(collection, "p3")
+    assert collection.loaded == {"p3"} and shared.loaded == {None}
+
+
+def test_partition_manager_reloads_not_loaded():
+    manager = PartitionLoadManager(preload_interval_s=0)
+    collection = FakeCollection()
+    manager.ensure_loaded(collection, "p1")
+    # released by another worker, the search is retried once the partition is loaded again
+    collection.release()
+    assert manager.run_loaded(collection, "p1", collection.search, "p1") == "p1"
+    assert manager.metrics()["reloads"] == 1
+    assert manager.metrics()["pinned_partitions"] == 0
@@ -4,6 +4,7 @@ Test configurations
 import os
 import shutil
 import requests
+import httpx
 import pytest
 import pytest_asyncio
 from httpx import AsyncClient
@@ -32,7 +33,7 @@ os.environ["MONGO_DOC_COLLECTION"] = TEST_MONGO_DOC_COLLECTION
 # custom imports
 import app.config as cfg
 from app.server import app
-from app.api.milvus import get_milvus_collec_conn
+from app.api.vector_store import get_vector_store_backend
 
 
 def _load_file_content(fpath: str) -> bytes:
@@ -58,14 +59,20 @@ async def test_app_asyncio():
 
 @pytest.fixture(scope="session")
 def test_milvus_conn():
-    """Yields a milvus collection connection instance"""
+    """Yields a milvus collection connection instance, a local collection with VECTOR_STORE_BACKEND=local"""
     print("Setting milvus connection & creating collection if it already doesn't exist")
-    connections.connect(
-        alias="default",
-        host=cfg.MILVUS_HOST,
-        port=cfg.MILVUS_PORT)
-
-    milvus_collec_conn = get_milvus_collec_conn(
+    milvus_backend = cfg.VECTOR_STORE_BACKEND == "milvus"
+    if milvus_backend:
+        connections.connect(
+            alias="default",
+            host=cfg.MILVUS_HOST,
+            port=cfg.MILVUS_PORT)
+    get_collec_conn, _ = get_vector_store_backend(
+        cfg.VECTOR_STORE_BACKEND,
+        root_dir=cfg.LOCAL_VECTOR_STORE_DIR,
+        ann_threshold=cfg.LOCAL_VECTOR_STORE_ANN_THRESHOLD)
+
+    milvus_collec_conn = get_collec_conn(
         collection_name=TEST_MILVUS_COLLECTION_NAME,
         vector_dim=cfg.MILVUS_EMB_VECTOR_DIM,
         metric_type=cfg.MILVUS_EMB_METRIC_TYPE,
@@ -77,8 +84,25 @@ def test_milvus_conn():
     yield milvus_collec_conn
     # drop test collections in teardown
     print("Tearing milvus connection")
-    utility.drop_collection(TEST_MILVUS_COLLECTION_NAME)
-    connections.disconnect("default")
+    if milvus_backend:
+        utility.drop_collection(TEST_MILVUS_COLLECTION_NAME)
+        connections.disconnect("default")
+    else:
+        milvus_collec_conn.release()
+        shutil.rmtree(os.path.join(cfg.LOCAL_VECTOR_STORE_DIR, TEST_MILVUS_COLLECTION_NAME))
+
+
+@pytest.fixture(scope="function")
+def stub_llm_client(monkeypatch):
+    """Replaces the qa llm client with a client of the in-process OpenAI compatible stub server"""
+    import routes.qa
+    from api.llm import OpenAICompatibleLLM
+    from api.llm_stub.server import app as llm_stub_app
+
+    llm_client = OpenAICompatibleLLM(
+        "http://llm-stub/v1", "stub-llm", transport=httpx.ASGITransport(app=llm_stub_app))
+    monkeypatch.setattr(routes.qa, "llm_client", llm_client)
+    return llm_client
 
 
 @pytest.fixture(scope="session")
@@ -0,0 +1,102 @@
+import pytest
+
+
+@pytest.mark.asyncio
+@pytest.mark.order(after=["test_search.py::test_search_existing"])
+async def test_get_partition_metrics(test_app_asyncio, test_milvus_conn):
+
+    response = await test_app_asyncio.get("/admin/partitions/metrics")
+    assert response.status_code == 200
+    metrics = response.json()["content"]
+    assert metrics["hits"] + metrics["misses"] > 0
+    assert metrics["loaded_partitions"] <= metrics["max_loaded_partitions"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.order(after=["test_search.py::test_search_existing"])
+async def test_get_db_pool_metrics(test_app_asyncio, test_mongodb_conn, test_milvus_conn):
+
+    response = await test_app_asyncio.get("/admin/db_pools/metrics")
+    assert response.status_code == 200
+    metrics = response.json()["content"]
+    assert metrics["mongo"]["calls"] > 0 and metrics["milvus"]["calls"] > 0
+    assert metrics["milvus"]["pending"] <= metrics["milvus"]["calls"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.order(after=["test_search.py::test_search_existing"])
+async def test_get_existence_cache_metrics(test_app_asyncio, test_mongodb_conn, test_milvus_conn, mock_user_data_dict):
+
+    user_data = mock_user_data_dict()
+    response = await test_app_asyncio.get("/admin/existence_cache/metrics")
+    hits = response.json()["content"]["hits"]
+    # the second search reuses the user & partition checks cached by the first one
+    for _ in range(2):
+        response = await test_app_asyncio.post(f"/search/{user_data['user_id']}", params={"query": "cuda devices"})
+        assert response.status_code == 200
+
+    response = await test_app_asyncio.get("/admin/existence_cache/metrics")
+    assert response.status_code == 200
+    metrics = response.json()["content"]
+    assert metrics["hits"] >= hits + 2
+    assert metrics["size"] > 0
+
+
+@pytest.mark.asyncio
+async def test_get_model_versions(test_app_asyncio, test_mongodb_conn):
+
+    response = await test_app_asyncio.get("/admin/models")
+    assert response.status_code == 200
+    content = response.json()["content"]
+    assert content["active"] in [spec["_id"] for spec in content["versions"]]
+
+
+@pytest.mark.asyncio
+async def test_reindex_active_model_version(test_app_asyncio, test_mongodb_conn):
+
+    active = (await test_app_asyncio.get("/admin/models")).json()["content"]["active"]
+    response = await test_app_asyncio.post(f"/admin/models/{active}/reindex", params={
+        "model_name": "sentence-transformers/all-MiniLM-L6-v2", "vector_dim": 384,
+        "emb_api_url": "http://hf_text_embedding_api:8009"})
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+@pytest.mark.order(after=["test_search.py::test_search_existing"])
+async def test_get_collection_indexes(test_app_asyncio, test_milvus_conn):
+
+    response = await test_app_asyncio.get("/admin/indexes")
+    assert response.status_code == 200
+    for info in response.json()["content"]:
+        assert info["index"]["index_type"] in ["HNSW", "IVF_FLAT", "IVF_PQ", "DISKANN", "FLAT"]
+        assert info["est_memory_bytes"] >= 0
+
+
+@pytest.mark.asyncio
+async def test_rebuild_collection_index_invalid(test_app_asyncio, test_milvus_conn):
+
+    response = await test_app_asyncio.post("/admin/indexes/non_existent_collection/rebuild",
+                                           params={"index_type": "IVF_PQ"})
+    assert response.status_code == 404
+
+    collections = (await test_app_asyncio.get("/admin/indexes")).json()["content"]
+    if collections:
+        collection_name = collections[0]["collection_name"]
+        response = await test_app_asyncio.post(f"/admin/indexes/{collection_name}/rebuild",
+                                               params={"index_type": "SCANN"})
+        assert response.status_code == 400
+        response = await test_app_asyncio.post(f"/admin/indexes/{collection_name}/rebuild",
+                                               params={"index_type": "IVF_PQ"}, json={"m": 7})
+        assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+@pytest.mark.order(after=["test_upsert.py::test_upsert_file_txt"])
+async def test_get_blob_metrics(test_app_asyncio, test_mongodb_conn):
+
+    response = await test_app_asyncio.get("/admin/blobs/metrics")
+    assert response.status_code == 200
+    metrics = response.json()["content"]
+    # files are stored once, compressed unless it does not pay off
+    assert metrics["blobs"] > 0 and metrics["refs"] >= metrics["blobs"]
+    assert metrics["stored_size"] <= metrics["size"]
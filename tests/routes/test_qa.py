@@ -30,3 +30,23 @@ async def test_search_non_existing(test_app_asyncio, test_mongodb_conn, test_mil
     assert response.status_code == 200
     json_response = response.json()
     assert "content" not in json_response
+
+
+@pytest.mark.asyncio
+@pytest.mark.order(after=["test_upsert.py::test_upsert_file_txt"])
+async def test_qa_answer_stream(
+        test_app_asyncio, test_mongodb_conn, test_milvus_conn, mock_user_data_dict, stub_llm_client):
+
+    user_data = mock_user_data_dict()
+    param_dict = {"query": "cuda devices", "answer": True}
+
+    events = []
+    async with test_app_asyncio.stream("POST", f"/qa/{user_data['user_id']}", params=param_dict) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        async for line in response.aiter_lines():
+            if line.startswith("event:"):
+                events.append(line[len("event:"):].strip())
+    assert events[0] == "context"
+    assert "token" in events
+    assert events[-1] == "done"
@@ -1,3 +1,6 @@
+import time
+import asyncio
+
 import pytest
 
 
@@ -30,3 +33,207 @@ async def test_search_non_existing(test_app_asyncio, test_mongodb_conn, test_mil
     assert response.status_code == 200
     json_response = response.json()
     assert "content" not in json_response
+
+
+@pytest.mark.asyncio
+@pytest.mark.order(after=["test_upsert.py::test_upsert_file_txt"])
+async def test_search_doc_id_with_quotes(test_app_asyncio, test_mongodb_conn, test_milvus_conn, mock_user_data_dict):
+
+    # a quoted doc id must not be able to widen the doc filter to the entities of other users
+    user_data = mock_user_data_dict()
+    param_dict = {"query": "cuda devices",
+                  "doc_id_list": ['x"]) or (id > 0 or doc_id in ["']}
+
+    response = await test_app_asyncio.post(
+        f"/search/{user_data['user_id']}",
+        params=param_dict)
+    assert response.status_code == 400
+    response = await test_app_asyncio.post(
+        f"/qa/{user_data['user_id']}",
+        params=param_dict)
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+@pytest.mark.order(after=["test_upsert.py::test_upsert_file_txt"])
+async def test_batch_search_existing(test_app_asyncio, test_mongodb_conn, test_milvus_conn, mock_user_data_dict):
+
+    user_data = mock_user_data_dict()
+    queries = ["cuda devices", "image transforms", "installation"]
+    json_data = {"queries": queries, "top_k": 3}
+
+    response = await test_app_asyncio.post(
+        f"/search/batch/{user_data['user_id']}",
+        json=json_data)
+    assert response.status_code == 200
+    json_response = response.json()
+    assert [res["query"] for res in json_response['content']] == queries
+    assert all(len(res["content"]) == 3 for res in json_response['content'])
+
+
+@pytest.mark.asyncio
+@pytest.mark.order(after=["test_upsert.py::test_upsert_file_txt"])
+async def test_range_search_existing(test_app_asyncio, test_mongodb_conn, test_milvus_conn, mock_user_data_dict):
+
+    user_data = mock_user_data_dict()
+    param_dict = {"query": "cuda devices", "top_k": 5, "search_mode": "range", "radius": 0.1}
+
+    response = await test_app_asyncio.post(
+        f"/search/{user_data['user_id']}",
+        params=param_dict)
+    assert response.status_code == 200
+    hits = response.json().get('content', [])
+    # IP metric, all hits must be above the radius & ordered from most to least similar
+    assert all(hit["distance"] > 0.1 for hit in hits)
+    assert [hit["distance"] for hit in hits] == sorted([hit["distance"] for hit in hits], reverse=True)
+
+
+@pytest.mark.asyncio
+@pytest.mark.order(after=["test_upsert.py::test_upsert_file_txt"])
+async def test_range_search_invalid_range(test_app_asyncio, test_mongodb_conn, test_milvus_conn, mock_user_data_dict):
+
+    user_data = mock_user_data_dict()
+    param_dict = {"query": "cuda devices", "search_mode": "range", "radius": 0.5, "range_filter": 0.2}
+
+    response = await test_app_asyncio.post(
+        f"/search/{user_data['user_id']}",
+        params=param_dict)
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+@pytest.mark.order(after=["test_upsert.py::test_upsert_file_txt"])
+@pytest.mark.parametrize("ef", ["64", "auto"])
+async def test_search_ef_override(test_app_asyncio, test_mongodb_conn, test_milvus_conn, mock_user_data_dict, ef):
+
+    user_data = mock_user_data_dict()
+    param_dict = {"query": "cuda devices", "ef": ef}
+
+    response = await test_app_asyncio.post(
+        f"/search/{user_data['user_id']}",
+        params=param_dict)
+    assert response.status_code == 200
+    assert len(response.json()['content']) == 5
+
+
+@pytest.mark.asyncio
+@pytest.mark.order(after=["test_upsert.py::test_upsert_file_txt"])
+async def test_hybrid_search_existing(test_app_asyncio, test_mongodb_conn, test_milvus_conn, mock_user_data_dict):
+
+    user_data = mock_user_data_dict()
+    param_dict = {"query": "torchvision.transforms", "search_mode": "hybrid", "lexical_weight": 2.0}
+
+    response = await test_app_asyncio.post(
+        f"/search/{user_data['user_id']}",
+        params=param_dict)
+    assert response.status_code == 200
+    json_response = response.json()
+    hits = json_response['content']
+    assert len(hits) == 5
+    assert all(hit["content"] for hit in hits)
+    assert [hit["score"] for hit in hits] == sorted([hit["score"] for hit in hits], reverse=True)
+    assert {"dense", "lexical", "fusion", "total"} <= set(json_response["latency_ms"])
+
+
+@pytest.mark.asyncio
+@pytest.mark.order(after=["test_upsert.py::test_upsert_file_txt"])
+async def test_search_rerank(test_app_asyncio, test_mongodb_conn, test_milvus_conn, mock_user_data_dict):
+
+    user_data = mock_user_data_dict()
+    param_dict = {"query": "cuda devices", "top_k": 3, "rerank": True}
+
+    response = await test_app_asyncio.post(
+        f"/search/{user_data['user_id']}",
+        params=param_dict)
+    assert response.status_code == 200
+    json_response = response.json()
+    assert len(json_response['content']) == 3
+    # hits are kept in ann order when the rerank is skipped for the latency budget
+    if json_response["rerank"]["reranked"]:
+        scores = [hit["rerank_score"] for hit in json_response['content']]
+        assert scores == sorted(scores, reverse=True)
+
+
+@pytest.mark.asyncio
+@pytest.mark.order(after=["test_upsert.py::test_upsert_file_txt"])
+async def test_search_mmr(test_app_asyncio, test_mongodb_conn, test_milvus_conn, mock_user_data_dict):
+
+    user_data = mock_user_data_dict()
+    param_dict = {"query": "cuda devices", "top_k": 3, "mmr": True, "mmr_lambda": 0.3}
+
+    response = await test_app_asyncio.post(
+        f"/search/{user_data['user_id']}",
+        params=param_dict)
+    assert response.status_code == 200
+    hits = response.json()['content']
+    assert len(hits) == 3
+    assert len({hit["id"] for hit in hits}) == 3
+    assert all("embedding" not in hit for hit in hits)
+
+    response = await test_app_asyncio.post(
+        f"/search/{user_data['user_id']}",
+        params={"query": "cuda devices", "search_mode": "hybrid", "mmr": True})
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+@pytest.mark.order(after=["test_upsert.py::test_upsert_file_txt"])
+async def test_search_two_stage(test_app_asyncio, test_mongodb_conn, test_milvus_conn, mock_user_data_dict):
+
+    user_data = mock_user_data_dict()
+    param_dict = {"query": "cuda devices", "top_k": 3, "search_mode": "two_stage", "num_docs": 1}
+
+    response = await test_app_asyncio.post(
+        f"/search/{user_data['user_id']}",
+        params=param_dict)
+    assert response.status_code == 200
+    json_response = response.json()
+    assert len(json_response['content']) == 3
+    assert json_response["routed_docs"] == 1
+    assert len({hit["doc_id"] for hit in json_response['content']}) == 1
+    assert {"routing", "search"} <= set(json_response["latency_ms"])
+
+
+@pytest.mark.asyncio
+@pytest.mark.order(after=["test_upsert.py::test_upsert_file_txt"])
+async def test_search_binary_no_prefilter(test_app_asyncio, test_mongodb_conn, test_milvus_conn, mock_user_data_dict):
+
+    # the test collections are created without BINARY_PREFILTER
+    user_data = mock_user_data_dict()
+    response = await test_app_asyncio.post(
+        f"/search/{user_data['user_id']}",
+        params={"query": "cuda devices", "search_mode": "binary", "oversample": 4})
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+@pytest.mark.order(after=["test_upsert.py::test_upsert_file_txt"])
+async def test_slow_search_does_not_block_user_lookup(
+        test_app_asyncio, test_mongodb_conn, test_milvus_conn, mock_user_data_dict, monkeypatch):
+    import routes.search
+    from config import MILVUS_THREAD_POOL_SIZE
+
+    user_data = mock_user_data_dict()
+    search_delay_s = 1.0
+    search_milvus = routes.search.search_milvus
+
+    def slow_search_milvus(*args, **kwargs):
+        time.sleep(search_delay_s)
+        return search_milvus(*args, **kwargs)
+    monkeypatch.setattr(routes.search, "search_milvus", slow_search_milvus)
+
+    async def timed_user_lookup():
+        await asyncio.sleep(0.1)  # let the search reach milvus first
+        t_0 = time.perf_counter()
+        response = await test_app_asyncio.get(f"/users/{user_data['user_id']}")
+        return response, time.perf_counter() - t_0
+
+    # as many slow searches as milvus pool workers, so every worker is busy when the user is looked up
+    *search_responses, (user_response, user_latency_s) = await asyncio.gather(
+        *[test_app_asyncio.post(f"/search/{user_data['user_id']}", params={"query": "cuda devices"})
+          for _ in range(MILVUS_THREAD_POOL_SIZE)],
+        timed_user_lookup())
+    assert all(response.status_code == 200 for response in search_responses)
+    assert user_response.status_code == 200
+    # the user lookup is served while the searches occupy the whole milvus pool
+    assert user_latency_s < search_delay_s / 2
@@ -1,3 +1,5 @@
+import hashlib
+
 import pytest
 
 
@@ -17,3 +19,48 @@ async def test_upsert_file_txt(test_app_asyncio, test_mongodb_conn, test_milvus_
         files=files)
     assert response.status_code == 200
     json_response = response.json()
+
+
+@pytest.mark.asyncio
+@pytest.mark.order(after="test_upsert_file_txt")
+async def test_upsert_file_extracted_text(test_app_asyncio, test_mongodb_conn, mock_user_data_dict):
+
+    user_data = mock_user_data_dict()
+    response = await test_app_asyncio.get(f"/users/{user_data['user_id']}/documents")
+    assert response.status_code == 200
+    doc_id = response.json()["content"][0]["_id"]
+    response = await test_app_asyncio.get(f"/users/{user_data['user_id']}/documents/{doc_id}")
+    assert response.status_code == 200
+    doc = response.json()["content"]
+    # extracted text & chunk manifest are cached next to the stored file
+    assert doc["text_path"].endswith(".text.zz") and doc["num_chunks"] > 0
+
+
+@pytest.mark.asyncio
+@pytest.mark.order(after="test_upsert_file_txt")
+async def test_upsert_file_resumable_upload(test_app_asyncio, test_mongodb_conn, mock_txt_file, mock_user_data_dict):
+
+    user_data = mock_user_data_dict()
+    fpath, fcontent = mock_txt_file
+    response = await test_app_asyncio.post(
+        f"/upsert/files/{user_data['user_id']}/uploads", params={"file_name": fpath, "size": len(fcontent)})
+    assert response.status_code == 200
+    url = f"/upsert/files/{user_data['user_id']}/uploads/{response.json()['content']['upload_id']}"
+
+    half = len(fcontent) // 2
+    for part_number, part in enumerate([fcontent[:half], fcontent[half:]], start=1):
+        response = await test_app_asyncio.put(
+            f"{url}/parts/{part_number}", params={"md5": hashlib.md5(part).hexdigest()}, content=part)
+        assert response.status_code == 200
+    # a part not matching its md5 is dropped
+    response = await test_app_asyncio.put(f"{url}/parts/3", params={"md5": "0" * 32}, content=b"x")
+    assert response.status_code in (400, 409)
+    response = await test_app_asyncio.get(url)
+    assert response.status_code == 200
+    assert response.json()["content"]["offset"] == len(fcontent)
+
+    # the same file was upserted by test_upsert_file_txt, the session is removed anyway
+    response = await test_app_asyncio.post(f"{url}/complete")
+    assert response.status_code == 400
+    response = await test_app_asyncio.get(url)
+    assert response.status_code == 404
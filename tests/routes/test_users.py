@@ -95,6 +95,26 @@ async def test_get_registered_user_one_doc(test_app_asyncio, test_mongodb_conn,
     assert response.status_code == 200
 
 
+@pytest.mark.asyncio
+@pytest.mark.order(after="test_get_registered_user_all_docs")
+async def test_download_registered_user_one_doc(test_app_asyncio, test_mongodb_conn, mock_user_data_dict):
+    user_data = mock_user_data_dict()
+    response = await test_app_asyncio.get(f"/users/{user_data['user_id']}/documents")
+    doc_id = response.json()["content"][0]["_id"]
+    url = f"/users/{user_data['user_id']}/documents/{doc_id}/download"
+    response = await test_app_asyncio.get(url)
+    assert response.status_code == 200
+    content, etag = response.content, response.headers["etag"]
+    response = await test_app_asyncio.get(url, headers={"Range": "bytes=0-9"})
+    assert response.status_code == 206
+    assert response.content == content[:10]
+    assert response.headers["content-range"] == f"bytes 0-9/{len(content)}"
+    response = await test_app_asyncio.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    response = await test_app_asyncio.get(f"/users/{user_data['user_id']}/documents/x/download")
+    assert response.status_code == 404
+
+
 @pytest.mark.asyncio
 @pytest.mark.order(after="test_get_registered_user_all_docs")
 async def test_delete_user_one_doc(test_app_asyncio, test_mongodb_conn, mock_user_data_dict):
@@ -107,8 +127,48 @@ async def test_delete_user_one_doc(test_app_asyncio, test_mongodb_conn, mock_use
     assert response.status_code == 200
 
 
+@pytest.mark.asyncio
+@pytest.mark.order(after="test_get_registered_user_all_docs")
+async def test_delete_user_non_existent_docs(test_app_asyncio, test_mongodb_conn, mock_user_data_dict):
+    user_data = mock_user_data_dict()
+    response = await test_app_asyncio.delete(
+        f"/users/{user_data['user_id']}/documents", params={"doc_id_list": ["x", "y"]})
+    assert response.status_code == 404
+    # unknown doc ids must not fall back to deleting all user docs
+    response = await test_app_asyncio.get(f"/users/{user_data['user_id']}/documents")
+    assert response.status_code == 200
+    assert len(response.json()["content"]) == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.order(after="test_get_registered_user_all_docs", before="test_delete_user_one_doc")
+async def test_delete_other_user_doc(test_app_asyncio, test_mongodb_conn, mock_user_data_dict):
+    user_data = mock_user_data_dict()
+    response = await test_app_asyncio.get(f"/users/{user_data['user_id']}/documents")
+    doc_id = response.json()["content"][0]["_id"]
+    other_user_data = mock_user_data_dict("test_other_user")
+    response = await test_app_asyncio.post("/users", params=other_user_data)
+    assert response.status_code == 200
+    # a user must not delete a doc of another user
+    response = await test_app_asyncio.delete(f"/users/{other_user_data['user_id']}/documents/{doc_id}")
+    assert response.status_code == 404
+    response = await test_app_asyncio.get(f"/users/{user_data['user_id']}/documents/{doc_id}")
+    assert response.status_code == 200
+    response = await test_app_asyncio.delete(f"/users/{other_user_data['user_id']}")
+    assert response.status_code == 200
+
+
 @pytest.mark.asyncio
 async def test_get_non_existent_user_doc(test_app_asyncio, test_mongodb_conn):
     user_id = 999
     response = await test_app_asyncio.get(f"/users/{user_id}/documents")
     assert response.status_code == 404
+
+
+# user snapshot tests
+
+@pytest.mark.asyncio
+async def test_export_non_existent_user_snapshot(test_app_asyncio, test_mongodb_conn):
+    user_id = 999
+    response = await test_app_asyncio.get(f"/users/{user_id}/snapshot")
+    assert response.status_code == 404